@@ -8,9 +8,19 @@ A package for optimizing transition metal complexes (TMCs) using large language
 from llmeo._utils.llm import (
     LLMConfig,
     LLMError,
+    LLMResponse,
+    LLMUsage,
+    UsageTracker,
     GPT4,
     GPTo1,
-    Claude3
+    Claude3,
+    HedgedLLM,
+    CircuitBreaker
+)
+
+from llmeo._utils.batch import (
+    BatchCollector,
+    BatchedLLM
 )
 
 from llmeo._utils.ga import (
@@ -24,9 +34,16 @@ __all__ = [
     # LLM related
     "LLMConfig",
     "LLMError",
+    "LLMResponse",
+    "LLMUsage",
+    "UsageTracker",
     "GPT4",
     "GPTo1", 
     "Claude3",
+    "HedgedLLM",
+    "CircuitBreaker",
+    "BatchCollector",
+    "BatchedLLM",
     
     # Genetic Algorithm
     "ga_sample",
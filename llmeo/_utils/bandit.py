@@ -0,0 +1,124 @@
+import math
+import random
+from typing import Dict, List, Optional
+
+
+class BanditArm:
+    """One proposer configuration: an LLM model, a prompt template and a temperature"""
+
+    def __init__(self, model, template: Optional[str] = None, temperature: Optional[float] = None):
+        self.model = model
+        self.template = template
+        self.temperature = temperature
+        self.name = f"{model.name}:{template or 'default'}:{'default' if temperature is None else temperature}"
+
+
+class BanditScheduler:
+    """
+    Discounted UCB1 bandit choosing the proposer arm of every iteration.
+
+    The reward of a pull is its gain (useful offspring, e.g. TMCs entering the
+    population or new Pareto points) per unit of cost, where the cost is the
+    wall time in seconds or the LLM price in dollars. Past pulls are discounted
+    by `discount` per iteration, so the choice follows whichever arm currently
+    gives the best gains per unit cost rather than the best on average.
+    """
+
+    COSTS = ("dollar", "time")
+
+    def __init__(
+        self,
+        arms: List[BanditArm],
+        cost: str = "dollar",
+        discount: float = 0.9,
+        exploration: float = 1.0,
+        min_cost: float = 1e-4,
+        seed: Optional[int] = None,
+    ):
+        if not arms:
+            raise ValueError("The bandit needs at least one arm")
+        if cost not in self.COSTS:
+            raise ValueError(f"Invalid bandit cost: {cost}")
+        self.arms = arms
+        self.cost = cost
+        self.discount = discount
+        self.exploration = exploration
+        self.min_cost = min_cost
+        self.history: List[Dict] = []
+        self._weights = [0.0] * len(arms)
+        self._rewards = [0.0] * len(arms)
+        self._random = random.Random(seed)
+
+    def select(self) -> BanditArm:
+        """Choose the arm of the next iteration; untried arms come first"""
+        scores = self.scores()
+        best = max(scores)
+        return self.arms[self._random.choice([i for i, s in enumerate(scores) if s == best])]
+
+    def scores(self) -> List[float]:
+        """Upper confidence bound of every arm"""
+        means = [
+            reward / weight if weight > 0 else 0.0
+            for reward, weight in zip(self._rewards, self._weights)
+        ]
+        # Rewards are unbounded rates, so exploration is scaled by the best mean
+        scale = max(max(means), self.min_cost)
+        total = sum(self._weights)
+        return [
+            mean + self.exploration * scale * math.sqrt(math.log(1.0 + total) / weight)
+            if weight > 0 else math.inf
+            for mean, weight in zip(means, self._weights)
+        ]
+
+    def update(self, arm: BanditArm, gain: float, seconds: float, dollars: float) -> Dict:
+        """
+        Record the outcome of an iteration proposed by `arm`.
+
+        Args:
+            arm: Arm that proposed the iteration
+            gain: Useful offspring of the iteration
+            seconds: Wall time of the iteration (LLM call and evaluation)
+            dollars: LLM cost of the iteration
+
+        Returns:
+            Dict: The logged record of the pull
+        """
+        spent = dollars if self.cost == "dollar" else seconds
+        reward = gain / max(spent, self.min_cost)
+
+        index = self.arms.index(arm)
+        self._weights = [w * self.discount for w in self._weights]
+        self._rewards = [r * self.discount for r in self._rewards]
+        self._weights[index] += 1.0
+        self._rewards[index] += reward
+
+        record = {
+            "iteration": len(self.history),
+            "arm": arm.name,
+            "gain": gain,
+            "seconds": seconds,
+            "dollars": dollars,
+            "reward": reward,
+        }
+        self.history.append(record)
+        return record
+
+    def summary(self) -> List[Dict]:
+        """Totals and gain rates of every arm over the whole run"""
+        rows = []
+        for arm, score in zip(self.arms, self.scores()):
+            records = [record for record in self.history if record["arm"] == arm.name]
+            gain = sum(record["gain"] for record in records)
+            seconds = sum(record["seconds"] for record in records)
+            dollars = sum(record["dollars"] for record in records)
+            rows.append({
+                "arm": arm.name,
+                "pulls": len(records),
+                "gain": gain,
+                "seconds": seconds,
+                "dollars": dollars,
+                "gain_per_second": gain / seconds if seconds else 0.0,
+                "gain_per_dollar": gain / dollars if dollars else 0.0,
+                "ucb": score,
+            })
+        return rows
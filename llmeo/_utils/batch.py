@@ -0,0 +1,390 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from itertools import count
+from typing import Callable, Dict, List, Optional, Union
+from uuid import uuid4
+
+from .llm import (LLMError, LLMResponse, LLMUsage, _anthropic_response,
+                  _openai_response)
+
+# Provider batch endpoints bill input and output tokens at half the synchronous price
+BATCH_DISCOUNT = 0.5
+
+BatchResults = Dict[str, Union[LLMResponse, LLMError]]
+
+
+class BatchRequest:
+    """One prompt of a batch job"""
+
+    def __init__(
+        self,
+        custom_id: str,
+        content: str,
+        system: Optional[str] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ):
+        self.custom_id = custom_id
+        self.content = content
+        self.system = system
+        self.response_schema = response_schema
+        self.history = history
+
+
+def _discounted(response: LLMResponse, start: float) -> LLMResponse:
+    """Apply the batch discount and measure latency as the batch turnaround"""
+    response.usage.cost *= BATCH_DISCOUNT
+    response.usage.latency = time.time() - start
+    response.usage.time_to_first_token = response.usage.latency
+    return response
+
+
+class OpenAIBatchBackend:
+    """
+    Batch jobs on the OpenAI Batch API (/v1/chat/completions).
+
+    Requests are built by the wrapped GPT4/GPTo1 model, so a batched call
+    sends exactly what a synchronous call would.
+    """
+
+    def __init__(self, model, completion_window: str = "24h"):
+        self.model = model
+        self.name = model.name
+        self.completion_window = completion_window
+        self.supports_structured_output = model.supports_structured_output
+        self._submitted: Dict[str, float] = {}
+
+    def submit(self, requests: List[BatchRequest]) -> str:
+        """Upload the requests as a JSONL file and start a batch job"""
+        lines = [
+            json.dumps({
+                "custom_id": request.custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self.model.request_params(
+                    request.content, request.system, request.response_schema, request.history
+                ),
+            })
+            for request in requests
+        ]
+        try:
+            client = self.model.client
+            batch_file = client.files.create(
+                file=("batch.jsonl", "\n".join(lines).encode()), purpose="batch"
+            )
+            batch = client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window=self.completion_window,
+            )
+        except Exception as e:
+            raise LLMError(f"OpenAI batch submission failed: {str(e)}")
+        self._submitted[batch.id] = time.time()
+        return batch.id
+
+    def poll(self, batch_id: str) -> Optional[BatchResults]:
+        """Return the results once the batch has ended, None while it is running"""
+        from openai.types.chat import ChatCompletion
+
+        client = self.model.client
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+
+        # Expired or cancelled batches still return the requests that finished
+        start = self._submitted.pop(batch_id, time.time())
+        results: BatchResults = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    completion = ChatCompletion.model_validate(response["body"])
+                    results[record["custom_id"]] = _discounted(
+                        _openai_response(self.name, completion, time.perf_counter()), start
+                    )
+                else:
+                    error = record.get("error") or response.get("body", {}).get("error")
+                    results[record["custom_id"]] = LLMError(f"Batch request failed: {error}")
+        if batch.status != "completed" and not results:
+            raise LLMError(f"OpenAI batch {batch_id} {batch.status}")
+        return results
+
+
+class AnthropicBatchBackend:
+    """Batch jobs on the Anthropic Message Batches API"""
+
+    def __init__(self, model):
+        self.model = model
+        self.name = model.name
+        self.supports_structured_output = model.supports_structured_output
+        self._submitted: Dict[str, float] = {}
+
+    def submit(self, requests: List[BatchRequest]) -> str:
+        """Create a message batch from the requests"""
+        try:
+            batch = self.model.client.messages.batches.create(requests=[
+                {
+                    "custom_id": request.custom_id,
+                    "params": self.model.request_params(
+                        request.content, request.system, request.response_schema, request.history
+                    ),
+                }
+                for request in requests
+            ])
+        except Exception as e:
+            raise LLMError(f"Anthropic batch submission failed: {str(e)}")
+        self._submitted[batch.id] = time.time()
+        return batch.id
+
+    def poll(self, batch_id: str) -> Optional[BatchResults]:
+        """Return the results once the batch has ended, None while it is running"""
+        batches = self.model.client.messages.batches
+        if batches.retrieve(batch_id).processing_status != "ended":
+            return None
+
+        start = self._submitted.pop(batch_id, time.time())
+        results: BatchResults = {}
+        for entry in batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = _discounted(
+                    _anthropic_response(self.name, entry.result.message, time.perf_counter()), start
+                )
+            else:
+                error = getattr(entry.result, "error", entry.result.type)
+                results[entry.custom_id] = LLMError(f"Batch request failed: {error}")
+        return results
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for a provider batch endpoint.
+
+    A batch is a directory with an `input.jsonl` of requests; it is complete
+    once an `output.jsonl` with one {"custom_id", "text"} or {"custom_id",
+    "error"} record per request appears. With a `responder` the output is
+    written right away, otherwise by an external process.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        responder: Optional[Callable[[BatchRequest], str]] = None,
+        name: str = "local",
+    ):
+        self.directory = directory
+        self.responder = responder
+        self.name = name
+        self.supports_structured_output = False
+        self._submitted: Dict[str, float] = {}
+
+    def submit(self, requests: List[BatchRequest]) -> str:
+        """Write the requests to a new batch directory"""
+        batch_id = f"batch-{uuid4().hex[:12]}"
+        batch_dir = os.path.join(self.directory, batch_id)
+        os.makedirs(batch_dir)
+        path = os.path.join(batch_dir, "input.jsonl")
+        with open(path + ".tmp", "w") as fo:
+            for request in requests:
+                fo.write(json.dumps(vars(request)) + "\n")
+        os.replace(path + ".tmp", path)
+        self._submitted[batch_id] = time.time()
+
+        if self.responder is not None:
+            records = []
+            for request in requests:
+                try:
+                    records.append({"custom_id": request.custom_id, "text": self.responder(request)})
+                except Exception as e:
+                    records.append({"custom_id": request.custom_id, "error": str(e)})
+            self.write_output(batch_id, records)
+        return batch_id
+
+    def write_output(self, batch_id: str, records: List[Dict]) -> None:
+        """Complete a batch; like the input, the file is renamed into place so readers never see it half-written"""
+        path = os.path.join(self.directory, batch_id, "output.jsonl")
+        with open(path + ".tmp", "w") as fo:
+            for record in records:
+                fo.write(json.dumps(record) + "\n")
+        os.replace(path + ".tmp", path)
+
+    def poll(self, batch_id: str) -> Optional[BatchResults]:
+        """Return the results once output.jsonl exists, None before"""
+        path = os.path.join(self.directory, batch_id, "output.jsonl")
+        if not os.path.exists(path):
+            return None
+        latency = time.time() - self._submitted.pop(batch_id, time.time())
+        results: BatchResults = {}
+        with open(path) as fo:
+            for line in fo:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "error" in record:
+                    results[record["custom_id"]] = LLMError(f"Batch request failed: {record['error']}")
+                else:
+                    results[record["custom_id"]] = LLMResponse(
+                        record["text"],
+                        usage=LLMUsage(latency=latency, time_to_first_token=latency),
+                        model=self.name,
+                    )
+        return results
+
+
+class BatchCollector:
+    """
+    Gather LLM requests from concurrent runs into provider batch jobs.
+
+    Every run registers with the collector. A batch is submitted as soon as
+    each registered run has a request pending, i.e. once per generation step
+    of the sweep, or when a request has waited `max_wait` seconds. The batch
+    is polled every `poll_interval` seconds in a background thread and each
+    result is handed back to the run that asked for it.
+    """
+
+    def __init__(
+        self,
+        backend,
+        poll_interval: float = 30.0,
+        max_wait: Optional[float] = None,
+        logger=None,
+    ):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.logger = logger
+        self.clients = 0
+        self.stats = {"batches": 0, "requests": 0, "errors": 0}
+        self._pending: List = []
+        self._ids = count()
+        self._lock = threading.Lock()
+
+    def register(self) -> None:
+        """Add a run whose requests are waited for before submitting"""
+        with self._lock:
+            self.clients += 1
+
+    def unregister(self) -> None:
+        """Remove a finished run; its absence may complete the current batch"""
+        with self._lock:
+            self.clients -= 1
+            batch = self._take(ready_only=True)
+        self._dispatch(batch)
+
+    def request(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> LLMResponse:
+        """Queue a prompt for the next batch and block until its result arrives"""
+        future: Future = Future()
+        with self._lock:
+            request = BatchRequest(
+                f"req-{next(self._ids)}", content, system, response_schema, history
+            )
+            self._pending.append((request, future))
+            batch = self._take(ready_only=True)
+        self._dispatch(batch)
+
+        try:
+            return future.result(timeout=self.max_wait)
+        except FutureTimeoutError:
+            # Stragglers would hold back everyone else, submit what is pending
+            with self._lock:
+                batch = self._take(ready_only=False)
+            self._dispatch(batch)
+            return future.result()
+
+    def _take(self, ready_only: bool) -> List:
+        """Remove the pending requests if a batch should be submitted (lock held)"""
+        if not self._pending or (ready_only and len(self._pending) < self.clients):
+            return []
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _dispatch(self, batch: List) -> None:
+        if batch:
+            threading.Thread(target=self._run, args=(batch,), daemon=True).start()
+
+    def _run(self, batch: List) -> None:
+        """Submit one batch, poll until it ends and resolve the waiting requests"""
+        try:
+            batch_id = self.backend.submit([request for request, _ in batch])
+            if self.logger is not None:
+                self.logger.info(f"submitted batch {batch_id} with {len(batch)} requests")
+            results = self.backend.poll(batch_id)
+            while results is None:
+                time.sleep(self.poll_interval)
+                results = self.backend.poll(batch_id)
+        except Exception as e:
+            results = {}
+            error = e if isinstance(e, LLMError) else LLMError(f"Batch failed: {str(e)}")
+            for request, _ in batch:
+                results[request.custom_id] = error
+
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+        for request, future in batch:
+            result = results.get(request.custom_id)
+            if result is None:
+                result = LLMError(f"No batch result for {request.custom_id}")
+            if isinstance(result, LLMResponse):
+                future.set_result(result)
+            else:
+                with self._lock:
+                    self.stats["errors"] += 1
+                future.set_exception(result)
+
+
+class BatchedLLM:
+    """
+    Model interface of a run inside a batched sweep.
+
+    `generate` queues the prompt with the shared BatchCollector and blocks
+    until the batch containing it has been completed.
+    """
+
+    supports_streaming = False
+
+    def __init__(self, collector: BatchCollector):
+        self.collector = collector
+        self.name = f"batch({collector.backend.name})"
+        self.supports_structured_output = collector.backend.supports_structured_output
+
+    def create(self) -> None:
+        """The backend owns the provider client, nothing to initialize"""
+
+    def call(self, content: str, system: Optional[str] = None) -> str:
+        """Call the model with content"""
+        return self.generate(content, system=system).text
+
+    def generate(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> LLMResponse:
+        """
+        Answer content through the next batch job.
+
+        Batch results arrive complete, so `on_text` receives the whole text once.
+        """
+        result = self.collector.request(
+            content, system=system, response_schema=response_schema, history=history
+        )
+        if on_text is not None:
+            on_text(result.text)
+        return result
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+from uuid import uuid4
+
+# Error classes of `_error` messages; transient ones are never cached
+ERROR_CLASSES = [
+    ("invalid_smiles", re.compile(r"invalid smiles")),
+    ("build_failed", re.compile(r"MolSimplify failed")),
+    ("runner_failed", re.compile(r"XtbRunner failed")),
+    ("xtb_failed", re.compile(r"run_xtb_from_xyz failed")),
+    ("connectivity_changed", re.compile(r"Connecting indices change")),
+    ("fragmented", re.compile(r"Graph not connected")),
+    ("timeout", re.compile(r"^Job timeout")),
+    ("killed", re.compile(r"^Job killed")),
+    ("not_promoted", re.compile(r"^Not promoted")),
+]
+TRANSIENT_ERRORS = {"runner_failed", "timeout", "killed", "worker_error", "unknown"}
+
+
+def error_class(message) -> str:
+    """
+    Classify an `_error` message of the ligand space calculation.
+
+    Args:
+        message: Value of the `_error` column
+
+    Returns:
+        str: "ok" for an empty message, otherwise the error class
+    """
+    if message is None or message != message or not str(message).strip():
+        return "ok"
+    for name, regex in ERROR_CLASSES:
+        if regex.search(str(message)):
+            return name
+    if str(message).startswith("Worker error"):
+        return "worker_error"
+    return "unknown"
+
+
+@lru_cache(maxsize=None)
+def tool_versions() -> Dict[str, str]:
+    """Versions of xtb, molSimplify and uxtbpy that produced the results"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    versions = {}
+    for package in ("molSimplify", "uxtbpy"):
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = "unknown"
+    try:
+        output = subprocess.run(["xtb", "--version"], capture_output=True, text=True, timeout=30).stdout
+        match = re.search(r"version\s+(\S+)", output)
+        versions["xtb"] = match.group(1) if match else "unknown"
+    except (OSError, subprocess.SubprocessError):
+        versions["xtb"] = "unknown"
+    return versions
+
+
+def canonical_ligands(ligands: Sequence) -> List:
+    """Smallest of the four rotations of a ligand sequence"""
+    ligands = list(ligands)
+    return min(ligands[i:] + ligands[:i] for i in range(4))
+
+
+class XtbCache:
+    """
+    Content-addressed store of xTB results shared across runs.
+
+    An entry is keyed by the SHA-256 of the canonical rotation of the ligand
+    (SMILES, connecting atom index) pairs, the total charge, the xTB
+    parameter string and the tool versions, so a rotated TMC, the same TMC
+    in another run, and the same TMC in another team's space all hit the
+    same entry. Entries hold the properties, the error class and the
+    optimized geometry. They are JSON files in a two-level directory tree,
+    renamed into place so concurrent writers on a shared filesystem never
+    expose partial files.
+    """
+
+    def __init__(self, directory: str, versions: Optional[Dict[str, str]] = None):
+        self.directory = directory
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, ligands: Sequence, charge: int, parameters: str) -> str:
+        """
+        Cache key of a calculation.
+
+        Args:
+            ligands: Four (SMILES, connecting atom index) pairs in clockwise order
+            charge: Total charge of the TMC
+            parameters: xTB command line parameters without the charge
+
+        Returns:
+            str: Hex digest addressing the entry
+        """
+        content = {
+            "ligands": canonical_ligands([[str(smiles), str(index)] for smiles, index in ligands]),
+            "charge": int(charge),
+            "parameters": parameters,
+            "versions": self.versions if self.versions is not None else tool_versions(),
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """The stored entry of key, or None"""
+        try:
+            with open(self._path(key)) as fo:
+                entry = json.load(fo)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: Dict) -> bool:
+        """
+        Store an entry unless its error class is transient.
+
+        Args:
+            key: Cache key
+            entry: Dict with "_error", "homo_lumo_gap", "polarisability" and
+                optionally "fileName" and "optimised_xyz"
+
+        Returns:
+            bool: Whether the entry was stored
+        """
+        entry = dict(entry, error_class=error_class(entry.get("_error")))
+        if entry["error_class"] in TRANSIENT_ERRORS:
+            return False
+        # Rows that stopped without an error message or a result are not reproducible answers
+        if entry["error_class"] == "ok" and entry.get("homo_lumo_gap") in ("", None):
+            return False
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp, "w") as fo:
+            json.dump(entry, fo, default=float)
+        os.replace(tmp, path)
+        return True
+
+    @property
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
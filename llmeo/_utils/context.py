@@ -0,0 +1,165 @@
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .utils import make_text_for_existing_tmcs
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens of a text.
+
+    Uses the common approximation of four characters per token, which is
+    cheap enough to run on every sample line at every iteration.
+
+    Args:
+        text: Text to estimate
+
+    Returns:
+        int: Estimated token count
+    """
+    return math.ceil(len(text) / 4)
+
+
+def objective_scores(df: pd.DataFrame, prop: str) -> pd.Series:
+    """
+    Score TMCs by the optimization target, larger is better.
+
+    Args:
+        df: DataFrame containing TMC properties
+        prop: Optimization target ("gap", "polarisability", "pf", "mb" or "mpsg")
+
+    Returns:
+        pd.Series: Objective score per row
+    """
+    if prop in ("gap", "polarisability"):
+        return df[prop]
+    if prop == "mpsg":
+        return df["polarisability"] / df["gap"]
+    # "pf" and "mb" both reward TMCs large in both properties
+    return df["gap"] * df["polarisability"]
+
+
+def pareto_mask(objective1: np.ndarray, objective2: np.ndarray, maximize1: bool = True,
+                maximize2: bool = True) -> np.ndarray:
+    """
+    Flag the points on the Pareto frontier of two objectives.
+
+    Args:
+        objective1: Values of the first objective
+        objective2: Values of the second objective
+        maximize1: True to maximize objective1, False to minimize it
+        maximize2: True to maximize objective2, False to minimize it
+
+    Returns:
+        np.ndarray: Boolean mask of Pareto-optimal points
+    """
+    objective1 = np.asarray(objective1, dtype=float) * (1 if maximize1 else -1)
+    objective2 = np.asarray(objective2, dtype=float) * (1 if maximize2 else -1)
+    order = np.argsort(-objective1, kind="stable")
+    best_so_far = np.maximum.accumulate(objective2[order])
+    # A point is optimal if it beats every point with a larger first objective
+    previous_best = np.concatenate(([-np.inf], best_so_far[:-1]))
+    mask = np.zeros(len(objective1), dtype=bool)
+    mask[order] = objective2[order] > previous_best
+    return mask
+
+
+def ligand_composition(df: pd.DataFrame) -> np.ndarray:
+    """
+    Count how often every ligand occurs in each TMC.
+
+    Args:
+        df: DataFrame with lig1..lig4 columns
+
+    Returns:
+        np.ndarray: (n_tmcs, n_ligands) matrix of ligand counts
+    """
+    ligs = df[["lig1", "lig2", "lig3", "lig4"]].to_numpy()
+    codes, _ = pd.factorize(ligs.ravel())
+    codes = codes.reshape(ligs.shape)
+    counts = np.zeros((len(df), codes.max() + 1 if codes.size else 0), dtype=np.int8)
+    for col in range(codes.shape[1]):
+        np.add.at(counts, (np.arange(len(df)), codes[:, col]), 1)
+    return counts
+
+
+def select_context(
+    df: pd.DataFrame,
+    lig_charge: Dict[str, int],
+    props: List[str],
+    prop: str,
+    budget_tokens: int,
+    top_fraction: float = 0.4,
+    pareto_fraction: float = 0.2,
+    seed: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Select evaluated TMCs for the prompt within a token budget.
+
+    The budget is filled with the best TMCs for the objective first, then with
+    members of the gap/polarisability Pareto frontier, and the remainder with
+    a diverse spread chosen greedily to be as far as possible (in ligand
+    composition) from everything already selected.
+
+    Args:
+        df: Evaluated TMCs
+        lig_charge: Dictionary mapping ligand IDs to charges
+        props: Properties rendered in the prompt
+        prop: Optimization target used to rank TMCs
+        budget_tokens: Maximum estimated tokens of the rendered samples
+        top_fraction: Share of the budget for the top performers
+        pareto_fraction: Share of the budget for Pareto members
+        seed: Seed for tie-breaking and the final shuffle
+
+    Returns:
+        pd.DataFrame: Selected TMCs in random order
+    """
+    rng = np.random.default_rng(seed)
+    df = df.drop_duplicates(subset=["id"])
+    lines = make_text_for_existing_tmcs(df, lig_charge, props).split("\n")
+    costs = np.array([estimate_tokens(line + "\n") for line in lines])
+    if costs.sum() <= budget_tokens:
+        return df.sample(frac=1.0, random_state=rng.integers(2**32))
+
+    scores = objective_scores(df, prop).to_numpy(dtype=float)
+    chosen = np.zeros(len(df), dtype=bool)
+    used = 0
+
+    def take(candidates, limit):
+        nonlocal used
+        for i in candidates:
+            if chosen[i] or used + costs[i] > limit:
+                continue
+            chosen[i] = True
+            used += costs[i]
+
+    take(np.argsort(-scores, kind="stable"), top_fraction * budget_tokens)
+
+    if "gap" in df and "polarisability" in df:
+        # "mpsg" looks for large polarisabilities with small gaps
+        pareto = np.flatnonzero(pareto_mask(
+            df["gap"].to_numpy(), df["polarisability"].to_numpy(), maximize1=prop != "mpsg"
+        ))
+        take(pareto[np.argsort(-scores[pareto], kind="stable")],
+             (top_fraction + pareto_fraction) * budget_tokens)
+
+    # Greedy max-min diversity: distance is the number of ligand positions that differ
+    counts = ligand_composition(df)
+    min_dist = np.full(len(df), 4.0)
+    for i in np.flatnonzero(chosen):
+        min_dist = np.minimum(min_dist, 4 - np.minimum(counts, counts[i]).sum(axis=1))
+    # Random jitter breaks ties between equally distant candidates
+    min_dist += rng.random(len(df)) * 0.5
+    while True:
+        fits = ~chosen & (costs <= budget_tokens - used)
+        if not fits.any():
+            break
+        i = np.flatnonzero(fits)[np.argmax(min_dist[fits])]
+        chosen[i] = True
+        used += costs[i]
+        min_dist = np.minimum(min_dist, 4 - np.minimum(counts, counts[i]).sum(axis=1))
+
+    return df[chosen].sample(frac=1.0, random_state=rng.integers(2**32))
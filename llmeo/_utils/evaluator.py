@@ -0,0 +1,112 @@
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import pandas as pd
+
+from .cache import canonical_ligands
+from .utils import prepare_ligand_space, save_row_to_csv
+
+# Charge of the Pd center added to the ligand charges
+METAL_CHARGE = 2
+
+
+class XtbEvaluator:
+    """
+    Evaluate proposed TMCs with molSimplify and xTB instead of a lookup.
+
+    Called with one TMC string, it builds and optimizes the complex like
+    `calculate_fitness_ligand_space` does for one row and returns it as a
+    row with "gap" and "polarisability" columns, the columns of the ground
+    truth table. Every evaluated row, failures included, is appended to
+    root_path/evaluated.csv. Calls from several threads run concurrently,
+    each in its own scratch directory; rotations and repeats of a TMC are
+    calculated once per run.
+
+    Args:
+        df_ligands: Ligand table with "SMILES", "id", "charge",
+            "connecting atom element" and "connecting atom index" columns
+        root_path: Base directory for file generation and calculations
+        cache: Optional XtbCache shared with other runs
+        limits: Optional dict of JobLimits for the "molsimplify" and "xtb" runs
+    """
+
+    def __init__(self, df_ligands: pd.DataFrame, root_path: str, cache=None, limits: Optional[Dict] = None):
+        self.ligands = {row["id"]: row for row in df_ligands.to_dict("records")}
+        self.root_path = str(Path(root_path).absolute())
+        self.cache = cache
+        self.limits = limits
+        self.csv_file = str(Path(self.root_path) / "evaluated.csv")
+        self._results = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def frame(self, tmc: str) -> Optional[pd.DataFrame]:
+        """
+        One-row DataFrame describing a TMC in the layout of `TMCGenerator`.
+
+        Args:
+            tmc: TMC string "Pd_lig1_lig2_lig3_lig4"
+
+        Returns:
+            pd.DataFrame: The row, or None if a ligand is not in the ligand table
+        """
+        ligs = tmc.split("_")[1:]
+        if len(ligs) != 4 or any(lig not in self.ligands for lig in ligs):
+            return None
+
+        row = {"id": "Pd_" + "_".join(canonical_ligands(ligs))}
+        for i, lig in enumerate(ligs, start=1):
+            ligand = self.ligands[lig]
+            row[f"lig{i}"] = lig
+            row[f"lig{i}_smiles"] = ligand["SMILES"]
+            row[f"lig{i}_element"] = ligand["connecting atom element"]
+            row[f"lig{i}_index"] = ligand["connecting atom index"]
+        row["charge"] = sum(int(self.ligands[lig]["charge"]) for lig in ligs) + METAL_CHARGE
+        return pd.DataFrame([row])
+
+    def __call__(self, tmc: str) -> Optional[pd.DataFrame]:
+        """
+        Evaluate one TMC.
+
+        Args:
+            tmc: TMC string "Pd_lig1_lig2_lig3_lig4"
+
+        Returns:
+            pd.DataFrame: The evaluated row, or None if the TMC has an unknown
+            ligand or its calculation failed
+        """
+        df = self.frame(tmc)
+        if df is None:
+            return None
+
+        key = df.loc[0, "id"]
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._results:
+                self._results[key] = self._evaluate(df)
+        result = self._results[key]
+        return None if result is None else result.copy()
+
+    def _evaluate(self, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+        from .mol_calculation import evaluate_row
+
+        prepare_ligand_space(df, self.root_path)
+        scratch_dir = Path(self.root_path) / "scratch" / f"eval-{threading.get_ident()}"
+        scratch_dir.mkdir(parents=True, exist_ok=True)
+        evaluate_row(
+            df, 0, df.loc[0], self.root_path, scratch_dir=str(scratch_dir),
+            cache=self.cache, limits=self.limits,
+        )
+        with self._lock:
+            save_row_to_csv(df.loc[0], 0, self.csv_file)
+
+        gap = pd.to_numeric(df["homo_lumo_gap"], errors="coerce")
+        polarisability = pd.to_numeric(df["polarisability"], errors="coerce")
+        if str(df.loc[0, "_error"]).strip() or gap.isna().any() or polarisability.isna().any():
+            print("Evaluation failed: ", df.loc[0, "id"], df.loc[0, "_error"])
+            return None
+        df["gap"] = gap.astype(float)
+        df["polarisability"] = polarisability.astype(float)
+        return df
@@ -0,0 +1,145 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .utils import TIERS_COLUMN
+
+# Name of the final tight GFN2 optimization in the tiers column
+FINAL_TIER = "gfn2"
+
+# xTB settings of the cheap tiers; the total charge is appended per TMC
+TIER_PRESETS = {
+    "gfnff": "--gfnff --opt crude --norestart -v",
+    "gfn0": "--gfn 0 --opt crude --uhf 0 --norestart -v",
+    "gfn2-crude": "--opt crude --uhf 0 --norestart -v",
+    "gfn2-loose": "--opt loose --uhf 0 --norestart -v",
+}
+
+PASSED = "passed"
+REJECTED = "rejected"
+NOT_PROMOTED = "not_promoted"
+FAILED = "failed"
+
+
+class Tier:
+    """
+    One low-fidelity pre-optimization ahead of the tight GFN2 run.
+
+    The tier optimizes the structure with cheaper settings. If the metal-ligand
+    graph changed or the complex fell apart, the row is rejected right away;
+    otherwise the pre-optimized geometry is the starting point of the next
+    tier. With `promote`, the tier's property estimates decide whether the
+    candidate is worth the next tier at all.
+
+    Args:
+        name: Tier name, a key of TIER_PRESETS unless parameters are given
+        parameters: xTB command line parameters without the charge
+        check_connectivity: Reject rows whose structure broke in this tier
+        promote: Called with the tier's xTB results, False stops the row
+    """
+
+    def __init__(
+        self,
+        name: str,
+        parameters: Optional[str] = None,
+        check_connectivity: bool = True,
+        promote: Optional[Callable[[Dict], bool]] = None,
+    ):
+        self.name = name
+        self.parameters = parameters if parameters is not None else TIER_PRESETS[name]
+        self.check_connectivity = check_connectivity
+        self.promote = promote
+        self.promote_signature = getattr(promote, "signature", None) if promote is not None else None
+
+    def signature(self) -> str:
+        """Identity of the tier's settings, part of the result cache key"""
+        return f"{self.name}[{self.parameters}|{self.check_connectivity}|{self.promote_signature}]"
+
+
+class MinGap:
+    """
+    Promotion rule keeping candidates whose estimated HOMO-LUMO gap reaches threshold.
+
+    A class rather than a closure so that tiers can be sent to worker processes.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.signature = f"min_gap={threshold}"
+
+    def __call__(self, result: Dict) -> bool:
+        try:
+            return float(result["homo_lumo_gap"]) >= self.threshold
+        except (KeyError, TypeError, ValueError):
+            return True
+
+
+def parse_tiers(spec: Optional[str], promote_min_gap: Optional[float] = None) -> List[Tier]:
+    """
+    Tiers from a comma-separated list of preset names.
+
+    Args:
+        spec: E.g. "gfnff,gfn2-crude"; empty or None for no tiers
+        promote_min_gap: Gap estimate the last tier requires for promotion to the tight run
+
+    Returns:
+        List of Tier, cheapest first
+    """
+    names = [name.strip() for name in (spec or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in TIER_PRESETS]
+    if unknown:
+        raise ValueError(f"Unknown tiers {unknown}, expected some of {list(TIER_PRESETS)}")
+    tiers = [Tier(name) for name in names]
+    if tiers and promote_min_gap is not None:
+        tiers[-1] = Tier(tiers[-1].name, promote=MinGap(promote_min_gap))
+    return tiers
+
+
+def tiers_signature(tiers: Optional[Iterable[Tier]]) -> str:
+    """Cache key component of a tier configuration, empty without tiers"""
+    return "".join(f"{tier.signature()} > " for tier in tiers or [])
+
+
+def add_tier_record(df, idx, name: str, status: str, seconds: float) -> None:
+    """Append the outcome of a tier to the tiers column of df.loc[idx]"""
+    previous = df.loc[idx, TIERS_COLUMN] if TIERS_COLUMN in df else ""
+    previous = previous if isinstance(previous, str) and previous else ""
+    df.loc[idx, TIERS_COLUMN] = ";".join(filter(None, [previous, f"{name}:{status}:{seconds:.2f}"]))
+
+
+def reject_last_tier(df, idx) -> None:
+    """Turn the last tier of df.loc[idx] into a rejection, e.g. when the final structure fails validation"""
+    records = df.loc[idx, TIERS_COLUMN] if TIERS_COLUMN in df else ""
+    if not isinstance(records, str) or not records:
+        return
+    *head, last = records.split(";")
+    name, _, seconds = last.rsplit(":", 2)
+    df.loc[idx, TIERS_COLUMN] = ";".join(head + [f"{name}:{REJECTED}:{seconds}"])
+
+
+def summarize_tiers(records: Iterable) -> Dict[str, Dict]:
+    """
+    Pass rate and time of every tier.
+
+    Args:
+        records: Values of the tiers column, one per row
+
+    Returns:
+        Dict mapping tier names, in order of appearance, to counts of rows
+        entering, passing, rejected, not promoted and failed, the pass rate
+        and the total and mean seconds spent
+    """
+    summary: Dict[str, Dict] = {}
+    for record in records:
+        if not isinstance(record, str) or not record:
+            continue
+        for entry in record.split(";"):
+            name, status, seconds = entry.rsplit(":", 2)
+            tier = summary.setdefault(name, {
+                "entered": 0, PASSED: 0, REJECTED: 0, NOT_PROMOTED: 0, FAILED: 0, "seconds": 0.0,
+            })
+            tier["entered"] += 1
+            tier[status] += 1
+            tier["seconds"] += float(seconds)
+    for tier in summary.values():
+        tier["pass_rate"] = tier[PASSED] / tier["entered"]
+        tier["mean_seconds"] = tier["seconds"] / tier["entered"]
+    return summary
@@ -0,0 +1,265 @@
+import json
+import os
+import shutil
+import socket
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+# Kinds of structures in a geometry archive
+INITIAL = "initial"
+OPTIMIZED = "optimized"
+
+
+def parse_xyz_text(text: str) -> Tuple[List[str], np.ndarray, str]:
+    """
+    Parse the first frame of XYZ text.
+
+    The atom lines are split in one pass and the coordinates converted by
+    NumPy as a whole, without a Python loop over the atoms.
+
+    Returns:
+        tuple: (element symbols, (n, 3) float coordinates, comment line)
+    """
+    lines = text.split("\n", 2)
+    count = int(lines[0])
+    comment = lines[1].rstrip("\r") if len(lines) > 1 else ""
+    body = lines[2] if len(lines) > 2 else ""
+    tokens = body.split(None, 4 * count)[:4 * count] if count else []
+    elements = tokens[0::4]
+    del tokens[0::4]
+    try:
+        if len(elements) != count or not all(map(str.isalpha, elements)):
+            raise ValueError
+        coords = np.array(tokens, dtype=float).reshape(count, 3)
+    except ValueError:
+        # Atom lines with extra columns; fall back to reading line by line
+        fields = [line.split()[:4] for line in body.splitlines()[:count]]
+        if len(fields) != count or any(len(field) != 4 for field in fields):
+            raise ValueError(f"Expected {count} atoms, found {len(fields)}")
+        elements = [field[0] for field in fields]
+        coords = np.array([field[1:] for field in fields], dtype=float).reshape(count, 3)
+    return elements, coords, comment
+
+
+def read_xyz(path: str) -> Tuple[List[str], np.ndarray, str]:
+    """
+    Read the first frame of an XYZ file.
+
+    Returns:
+        tuple: (element symbols, (n, 3) coordinates, comment line)
+    """
+    with open(path) as fo:
+        return parse_xyz_text(fo.read())
+
+
+def write_xyz(path: str, elements: Sequence[str], coords: np.ndarray, comment: str = "") -> None:
+    """Write an XYZ file, renamed into place so readers never see a partial file"""
+    lines = [str(len(elements)), comment]
+    lines += [f"{element} {x:.6f} {y:.6f} {z:.6f}" for element, (x, y, z) in zip(elements, coords)]
+    tmp = f"{path}.{uuid4().hex}.tmp"
+    with open(tmp, "w") as fo:
+        fo.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+
+
+class GeometryArchive:
+    """
+    Append-only archive of TMC structures in a few large files.
+
+    Every writer process appends to its own shard:
+
+        <shard>.f32  coordinates of all its structures as float32 triples
+        <shard>.idx  one JSON line per structure: key, kind, offset, elements
+
+    Coordinates are written before their index line, and a reader ignores a
+    trailing index line without newline, so an index entry always points at
+    complete data. Readers map the coordinate files with np.memmap and
+    slice structures out of them without copying. A structure stored again
+    under the same key and kind supersedes the earlier one. Compared to one
+    directory per molecule, a space of a million TMCs takes a few files per
+    worker instead of millions of inodes.
+
+    Args:
+        directory: Archive directory, shared by all writers
+        shard: Shard this archive appends to, defaults to one per host and process
+    """
+
+    def __init__(self, directory: str, shard: Optional[str] = None):
+        self.directory = directory
+        self.shard = shard
+        self._index: Dict[Tuple[str, str], Dict] = {}
+        self._read_positions: Dict[str, int] = {}
+        self._maps: Dict[str, np.memmap] = {}
+        # Threads of one process share its shard; appends must not interleave
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Worker processes start with an empty index and their own memory maps
+        return {"directory": self.directory, "shard": self.shard}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"], state["shard"])
+
+    def _shard_name(self) -> str:
+        return self.shard or f"{socket.gethostname()}-{os.getpid()}"
+
+    def _data_path(self, shard: str) -> str:
+        return os.path.join(self.directory, f"{shard}.f32")
+
+    def _index_path(self, shard: str) -> str:
+        return os.path.join(self.directory, f"{shard}.idx")
+
+    def put(self, key: str, elements: Sequence[str], coords: np.ndarray, kind: str = OPTIMIZED,
+            comment: str = "") -> None:
+        """
+        Append a structure.
+
+        Args:
+            key: Identifier of the TMC, e.g. its fileName
+            elements: Element symbols
+            coords: (n, 3) coordinates, stored as float32
+            kind: INITIAL for molSimplify builds, OPTIMIZED for xTB results
+            comment: Comment line of the structure
+        """
+        shard = self._shard_name()
+        data = np.ascontiguousarray(coords, dtype="<f4").reshape(-1, 3)
+        if len(data) != len(elements):
+            raise ValueError(f"{len(elements)} elements but {len(data)} coordinates")
+        with self._lock:
+            with open(self._data_path(shard), "ab") as fo:
+                offset = fo.tell()
+                fo.write(data.tobytes())
+            entry = {
+                "key": str(key), "kind": kind, "offset": offset,
+                "elements": " ".join(elements), "comment": comment,
+            }
+            with open(self._index_path(shard), "a") as fo:
+                fo.write(json.dumps(entry) + "\n")
+
+    def refresh(self) -> None:
+        """Read the index lines appended by any writer since the last refresh"""
+        # Threads restoring structures refresh concurrently; read positions must advance once
+        with self._lock:
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".idx"):
+                    continue
+                shard = name[:-4]
+                with open(self._index_path(shard), "rb") as fo:
+                    fo.seek(self._read_positions.get(shard, 0))
+                    data = fo.read()
+                complete = data[:data.rfind(b"\n") + 1]
+                self._read_positions[shard] = self._read_positions.get(shard, 0) + len(complete)
+                for line in complete.decode().splitlines():
+                    entry = json.loads(line)
+                    entry["shard"] = shard
+                    self._index[(entry["key"], entry["kind"])] = entry
+
+    def keys(self, kind: str = OPTIMIZED) -> List[str]:
+        """Keys of the stored structures of a kind"""
+        self.refresh()
+        return sorted(key for key, entry_kind in self._index if entry_kind == kind)
+
+    def _map(self, shard: str, end: int) -> np.memmap:
+        """Memory map of a coordinate file covering at least `end` bytes"""
+        mapped = self._maps.get(shard)
+        if mapped is None or mapped.nbytes < end:
+            mapped = np.memmap(self._data_path(shard), dtype="<f4", mode="r")
+            self._maps[shard] = mapped
+        return mapped
+
+    def get(self, key: str, kind: str = OPTIMIZED) -> Optional[Tuple[List[str], np.ndarray, str]]:
+        """
+        A stored structure.
+
+        Returns:
+            tuple: (element symbols, read-only (n, 3) float32 view of the
+            coordinates, comment), or None if the key is not stored
+        """
+        entry = self._index.get((str(key), kind))
+        if entry is None:
+            self.refresh()
+            entry = self._index.get((str(key), kind))
+            if entry is None:
+                return None
+        elements = entry["elements"].split()
+        start = entry["offset"] // 4
+        mapped = self._map(entry["shard"], entry["offset"] + 12 * len(elements))
+        coords = mapped[start:start + 3 * len(elements)].reshape(-1, 3)
+        return elements, coords, entry["comment"]
+
+    def export_xyz(self, key: str, path: str, kind: str = OPTIMIZED) -> bool:
+        """Write a stored structure to an XYZ file, e.g. as input of a tool; False if not stored"""
+        stored = self.get(key, kind)
+        if stored is None:
+            return False
+        write_xyz(path, *stored)
+        return True
+
+    def put_xyz(self, key: str, path: str, kind: str = OPTIMIZED) -> bool:
+        """Append the structure of an XYZ file; False if it cannot be read"""
+        try:
+            elements, coords, comment = read_xyz(str(path))
+        except (OSError, ValueError, IndexError):
+            return False
+        self.put(key, elements, coords, kind=kind, comment=comment)
+        return True
+
+
+def find_molsimplify_xyz(run_dir) -> Optional[Path]:
+    """The structure molSimplify wrote below its run directory, None if there is none or it is a bad job"""
+    files = sorted(Path(run_dir).rglob("*.xyz"))
+    if not files or "badjob" in str(files[0]):
+        return None
+    return files[0]
+
+
+def migrate_run_directories(archive: GeometryArchive, root_path: str, xtb_dir: Optional[str] = None,
+                            remove: bool = False, logger=None) -> Dict[str, int]:
+    """
+    Move the structures of per-molecule run directories into an archive.
+
+    Structures already in the archive are skipped, so an interrupted
+    migration can be run again.
+
+    Args:
+        archive: Target archive
+        root_path: Directory holding molSimplify_xyz/<fileName>/ run directories
+        xtb_dir: Directory holding xtb_xyz/<fileName>/xtbopt.xyz, defaults to root_path/xtb_xyz
+        remove: Delete every run directory whose structure is archived
+        logger: Optional logger for progress messages
+
+    Returns:
+        dict: Structures of each kind archived, skipped, unreadable and directories removed
+    """
+    counts = {INITIAL: 0, OPTIMIZED: 0, "skipped": 0, "unreadable": 0, "removed": 0}
+    known = {INITIAL: set(archive.keys(INITIAL)), OPTIMIZED: set(archive.keys(OPTIMIZED))}
+    sources = [
+        (INITIAL, Path(root_path) / "molSimplify_xyz", find_molsimplify_xyz),
+        (OPTIMIZED, Path(xtb_dir) if xtb_dir else Path(root_path) / "xtb_xyz",
+         lambda run_dir: run_dir / "xtbopt.xyz" if (run_dir / "xtbopt.xyz").exists() else None),
+    ]
+    for kind, directory, locate in sources:
+        if not directory.is_dir():
+            continue
+        for run_dir in sorted(path for path in directory.iterdir() if path.is_dir()):
+            archived = run_dir.name in known[kind]
+            if archived:
+                counts["skipped"] += 1
+            else:
+                xyz_path = locate(run_dir)
+                if xyz_path is not None and archive.put_xyz(run_dir.name, xyz_path, kind):
+                    counts[kind] += 1
+                    archived = True
+                else:
+                    counts["unreadable"] += 1
+            if archived and remove:
+                shutil.rmtree(run_dir, ignore_errors=True)
+                counts["removed"] += 1
+        if logger is not None:
+            logger.info(f"Migrated {directory}: {counts}")
+    return counts
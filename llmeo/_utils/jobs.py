@@ -0,0 +1,238 @@
+import multiprocessing
+import os
+import resource
+import signal
+import subprocess
+import threading
+import traceback
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence, Union
+
+# Thread pools of xTB (OpenMP) and of the linear algebra libraries
+THREAD_ENV = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+_core_budget = None
+
+
+class JobError(Exception):
+    """A job did not finish on its own"""
+
+
+class JobTimeout(JobError):
+    """A job exceeded its wall-clock limit and was killed"""
+
+
+class JobKilled(JobError):
+    """A job was terminated by a signal, e.g. by the kernel when out of memory"""
+
+
+class JobLimits:
+    """
+    Resource limits of one molSimplify or xTB job.
+
+    Args:
+        timeout: Wall-clock limit in seconds, None for no limit
+        memory_mb: Address space limit in MiB, None for no limit
+        nice: Niceness increment of the job
+        threads: OpenMP/BLAS threads of the job, also the cores it takes from the core budget
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        memory_mb: Optional[int] = None,
+        nice: int = 0,
+        threads: int = 1,
+    ):
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.nice = nice
+        self.threads = threads
+
+    def environment(self) -> Dict[str, str]:
+        """Environment of the job with the thread count pinned"""
+        env = dict(os.environ)
+        for name in THREAD_ENV:
+            env[name] = str(self.threads)
+        return env
+
+    def apply(self) -> None:
+        """Apply niceness and memory limit to the current process (run in the job process)"""
+        if self.nice:
+            os.nice(self.nice)
+        if self.memory_mb:
+            limit = int(self.memory_mb) * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class CoreBudget:
+    """
+    Cores shared by the concurrent jobs of a node.
+
+    A job reserves as many cores as it has threads and waits while the
+    budget is exhausted. The counter lives in shared memory, so one budget
+    created before a process pool starts is honoured by all its workers.
+    """
+
+    def __init__(self, cores: int):
+        self.cores = cores
+        self._condition = multiprocessing.Condition()
+        self._free = multiprocessing.Value("i", cores, lock=False)
+
+    @property
+    def free(self) -> int:
+        with self._condition:
+            return self._free.value
+
+    @contextmanager
+    def reserve(self, cores: int):
+        """Hold `cores` cores (at most the whole budget) while the block runs"""
+        cores = max(1, min(cores, self.cores))
+        with self._condition:
+            self._condition.wait_for(lambda: self._free.value >= cores)
+            self._free.value -= cores
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._free.value += cores
+                self._condition.notify_all()
+
+
+def set_core_budget(budget: Optional[CoreBudget]) -> None:
+    """Make budget the core budget of every job started by this process"""
+    global _core_budget
+    _core_budget = budget
+
+
+@contextmanager
+def _reserved(limits: JobLimits):
+    if _core_budget is None:
+        yield
+    else:
+        with _core_budget.reserve(limits.threads):
+            yield
+
+
+def _kill_group(pid: int) -> None:
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def run_command(
+    command: Union[str, Sequence[str]],
+    limits: Optional[JobLimits] = None,
+    name: str = "job",
+    shell: bool = False,
+    cwd: Optional[str] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Run an external program under resource limits.
+
+    The program runs in its own process group, so a timeout kills it
+    together with everything it started.
+
+    Args:
+        command: Command line as for subprocess.run
+        limits: Resource limits, defaults to JobLimits()
+        name: Job name used in error messages
+        shell: Whether command is run through the shell
+        cwd: Working directory of the program
+
+    Returns:
+        subprocess.CompletedProcess: Exit code and captured output
+
+    Raises:
+        JobTimeout: If the program exceeded limits.timeout
+        JobKilled: If the program was terminated by a signal
+    """
+    limits = limits or JobLimits()
+    with _reserved(limits):
+        process = subprocess.Popen(
+            command,
+            shell=shell,
+            cwd=cwd,
+            env=limits.environment(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            preexec_fn=limits.apply,
+        )
+        try:
+            stdout, stderr = process.communicate(timeout=limits.timeout)
+        except subprocess.TimeoutExpired:
+            _kill_group(process.pid)
+            process.communicate()
+            raise JobTimeout(f"Job timeout: {name} exceeded {limits.timeout:g}s")
+    if process.returncode < 0:
+        raise JobKilled(f"Job killed: {name} received signal {-process.returncode}")
+    return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+
+
+def _call_in_child(connection, function: Callable, args, kwargs, limits: JobLimits) -> None:
+    os.setsid()
+    os.environ.update(limits.environment())
+    limits.apply()
+    try:
+        connection.send(("ok", function(*args, **kwargs)))
+    except BaseException as e:
+        connection.send(("error", f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+    finally:
+        connection.close()
+
+
+def run_function(function: Callable, *args, limits: Optional[JobLimits] = None, name: str = "job", **kwargs):
+    """
+    Call a Python function in a forked process under resource limits.
+
+    Used for libraries such as uxtbpy that start their own subprocesses
+    without a timeout. The child and anything it starts form one process
+    group that is killed on timeout. The return value must be picklable.
+    While other threads are running, the child is started by a forkserver
+    instead, since a fork can copy locks held by those threads (e.g. the
+    stdout lock) into the child, where they are never released; function
+    and arguments must then be picklable too.
+
+    Args:
+        function: Function to call
+        *args: Positional arguments of function
+        limits: Resource limits, defaults to JobLimits()
+        name: Job name used in error messages
+        **kwargs: Keyword arguments of function
+
+    Returns:
+        The return value of function
+
+    Raises:
+        JobTimeout: If the call exceeded limits.timeout
+        JobKilled: If the child was terminated by a signal
+        RuntimeError: If function raised, with the original traceback as message
+    """
+    limits = limits or JobLimits()
+    context = multiprocessing.get_context("fork" if threading.active_count() == 1 else "forkserver")
+    receiver, sender = context.Pipe(duplex=False)
+    with _reserved(limits):
+        process = context.Process(target=_call_in_child, args=(sender, function, args, kwargs, limits))
+        process.start()
+        sender.close()
+        try:
+            # Wait for the result rather than the exit, large results would block the child on the pipe
+            if not receiver.poll(limits.timeout):
+                _kill_group(process.pid)
+                process.join()
+                raise JobTimeout(f"Job timeout: {name} exceeded {limits.timeout:g}s")
+            try:
+                status, value = receiver.recv()
+            except EOFError:
+                process.join()
+                if process.exitcode < 0:
+                    raise JobKilled(f"Job killed: {name} received signal {-process.exitcode}")
+                raise RuntimeError(f"{name} exited with code {process.exitcode} without a result")
+            process.join()
+        finally:
+            receiver.close()
+    if status == "error":
+        raise RuntimeError(value)
+    return value
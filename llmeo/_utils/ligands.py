@@ -0,0 +1,236 @@
+import json
+import os
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+from rdkit import Chem, rdBase
+from rdkit.Chem import rdMolDescriptors
+
+from .utils import LIG_CONNECTING_ATOM_INDEX, LIG_CONNECTING_ATOM_LIST, LIG_SMILE_LIST
+
+
+def _occurrence(value) -> Optional[int]:
+    """Occurrence as `find_index` reads it, None if it is not an integer"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LigandInfo:
+    """
+    What row processing needs to know about one ligand at one attachment.
+
+    Args:
+        smiles: Ligand SMILES
+        element: Connecting atom element
+        occurrence: Which atom of that element connects, 1-based
+        index: 1-based atom index of the connecting atom, None if the
+            occurrence is not an integer or the SMILES is invalid
+        error: Why the connecting atom does not exist, empty otherwise
+        atoms: Atoms including hydrogens, 0 for an invalid SMILES
+        rotatable: Rotatable bonds
+    """
+
+    def __init__(self, smiles: str, element, occurrence, index: Optional[int] = None, error: str = "",
+                 atoms: int = 0, rotatable: int = 0):
+        self.smiles = smiles
+        self.element = element
+        self.occurrence = occurrence
+        self.index = index
+        self.error = error
+        self.atoms = atoms
+        self.rotatable = rotatable
+
+    @property
+    def valid(self) -> bool:
+        return self.atoms > 0 and not self.error
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, entry: Dict) -> "LigandInfo":
+        return cls(**entry)
+
+
+class LigandTable:
+    """
+    Per-ligand precomputations, resolved once per process or once per file.
+
+    A ligand space has millions of rows but only a few dozen distinct
+    ligands. RDKit parses every SMILES once; connecting atom indices,
+    atom counts and rotatable bonds are then resolved once per
+    (SMILES, element, occurrence) and looked up from a dict for every row.
+    With a path, the table is read from and written back to a JSON file, so
+    later runs and other nodes do not parse at all. The file records the
+    RDKit version and is ignored when it was written by another one.
+
+    Args:
+        path: Optional JSON file backing the table
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = None
+        self._molecules: Dict[str, Dict] = {}
+        self._ligands: Dict[Tuple, LigandInfo] = {}
+        self.parsed = 0
+        self.lookups = 0
+        if path is not None:
+            self.load(path)
+
+    def load(self, path: str) -> int:
+        """
+        Back the table with a JSON file and read the ligands stored in it.
+
+        Returns:
+            int: Ligands read from the file
+        """
+        self.path = path
+        try:
+            with open(path) as fo:
+                stored = json.load(fo)
+        except (OSError, ValueError):
+            return 0
+        if stored.get("rdkit") != rdBase.rdkitVersion:
+            return 0
+        self._molecules.update(stored.get("molecules", {}))
+        for entry in stored.get("ligands", []):
+            info = LigandInfo.from_dict(entry)
+            self._ligands[(info.smiles, info.element, info.occurrence)] = info
+        return len(stored.get("ligands", []))
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the table to its JSON file, renamed into place so readers never see a partial file"""
+        path = path or self.path
+        if path is None:
+            return
+        content = {
+            "rdkit": rdBase.rdkitVersion,
+            "molecules": self._molecules,
+            "ligands": [info.to_dict() for info in self._ligands.values()],
+        }
+        tmp = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp, "w") as fo:
+            json.dump(content, fo)
+        os.replace(tmp, path)
+
+    def molecule(self, smiles) -> Dict:
+        """
+        Parse a SMILES once.
+
+        Returns:
+            dict: "valid", "atoms" including hydrogens, "rotatable" bonds and
+            the "symbols" of the heavy atoms in SMILES order
+        """
+        smiles = str(smiles)
+        molecule = self._molecules.get(smiles)
+        if molecule is None:
+            self.parsed += 1
+            mol = Chem.MolFromSmiles(smiles)
+            if mol is None:
+                molecule = {"valid": False, "atoms": 0, "rotatable": 0, "symbols": []}
+            else:
+                molecule = {
+                    "valid": True,
+                    "atoms": Chem.AddHs(mol).GetNumAtoms(),
+                    "rotatable": rdMolDescriptors.CalcNumRotatableBonds(mol),
+                    "symbols": [atom.GetSymbol() for atom in mol.GetAtoms()],
+                }
+            self._molecules[smiles] = molecule
+        return molecule
+
+    def info(self, smiles, element, occurrence) -> LigandInfo:
+        """Connecting atom, size and flexibility of a ligand, resolved on first use"""
+        self.lookups += 1
+        key = (str(smiles), str(element), _occurrence(occurrence))
+        info = self._ligands.get(key)
+        if info is None:
+            info = self._resolve(*key)
+            self._ligands[key] = info
+        return info
+
+    def _resolve(self, smiles: str, element: str, occurrence: Optional[int]) -> LigandInfo:
+        molecule = self.molecule(smiles)
+        info = LigandInfo(smiles, element, occurrence, atoms=molecule["atoms"], rotatable=molecule["rotatable"])
+        if occurrence is None:
+            return info
+        if not molecule["valid"]:
+            print(f"find Index {smiles} Invalid SMILES string")
+            return info
+        indices = [i for i, symbol in enumerate(molecule["symbols"]) if symbol == element]
+        if occurrence <= 0 or occurrence > len(indices):
+            info.error = f"The {occurrence}-th occurrence of atom '{element}' does not exist in the SMILES string."
+        else:
+            info.index = indices[occurrence - 1] + 1
+        return info
+
+    def precompute(self, df) -> int:
+        """
+        Resolve every distinct ligand of a ligand space frame.
+
+        Args:
+            df: Frame with lig{n}_smiles, lig{n}_element and lig{n}_index columns
+
+        Returns:
+            int: Distinct ligands in df
+        """
+        ligands = set()
+        for smiles, element, index in zip(LIG_SMILE_LIST, LIG_CONNECTING_ATOM_LIST, LIG_CONNECTING_ATOM_INDEX):
+            if smiles in df and element in df and index in df:
+                ligands.update(zip(df[smiles], df[element], df[index]))
+        for ligand in ligands:
+            self.info(*ligand)
+        return len(ligands)
+
+    def update(self, other: "LigandTable") -> None:
+        """Take over the precomputations of another table, e.g. one sent to a worker process"""
+        self._molecules.update(other._molecules)
+        self._ligands.update(other._ligands)
+
+    @property
+    def stats(self) -> Dict:
+        return {"ligands": len(self._ligands), "smiles": len(self._molecules), "parsed": self.parsed,
+                "lookups": self.lookups}
+
+
+# Table of this process, shared by all callers
+LIGANDS = LigandTable()
+
+
+def ligand_info(smiles, element, occurrence) -> LigandInfo:
+    """Connecting atom, size and flexibility of a ligand from the process table"""
+    return LIGANDS.info(smiles, element, occurrence)
+
+
+def ligand_descriptors(smiles: str) -> Tuple[int, int]:
+    """
+    Size and flexibility of a ligand, computed once per SMILES.
+
+    Args:
+        smiles: Ligand SMILES
+
+    Returns:
+        tuple: (atoms including hydrogens, rotatable bonds), (0, 0) for invalid SMILES
+    """
+    molecule = LIGANDS.molecule(smiles)
+    return molecule["atoms"], molecule["rotatable"]
+
+
+def prepare_ligands(df, path: Optional[str] = None) -> Dict:
+    """
+    Resolve the ligands of a frame in the process table before its rows are calculated.
+
+    Args:
+        df: Rows about to be calculated
+        path: Optional JSON file to read the table from and write it back to
+
+    Returns:
+        dict: Stats of the process table
+    """
+    if path is not None:
+        LIGANDS.load(path)
+    LIGANDS.precompute(df)
+    if path is not None:
+        LIGANDS.save()
+    return LIGANDS.stats
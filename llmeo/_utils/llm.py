@@ -1,11 +1,226 @@
+import json
+import math
 import os
-from typing import Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
 import yaml
 
+# USD per million tokens as (input, cached input, output)
+MODEL_PRICING: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4": (30.0, 30.0, 60.0),
+    "o1-preview": (15.0, 7.5, 60.0),
+    "o1-mini": (3.0, 1.5, 12.0),
+    "o1": (15.0, 7.5, 60.0),
+    "claude-3-5-sonnet-20240620": (3.0, 0.3, 15.0),
+    "gemini-2.0-flash-thinking-exp": (0.0, 0.0, 0.0),
+}
+
 class LLMError(Exception):
     """Base exception for LLM-related errors"""
     pass
 
+class LLMUsage:
+    """Token, latency and cost accounting for a single LLM call"""
+    def __init__(
+        self,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        cached_tokens: int = 0,
+        reasoning_tokens: int = 0,
+        latency: float = 0.0,
+        time_to_first_token: Optional[float] = None,
+        cost: float = 0.0,
+    ):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.latency = latency
+        self.time_to_first_token = time_to_first_token
+        self.cost = cost
+
+    def to_dict(self) -> Dict[str, float]:
+        """Return the usage as a flat dictionary"""
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "latency": self.latency,
+            "time_to_first_token": self.time_to_first_token,
+            "cost": self.cost,
+        }
+
+class LLMResponse:
+    """Text returned by an LLM together with the usage of the call"""
+    def __init__(self, text: str, usage: Optional[LLMUsage] = None, model: Optional[str] = None):
+        self.text = text
+        self.usage = usage or LLMUsage()
+        self.model = model
+
+    def __str__(self) -> str:
+        return self.text
+
+def estimate_cost(model_name: str, usage: LLMUsage) -> float:
+    """
+    Estimate the USD cost of a call from its token counts.
+
+    Cached input tokens are billed at the cached rate and reasoning tokens are
+    already part of the output tokens. Unknown models are assumed to be free.
+    """
+    input_price, cached_price, output_price = MODEL_PRICING.get(model_name, (0.0, 0.0, 0.0))
+    uncached = max(usage.input_tokens - usage.cached_tokens, 0)
+    return (
+        uncached * input_price
+        + usage.cached_tokens * cached_price
+        + usage.output_tokens * output_price
+    ) / 1e6
+
+def _usage_value(obj, *attrs) -> int:
+    """Follow an attribute path on a provider usage object, returning 0 if absent"""
+    for attr in attrs:
+        obj = getattr(obj, attr, None)
+        if obj is None:
+            return 0
+    return obj if isinstance(obj, (int, float)) else 0
+
+def _make_response(
+    name: str,
+    text: str,
+    start: float,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    cached_tokens: int = 0,
+    reasoning_tokens: int = 0,
+    time_to_first_token: Optional[float] = None,
+) -> LLMResponse:
+    """Build an LLMResponse, timing the call from `start` and pricing it"""
+    latency = time.perf_counter() - start
+    usage = LLMUsage(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cached_tokens=cached_tokens,
+        reasoning_tokens=reasoning_tokens,
+        latency=latency,
+        # Without streaming the first token arrives with the full response
+        time_to_first_token=latency if time_to_first_token is None else time_to_first_token,
+    )
+    usage.cost = estimate_cost(name, usage)
+    return LLMResponse(text, usage=usage, model=name)
+
+def _openai_usage(usage) -> Dict[str, int]:
+    """Extract token counts from an OpenAI usage object"""
+    return {
+        "input_tokens": _usage_value(usage, "prompt_tokens"),
+        "output_tokens": _usage_value(usage, "completion_tokens"),
+        "cached_tokens": _usage_value(usage, "prompt_tokens_details", "cached_tokens"),
+        "reasoning_tokens": _usage_value(usage, "completion_tokens_details", "reasoning_tokens"),
+    }
+
+def _openai_response(name: str, response, start: float) -> LLMResponse:
+    """Convert an OpenAI chat completion into an LLMResponse"""
+    return _make_response(
+        name,
+        response.choices[0].message.content,
+        start,
+        **_openai_usage(getattr(response, "usage", None)),
+    )
+
+def _openai_stream_response(
+    name: str, stream, start: float, on_text: Callable[[str], None]
+) -> LLMResponse:
+    """Consume an OpenAI chat completion stream, forwarding text deltas to on_text"""
+    parts = []
+    usage = None
+    first_token = None
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            parts.append(delta)
+            on_text(delta)
+    return _make_response(
+        name, "".join(parts), start, time_to_first_token=first_token, **_openai_usage(usage)
+    )
+
+def _anthropic_response(
+    name: str, response, start: float, time_to_first_token: Optional[float] = None
+) -> LLMResponse:
+    """Convert an Anthropic message into an LLMResponse; a tool call is returned as JSON text"""
+    text = next(
+        (json.dumps(block.input) for block in response.content
+         if getattr(block, "type", None) == "tool_use"),
+        None,
+    )
+    if text is None:
+        text = response.content[0].text
+    usage = getattr(response, "usage", None)
+    cache_read = _usage_value(usage, "cache_read_input_tokens")
+    # Anthropic reports cache reads and writes separately from input_tokens
+    input_tokens = (
+        _usage_value(usage, "input_tokens")
+        + cache_read
+        + _usage_value(usage, "cache_creation_input_tokens")
+    )
+    return _make_response(
+        name,
+        text,
+        start,
+        input_tokens=input_tokens,
+        output_tokens=_usage_value(usage, "output_tokens"),
+        cached_tokens=cache_read,
+        time_to_first_token=time_to_first_token,
+    )
+
+class UsageTracker:
+    """Collect the usage of every LLM call of a run, tagged by iteration"""
+    def __init__(self):
+        self.records: List[Dict] = []
+
+    def record(self, iteration: int, response: LLMResponse) -> None:
+        """Store the usage of one call made during `iteration`"""
+        self.records.append(
+            {"iter": iteration, "model": response.model, **response.usage.to_dict()}
+        )
+
+    def per_iteration(self) -> List[Dict]:
+        """Sum the usage of all calls belonging to the same iteration"""
+        summary: Dict[int, Dict] = {}
+        for rec in self.records:
+            agg = summary.setdefault(
+                rec["iter"],
+                {"iter": rec["iter"], "calls": 0, "input_tokens": 0, "output_tokens": 0,
+                 "cached_tokens": 0, "reasoning_tokens": 0, "latency": 0.0,
+                 "time_to_first_token": 0.0, "cost": 0.0},
+            )
+            agg["calls"] += 1
+            for key in ("input_tokens", "output_tokens", "cached_tokens",
+                        "reasoning_tokens", "latency", "cost"):
+                agg[key] += rec[key]
+            agg["time_to_first_token"] += rec["time_to_first_token"] or 0.0
+        return [summary[k] for k in sorted(summary)]
+
+    def totals(self) -> Dict:
+        """Return run-level totals and mean latencies"""
+        n = len(self.records)
+        totals = {"calls": n}
+        for key in ("input_tokens", "output_tokens", "cached_tokens",
+                    "reasoning_tokens", "latency", "cost"):
+            totals[key] = sum(rec[key] for rec in self.records)
+        totals["mean_latency"] = totals["latency"] / n if n else 0.0
+        totals["mean_time_to_first_token"] = (
+            sum(rec["time_to_first_token"] or 0.0 for rec in self.records) / n if n else 0.0
+        )
+        return totals
+
 class LLMConfig:
     """Configuration for LLM models"""
     def __init__(
@@ -16,7 +231,8 @@ class LLMConfig:
         temperature: float = 0.5,
         top_p: float = 1.0,
         max_tokens: int = 4096,
-        system_prompt: str = "You are a helpful assistant."
+        system_prompt: str = "You are a helpful assistant.",
+        prompt_caching: bool = False,
     ):
         self.openai_api_key = openai_api_key
         self.anthropic_api_key = anthropic_api_key
@@ -25,6 +241,8 @@ class LLMConfig:
         self.top_p = top_p
         self.max_tokens = max_tokens
         self.system_prompt = system_prompt
+        # Mark the first prompt of a conversation as a cache breakpoint (Anthropic)
+        self.prompt_caching = prompt_caching
 
     @classmethod
     def from_yaml(cls, config_path: str) -> "LLMConfig":
@@ -45,11 +263,15 @@ class LLMConfig:
             system_prompt=config_data.get(
                 "system_prompt", 
                 "You are a helpful assistant."
-            )
+            ),
+            prompt_caching=config_data.get("prompt_caching", False),
         )
 
 class GPT4:
     """GPT-4 model implementation"""
+    supports_streaming = True
+    supports_structured_output = False
+
     def __init__(self, config: LLMConfig):
         self.config = config
         self.name = "gpt-4"
@@ -67,32 +289,73 @@ class GPT4:
 
     def call(self, content: str, system: Optional[str] = None) -> str:
         """Call the model with content"""
-        try:
-            messages = [
+        return self.generate(content, system=system).text
+
+    def request_params(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Dict:
+        """Keyword arguments of the chat completion request for content"""
+        return {
+            "model": self.name,
+            "messages": [
                 {
                     "role": "system", 
                     "content": system or self.config.system_prompt
                 },
+                *(history or []),
                 {"role": "user", "content": content}
-            ]
-            
-            response = self.client.chat.completions.create(
-                model=self.name,
-                messages=messages,
-                max_tokens=self.config.max_tokens,
-                top_p=self.config.top_p,
-                temperature=self.config.temperature,
-            )
-            return response.choices[0].message.content
+            ],
+            "max_tokens": self.config.max_tokens,
+            "top_p": self.config.top_p,
+            "temperature": self.config.temperature,
+        }
+
+    def generate(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> LLMResponse:
+        """
+        Call the model with content and return the text with its usage.
+        Earlier turns of the conversation can be passed as `history`, a list
+        of {"role": "user" | "assistant", "content": ...} messages.
+
+        If `on_text` is given the response is streamed and every text delta is
+        passed to it as soon as it arrives. gpt-4 has no JSON-schema output, so
+        `response_schema` is ignored (see `supports_structured_output`).
+        """
+        try:
+            params = self.request_params(content, system, history=history)
+            start = time.perf_counter()
+            if on_text is not None:
+                stream = self.client.chat.completions.create(
+                    **params,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                return _openai_stream_response(self.name, stream, start, on_text)
+            response = self.client.chat.completions.create(**params)
+            return _openai_response(self.name, response, start)
         except Exception as e:
             raise LLMError(f"GPT-4 API call failed: {str(e)}")
 
 class GPTo1:
     """GPT-o1 model implementation"""
+    supports_streaming = True
+
     def __init__(self, config: LLMConfig, name: str = "o1-preview"):
         self.config = config
         self.name = name
         self.client = None
+        # JSON-schema response formats are not available for the preview models
+        self.supports_structured_output = name not in ("o1-preview", "o1-mini")
 
     def create(self) -> None:
         """Initialize the model"""
@@ -106,20 +369,79 @@ class GPTo1:
 
     def call(self, content: str, system: Optional[str] = None) -> str:
         """Call the model with content"""
+        return self.generate(content, system=system).text
+
+    def request_params(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Dict:
+        """Keyword arguments of the chat completion request for content"""
+        messages = [dict(message) for message in history or []]
+        messages.append({"role": "user", "content": content})
+        # o1 models take no system message, it is prepended to the first user turn
+        if system:
+            messages[0]["content"] = system + "\n" + messages[0]["content"]
+        params = {
+            "model": self.name,
+            "messages": messages,
+        }
+        if response_schema is not None and self.supports_structured_output:
+            params["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "tmc_proposals",
+                    "schema": response_schema,
+                    "strict": True,
+                },
+            }
+        return params
+
+    def generate(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> LLMResponse:
+        """
+        Call the model with content and return the text with its usage.
+        Earlier turns of the conversation can be passed as `history`, a list
+        of {"role": "user" | "assistant", "content": ...} messages.
+
+        If `on_text` is given the response is streamed and every text delta is
+        passed to it as soon as it arrives. If `response_schema` is given the
+        answer is constrained to that JSON schema.
+        """
         try:
-            if system:
-                content = system + "\n" + content
-            messages = [{"role": "user", "content": content}]
-            response = self.client.chat.completions.create(
-                model=self.name, 
-                messages=messages
-            )
-            return response.choices[0].message.content
+            params = self.request_params(content, system, response_schema, history)
+            start = time.perf_counter()
+            if "response_format" in params:
+                response = self.client.chat.completions.create(**params)
+                result = _openai_response(self.name, response, start)
+                if on_text is not None:
+                    on_text(result.text)
+                return result
+            if on_text is not None:
+                stream = self.client.chat.completions.create(
+                    **params,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                return _openai_stream_response(self.name, stream, start, on_text)
+            response = self.client.chat.completions.create(**params)
+            return _openai_response(self.name, response, start)
         except Exception as e:
             raise LLMError(f"GPT-o1 API call failed: {str(e)}")
 
 class Claude3:
     """Claude-3 model implementation"""
+    supports_streaming = True
+    supports_structured_output = True
+
     def __init__(self, config: LLMConfig):
         self.config = config
         self.name = "claude-3-5-sonnet-20240620"
@@ -137,25 +459,86 @@ class Claude3:
 
     def call(self, content: str, system: Optional[str] = None) -> str:
         """Call the model with content"""
+        return self.generate(content, system=system).text
+
+    def request_params(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Dict:
+        """Keyword arguments of the messages request for content"""
+        messages = [dict(message) for message in history or []]
+        messages.append({"role": "user", "content": content})
+        if self.config.prompt_caching:
+            # Follow-up turns then reuse the cached system prompt and first prompt
+            messages[0]["content"] = [{
+                "type": "text",
+                "text": messages[0]["content"],
+                "cache_control": {"type": "ephemeral"},
+            }]
+        params = {
+            "model": self.name,
+            "system": system or self.config.system_prompt,
+            "messages": messages,
+            "max_tokens": self.config.max_tokens,
+            "temperature": self.config.temperature,
+            "top_p": self.config.top_p,
+        }
+        if response_schema is not None:
+            params["tools"] = [{
+                "name": "propose_tmcs",
+                "description": "Report the proposed TMCs",
+                "input_schema": response_schema,
+            }]
+            params["tool_choice"] = {"type": "tool", "name": "propose_tmcs"}
+        return params
+
+    def generate(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> LLMResponse:
+        """
+        Call the model with content and return the text with its usage.
+        Earlier turns of the conversation can be passed as `history`, a list
+        of {"role": "user" | "assistant", "content": ...} messages.
+
+        If `on_text` is given the response is streamed and every text delta is
+        passed to it as soon as it arrives. If `response_schema` is given the
+        model is forced to answer through a tool taking that schema, and the
+        tool input is returned as JSON text.
+        """
         try:
-            system = system or self.config.system_prompt
-            messages = [{"role": "user", "content": content}]
-            
-            response = self.client.messages.create(
-                model=self.name,
-                system=system,
-                messages=messages,
-                max_tokens=self.config.max_tokens,
-                temperature=self.config.temperature,
-                top_p=self.config.top_p,
-            )
-            return response.content[0].text
+            params = self.request_params(content, system, response_schema, history)
+            start = time.perf_counter()
+            first_token = None
+            if response_schema is None and on_text is not None:
+                with self.client.messages.stream(**params) as stream:
+                    for delta in stream.text_stream:
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        on_text(delta)
+                    response = stream.get_final_message()
+            else:
+                response = self.client.messages.create(**params)
+            result = _anthropic_response(self.name, response, start, time_to_first_token=first_token)
+            if response_schema is not None and on_text is not None:
+                on_text(result.text)
+            return result
         except Exception as e:
             raise LLMError(f"Claude-3 API call failed: {str(e)}")
 
       
 class Gemini:
     """Gemini model implementation"""
+    supports_streaming = False
+    supports_structured_output = False
+
     def __init__(self, config: LLMConfig, name: str = "gemini-2.0-flash-thinking-exp"):
         self.config = config
         self.name = name
@@ -171,14 +554,285 @@ class Gemini:
         
     def call(self, content: str, system: Optional[str] = None) -> str:
         """Call the model with content"""
+        return self.generate(content, system=system).text
+
+    def generate(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> LLMResponse:
+        """
+        Call the model with content and return the text with its usage.
+        Earlier turns of the conversation can be passed as `history`, a list
+        of {"role": "user" | "assistant", "content": ...} messages.
+
+        Streaming and structured output are not supported for the thinking
+        model, so `on_text` receives the whole answer once it has arrived and
+        `response_schema` is ignored.
+        """
         try:
+            if history:
+                content = [
+                    {"role": "model" if message["role"] == "assistant" else "user",
+                     "parts": [{"text": message["content"]}]}
+                    for message in history + [{"role": "user", "content": content}]
+                ]
+            start = time.perf_counter()
             response = self.client.models.generate_content(
                 model=self.name, contents=content
             )
-            return response.candidates[0].content.parts[1].text
+            usage = getattr(response, "usage_metadata", None)
+            result = _make_response(
+                self.name,
+                response.candidates[0].content.parts[1].text,
+                start,
+                input_tokens=_usage_value(usage, "prompt_token_count"),
+                output_tokens=(
+                    _usage_value(usage, "candidates_token_count")
+                    + _usage_value(usage, "thoughts_token_count")
+                ),
+                cached_tokens=_usage_value(usage, "cached_content_token_count"),
+                reasoning_tokens=_usage_value(usage, "thoughts_token_count"),
+            )
+            if on_text is not None:
+                on_text(result.text)
+            return result
         except Exception as e:
             raise LLMError(f"Gemini API call failed: {str(e)}")
 
+class CircuitBreaker:
+    """
+    Sideline a provider whose recent error rate is too high.
+
+    The breaker opens when at least `error_threshold` of the last `window`
+    calls failed (after `min_calls` calls). Once `cooldown` seconds have
+    passed a trial call is allowed; its success closes the breaker again.
+    """
+    def __init__(
+        self,
+        window: int = 20,
+        error_threshold: float = 0.5,
+        min_calls: int = 5,
+        cooldown: float = 60.0,
+    ):
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may be sent to the provider"""
+        return self.state != "open"
+
+    def record(self, success: bool) -> None:
+        """Register the outcome of a call"""
+        with self._lock:
+            if self.opened_at is not None:
+                if success:
+                    self.opened_at = None
+                    self.outcomes.clear()
+                else:
+                    self.opened_at = time.monotonic()
+                return
+            self.outcomes.append(success)
+            errors = self.outcomes.count(False)
+            if (
+                len(self.outcomes) >= self.min_calls
+                and errors / len(self.outcomes) >= self.error_threshold
+            ):
+                self.opened_at = time.monotonic()
+
+class HedgedLLM:
+    """
+    Composite provider hedging slow requests across several models.
+
+    The request goes to the first available model. If it has not returned a
+    valid answer after the `hedge_percentile` of that model's past latencies
+    (`initial_hedge_delay` until `min_samples` calls were seen), the same
+    request is fired at the next model. The first valid answer wins and the
+    other requests are cancelled if not yet started, otherwise abandoned.
+    Failed or invalid answers fail over to the next model, and each model has
+    a CircuitBreaker sidelining it while its error rate is high.
+    """
+    supports_streaming = False
+
+    def __init__(
+        self,
+        models: List,
+        hedge_percentile: float = 95.0,
+        initial_hedge_delay: float = 60.0,
+        min_samples: int = 5,
+        timeout: Optional[float] = None,
+        validator: Optional[Callable[[str], bool]] = None,
+        breaker_kwargs: Optional[Dict] = None,
+    ):
+        if not models:
+            raise LLMError("HedgedLLM needs at least one model")
+        self.models = models
+        self.name = "hedged(" + ",".join(model.name for model in models) + ")"
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        self.timeout = timeout
+        self.validator = validator or (lambda text: bool(text and text.strip()))
+        self.breakers = {model.name: CircuitBreaker(**(breaker_kwargs or {})) for model in models}
+        self.latencies = {model.name: deque(maxlen=200) for model in models}
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "failovers": 0,
+                      "errors": {model.name: 0 for model in models}, "abandoned_cost": 0.0}
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(models))
+        self._lock = threading.Lock()
+
+    @property
+    def supports_structured_output(self) -> bool:
+        return all(getattr(model, "supports_structured_output", False) for model in self.models)
+
+    def create(self) -> None:
+        """Initialize all wrapped models"""
+        for model in self.models:
+            model.create()
+
+    def call(self, content: str, system: Optional[str] = None) -> str:
+        """Call the models with content"""
+        return self.generate(content, system=system).text
+
+    def hedge_delay(self, model) -> float:
+        """Seconds to wait for `model` before firing a hedge request"""
+        history = sorted(self.latencies[model.name])
+        if len(history) < self.min_samples:
+            return self.initial_hedge_delay
+        rank = max(math.ceil(self.hedge_percentile / 100 * len(history)) - 1, 0)
+        return history[rank]
+
+    def _available_models(self) -> List:
+        available = [model for model in self.models if self.breakers[model.name].allow()]
+        # With every provider sidelined, keep trying them in order of preference
+        return available or list(self.models)
+
+    def _call_model(self, model, content, system, response_schema, history=None) -> LLMResponse:
+        kwargs = {}
+        if history:
+            kwargs["history"] = history
+        if response_schema is not None and getattr(model, "supports_structured_output", False):
+            kwargs["response_schema"] = response_schema
+        try:
+            response = model.generate(content, system=system, **kwargs)
+        except Exception:
+            self.breakers[model.name].record(False)
+            with self._lock:
+                self.stats["errors"][model.name] += 1
+            raise
+        valid = self.validator(response.text)
+        self.breakers[model.name].record(valid)
+        with self._lock:
+            if valid:
+                self.latencies[model.name].append(response.usage.latency)
+            else:
+                self.stats["errors"][model.name] += 1
+        return response
+
+    def _abandon(self, future) -> None:
+        """Cancel a losing request, or account for its cost once it finishes"""
+        if future.cancel():
+            return
+
+        def add_cost(done):
+            if done.exception() is None:
+                with self._lock:
+                    self.stats["abandoned_cost"] += done.result().usage.cost
+
+        future.add_done_callback(add_cost)
+
+    def generate(
+        self,
+        content: str,
+        system: Optional[str] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        response_schema: Optional[Dict] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> LLMResponse:
+        """
+        Call the models with hedging and failover and return the first valid answer.
+
+        `on_text` receives the winning answer once it has arrived.
+        """
+        queue = self._available_models()
+        with self._lock:
+            self.stats["requests"] += 1
+        start = time.monotonic()
+        pending: Dict = {}
+        errors: List[str] = []
+        # The next hedge is due a hedge delay of the latest request after its launch
+        next_hedge_at = start
+
+        def launch():
+            nonlocal next_hedge_at
+            model = queue.pop(0)
+            future = self._executor.submit(
+                self._call_model, model, content, system, response_schema, history
+            )
+            pending[future] = model
+            next_hedge_at = time.monotonic() + self.hedge_delay(model)
+            return model
+
+        primary = launch()
+        while pending:
+            now = time.monotonic()
+            remaining = None if self.timeout is None else self.timeout - (now - start)
+            if remaining is not None and remaining <= 0:
+                break
+            wait_for = max(next_hedge_at - now, 0.0) if queue else remaining
+            if wait_for is not None and remaining is not None:
+                wait_for = min(wait_for, remaining)
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if queue and time.monotonic() >= next_hedge_at:
+                    launch()
+                    with self._lock:
+                        self.stats["hedges"] += 1
+                continue
+
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    errors.append(f"{model.name}: {str(e)}")
+                    response = None
+                if response is not None and self.validator(response.text):
+                    for loser in pending:
+                        self._abandon(loser)
+                    with self._lock:
+                        if model is not primary:
+                            self.stats["hedge_wins"] += 1
+                    if on_text is not None:
+                        on_text(response.text)
+                    return response
+                if response is not None:
+                    errors.append(f"{model.name}: invalid answer")
+                # Fail over right away instead of waiting for the hedge delay
+                if not pending and queue:
+                    launch()
+                    with self._lock:
+                        self.stats["failovers"] += 1
+
+        for loser in pending:
+            self._abandon(loser)
+        raise LLMError(f"All hedged requests failed: {'; '.join(errors) or 'timeout'}")
+
 def test_models(config: LLMConfig):
     """Test different LLM models"""
     test_prompt = "Tell me a joke."
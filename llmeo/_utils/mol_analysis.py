@@ -1,7 +1,9 @@
 import numpy as np
+from scipy.sparse import coo_matrix
 from scipy.sparse.csgraph import connected_components
-from molSimplify.Classes.mol3D import mol3D
-import numpy as np
+from scipy.spatial import cKDTree
+
+from .geometry import parse_xyz_text, read_xyz
 
 # List of chemical elements by their symbols
 element_identifiers = ['H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
@@ -31,6 +33,46 @@ transition_metal_atomic_numbers = [
     104, 105, 106, 107, 108, 109, 110, 111, 112
 ]
 
+# Covalent radii (Angstrom) of the elements the coordination fast path knows;
+# structures with other elements are left to molSimplify
+COVALENT_RADII = {
+    'H': 0.37, 'B': 0.85, 'C': 0.77, 'N': 0.75, 'O': 0.73, 'F': 0.71,
+    'Si': 1.11, 'P': 1.06, 'S': 1.02, 'Cl': 0.99, 'As': 1.19, 'Se': 1.16,
+    'Br': 1.14, 'Te': 1.35, 'I': 1.33,
+    'Cr': 1.27, 'Mn': 1.39, 'Fe': 1.25, 'Co': 1.26, 'Ni': 1.21, 'Cu': 1.38,
+    'Zn': 1.31, 'Ru': 1.25, 'Rh': 1.25, 'Pd': 1.2, 'Ag': 1.53, 'Ir': 1.27,
+    'Pt': 1.23, 'Au': 1.24,
+}
+# mol3D bonds atoms to a metal within 1.35 times their summed radii; the
+# hydrogen cutoff differs between molSimplify versions, so hydrogens
+# between the two factors are ambiguous
+METAL_BOND_FACTOR = 1.35
+METAL_HYDROGEN_BOND_FACTOR = 1.1
+# Relative margin around a cutoff within which the decision is left to mol3D
+COORDINATION_AMBIGUITY = 0.05
+
+def get_radius_adjacency(positions, radius_cutoff: float):
+    """
+    Sparse adjacency of the atoms within radius_cutoff of each other.
+
+    The pairs are found with a KD-tree, so only nearby atoms are compared
+    and no Python loop runs over atom pairs.
+
+    Args:
+        positions: List or (n, 3) array of atomic positions
+        radius_cutoff: Maximum distance for considering atoms as connected
+
+    Returns:
+        scipy.sparse.coo_matrix: Boolean adjacency holding every pair once, i < j
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    n_atoms = len(positions)
+    pairs = cKDTree(positions).query_pairs(radius_cutoff, output_type="ndarray").reshape(-1, 2)
+    return coo_matrix(
+        (np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])), shape=(n_atoms, n_atoms)
+    )
+
+
 def get_radius_adjacency_matrix(positions: list, radius_cutoff: float):
     """
     Creates an adjacency matrix based on distance between atoms.
@@ -42,16 +84,10 @@ def get_radius_adjacency_matrix(positions: list, radius_cutoff: float):
     Returns:
         numpy.ndarray: Adjacency matrix
     """
-    adjacency_matrix = np.zeros((len(positions), len(positions)))
-
-    for i in range(len(positions)):
-        for j in range(i + 1, len(positions)):
-            if (
-                np.linalg.norm(np.array(positions[i]) - np.array(positions[j]))
-                <= radius_cutoff
-            ):
-                adjacency_matrix[i, j] = adjacency_matrix[j, i] = 1
-
+    adjacency = get_radius_adjacency(positions, radius_cutoff)
+    adjacency_matrix = np.zeros(adjacency.shape)
+    adjacency_matrix[adjacency.row, adjacency.col] = 1
+    adjacency_matrix[adjacency.col, adjacency.row] = 1
     return adjacency_matrix
 
 
@@ -66,8 +102,8 @@ def radius_graph_is_connected(positions: list, radius_cutoff: float):
     Returns:
         bool: True if graph is connected, False otherwise
     """
-    adj = get_radius_adjacency_matrix(positions, radius_cutoff)
-    n_connected_components = connected_components(adj)[0]
+    adj = get_radius_adjacency(positions, radius_cutoff)
+    n_connected_components = connected_components(adj, directed=False)[0]
     return n_connected_components == 1
 
 
@@ -79,8 +115,15 @@ def parse_xyz(xyz: str):
         xyz: String containing XYZ format molecular data
 
     Returns:
-        tuple: (list of atom symbols, list of atomic positions)
+        tuple: (list of atom symbols, numpy.ndarray of atomic positions)
     """
+    try:
+        atoms, positions, _ = parse_xyz_text(xyz)
+        return atoms, positions
+    except (ValueError, IndexError):
+        pass
+
+    # No valid atom count; read atom lines up to the first other line
     atoms = []
     positions = []
 
@@ -94,29 +137,114 @@ def parse_xyz(xyz: str):
         atoms.append(line_split[0])
         positions.append([float(line_split[j]) for j in [1, 2, 3]])
 
-    return atoms, positions
+    return atoms, np.array(positions, dtype=float).reshape(-1, 3)
 
 
-def compare_connecting_idx(xtb_xyz_path, molSimp_xyz_path):
+def metal_coordination(elements, coords, metal_index=0):
+    """
+    Atoms bonded to a transition metal, from covalent-radius cutoffs.
+
+    Reproduces row `metal_index` of mol3D's molecular graph without
+    building the graph of the whole molecule.
+
+    Args:
+        elements: Element symbols
+        coords: (n, 3) array of atomic positions
+        metal_index: Index of the metal
+
+    Returns:
+        frozenset: Indices of the coordinating atoms, or None if the atom is
+        not a known transition metal, an element has no radius, or an atom
+        lies within COORDINATION_AMBIGUITY of its cutoff
+    """
+    metal = elements[metal_index]
+    if metal not in element_identifiers or \
+            element_identifiers.index(metal) + 1 not in transition_metal_atomic_numbers:
+        return None
+    try:
+        radii = np.array([COVALENT_RADII[element] for element in elements])
+    except KeyError:
+        return None
+
+    distances = np.linalg.norm(coords - coords[metal_index], axis=1)
+    summed = radii + radii[metal_index]
+    hydrogen = np.array([element == 'H' for element in elements])
+    lower = np.where(hydrogen, METAL_HYDROGEN_BOND_FACTOR, METAL_BOND_FACTOR) * summed * (1 - COORDINATION_AMBIGUITY)
+    upper = METAL_BOND_FACTOR * summed * (1 + COORDINATION_AMBIGUITY)
+    others = np.arange(len(elements)) != metal_index
+    if np.any(others & (distances >= lower) & (distances <= upper)):
+        return None
+    return frozenset(np.flatnonzero(others & (distances < lower)).tolist())
+
+
+def _mol3d_metal_row(xyz_path):
+    """Row 0 of the molecular graph mol3D builds for an XYZ file"""
+    # molSimplify pulls in a heavy stack; only load it when the fast path cannot decide
+    from molSimplify.Classes.mol3D import mol3D
+
+    mol = mol3D()
+    mol.readfromxyz(xyz_path)
+    mol.createMolecularGraph(oct=False)
+    return mol.graph[0]
+
+
+def compare_connecting_idx(xtb_xyz_path, molSimp_xyz_path, fast=True):
     """
     Compare molecular graphs before and after optimization.
 
+    The metal's coordination is first compared from covalent-radius cutoffs;
+    mol3D graphs are only built if that is ambiguous for either structure.
+
     Args:
         xtb_xyz_path: Path to XTB optimized structure
         molSimp_xyz_path: Path to MolSimplify generated structure
+        fast: Try the covalent-radius fast path before mol3D
 
     Returns:
         bool: True if molecular graphs are identical for center metal atom
     """
-    mol_opt = mol3D()
-    mol_opt.readfromxyz(xtb_xyz_path)
-    mol_opt.createMolecularGraph(oct=False)
+    if fast:
+        try:
+            opt_elements, opt_coords, _ = read_xyz(str(xtb_xyz_path))
+            init_elements, init_coords, _ = read_xyz(str(molSimp_xyz_path))
+        except (OSError, ValueError, IndexError):
+            opt_elements = None
+        if opt_elements is not None:
+            if len(opt_elements) != len(init_elements):
+                return False
+            opt_coordination = metal_coordination(opt_elements, opt_coords)
+            init_coordination = metal_coordination(init_elements, init_coords)
+            if opt_coordination is not None and init_coordination is not None:
+                return opt_coordination == init_coordination
+
+    return np.array_equal(_mol3d_metal_row(xtb_xyz_path), _mol3d_metal_row(molSimp_xyz_path))
 
-    mol_init = mol3D()
-    mol_init.readfromxyz(molSimp_xyz_path)
-    mol_init.createMolecularGraph(oct=False)
 
-    return np.array_equal(mol_opt.graph[0], mol_init.graph[0])
+def verify_coordination_fast_path(pairs):
+    """
+    Check the fast path of `compare_connecting_idx` against mol3D on stored structures.
+
+    Args:
+        pairs: Iterable of (xTB optimized XYZ, molSimplify XYZ) paths
+
+    Returns:
+        dict: Pairs where both agree, disagree, or the fast path defers to
+        mol3D, and the disagreeing pairs
+    """
+    report = {"agree": 0, "disagree": 0, "ambiguous": 0, "disagreements": []}
+    for xtb_xyz_path, molSimp_xyz_path in pairs:
+        expected = np.array_equal(_mol3d_metal_row(xtb_xyz_path), _mol3d_metal_row(molSimp_xyz_path))
+        opt_elements, opt_coords, _ = read_xyz(str(xtb_xyz_path))
+        init_elements, init_coords, _ = read_xyz(str(molSimp_xyz_path))
+        coordinations = [metal_coordination(opt_elements, opt_coords), metal_coordination(init_elements, init_coords)]
+        if len(opt_elements) == len(init_elements) and None in coordinations:
+            report["ambiguous"] += 1
+        elif compare_connecting_idx(xtb_xyz_path, molSimp_xyz_path) == expected:
+            report["agree"] += 1
+        else:
+            report["disagree"] += 1
+            report["disagreements"].append((str(xtb_xyz_path), str(molSimp_xyz_path)))
+    return report
 
 
 def check_structure_validity(df, xtb_xyz_path, mol_xyz_path, storage_path, idx, result):
@@ -127,7 +255,7 @@ def check_structure_validity(df, xtb_xyz_path, mol_xyz_path, storage_path, idx,
         df: DataFrame containing molecular data
         xtb_xyz_path: Path to XTB optimized structure
         mol_xyz_path: Path to MolSimplify generated structure
-        storage_path: Path for saving results
+        storage_path: Path for saving results, None to leave saving to the caller
         idx: Row index in DataFrame
         result: XTB calculation results
 
@@ -137,18 +265,20 @@ def check_structure_validity(df, xtb_xyz_path, mol_xyz_path, storage_path, idx,
     if not compare_connecting_idx(xtb_xyz_path, mol_xyz_path):
         print("Connecting indices different")
         df.loc[idx, "_error"] = "Connecting indices change, Bad Optimized Structure"
-        df.loc[idx].to_frame().T.to_csv(
-            storage_path, mode="a", header=(idx == 0), index=False
-        )
+        if storage_path is not None:
+            df.loc[idx].to_frame().T.to_csv(
+                storage_path, mode="a", header=(idx == 0), index=False
+            )
         return True
 
     is_connected = radius_graph_is_connected(parse_xyz(result["optimised_xyz"])[1], 3.0)
     if not is_connected:
         print("Graph not connected")
         df.loc[idx, "_error"] = "Graph not connected, metal bond is break after xtb"
-        df.loc[idx].to_frame().T.to_csv(
-            storage_path, mode="a", header=(idx == 0), index=False
-        )
+        if storage_path is not None:
+            df.loc[idx].to_frame().T.to_csv(
+                storage_path, mode="a", header=(idx == 0), index=False
+            )
         return True
 
     return False
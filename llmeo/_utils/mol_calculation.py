@@ -1,13 +1,32 @@
 
-import os
-import subprocess
+import shutil
+import threading
+import time
+from collections import Counter
 from pathlib import Path
 
 import uxtbpy
-from rdkit import Chem
 
+from .fidelity import (FAILED, FINAL_TIER, NOT_PROMOTED, PASSED, REJECTED,
+                       add_tier_record, reject_last_tier, summarize_tiers,
+                       tiers_signature)
+from .geometry import INITIAL, OPTIMIZED
+from .jobs import JobError, run_command, run_function
+from .ligands import ligand_info, prepare_ligands
 from .mol_analysis import check_structure_validity
-from .utils import save_row_to_csv, hash_string_to_number
+from .pipeline import KeyedLocks, Pipeline, Stage
+from .resume import plan_resume
+from .utils import (CYCLES_COLUMN, CYCLES_SAVED_COLUMN, LIG_CONNECTING_ATOM_INDEX,
+                    LIG_CONNECTING_ATOM_LIST, LIG_LIST, LIG_SMILE_LIST, RESULT_COLUMNS,
+                    TIERS_COLUMN, TIMING_COLUMN, hash_string_to_number,
+                    prepare_ligand_space, save_row_to_csv)
+from .warmstart import count_optimization_cycles, summarize_warm_starts
+
+# xTB optimization settings; the total charge is appended per TMC
+XTB_PARAMETERS = "--opt tight --uhf 0 --norestart -v"
+
+# Worker threads per stage of the staged calculation
+DEFAULT_STAGES = {"build": 2, "optimize": 4, "validate": 1}
 
 
 def find_index(smiles_string, atom_symbol, n):  
@@ -21,29 +40,17 @@ def find_index(smiles_string, atom_symbol, n):
     
     Returns:  
         int: Index of the nth occurrence of the atom (1-based indexing)  
-    """  
-    mol = Chem.MolFromSmiles(smiles_string)  
-    try:  
-        n = int(n)  
-    except:  
-        return None  
-
-    if not mol:  
-        print(f"find Index {smiles_string} Invalid SMILES string")  
-        return None  
-
-    atom_indices = [atom.GetIdx() for atom in mol.GetAtoms()   
-                   if atom.GetSymbol() == atom_symbol]  
-
-    if n <= 0 or n > len(atom_indices):  
-        raise ValueError(  
-            f"The {n}-th occurrence of atom '{atom_symbol}' does not exist in the SMILES string."  
-        )  
 
-    return atom_indices[n - 1] + 1  
+    Note:  
+        Resolved once per (SMILES, atom, n) and looked up afterwards, see ligands.py  
+    """  
+    info = ligand_info(smiles_string, atom_symbol, n)
+    if info.error:
+        raise ValueError(info.error)
+    return info.index
 
 
-def molSimplify_xyz_generation(df, root_path, idx, fileName, tmc, sml_list):
+def molSimplify_xyz_generation(df, root_path, idx, fileName, tmc, sml_list, limits=None, cwd=None):
     """
     Generate XYZ coordinates using MolSimplify.
     
@@ -54,6 +61,11 @@ def molSimplify_xyz_generation(df, root_path, idx, fileName, tmc, sml_list):
         fileName: Unique identifier for the molecule
         tmc: Dictionary containing ligand information
         sml_list: List of SMILES strings for ligands
+        limits: JobLimits of the molSimplify run
+        cwd: Working directory of molSimplify, which leaves stray files there
+    
+    Returns:
+        bool: False if the run timed out or was killed
     """
     xyz_directory = Path(root_path) / "molSimplify_xyz" / str(fileName)
     
@@ -74,12 +86,19 @@ def molSimplify_xyz_generation(df, root_path, idx, fileName, tmc, sml_list):
         
         command = ' '.join(['molsimplify', *parameters])
         print(command)
-        result = subprocess.run(command, stdout=subprocess.PIPE, 
-                              stderr=subprocess.PIPE, shell=True)
+        try:
+            result = run_command(command, limits, name="molSimplify", shell=True, cwd=cwd)
+        except JobError as e:
+            print(str(e))
+            df.loc[idx, "_error"] = str(e)
+            # A partial run directory would be mistaken for a finished one
+            shutil.rmtree(xyz_directory, ignore_errors=True)
+            return False
         print(result)
         df.loc[idx, "fileName"] = fileName
     else:
         print("Directory exists: ", xyz_directory)
+    return True
 
 def check_if_molSimplify_file_exist(root_path, fileName):
     """
@@ -107,22 +126,26 @@ def check_if_molSimplify_file_exist(root_path, fileName):
     
     return path, subdirs
 
-def xtb_calculation(fileName, path, storage_path, df, idx, charge):
+def xtb_calculation(fileName, path, storage_path, df, idx, charge, scratch_dir=None, limits=None,
+                    parameters=XTB_PARAMETERS):
     """
     Perform XTB calculations on the molecular structure.
     
     Args:
         fileName: Unique identifier for the molecule
         path: Path to input XYZ file
-        storage_path: Path for saving results
+        storage_path: Path for saving results, None to leave saving to the caller
         df: DataFrame containing molecular data
         idx: Row index in DataFrame
         charge: Total molecular charge
+        scratch_dir: Directory holding the xtb_xyz/ run directories, defaults to the working directory
+        limits: JobLimits of the xTB run, None to run xTB in this process without limits
+        parameters: xTB command line parameters without the charge
     
     Returns:
         tuple: (calculation results, continue flag)
     """
-    tmp_dir = Path.cwd() / "xtb_xyz" / str(fileName)
+    tmp_dir = Path(scratch_dir or Path.cwd()) / "xtb_xyz" / str(fileName)
     
     with open(path) as fh:
         xyz = fh.read()
@@ -133,20 +156,36 @@ def xtb_calculation(fileName, path, storage_path, df, idx, charge):
     except:
         print("Error: uxtbpy.XtbRunner failed")
         df.loc[idx, "_error"] = "Error: uxtbpy.XtbRunner failed"
-        save_row_to_csv(df.loc[idx], idx, storage_path)
+        if storage_path is not None:
+            save_row_to_csv(df.loc[idx], idx, storage_path)
         return None, True
 
-    xtb_parameters = [f'--opt tight --uhf 0 --norestart -v -c {charge}']
+    xtb_parameters = [f'{parameters} -c {charge}']
     
     try:
-        result = xtb_runner.run_xtb_from_xyz(xyz, parameters=xtb_parameters)
+        if limits is None:
+            result = xtb_runner.run_xtb_from_xyz(xyz, parameters=xtb_parameters)
+        else:
+            result = run_function(_run_xtb, str(tmp_dir), xyz, xtb_parameters, limits=limits, name="xTB")
         return result, False
+    except JobError as e:
+        print(str(e))
+        df.loc[idx, "_error"] = str(e)
+        if storage_path is not None:
+            save_row_to_csv(df.loc[idx], idx, storage_path)
+        return None, True
     except:
         print("Error: xtb_runner.run_xtb_from_xyz failed")
         df.loc[idx, "_error"] = "Error: xtb_runner.run_xtb_from_xyz failed"
-        save_row_to_csv(df.loc[idx], idx, storage_path)
+        if storage_path is not None:
+            save_row_to_csv(df.loc[idx], idx, storage_path)
         return None, True
 
+def _run_xtb(xtb_directory, xyz, parameters):
+    """Run xTB through uxtbpy in the child process of `run_function`; module level, so it can be pickled"""
+    xtb_runner = uxtbpy.XtbRunner(xtb_directory=xtb_directory, output_format='dict')
+    return xtb_runner.run_xtb_from_xyz(xyz, parameters=parameters)
+
 def extract_lig_info_ligSpace(df, row, idx, lig_smile_list, lig_list, 
                             lig_connecting_atom_list, lig_connecting_atom_index):
     """
@@ -187,7 +226,10 @@ def extract_lig_info_ligSpace(df, row, idx, lig_smile_list, lig_list,
             
     return tmc, flag_continue
 
-def calculate_fitness_ligand_space(df, root_path, storage_path, unbounded=False):
+def calculate_fitness_ligand_space(df, root_path, storage_path, unbounded=False, cache=None,
+                                   resume=False, retry=None, limits=None, stages=None,
+                                   queue_size=8, scheduler=None, tiers=None, geometries=None,
+                                   archive=None, ligand_cache=None):
     """  
     Calculate chemical properties for a set of TMC structures.  
     
@@ -206,6 +248,20 @@ def calculate_fitness_ligand_space(df, root_path, storage_path, unbounded=False)
             - charge: Total complex charge  
         root_path (str): Base directory for file generation and calculations  
         storage_path (str): Path for saving intermediate results  
+        cache (XtbCache): Optional result cache consulted before any molSimplify or xTB run  
+        resume (bool): Take finished rows from storage_path and only calculate the rest  
+        retry (RetryPolicy): Which failed rows are calculated again on resume  
+        limits (dict): JobLimits of the "molsimplify" and "xtb" runs  
+        stages (dict): Worker threads of the "build", "optimize" and "validate"  
+            stages; with stages the rows run through a pipeline instead of one  
+            after another  
+        queue_size (int): Capacity of the queue in front of every stage  
+        scheduler (Scheduler): Order in which the rows are dispatched, defaults to the frame order  
+        tiers (list): Cheap pre-optimization Tiers run before the tight GFN2 optimization  
+        geometries (GeometryStore): Optional store of optimized geometries; the  
+            optimization of a TMC starts from its nearest stored neighbour  
+        archive (GeometryArchive): Optional archive receiving the initial and optimized structures  
+        ligand_cache (str): Optional JSON file of per-ligand precomputations shared between runs  
     
     Returns:  
         pd.DataFrame: Updated DataFrame with additional columns:  
@@ -213,102 +269,603 @@ def calculate_fitness_ligand_space(df, root_path, storage_path, unbounded=False)
             - fileName: Unique identifier for the structure  
             - homo_lumo_gap: Calculated HOMO-LUMO gap  
             - polarisability: Calculated molecular polarisability  
+            - xtb_seconds: Wall time of the xTB optimization  
+            - tiers: Outcome and time of every optimization tier  
+            - xtb_cycles: Optimization cycles of the tight xTB run  
+            - cycles_saved: Cycles saved by a warm start, empty for cold starts  
     
     Notes:  
         - Results are saved incrementally to storage_path  
+        - With resume, rows are matched to storage_path by canonical ligand content  
+        - With stages, rows are saved in completion order  
         - Failed calculations are logged but don't stop the process  
         - Directory structure:  
             root_path/  
             ├── molSimplify_xyz/  # Initial structures  
             └── xtb_xyz/         # Optimized structures  
     """  
-    # Initialize DataFrame columns
-    df["_error"] = ""
-    df["fileName"] = ""
-    df["homo_lumo_gap"] = ""
-    df["polarisability"] = ""
-    
-    # Define column name lists
-    lig_list = ['lig1', 'lig2', 'lig3', 'lig4']
-    lig_smile_list = ['lig1_smiles', 'lig2_smiles', 'lig3_smiles', 'lig4_smiles']
-    lig_connecting_atom_list = ['lig1_element', 'lig2_element', 'lig3_element', 'lig4_element']
-    lig_connecting_atom_index = ['lig1_index', 'lig2_index', 'lig3_index', 'lig4_index']
+    prepare_ligand_space(df, root_path, unbounded)
+
+    pending = df.index
+    if resume:
+        plan = plan_resume(df, storage_path, retry)
+        print("Resume: ", plan.to_dict())
+        pending = plan.pending
+    print("Ligands: ", prepare_ligands(df.loc[pending], ligand_cache))
+    if scheduler is not None:
+        pending = scheduler.order(df, pending)
+
+    if stages is not None:
+        calculate_staged(df, pending, root_path, storage_path, unbounded=unbounded, cache=cache,
+                         limits=limits, stages=stages, queue_size=queue_size, tiers=tiers,
+                         geometries=geometries, archive=archive)
+    else:
+        # Process each row in the DataFrame
+        for idx in pending:
+            row = df.loc[idx]
+            evaluate_row(df, idx, row, root_path, unbounded=unbounded, cache=cache, limits=limits, tiers=tiers,
+                         geometries=geometries, archive=archive)
+            save_row_to_csv(df.loc[idx], idx, file_name=storage_path)
+
+    if cache is not None:
+        print("xTB cache: ", cache.stats)
+    print("Tiers: ", summarize_tiers(df.loc[pending, TIERS_COLUMN]))
+    if geometries is not None:
+        print("Warm start: ", summarize_warm_starts(df.loc[pending]))
+    return df
+
+
+def evaluate_row(df, idx, row, root_path, unbounded=False, scratch_dir=None, cache=None, limits=None,
+                 tiers=None, geometries=None, archive=None):
+    """
+    Build, optimize and validate one TMC, writing the results into df.loc[idx].
+
+    The row is not saved; callers write df.loc[idx] once it returns, whatever
+    the outcome.
+
+    Args:
+        df: DataFrame prepared by `prepare_ligand_space`
+        idx: Row index in DataFrame
+        row: The row itself
+        root_path: Base directory for file generation and calculations
+        unbounded: Whether the lig{n} columns hold SMILES instead of ligand IDs
+        scratch_dir: Directory for the xTB runs, defaults to the working directory
+        cache: Optional XtbCache; a hit skips molSimplify and xTB, a miss is stored
+        limits: Optional dict of JobLimits for the "molsimplify" and "xtb" runs
+        tiers: Optional list of Tiers run before the tight GFN2 optimization
+        geometries: Optional GeometryStore to warm-start from and store the optimized geometry in
+        archive: Optional GeometryArchive receiving the initial and optimized structures
+    """
+    prepared = prepare_row(df, idx, row, unbounded=unbounded, cache=cache, tiers=tiers)
+    if prepared is None:
+        return
+    tmc, fileName, charge, key = prepared
+
+    result = build_and_optimize(
+        df, idx, tmc, fileName, charge, root_path, scratch_dir, limits, tiers, geometries, archive
+    )
+    store_in_cache(cache, key, df, idx, result)
+
+
+def prepare_row(df, idx, row, unbounded=False, cache=None, tiers=None):
+    """
+    Extract the ligands, file name and charge of a row and look it up in the cache.
+
+    Args:
+        df: DataFrame prepared by `prepare_ligand_space`
+        idx: Row index in DataFrame
+        row: The row itself
+        unbounded: Whether the lig{n} columns hold SMILES instead of ligand IDs
+        cache: Optional XtbCache; a hit fills in the result columns
+        tiers: Optional Tiers, results of other tier configurations are cached apart
+
+    Returns:
+        tuple: (ligand info, fileName, charge, cache key), or None if the row
+        needs no calculation (invalid SMILES or cache hit)
+    """
+    # Extract ligand information
+    tmc, flag_continue = extract_lig_info_ligSpace(
+        df, row, idx, LIG_SMILE_LIST, LIG_LIST,
+        LIG_CONNECTING_ATOM_LIST, LIG_CONNECTING_ATOM_INDEX
+    )
+    if flag_continue:
+        return None
+        
+    # Generate unique filename
+    fileName = hash_string_to_number(tmc["lig1"]+tmc["lig2"]+tmc["lig3"]+tmc["lig4"])
+    if unbounded:
+        charge = int(row["lig1_charge"])+int(row["lig2_charge"])+int(row["lig3_charge"])+int(row["lig4_charge"])
+    else:
+        charge = int(row["charge"])
+
+    if cache is None:
+        return tmc, fileName, charge, None
+
+    # Rotations and repeats of a TMC share one cache entry
+    key = cache.key(
+        _ligand_pairs(tmc),
+        charge,
+        tiers_signature(tiers) + XTB_PARAMETERS,
+    )
+    entry = cache.get(key)
+    if entry is not None:
+        print("Cache hit: ", key)
+        for column in RESULT_COLUMNS:
+            df.loc[idx, column] = entry.get(column, "")
+        df.loc[idx, "fileName"] = fileName
+        return None
+    return tmc, fileName, charge, key
+
+
+def store_in_cache(cache, key, df, idx, result):
+    """Store the outcome of a calculated row, `result` being the xTB results or None"""
+    if cache is None or key is None:
+        return
+    entry = {column: df.loc[idx, column] for column in RESULT_COLUMNS}
+    entry["optimised_xyz"] = result["optimised_xyz"] if result is not None else None
+    cache.put(key, entry)
+
+
+def build_and_optimize(df, idx, tmc, fileName, charge, root_path, scratch_dir=None, limits=None,
+                       tiers=None, geometries=None, archive=None):
+    """
+    Run molSimplify, xTB and the validation of one TMC.
+
+    Args:
+        df: DataFrame prepared by `prepare_ligand_space`
+        idx: Row index in DataFrame
+        tmc: Ligand information from `extract_lig_info_ligSpace`
+        fileName: Unique identifier for the molecule
+        charge: Total molecular charge
+        root_path: Base directory for file generation and calculations
+        scratch_dir: Directory for the xTB runs, defaults to the working directory
+        limits: Optional dict of JobLimits for the "molsimplify" and "xtb" runs
+        tiers: Optional list of Tiers run before the tight GFN2 optimization
+        geometries: Optional GeometryStore to warm-start from and store the optimized geometry in
+        archive: Optional GeometryArchive receiving the initial and optimized structures
+
+    Returns:
+        dict: xTB results, or None if the TMC failed before xTB finished
+    """
+    limits = limits or {}
+    mol_xyz_path = build_structure(
+        df, idx, tmc, fileName, root_path, limits.get("molsimplify"), archive, scratch_dir, cwd=scratch_dir
+    )
+    if mol_xyz_path is None:
+        return None
+
+    archived = False
+    try:
+        start_xyz_path, warm = warm_start_structure(tmc, fileName, mol_xyz_path, geometries, scratch_dir)
+        result = optimize_structure(
+            df, idx, fileName, mol_xyz_path, charge, scratch_dir, limits.get("xtb"), tiers, start_xyz_path
+        )
+        if result is None:
+            return None
+
+        if validate_structure(df, idx, fileName, mol_xyz_path, result, scratch_dir):
+            store_geometry(geometries, df, idx, tmc, fileName, warm, scratch_dir)
+        xtb_xyz_path = Path(scratch_dir or Path.cwd()) / "xtb_xyz" / str(fileName) / "xtbopt.xyz"
+        archived = archive_structure(archive, fileName, xtb_xyz_path, OPTIMIZED)
+        return result
+    finally:
+        release_structure(archive, fileName, mol_xyz_path, archived, scratch_dir, tiers)
+
+
+def build_structure(df, idx, tmc, fileName, root_path, limits=None, archive=None, scratch_dir=None, cwd=None):
+    """
+    Generate the initial structure of a TMC with molSimplify.
+
+    With an archive, a structure archived by an earlier run is restored
+    instead, and a new molSimplify run directory is archived and removed.
+    The row then works on its own copy below scratch_dir/initial_xyz/.
 
-    if(unbounded):
-        for i in range(4):
-            df[lig_smile_list[i]] = df[lig_list[i]]
+    Args:
+        df: DataFrame prepared by `prepare_ligand_space`
+        idx: Row index in DataFrame
+        tmc: Ligand information from `extract_lig_info_ligSpace`
+        fileName: Unique identifier for the molecule
+        root_path: Base directory for file generation and calculations
+        limits: JobLimits of the molSimplify run
+        archive: Optional GeometryArchive of initial structures
+        scratch_dir: Directory for the row's copy of an archived structure, defaults to the working directory
+        cwd: Working directory of molSimplify, defaults to the working directory
+
+    Returns:
+        Path: The generated XYZ file, or None if molSimplify failed
+    """
+    if archive is not None:
+        restored = restore_structure(archive, idx, fileName, scratch_dir)
+        if restored is not None:
+            print("Restored from archive: ", fileName)
+            return restored
 
+    # Generate molecular structure
+    if not molSimplify_xyz_generation(df, root_path, idx, fileName, tmc, LIG_SMILE_LIST, limits=limits, cwd=cwd):
+        return None
     
-    # Create necessary directories
-    os.makedirs(f"{root_path}/molSimplify_xyz/", exist_ok=True)
-    os.makedirs(f"{root_path}/xtb_xyz/", exist_ok=True)
+    # Check for generated files
+    path, subdirs = check_if_molSimplify_file_exist(root_path, fileName)
     
-    # Process each row in the DataFrame
-    for idx, row in df.iterrows():
-        # Extract ligand information
-        tmc, flag_continue = extract_lig_info_ligSpace(
-            df, row, idx, lig_smile_list, lig_list, 
-            lig_connecting_atom_list, lig_connecting_atom_index
-        )
-        if flag_continue:
-            save_row_to_csv(df.loc[idx], idx, storage_path)
-            continue
-            
-        # Generate unique filename
-        fileName = hash_string_to_number(tmc["lig1"]+tmc["lig2"]+tmc["lig3"]+tmc["lig4"])
-        if unbounded:
-            charge = int(row["lig1_charge"])+int(row["lig2_charge"])+int(row["lig3_charge"])+int(row["lig4_charge"])
-        else:
-            charge = int(row["charge"])
+    # Search for XYZ files
+    directory = Path(path)
+    files = list(directory.rglob('*.xyz'))
+    if len(files) == 0:
+        print("No xyz files found: ", str(path))
+        return None
+    
+    if "badjob" in str(files[0]):
+        print("Bad file: ", str(files[0]))
+        df.loc[idx, "_error"] = f"Bad Structure: {fileName} MolSimplify failed"
+        return None
+    
+    mol_xyz_path = path / subdirs[0] / files[0]
+    if archive is None or not archive_structure(archive, fileName, mol_xyz_path, INITIAL):
+        return mol_xyz_path
+    shutil.rmtree(Path(root_path) / "molSimplify_xyz" / str(fileName), ignore_errors=True)
+    return restore_structure(archive, idx, fileName, scratch_dir)
 
-        
-        # Generate molecular structure
-        molSimplify_xyz_generation(df, root_path, idx, fileName, tmc, lig_smile_list)
-        
-        # Check for generated files
-        path, subdirs = check_if_molSimplify_file_exist(root_path, fileName)
-        
-        # Search for XYZ files
-        directory = Path(path)
-        files = list(directory.rglob('*.xyz'))
-        if len(files) == 0:
-            print("No xyz files found: ", str(path))
-            save_row_to_csv(df.loc[idx], idx, file_name=storage_path)
-            continue
-        
-        if "badjob" in str(files[0]):
-            print("Bad file: ", str(files[0]))
-            df.loc[idx, "_error"] = f"Bad Structure: {fileName} MolSimplify failed"
-            save_row_to_csv(df.loc[idx], idx, file_name=storage_path)
-            continue
-        
-        # Set paths
-        path = path / subdirs[0] / files[0]
-        mol_xyz_path = path
-        
-        # Run XTB calculations
-        result, continue_flag = xtb_calculation(fileName, path, storage_path, df, idx, charge)
-        if continue_flag:
-            continue
-        
-        # Extract properties
-        gap = result["homo_lumo_gap"]
-        polar = result["polarisability"]
-        xtb_xyz_path = Path.cwd() / "xtb_xyz" / fileName / "xtbopt.xyz"
-        
-        # Validate structure
-        continue_flag = check_structure_validity(df, xtb_xyz_path, mol_xyz_path, storage_path, idx, result)
+
+def restore_structure(archive, idx, fileName, scratch_dir=None):
+    """
+    Copy of an archived initial structure for one row.
+
+    Returns:
+        Path: scratch_dir/initial_xyz/<fileName>-<idx>.xyz, or None if the structure is not archived
+    """
+    initial_dir = Path(scratch_dir or Path.cwd()) / "initial_xyz"
+    initial_dir.mkdir(parents=True, exist_ok=True)
+    xyz_path = initial_dir / f"{fileName}-{idx}.xyz"
+    if not archive.export_xyz(str(fileName), str(xyz_path), INITIAL):
+        return None
+    return xyz_path
+
+
+def release_structure(archive, fileName, mol_xyz_path=None, archived=False, scratch_dir=None, tiers=None,
+                      shared=True):
+    """
+    Remove the per-molecule files of a finished row once its structures are archived.
+
+    Without an archive nothing is removed. The row's copy of the initial
+    structure always goes. With `shared`, so do the warm start geometry and
+    the tier runs, and the xTB run directory if the optimized structure was
+    archived.
+
+    Args:
+        archive: Optional GeometryArchive
+        fileName: Unique identifier for the molecule
+        mol_xyz_path: XYZ file from `build_structure`, removed if it is a copy below initial_xyz/
+        archived: Whether the optimized structure was archived
+        scratch_dir: Directory of the xTB runs, defaults to the working directory
+        tiers: Tiers whose run directories are removed
+        shared: False while other rows of the same molecule still use its files
+    """
+    if archive is None:
+        return
+    scratch = Path(scratch_dir or Path.cwd())
+    if mol_xyz_path is not None and Path(mol_xyz_path).parent == scratch / "initial_xyz":
+        Path(mol_xyz_path).unlink(missing_ok=True)
+    if not shared:
+        return
+    (scratch / "warm_start" / f"{fileName}.xyz").unlink(missing_ok=True)
+    run_dirs = [f"{fileName}_{tier.name}" for tier in tiers or []]
+    if archived:
+        run_dirs.append(str(fileName))
+    for run_dir in run_dirs:
+        shutil.rmtree(scratch / "xtb_xyz" / run_dir, ignore_errors=True)
+
+
+def optimize_structure(df, idx, fileName, mol_xyz_path, charge, scratch_dir=None, limits=None, tiers=None,
+                       start_xyz_path=None):
+    """
+    Optimize a molSimplify structure with xTB, recording its wall time.
+
+    With tiers, the structure is first pre-optimized with every tier in
+    turn. A tier whose structure changed its metal-ligand graph or fell
+    apart rejects the row before the expensive tight GFN2 run, as does a
+    tier whose promotion rule turns the candidate down. A tier that fails to
+    run is skipped. Each tier starts from the geometry of the previous one.
+
+    Args:
+        df: DataFrame prepared by `prepare_ligand_space`
+        idx: Row index in DataFrame
+        fileName: Unique identifier for the molecule
+        mol_xyz_path: XYZ file from `build_structure`
+        charge: Total molecular charge
+        scratch_dir: Directory for the xTB runs, defaults to the working directory
+        limits: JobLimits of the xTB run
+        tiers: Optional list of Tiers run before the tight GFN2 optimization
+        start_xyz_path: Starting geometry, e.g. from `warm_start_structure`; defaults to mol_xyz_path
+
+    Returns:
+        dict: xTB results, or None if xTB failed or a tier rejected the row
+    """
+    xyz_path = start_xyz_path or mol_xyz_path
+    for tier in tiers or []:
+        tier_name = f"{fileName}_{tier.name}"
+        start = time.perf_counter()
+        result, continue_flag = xtb_calculation(
+            tier_name, xyz_path, None, df, idx, charge, scratch_dir=scratch_dir, limits=limits,
+            parameters=tier.parameters,
+        )
+        seconds = time.perf_counter() - start
         if continue_flag:
+            print(f"Tier {tier.name} failed, skipped: ", df.loc[idx, "_error"])
+            df.loc[idx, "_error"] = ""
+            add_tier_record(df, idx, tier.name, FAILED, seconds)
             continue
-        
-        # Store results
-        print("HomoLumo gap: ", gap)
-        print("Polarisability: ", polar)
-        df.loc[idx, "fileName"] = fileName
-        df.loc[idx, "homo_lumo_gap"] = gap
-        df.loc[idx, "polarisability"] = polar
-        
-        # Save results
-        save_row_to_csv(df.loc[idx], idx, file_name=storage_path)
+
+        tier_xyz_path = Path(scratch_dir or Path.cwd()) / "xtb_xyz" / tier_name / "xtbopt.xyz"
+        if tier.check_connectivity and check_structure_validity(
+            df, tier_xyz_path, mol_xyz_path, None, idx, result
+        ):
+            df.loc[idx, "_error"] = f"{df.loc[idx, '_error']} (tier {tier.name})"
+            add_tier_record(df, idx, tier.name, REJECTED, seconds)
+            return None
+        if tier.promote is not None and not tier.promote(result):
+            df.loc[idx, "_error"] = (
+                f"Not promoted after tier {tier.name}: gap {result.get('homo_lumo_gap')}, "
+                f"polarisability {result.get('polarisability')}"
+            )
+            add_tier_record(df, idx, tier.name, NOT_PROMOTED, seconds)
+            return None
+        add_tier_record(df, idx, tier.name, PASSED, seconds)
+        xyz_path = tier_xyz_path
+
+    start = time.perf_counter()
+    result, continue_flag = xtb_calculation(
+        fileName, xyz_path, None, df, idx, charge, scratch_dir=scratch_dir, limits=limits
+    )
+    seconds = time.perf_counter() - start
+    if continue_flag:
+        add_tier_record(df, idx, FINAL_TIER, FAILED, seconds)
+        return None
+    df.loc[idx, TIMING_COLUMN] = round(seconds, 2)
+    cycles = count_optimization_cycles(Path(scratch_dir or Path.cwd()) / "xtb_xyz" / str(fileName))
+    df.loc[idx, CYCLES_COLUMN] = cycles if cycles is not None else ""
+    add_tier_record(df, idx, FINAL_TIER, PASSED, seconds)
+    return result
+
+
+def warm_start_structure(tmc, fileName, mol_xyz_path, geometries=None, scratch_dir=None):
+    """
+    Starting geometry of a TMC spliced from the optimized geometry of a neighbour.
+
+    Args:
+        tmc: Ligand information from `extract_lig_info_ligSpace`
+        fileName: Unique identifier for the molecule
+        mol_xyz_path: XYZ file from `build_structure`
+        geometries: Optional GeometryStore
+        scratch_dir: Directory for the xTB runs, defaults to the working directory
+
+    Returns:
+        tuple: (starting XYZ file, warm start info from `GeometryStore.warm_start`),
+        (mol_xyz_path, None) for a cold start
+    """
+    if geometries is None:
+        return mol_xyz_path, None
+    warm_dir = Path(scratch_dir or Path.cwd()) / "warm_start"
+    warm_dir.mkdir(parents=True, exist_ok=True)
+    start_xyz_path = warm_dir / f"{fileName}.xyz"
+    try:
+        warm = geometries.warm_start(_ligand_pairs(tmc), mol_xyz_path, start_xyz_path)
+    except (OSError, ValueError, IndexError) as e:
+        print("Warm start failed: ", str(e))
+        warm = None
+    if warm is None:
+        return mol_xyz_path, None
+    print("Warm start from: ", warm["neighbour"])
+    return start_xyz_path, warm
+
+
+def store_geometry(geometries, df, idx, tmc, fileName, warm=None, scratch_dir=None):
+    """
+    Record the cycles a warm start saved and store the validated geometry for later neighbours.
+
+    The cycles saved are those of the cold start the neighbour measured or
+    inherited minus the cycles of this run. A stored geometry inherits that
+    cold-start count, so savings are not compounded along a chain of warm
+    starts.
+    """
+    if geometries is None:
+        return
+    cycles = df.loc[idx, CYCLES_COLUMN]
+    cycles = cycles if cycles != "" else None
+    cold_cycles = cycles
+    if warm is not None:
+        cold_cycles = warm.get("cold_cycles")
+        if cold_cycles is not None and cycles is not None:
+            df.loc[idx, CYCLES_SAVED_COLUMN] = int(cold_cycles) - int(cycles)
+    xtb_xyz_path = Path(scratch_dir or Path.cwd()) / "xtb_xyz" / str(fileName) / "xtbopt.xyz"
+    geometries.put(_ligand_pairs(tmc), xtb_xyz_path, cold_cycles)
+
+
+def archive_structure(archive, fileName, xyz_path, kind):
+    """Append the structure of an XYZ file to the geometry archive, if there is one; True if archived"""
+    if archive is None:
+        return False
+    if not archive.put_xyz(str(fileName), xyz_path, kind):
+        print("Not archived, unreadable: ", str(xyz_path))
+        return False
+    return True
+
+
+def _ligand_pairs(tmc):
+    """(SMILES, connecting atom index) pairs of a TMC in clockwise order"""
+    return [(tmc[LIG_SMILE_LIST[i]], tmc[LIG_LIST[i] + "_index"]) for i in range(4)]
+
+
+def validate_structure(df, idx, fileName, mol_xyz_path, result, scratch_dir=None):
+    """
+    Validate an xTB optimized structure and store its properties.
+
+    Args:
+        df: DataFrame prepared by `prepare_ligand_space`
+        idx: Row index in DataFrame
+        fileName: Unique identifier for the molecule
+        mol_xyz_path: XYZ file from `build_structure`
+        result: xTB results from `optimize_structure`
+        scratch_dir: Directory of the xTB runs, defaults to the working directory
+
+    Returns:
+        bool: True if the structure is valid
+    """
+    # Extract properties
+    gap = result["homo_lumo_gap"]
+    polar = result["polarisability"]
+    xtb_xyz_path = Path(scratch_dir or Path.cwd()) / "xtb_xyz" / fileName / "xtbopt.xyz"
+    
+    # Validate structure
+    if check_structure_validity(df, xtb_xyz_path, mol_xyz_path, None, idx, result):
+        reject_last_tier(df, idx)
+        return False
     
-    return df
\ No newline at end of file
+    # Store results
+    print("HomoLumo gap: ", gap)
+    print("Polarisability: ", polar)
+    df.loc[idx, "fileName"] = fileName
+    df.loc[idx, "homo_lumo_gap"] = gap
+    df.loc[idx, "polarisability"] = polar
+    return True
+
+
+class _RowTask:
+    """A row travelling through the stages, with a private one-row DataFrame"""
+
+    def __init__(self, df, idx):
+        self.idx = idx
+        self.df = df.loc[[idx]].copy()
+        self.tmc = None
+        self.fileName = None
+        self.charge = None
+        self.key = None
+        self.mol_xyz_path = None
+        self.warm = None
+        self.result = None
+        self.archived = False
+
+
+def calculate_staged(df, pending, root_path, storage_path, unbounded=False, cache=None,
+                     limits=None, stages=None, queue_size=8, report_interval=60.0, tiers=None,
+                     geometries=None, archive=None):
+    """
+    Calculate rows of a ligand space in a build -> optimize -> validate pipeline.
+
+    molSimplify, xTB and the validation run on separate thread pools
+    connected by bounded queues, so builds run ahead of the xTB workers and
+    keep them busy. Both tools run as subprocesses, which is why threads
+    are enough; with limits, xTB children come from a forkserver, never
+    from a fork of this multi-threaded process, and every build thread runs
+    molSimplify in its own root_path/scratch/build-<thread>/. Every row works on its own one-row copy that is merged into
+    df, cached and saved in the calling thread once the row is finished.
+
+    Args:
+        df: DataFrame prepared by `prepare_ligand_space`, updated in place
+        pending: Indices of the rows to calculate
+        root_path: Base directory for file generation and calculations
+        storage_path: CSV file the finished rows are appended to
+        unbounded: Whether the lig{n} columns hold SMILES instead of ligand IDs
+        cache: Optional XtbCache
+        limits: Optional dict of JobLimits for the "molsimplify" and "xtb" runs
+        stages: Worker threads per stage, missing stages use DEFAULT_STAGES
+        queue_size: Capacity of the queue in front of every stage
+        report_interval: Seconds between progress reports
+        tiers: Optional list of Tiers run in the optimize stage before the tight GFN2 run
+        geometries: Optional GeometryStore to warm-start from and store the validated geometries in
+        archive: Optional GeometryArchive receiving the initial and optimized structures
+
+    Returns:
+        dict: Per-stage throughput, utilization and queue depth statistics
+    """
+    limits = limits or {}
+    workers = dict(DEFAULT_STAGES, **(stages or {}))
+    # molSimplify runs in per-thread directories, so every path must be absolute
+    root_path = str(Path(root_path).absolute())
+    # Duplicate TMCs share the molSimplify and xTB directories of their fileName
+    locks = KeyedLocks()
+    # Rows in flight per fileName; shared run directories are released by the last one
+    in_flight = Counter()
+    in_flight_lock = threading.Lock()
+
+    def prepare(task):
+        prepared = prepare_row(
+            task.df, task.idx, task.df.loc[task.idx], unbounded=unbounded, cache=cache, tiers=tiers
+        )
+        if prepared is None:
+            return False
+        task.tmc, task.fileName, task.charge, task.key = prepared
+        with in_flight_lock:
+            in_flight[task.fileName] += 1
+        return True
+
+    def build(task):
+        # Concurrent builds leave their stray files in separate directories, as pool workers do
+        build_dir = Path(root_path) / "scratch" / f"build-{threading.get_ident()}"
+        build_dir.mkdir(parents=True, exist_ok=True)
+        with locks.hold(task.fileName):
+            task.mol_xyz_path = build_structure(
+                task.df, task.idx, task.tmc, task.fileName, root_path, limits.get("molsimplify"), archive,
+                cwd=str(build_dir),
+            )
+        return task.mol_xyz_path is not None
+
+    def optimize(task):
+        with locks.hold(task.fileName):
+            start_xyz_path, task.warm = warm_start_structure(
+                task.tmc, task.fileName, task.mol_xyz_path, geometries
+            )
+            task.result = optimize_structure(
+                task.df, task.idx, task.fileName, task.mol_xyz_path, task.charge,
+                limits=limits.get("xtb"), tiers=tiers, start_xyz_path=start_xyz_path,
+            )
+        return task.result is not None
+
+    def validate(task):
+        with locks.hold(task.fileName):
+            if validate_structure(task.df, task.idx, task.fileName, task.mol_xyz_path, task.result):
+                store_geometry(geometries, task.df, task.idx, task.tmc, task.fileName, task.warm)
+            task.archived = archive_structure(
+                archive, task.fileName, Path.cwd() / "xtb_xyz" / str(task.fileName) / "xtbopt.xyz", OPTIMIZED
+            )
+        return True
+
+    pipeline = Pipeline(
+        [
+            Stage("prepare", prepare, 1),
+            Stage("build", build, workers["build"]),
+            Stage("optimize", optimize, workers["optimize"]),
+            Stage("validate", validate, workers["validate"]),
+        ],
+        queue_size=queue_size,
+        report_interval=report_interval,
+    )
+    done = [0]
+
+    def finish(task):
+        store_in_cache(cache, task.key, task.df, task.idx, task.result)
+        for column in RESULT_COLUMNS:
+            df.loc[task.idx, column] = task.df.loc[task.idx, column]
+        save_row_to_csv(df.loc[task.idx], task.idx, file_name=storage_path)
+        done[0] += 1
+        if task.fileName is None:
+            return
+        with in_flight_lock:
+            in_flight[task.fileName] -= 1
+            last = in_flight[task.fileName] == 0
+        with locks.hold(task.fileName):
+            release_structure(
+                archive, task.fileName, task.mol_xyz_path, task.archived, tiers=tiers, shared=last
+            )
+
+    def fail(task, stage, error):
+        task.df.loc[task.idx, "_error"] = f"Worker error: {stage}: {str(error)}"
+
+    def report(stats):
+        print(f"Staged calculation: {done[0]}/{len(pending)} rows")
+        for name, stage in stats.items():
+            print(f"  {name}: {stage['throughput']:.3f} rows/s, utilization {stage['utilization']:.0%}, "
+                  f"queue {stage['mean_queue_depth']:.1f}/{stage['queue_size']}")
+
+    stats = pipeline.run((_RowTask(df, idx) for idx in pending), finish, on_error=fail, on_report=report)
+    report(stats)
+    return stats
@@ -0,0 +1,206 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .jobs import THREAD_ENV, CoreBudget, set_core_budget
+from .ligands import LIGANDS, LigandTable, prepare_ligands
+from .resume import plan_resume
+from .utils import LIG_LIST, RESULT_COLUMNS, align_csv_header, prepare_ligand_space
+
+_worker_scratch: Optional[Path] = None
+
+
+class RowWriter:
+    """
+    Single writer appending result rows to a CSV file.
+
+    Rows are put on a queue from any thread and written in arrival order by
+    one background thread, so concurrent producers never interleave lines.
+    The header is written only if the file is new or empty; rows follow the
+    column order of an existing header, see align_csv_header.
+    """
+
+    def __init__(self, path: str, columns: List[str]):
+        self.path = path
+        self.columns = columns
+        self.written = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, row: Dict) -> None:
+        """Queue one row (a dict of column values) for writing"""
+        self._queue.put(row)
+
+    def close(self) -> None:
+        """Write the queued rows and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        columns = align_csv_header(self.path, self.columns)
+        header = columns is None
+        with open(self.path, "a", newline="") as fo:
+            while True:
+                row = self._queue.get()
+                if row is None:
+                    break
+                pd.DataFrame([row], columns=columns or self.columns).to_csv(fo, header=header, index=False)
+                fo.flush()
+                header = False
+                self.written += 1
+
+
+def _init_worker(root_path: str, threads: int, budget: Optional[CoreBudget] = None,
+                 ligands: Optional[LigandTable] = None) -> None:
+    """Pin the thread count of a worker, join the core budget and give it a private scratch directory"""
+    global _worker_scratch
+    for name in THREAD_ENV:
+        os.environ[name] = str(threads)
+    set_core_budget(budget)
+    if ligands is not None:
+        # Ligands resolved by the parent, so workers do not parse them again
+        LIGANDS.update(ligands)
+    _worker_scratch = Path(root_path) / "scratch" / f"worker-{os.getpid()}"
+    _worker_scratch.mkdir(parents=True, exist_ok=True)
+    # molSimplify and xTB leave stray files in the working directory
+    os.chdir(_worker_scratch)
+
+
+def _evaluate_group(
+    records: List[Tuple], root_path: str, unbounded: bool, evaluate: Callable, cache=None, limits=None,
+    tiers=None, geometries=None, archive=None,
+) -> List[Tuple]:
+    """Evaluate rows sharing a TMC one after another in a worker process"""
+    df = pd.DataFrame.from_dict(dict(records), orient="index")
+    df = df.astype({column: object for column in RESULT_COLUMNS})
+    for idx, row in df.iterrows():
+        try:
+            evaluate(
+                df, idx, row, root_path,
+                unbounded=unbounded, scratch_dir=_worker_scratch, cache=cache, limits=limits,
+                tiers=tiers, geometries=geometries, archive=archive,
+            )
+        except Exception as e:
+            df.loc[idx, "_error"] = f"Worker error: {str(e)}"
+    return [(idx, df.loc[idx].to_dict()) for idx in df.index]
+
+
+def calculate_fitness_ligand_space_parallel(
+    df: pd.DataFrame,
+    root_path: str,
+    storage_path: str,
+    workers: Optional[int] = None,
+    threads_per_worker: int = 1,
+    unbounded: bool = False,
+    evaluate: Optional[Callable] = None,
+    cache=None,
+    resume: bool = False,
+    retry=None,
+    limits: Optional[Dict] = None,
+    cores: Optional[int] = None,
+    scheduler=None,
+    tiers=None,
+    geometries=None,
+    archive=None,
+    ligand_cache: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Calculate chemical properties of TMCs on a process pool.
+
+    Same results as `calculate_fitness_ligand_space`, with rows sharded over
+    `workers` processes that each run xTB with `threads_per_worker` OpenMP
+    threads (workers * threads_per_worker should match the cores of the
+    node). Every worker runs in its own scratch directory below
+    root_path/scratch/. Rows of the same TMC go to the same task, so two
+    workers never build the same molSimplify directory. Finished rows are
+    appended to storage_path by a single writer in completion order; the
+    returned DataFrame keeps the input order.
+
+    Args:
+        df: DataFrame of TMCs as for `calculate_fitness_ligand_space`
+        root_path: Base directory for file generation and calculations
+        storage_path: CSV file the finished rows are appended to
+        workers: Number of worker processes, defaults to cores / threads_per_worker
+        threads_per_worker: OMP_NUM_THREADS of every worker
+        unbounded: Whether the lig{n} columns hold SMILES instead of ligand IDs
+        evaluate: Row evaluation function, defaults to `mol_calculation.evaluate_row`
+        cache: Optional XtbCache shared by the workers
+        resume: Take finished rows from storage_path and only calculate the rest
+        retry: RetryPolicy deciding which failed rows are calculated again on resume
+        limits: JobLimits of the "molsimplify" and "xtb" runs; with limits the
+            jobs of all workers share a budget of `cores` cores
+        cores: Size of the core budget, defaults to the cores of the node
+        scheduler: Scheduler ordering the tasks, a TMC's rows are dispatched at
+            the position of its first row
+        tiers: Cheap pre-optimization Tiers run before the tight GFN2 optimization
+        geometries: Optional GeometryStore shared by the workers for warm starts
+        archive: Optional GeometryArchive; every worker appends to its own shard
+        ligand_cache: Optional JSON file of per-ligand precomputations; the
+            ligands are resolved once in this process and handed to the workers
+
+    Returns:
+        pd.DataFrame: df with the result columns filled in
+    """
+    if evaluate is None:
+        from .mol_calculation import evaluate_row as evaluate
+
+    # Workers change their working directory, so every path must be absolute
+    root_path = os.path.abspath(root_path)
+    storage_path = os.path.abspath(storage_path)
+    workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    budget = CoreBudget(cores or os.cpu_count() or 1) if limits else None
+    prepare_ligand_space(df, root_path, unbounded)
+
+    todo = df
+    if resume:
+        plan = plan_resume(df, storage_path, retry)
+        print(f"Resume: {plan.to_dict()}")
+        todo = df.loc[plan.pending]
+    print(f"Ligands: {prepare_ligands(todo, ligand_cache)}")
+
+    groups = list(todo.groupby(LIG_LIST, sort=False, dropna=False).indices.values())
+    if scheduler is not None:
+        rank = {idx: i for i, idx in enumerate(scheduler.order(todo))}
+        groups.sort(key=lambda positions: min(rank[todo.index[i]] for i in positions))
+    groups = iter(groups)
+    writer = RowWriter(storage_path, list(df.columns))
+    results: Dict = {}
+    start = time.perf_counter()
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(root_path, threads_per_worker, budget, LIGANDS)
+        ) as executor:
+            pending = set()
+            while True:
+                # Keep a bounded number of tasks in flight instead of submitting the whole space
+                for positions in groups:
+                    records = [(todo.index[i], todo.iloc[i].to_dict()) for i in positions]
+                    pending.add(executor.submit(
+                        _evaluate_group, records, root_path, unbounded, evaluate,
+                        cache, limits, tiers, geometries, archive,
+                    ))
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for idx, row in future.result():
+                        writer.put(row)
+                        results[idx] = {column: row[column] for column in RESULT_COLUMNS}
+                print(f"Evaluated {len(results)}/{len(todo)} rows in {time.perf_counter() - start:.0f}s")
+    finally:
+        writer.close()
+
+    if results:
+        done_df = pd.DataFrame.from_dict(results, orient="index")
+        df.loc[done_df.index, RESULT_COLUMNS] = done_df[RESULT_COLUMNS]
+    return df
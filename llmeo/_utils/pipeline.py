@@ -0,0 +1,198 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+_STOP = object()
+
+
+class Stage:
+    """
+    One step of a pipeline run by its own pool of worker threads.
+
+    Args:
+        name: Stage name used in reports
+        function: Called with an item; returns True to pass the item on to
+            the next stage, False if the item is finished (e.g. failed)
+        workers: Number of worker threads
+    """
+
+    def __init__(self, name: str, function: Callable[[object], bool], workers: int = 1):
+        self.name = name
+        self.function = function
+        self.workers = workers
+
+
+class StageStats:
+    """Throughput, utilization and input queue depth of one stage"""
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.depths: List[int] = []
+
+    def to_dict(self, elapsed: float) -> Dict:
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "throughput": self.processed / elapsed if elapsed else 0.0,
+            "utilization": self.busy / (elapsed * self.workers) if elapsed else 0.0,
+            "mean_queue_depth": sum(self.depths) / len(self.depths) if self.depths else 0.0,
+            "max_queue_depth": max(self.depths, default=0),
+            "queue_size": self.queue_size,
+        }
+
+
+class Pipeline:
+    """
+    Producer/consumer pipeline of stages connected by bounded queues.
+
+    Items flow through the stages in order. Every stage has its own worker
+    pool, so a slow stage (xTB) is kept saturated while a fast one
+    (molSimplify) runs ahead until the queue in front of the slow stage is
+    full. Finished items, whether they went through every stage or dropped
+    out early, are handed to `on_done` in the calling thread, which is
+    therefore the only thread that needs to touch shared results.
+
+    Queue depths are sampled every `sample_interval` seconds: a stage whose
+    input queue stays full is the bottleneck and deserves more workers, one
+    whose queue stays empty has too many.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        queue_size: int = 8,
+        report_interval: float = 60.0,
+        sample_interval: float = 1.0,
+    ):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.sample_interval = sample_interval
+        self.stats = {stage.name: StageStats(stage.name, stage.workers, queue_size) for stage in stages}
+        self._lock = threading.Lock()
+
+    def _work(self, i: int, queues: List[queue.Queue], done: queue.Queue, on_error) -> None:
+        stage = self.stages[i]
+        stats = self.stats[stage.name]
+        while True:
+            item = queues[i].get()
+            if item is _STOP:
+                break
+            start = time.perf_counter()
+            try:
+                proceed = stage.function(item)
+            except Exception as e:
+                proceed = False
+                if on_error is not None:
+                    on_error(item, stage.name, e)
+                with self._lock:
+                    stats.failed += 1
+            with self._lock:
+                stats.processed += 1
+                stats.busy += time.perf_counter() - start
+            if proceed and i + 1 < len(self.stages):
+                # Blocks while the next stage is backed up
+                queues[i + 1].put(item)
+            else:
+                done.put(item)
+
+    def _sample(self, queues: List[queue.Queue]) -> None:
+        with self._lock:
+            for stage, q in zip(self.stages, queues):
+                self.stats[stage.name].depths.append(q.qsize())
+
+    def report(self, elapsed: float) -> Dict[str, Dict]:
+        """Per-stage statistics after elapsed seconds"""
+        with self._lock:
+            return {name: stats.to_dict(elapsed) for name, stats in self.stats.items()}
+
+    def run(
+        self,
+        items: Iterable,
+        on_done: Callable[[object], None],
+        on_error: Optional[Callable[[object, str, Exception], None]] = None,
+        on_report: Optional[Callable[[Dict[str, Dict]], None]] = None,
+    ) -> Dict[str, Dict]:
+        """
+        Push items through the stages.
+
+        Args:
+            items: Items to process, consumed lazily
+            on_done: Called in the calling thread with every finished item
+            on_error: Called in a worker thread with (item, stage name,
+                exception) when a stage raises; the item is then finished
+            on_report: Called with the statistics every report_interval seconds
+
+        Returns:
+            Dict mapping stage names to their statistics
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        done: queue.Queue = queue.Queue()
+        fed = [0]
+        feeding = threading.Event()
+
+        def feed():
+            try:
+                for item in items:
+                    queues[0].put(item)
+                    fed[0] += 1
+            finally:
+                feeding.set()
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads += [
+                threading.Thread(target=self._work, args=(i, queues, done, on_error), daemon=True)
+                for _ in range(stage.workers)
+            ]
+        start = last_report = last_sample = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        completed = 0
+        while not (feeding.is_set() and completed == fed[0]):
+            try:
+                item = done.get(timeout=self.sample_interval)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                on_done(item)
+                completed += 1
+            if time.perf_counter() - last_sample >= self.sample_interval:
+                last_sample = time.perf_counter()
+                self._sample(queues)
+            if time.perf_counter() - last_report >= self.report_interval:
+                last_report = time.perf_counter()
+                if on_report is not None:
+                    on_report(self.report(last_report - start))
+
+        for i, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                queues[i].put(_STOP)
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - start)
+
+
+class KeyedLocks:
+    """Locks created on demand per key, e.g. per molSimplify/xTB run directory"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, threading.Lock] = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: Hashable):
+        with self._lock:
+            lock = self._locks[key]
+        with lock:
+            yield
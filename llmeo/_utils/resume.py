@@ -0,0 +1,190 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .cache import TRANSIENT_ERRORS, canonical_ligands, error_class
+from .utils import (CYCLES_COLUMN, CYCLES_SAVED_COLUMN, LIG_CONNECTING_ATOM_INDEX,
+                    LIG_CONNECTING_ATOM_LIST, LIG_SMILE_LIST, RESULT_COLUMNS, TIMING_COLUMN)
+
+# Result columns holding numbers
+NUMERIC_COLUMNS = ("homo_lumo_gap", "polarisability", TIMING_COLUMN, CYCLES_COLUMN, CYCLES_SAVED_COLUMN)
+
+# Rows that stopped without an error message and without properties, e.g. no xyz file was written
+INCOMPLETE = "incomplete"
+
+
+def _normalize(value) -> str:
+    """String form of a CSV cell that is equal for 1, 1.0 and "1" """
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    return str(int(number)) if number.is_integer() else str(number)
+
+
+def ligand_key(row) -> Tuple:
+    """
+    Rotation-invariant identity of a TMC row.
+
+    Args:
+        row: Row with lig{n}_smiles, lig{n}_element and lig{n}_index columns
+
+    Returns:
+        Tuple: Canonical rotation of the (SMILES, connecting element, occurrence) triples
+    """
+    ligands = [
+        (str(row[LIG_SMILE_LIST[i]]), str(row[LIG_CONNECTING_ATOM_LIST[i]]), _normalize(row[LIG_CONNECTING_ATOM_INDEX[i]]))
+        for i in range(4)
+    ]
+    return tuple(canonical_ligands(ligands))
+
+
+def row_outcome(row) -> str:
+    """Error class of a stored row, INCOMPLETE for rows without error and without properties"""
+    outcome = error_class(row.get("_error"))
+    gap = row.get("homo_lumo_gap")
+    if outcome == "ok" and (gap is None or gap != gap or str(gap).strip() == ""):
+        return INCOMPLETE
+    return outcome
+
+
+class RetryPolicy:
+    """
+    Decides which stored rows are calculated again on resume.
+
+    Successful rows and deterministic failures (invalid SMILES, broken
+    structures, ...) are final. Transient failures and incomplete rows are
+    retried until they have been attempted `max_attempts` times.
+    """
+
+    def __init__(self, max_attempts: int = 3, retry_errors=None):
+        self.max_attempts = max_attempts
+        self.retry_errors = set(TRANSIENT_ERRORS if retry_errors is None else retry_errors) | {INCOMPLETE}
+
+    def is_final(self, outcome: str) -> bool:
+        return outcome not in self.retry_errors
+
+    def should_retry(self, outcome: str, attempts: int) -> bool:
+        return not self.is_final(outcome) and attempts < self.max_attempts
+
+
+def truncate_partial_line(path: str) -> int:
+    """
+    Drop a trailing line cut off by an interrupted write.
+
+    Appending to such a file would glue the next row onto the broken one.
+
+    Returns:
+        int: Number of bytes removed
+    """
+    with open(path, "rb+") as fo:
+        data = fo.read()
+        if not data or data.endswith(b"\n"):
+            return 0
+        keep = data.rfind(b"\n") + 1
+        fo.truncate(keep)
+    return len(data) - keep
+
+
+def load_progress(storage_path: str, policy: RetryPolicy) -> Dict[Tuple, Tuple[Dict, int]]:
+    """
+    Read the rows stored by earlier runs.
+
+    Args:
+        storage_path: CSV file the evaluated rows were appended to
+        policy: Retry policy telling final from retryable outcomes
+
+    Returns:
+        Dict mapping the ligand key to (stored row, attempts); the last final
+        row of a TMC wins over any retryable one
+
+    Raises:
+        ValueError: If rows of the file have more fields than its header
+    """
+    if not os.path.exists(storage_path) or os.path.getsize(storage_path) == 0:
+        return {}
+    truncate_partial_line(storage_path)
+    try:
+        stored = pd.read_csv(storage_path, dtype=str, keep_default_na=False)
+    except pd.errors.ParserError as e:
+        # Rows with more fields than the header cannot be matched to columns; skipping them
+        # would silently calculate them again on every resume
+        raise ValueError(f"{storage_path} has rows that do not match its header: {e}") from e
+    # Runs restarted without resume may have appended their header again
+    stored = stored[stored[LIG_SMILE_LIST[0]] != LIG_SMILE_LIST[0]]
+
+    progress: Dict[Tuple, Tuple[Dict, int]] = {}
+    for record in stored.to_dict("records"):
+        try:
+            key = ligand_key(record)
+        except KeyError:
+            continue
+        previous, attempts = progress.get(key, (None, 0))
+        if previous is not None and policy.is_final(row_outcome(previous)) and not policy.is_final(row_outcome(record)):
+            record = previous
+        progress[key] = (record, attempts + 1)
+    return progress
+
+
+class ResumePlan:
+    """Rows of a ligand space that still need a calculation, and what was taken from storage"""
+
+    def __init__(self):
+        self.pending: List = []
+        self.finished = 0
+        self.retried = 0
+        self.exhausted = 0
+        self.missing = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            "pending": len(self.pending),
+            "finished": self.finished,
+            "retried": self.retried,
+            "exhausted": self.exhausted,
+            "missing": self.missing,
+        }
+
+
+def plan_resume(df: pd.DataFrame, storage_path: str, policy: Optional[RetryPolicy] = None) -> ResumePlan:
+    """
+    Fill in the results of rows finished by earlier runs and list the rest.
+
+    Rows are matched by `ligand_key`, so a TMC stored under another rotation
+    or row number is recognized. Finished rows and rows whose retries are
+    exhausted get their stored result columns; rows never stored or failed
+    with a retryable outcome are pending.
+
+    Args:
+        df: DataFrame prepared by `prepare_ligand_space`, modified in place
+        storage_path: CSV file the evaluated rows were appended to
+        policy: Retry policy, defaults to RetryPolicy()
+
+    Returns:
+        ResumePlan: Pending row indices and resume statistics
+    """
+    policy = policy or RetryPolicy()
+    progress = load_progress(storage_path, policy)
+    plan = ResumePlan()
+
+    for idx, row in df.iterrows():
+        stored = progress.get(ligand_key(row))
+        if stored is None:
+            plan.missing += 1
+            plan.pending.append(idx)
+            continue
+        record, attempts = stored
+        outcome = row_outcome(record)
+        if policy.should_retry(outcome, attempts):
+            plan.retried += 1
+            plan.pending.append(idx)
+            continue
+        if policy.is_final(outcome):
+            plan.finished += 1
+        else:
+            plan.exhausted += 1
+        for column in RESULT_COLUMNS:
+            value = record.get(column, "")
+            df.loc[idx, column] = float(value) if column in NUMERIC_COLUMNS and value else value
+    return plan
@@ -0,0 +1,145 @@
+import os
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .ligands import ligand_descriptors
+from .utils import LIG_SMILE_LIST, TIMING_COLUMN
+
+SCHEDULES = ("none", "lpt", "value")
+
+
+def tmc_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Atom count (metal included) and rotatable bonds of the TMCs in a frame.
+
+    Args:
+        df: Frame with lig{n}_smiles columns
+
+    Returns:
+        pd.DataFrame: "atoms" and "rotatable" columns with the index of df
+    """
+    atoms = np.ones(len(df))
+    rotatable = np.zeros(len(df))
+    for column in LIG_SMILE_LIST:
+        descriptors = np.array([ligand_descriptors(smiles) for smiles in df[column]], dtype=float).reshape(-1, 2)
+        atoms += descriptors[:, 0]
+        rotatable += descriptors[:, 1]
+    return pd.DataFrame({"atoms": atoms, "rotatable": rotatable}, index=df.index)
+
+
+class RuntimePredictor:
+    """
+    Predicted xTB wall time of a TMC from its size and flexibility.
+
+    A log-linear model log(t) = a + b log(atoms) + c rotatable is fitted to
+    measured timings. Until enough timings are available, a prior growing
+    with the square of the atom count keeps at least the ranking of jobs
+    sensible, which is all the scheduler needs.
+    """
+
+    def __init__(self, min_observations: int = 10):
+        self.min_observations = min_observations
+        self.coefficients: Optional[np.ndarray] = None
+        self.observations = 0
+
+    @staticmethod
+    def _design(features: pd.DataFrame) -> np.ndarray:
+        atoms = np.maximum(features["atoms"].to_numpy(dtype=float), 1.0)
+        return np.column_stack([np.ones(len(features)), np.log(atoms), features["rotatable"].to_numpy(dtype=float)])
+
+    def fit(self, features: pd.DataFrame, seconds: Iterable[float]) -> "RuntimePredictor":
+        """Fit the model to timings of TMCs with the given features"""
+        seconds = np.asarray(list(seconds), dtype=float)
+        keep = np.isfinite(seconds) & (seconds > 0)
+        self.observations = int(keep.sum())
+        if self.observations < self.min_observations:
+            self.coefficients = None
+            return self
+        design = self._design(features)[keep]
+        self.coefficients = np.linalg.lstsq(design, np.log(seconds[keep]), rcond=None)[0]
+        return self
+
+    def fit_frame(self, df: pd.DataFrame) -> "RuntimePredictor":
+        """Fit the model to the rows of an evaluated frame that have a timing"""
+        seconds = pd.to_numeric(df.get(TIMING_COLUMN, pd.Series(dtype=float)), errors="coerce")
+        timed = df[seconds.notna()] if len(seconds) else df.iloc[:0]
+        return self.fit(tmc_features(timed), seconds.dropna())
+
+    def predict(self, features: pd.DataFrame) -> np.ndarray:
+        """Predicted seconds of the TMCs with the given features"""
+        if self.coefficients is None:
+            atoms = features["atoms"].to_numpy(dtype=float)
+            return 1e-2 * atoms ** 2 * (1 + 0.1 * features["rotatable"].to_numpy(dtype=float))
+        return np.exp(self._design(features) @ self.coefficients)
+
+
+def load_timings(paths: Iterable[str]) -> pd.DataFrame:
+    """Rows with a measured xTB time from storage files of earlier runs"""
+    frames = []
+    for path in paths:
+        if not path or not os.path.exists(path) or os.path.getsize(path) == 0:
+            continue
+        stored = pd.read_csv(path, on_bad_lines="skip", low_memory=False)
+        if TIMING_COLUMN in stored and all(column in stored for column in LIG_SMILE_LIST):
+            stored = stored[pd.to_numeric(stored[TIMING_COLUMN], errors="coerce").notna()]
+            frames.append(stored[LIG_SMILE_LIST + [TIMING_COLUMN]])
+    if not frames:
+        return pd.DataFrame(columns=LIG_SMILE_LIST + [TIMING_COLUMN])
+    return pd.concat(frames, ignore_index=True)
+
+
+class Scheduler:
+    """
+    Order in which the rows of a ligand space are dispatched.
+
+    "lpt" runs the longest predicted jobs first, which keeps every worker
+    busy until the end of a batch instead of leaving one straggler.
+    "value" runs the jobs with the highest expected value per predicted
+    CPU-second first; without a value column every job is worth the same
+    and the shortest go first, which brings the first results in soonest.
+    "none" keeps the frame order.
+    """
+
+    def __init__(self, predictor: Optional[RuntimePredictor] = None, mode: str = "lpt",
+                 value_column: Optional[str] = None):
+        if mode not in SCHEDULES:
+            raise ValueError(f"Unknown schedule {mode}, expected one of {SCHEDULES}")
+        self.predictor = predictor or RuntimePredictor()
+        self.mode = mode
+        self.value_column = value_column
+
+    @classmethod
+    def from_history(cls, paths: Iterable[str], mode: str = "lpt", value_column: Optional[str] = None) -> "Scheduler":
+        """Scheduler with a predictor fitted to the timings stored in earlier runs' files"""
+        return cls(RuntimePredictor().fit_frame(load_timings(paths)), mode, value_column)
+
+    def predict(self, df: pd.DataFrame) -> pd.Series:
+        """Predicted seconds of every row of df"""
+        return pd.Series(self.predictor.predict(tmc_features(df)), index=df.index)
+
+    def order(self, df: pd.DataFrame, indices: Optional[Iterable] = None) -> List:
+        """
+        Dispatch order of rows.
+
+        Args:
+            df: Frame with lig{n}_smiles columns
+            indices: Rows to order, defaults to all
+
+        Returns:
+            List of row indices, first to dispatch first
+        """
+        indices = list(df.index if indices is None else indices)
+        if self.mode == "none" or not indices:
+            return indices
+        predicted = self.predict(df.loc[indices]).to_numpy()
+        if self.mode == "lpt":
+            priority = predicted
+        else:
+            value = 1.0
+            if self.value_column is not None:
+                value = pd.to_numeric(df.loc[indices, self.value_column], errors="coerce").fillna(0.0).to_numpy()
+            priority = value / np.maximum(predicted, 1e-6)
+        order = np.argsort(-priority, kind="stable")
+        return [indices[i] for i in order]
@@ -0,0 +1,267 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+LIG_COLUMNS = ["lig1", "lig2", "lig3", "lig4"]
+
+
+def ligand_similarity(df_ligands: pd.DataFrame) -> pd.DataFrame:
+    """
+    Crude similarity between ligands of the pool, from 0 (unrelated) to 1 (same ligand).
+
+    Two different ligands score 0.5 for the same charge and 0.25 for the same
+    connecting atom element, so swapping a ligand for one that binds and
+    charges like it counts as a smaller change than an arbitrary swap.
+
+    Args:
+        df_ligands: Ligand table with "id", "charge" and "connecting atom element" columns
+
+    Returns:
+        pd.DataFrame: Square similarity matrix indexed by ligand ID
+    """
+    charge = df_ligands["charge"].to_numpy()
+    element = df_ligands["connecting atom element"].to_numpy()
+    similarity = (
+        0.5 * (charge[:, None] == charge[None, :])
+        + 0.25 * (element[:, None] == element[None, :])
+    )
+    np.fill_diagonal(similarity, 1.0)
+    return pd.DataFrame(similarity, index=df_ligands["id"], columns=df_ligands["id"])
+
+
+class SnapIndex:
+    """
+    Nearest-member index over an enumerated TMC space.
+
+    The distance between two TMCs is the Hamming distance of their ligand
+    positions, minimized over the four rotations of the square-planar
+    complex. Every member is stored under its four rotation triples (three
+    consecutive ligands in clockwise order), so all members within distance
+    one ligand swap of a proposal are found with four binary searches,
+    independent of the size of the space. More swaps fall back to a
+    vectorized scan of the whole space.
+
+    Among equally distant members, those closest to the proposal's total
+    charge (clamped to the allowed range) are preferred, so a proposal with
+    charge +2 snaps to a +1 neighbour rather than an arbitrary one. With a
+    ligand similarity matrix, members are ranked by the summed dissimilarity
+    of the swapped ligands instead of the number of swaps.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        lig_charge: Dict[str, int],
+        metal: str = "Pd",
+        metal_charge: int = 2,
+        charge_range: Tuple[int, int] = (-1, 1),
+        similarity: Optional[pd.DataFrame] = None,
+    ):
+        self.metal = metal
+        self.metal_charge = metal_charge
+        self.charge_range = charge_range
+
+        ligands = list(lig_charge)
+        extra = pd.unique(df[LIG_COLUMNS].to_numpy().ravel())
+        ligands += [lig for lig in extra if lig not in lig_charge]
+        self.ligands = ligands
+        self.codes = {lig: i for i, lig in enumerate(ligands)}
+        # The last code stands for ligands outside the pool and never matches
+        self.unknown = len(ligands)
+        self.base = len(ligands) + 1
+
+        self.members = np.stack(
+            [df[col].map(self.codes).to_numpy(dtype=np.int64) for col in LIG_COLUMNS], axis=1
+        )
+        self.lig_charges = np.array([lig_charge.get(lig, 0) for lig in ligands] + [0])
+        self.charges = metal_charge + self.lig_charges[self.members].sum(axis=1)
+
+        self.cost = 1.0 - np.eye(self.base)
+        if similarity is not None:
+            sim = similarity.reindex(index=ligands, columns=ligands).fillna(0.0).to_numpy()
+            self.cost[:-1, :-1] = 1.0 - sim
+            np.fill_diagonal(self.cost, 0.0)
+
+        # Rotation triples: the three ligands following each position
+        rows = np.arange(len(self.members))
+        triples = np.concatenate([self._encode(self._rotate(self.members, p)[:, 1:]) for p in range(4)])
+        order = np.argsort(triples, kind="stable")
+        self._triples = triples[order]
+        self._triple_rows = np.tile(rows, 4)[order]
+
+        keys = self._canonical(self.members)
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._key_rows = order
+
+    def _encode(self, codes: np.ndarray) -> np.ndarray:
+        key = np.zeros(codes.shape[:-1], dtype=np.int64)
+        for i in range(codes.shape[-1]):
+            key = key * self.base + codes[..., i]
+        return key
+
+    @staticmethod
+    def _rotate(codes: np.ndarray, shift: int) -> np.ndarray:
+        return np.roll(codes, -shift, axis=-1)
+
+    def _canonical(self, codes: np.ndarray) -> np.ndarray:
+        return np.min([self._encode(self._rotate(codes, p)) for p in range(4)], axis=0)
+
+    def _parse(self, tmc: str) -> Optional[List[int]]:
+        ligs = tmc.split("_")[1:]
+        if len(ligs) != 4:
+            return None
+        return [self.codes.get(lig, self.unknown) for lig in ligs]
+
+    def _key_of(self, codes) -> int:
+        # Scalar version of _encode, a single query is faster in plain Python
+        key = 0
+        for code in codes:
+            key = key * self.base + int(code)
+        return key
+
+    def _key(self, codes: List[int]) -> int:
+        return min(self._key_of(codes[p:] + codes[:p]) for p in range(4))
+
+    def tmc(self, row: int) -> str:
+        """TMC string of a member row"""
+        return "_".join([self.metal] + [self.ligands[code] for code in self.members[row]])
+
+    def key(self, tmc: str) -> Optional[int]:
+        """Rotation-invariant key of a TMC, None for malformed TMCs"""
+        codes = self._parse(tmc)
+        return None if codes is None else self._key(codes)
+
+    def lookup(self, tmc: str) -> Optional[int]:
+        """Row of the member equal to tmc up to rotation, or None"""
+        key = self.key(tmc)
+        if key is None:
+            return None
+        i = int(self._keys.searchsorted(key))
+        if i < len(self._keys) and self._keys[i] == key:
+            return int(self._key_rows[i])
+        return None
+
+    def frame_keys(self, df: pd.DataFrame) -> Set[int]:
+        """Rotation-invariant keys of the TMCs in a frame with lig1..lig4 columns"""
+        codes = np.stack(
+            [df[col].map(self.codes).fillna(self.unknown).to_numpy(dtype=np.int64) for col in LIG_COLUMNS],
+            axis=1,
+        )
+        return set(self._canonical(codes).tolist())
+
+    def target_charge(self, tmc: str) -> Optional[int]:
+        """Total charge of tmc clamped to the allowed range, None with unknown ligands"""
+        codes = self._parse(tmc)
+        if codes is None or self.unknown in codes:
+            return None
+        charge = self.metal_charge + int(self.lig_charges[codes].sum())
+        return min(max(charge, self.charge_range[0]), self.charge_range[1])
+
+    def nearest(
+        self,
+        tmc: str,
+        k: int = 1,
+        max_swaps: int = 1,
+        exclude: Optional[Set[int]] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Find the members closest to a proposal.
+
+        Args:
+            tmc: Proposed TMC string
+            k: Number of members to return
+            max_swaps: Largest number of ligand positions that may differ; up to
+                one the index is used, beyond that the whole space is scanned
+            exclude: Keys (see `key`) of members that must not be returned
+
+        Returns:
+            List of (member TMC, distance) pairs, closest first; the distance is
+            the number of swapped ligands, or their summed dissimilarity when
+            the index has a similarity matrix
+        """
+        codes = self._parse(tmc)
+        if codes is None:
+            return []
+        rotations = np.array([codes[p:] + codes[:p] for p in range(4)])
+
+        if max_swaps <= 1:
+            triples = [self._key_of(rotation[1:]) for rotation in rotations]
+            lo = self._triples.searchsorted(triples, side="left")
+            hi = self._triples.searchsorted(triples, side="right")
+            rows = np.unique(np.concatenate([self._triple_rows[a:b] for a, b in zip(lo, hi)]))
+        else:
+            rows = np.arange(len(self.members))
+        if not len(rows):
+            return []
+
+        # Compare every candidate against every rotation of the proposal
+        candidates = self.members[rows]
+        mismatch = (rotations[:, None, :] != candidates[None, :, :]).sum(axis=2)
+        best = mismatch.argmin(axis=0)
+        swaps = mismatch[best, np.arange(len(rows))]
+        cost = self.cost[rotations[best], candidates].sum(axis=1)
+        keep = swaps <= max_swaps
+        if exclude:
+            keep &= ~np.isin(self._canonical(candidates), list(exclude))
+        rows, cost = rows[keep], cost[keep]
+
+        target = self.target_charge(tmc)
+        charge_gap = np.zeros(len(rows)) if target is None else np.abs(self.charges[rows] - target)
+        nearest = {}
+        for i in np.lexsort((rows, charge_gap, cost)):
+            if len(nearest) == k:
+                break
+            # Spaces listing a TMC under several rotations yield it only once
+            nearest.setdefault(self._key(self.members[rows[i]].tolist()), (self.tmc(rows[i]), float(cost[i])))
+        return list(nearest.values())
+
+    def snap(self, tmc: str, max_swaps: int = 1, exclude: Optional[Set[int]] = None) -> Optional[str]:
+        """The nearest member of a proposal, or None if there is none within max_swaps"""
+        nearest = self.nearest(tmc, k=1, max_swaps=max_swaps, exclude=exclude)
+        return nearest[0][0] if nearest else None
+
+
+class SnapStats:
+    """Running statistics of proposals snapped to the nearest member of the space"""
+
+    def __init__(self):
+        self.proposals = 0
+        self.in_space = 0
+        self.snapped = 0
+        self.unsnapped = 0
+        self.distances: List[float] = []
+        self.pairs: List[Dict] = []
+
+    def record(self, proposal: str, snapped: Optional[str], distance: Optional[float] = None) -> None:
+        """Add one out-of-space or invalid proposal and the member it was snapped to"""
+        self.proposals += 1
+        if snapped is None:
+            self.unsnapped += 1
+            return
+        self.snapped += 1
+        self.distances.append(distance)
+        self.pairs.append({"proposal": proposal, "snapped": snapped, "distance": distance})
+
+    def record_in_space(self, n: int = 1) -> None:
+        """Add proposals that were members of the space already"""
+        self.proposals += n
+        self.in_space += n
+
+    @property
+    def snap_rate(self) -> float:
+        """Fraction of out-of-space proposals that were snapped"""
+        missed = self.snapped + self.unsnapped
+        return self.snapped / missed if missed else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "proposals": self.proposals,
+            "in_space": self.in_space,
+            "snapped": self.snapped,
+            "unsnapped": self.unsnapped,
+            "snap_rate": self.snap_rate,
+            "mean_distance": float(np.mean(self.distances)) if self.distances else 0.0,
+            "pairs": list(self.pairs),
+        }
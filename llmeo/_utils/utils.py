@@ -1,17 +1,78 @@
+import csv
 import hashlib
+import io
+import json
+import os
 import re
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from uuid import uuid4
 
 import pandas as pd
 
+# Possible delimiters for TMC in message, in order of preference
+TMC_DELIMITERS = ["*TMC*", "<<<TMC>>>:", "<TMC>", "TMC:", " TMC"]
+# Structured delimiters preceding a proposed TMC in a streamed LLM answer
+STREAM_DELIMITER_REGEX = re.compile(r"\*TMC\*|<<<TMC>>>:|<TMC>|TMC:")
+TMC_REGEX = re.compile(
+    r"Pd_(\w{6})-subgraph-(\d+)_(\w{6})-subgraph-(\d+)_(\w{6})-subgraph-(\d+)_(\w{6})-subgraph-(\d+)"
+)
+ALIAS_TMC_REGEX = re.compile(r"Pd(?:_L\d{2,}){4}")
+# Property precision of compact (aliased) prompts
+COMPACT_PRECISION = {"gap": 2, "polarisability": 1}
 
-def find_tmc_in_space(df: pd.DataFrame, tmcs: List[str]) -> Optional[pd.DataFrame]:
+
+class LigandAliases:
+    """
+    Short, stable aliases (L01, L02, ...) for ligand IDs in prompts.
+
+    Aliases follow the order of the ligand pool, so the same pool always gets
+    the same aliases. `expand` maps aliases in an LLM message back to the
+    canonical IDs before the message is parsed.
+    """
+
+    ALIAS_REGEX = re.compile(r"(?<![A-Za-z0-9-])L\d{2,}(?![0-9])")
+
+    def __init__(self, ligand_ids: Iterable[str]):
+        ligand_ids = list(dict.fromkeys(ligand_ids))
+        width = max(2, len(str(len(ligand_ids))))
+        self.to_alias = {lig: f"L{i + 1:0{width}d}" for i, lig in enumerate(ligand_ids)}
+        self.to_canonical = {alias: lig for lig, alias in self.to_alias.items()}
+
+    def alias(self, ligand_id: str) -> str:
+        """Alias of a ligand ID; unknown IDs are returned unchanged"""
+        return self.to_alias.get(ligand_id, ligand_id)
+
+    def expand(self, message: str) -> str:
+        """Replace every known alias in a message with its canonical ligand ID"""
+        return self.ALIAS_REGEX.sub(
+            lambda match: self.to_canonical.get(match.group(), match.group()), message
+        )
+
+    def ligand_table(self, ligands: str) -> str:
+        """
+        Rewrite the ligand CSV with aliases as IDs and a short header.
+
+        Args:
+            ligands: Content of the ligand CSV file
+
+        Returns:
+            Compact CSV with columns SMILES, id, charge, element and index
+        """
+        df = pd.read_csv(io.StringIO(ligands))
+        df.columns = ["SMILES", "id", "charge", "element", "index"]
+        df["id"] = df["id"].map(self.alias)
+        return df.to_csv(index=False)
+
+
+def find_tmc_in_space(df: pd.DataFrame, tmcs: List[str], index=None) -> Optional[pd.DataFrame]:
     """
     Find TMCs in the search space by checking all possible rotations of ligands.
     
     Args:
         df: DataFrame containing the TMC search space
         tmcs: List of TMC strings to search for
+        index: Optional SnapIndex built on df, replacing the column scans by a key lookup
         
     Returns:
         DataFrame containing matched TMCs, or None if no matches found
@@ -21,6 +82,12 @@ def find_tmc_in_space(df: pd.DataFrame, tmcs: List[str]) -> Optional[pd.DataFram
     for tmc in tmcs:
         if tmc is None:
             continue
+
+        if index is not None:
+            row = index.lookup(tmc)
+            if row is not None:
+                matched_tmcs.append(df.iloc[[row]])
+            continue
             
         # Get ligands from TMC string
         ligs = tmc.split("_")[1:]
@@ -45,10 +112,42 @@ def find_tmc_in_space(df: pd.DataFrame, tmcs: List[str]) -> Optional[pd.DataFram
                 
     return pd.concat(matched_tmcs) if matched_tmcs else None
 
+class PromptTemplate:
+    """
+    Prompt template split once at its named slots.
+
+    Rendering joins the fixed text with the slot values in a single pass
+    instead of one full-template `str.replace` per slot. Slot values are
+    inserted verbatim, so slot names inside values are not substituted again.
+    """
+
+    SLOT_REGEX = re.compile(r"(CSV_FILE_CONTENT|CURRENT_SAMPLES|NUM_PROVIDED_SAMPLES|NUM_SAMPLES)")
+
+    def __init__(self, template: str):
+        self.template = template
+        # Even positions hold fixed text, odd positions slot names
+        self._parts = self.SLOT_REGEX.split(template)
+        self.slots = set(self._parts[1::2])
+
+    def render(self, **values: str) -> str:
+        """Fill every slot of the template; missing values raise a KeyError"""
+        parts = list(self._parts)
+        parts[1::2] = [values[slot] for slot in self._parts[1::2]]
+        return "".join(parts)
+
+
+@lru_cache(maxsize=None)
+def compile_template(template: str) -> PromptTemplate:
+    """Return the cached PromptTemplate of a template string"""
+    return PromptTemplate(template)
+
+
 def make_text_for_existing_tmcs(
     df: pd.DataFrame, 
     lig_charge: Dict[str, int], 
-    props: List[str]
+    props: List[str],
+    aliases: Optional[LigandAliases] = None,
+    precision: Union[int, Dict[str, int]] = 3,
 ) -> str:
     """
     Create formatted text representation of TMCs with their properties.
@@ -57,26 +156,40 @@ def make_text_for_existing_tmcs(
         df: DataFrame containing TMC data
         lig_charge: Dictionary mapping ligands to their charges
         props: List of property names to include
+        aliases: Optional ligand aliases used instead of the ligand IDs
+        precision: Decimals of the property values, per property or for all
         
     Returns:
         Formatted string containing TMC information
     """
-    lines = []
-    for _, row in df.iterrows():
-        # Construct TMC string
-        tmc = "Pd_" + "_".join([row["lig1"], row["lig2"], row["lig3"], row["lig4"]])
-        
-        # Calculate total charge
-        total_charge = 2 + sum(lig_charge[row[f"lig{i}"]] for i in range(1, 5))
-        
-        # Get property values
-        prop_values = [str(round(row[prop], 3)) for prop in props]
-        
-        # Format line
-        line = "{" + ", ".join([tmc, str(total_charge)] + prop_values) + "}"
-        lines.append(line)
-        
-    return "\n".join(lines)
+    if not len(df):
+        return ""
+    digits = {
+        prop: precision.get(prop, 3) if isinstance(precision, dict) else precision
+        for prop in props
+    }
+    lig_columns = [df[f"lig{i}"] for i in range(1, 5)]
+
+    # Calculate total charges column-wise
+    charge_of = pd.Series(lig_charge)
+    total_charge = 2
+    for column in lig_columns:
+        charges = column.map(charge_of)
+        if charges.isna().any():
+            raise KeyError(column[charges.isna()].iloc[0])
+        total_charge = total_charge + charges
+
+    # Construct TMC strings
+    if aliases is not None:
+        lig_columns = [column.map(aliases.alias) for column in lig_columns]
+    tmcs = "Pd_" + lig_columns[0] + "_" + lig_columns[1] + "_" + lig_columns[2] + "_" + lig_columns[3]
+
+    # Python floats rounded with round() keep the exact digits of the row-wise format
+    columns = [tmcs.tolist(), [str(charge) for charge in total_charge.tolist()]]
+    for prop in props:
+        columns.append([str(round(value, digits[prop])) for value in df[prop].tolist()])
+
+    return "\n".join("{" + ", ".join(fields) + "}" for fields in zip(*columns))
 
 def make_prompt(
     template: str,
@@ -84,7 +197,8 @@ def make_prompt(
     df_samples: pd.DataFrame,
     lig_charge: Dict[str, int],
     num_samples: str = "ONE",
-    props: List[str] = ["gap"]
+    props: List[str] = ["gap"],
+    aliases: Optional[LigandAliases] = None,
 ) -> str:
     """
     Create prompt for LLM by filling template with TMC information.
@@ -96,44 +210,48 @@ def make_prompt(
         lig_charge: Dictionary of ligand charges
         num_samples: Number of samples to request
         props: List of properties to include
+        aliases: Optional ligand aliases; gives a compact prompt with aliased
+            ligand table and samples at COMPACT_PRECISION
         
     Returns:
         Formatted prompt string
     """
-    replacements = {
-        "CSV_FILE_CONTENT": ligands,
-        "CURRENT_SAMPLES": make_text_for_existing_tmcs(df_samples, lig_charge, props),
-        "NUM_SAMPLES": num_samples,
-        "NUM_PROVIDED_SAMPLES": str(len(df_samples))
-    }
-    
-    for key, value in replacements.items():
-        template = template.replace(key, value)
-        
-    return template
+    if aliases is not None:
+        ligands = aliases.ligand_table(ligands)
+        samples = make_text_for_existing_tmcs(
+            df_samples, lig_charge, props, aliases=aliases, precision=COMPACT_PRECISION
+        )
+    else:
+        samples = make_text_for_existing_tmcs(df_samples, lig_charge, props)
+    return compile_template(template).render(
+        CSV_FILE_CONTENT=ligands,
+        CURRENT_SAMPLES=samples,
+        NUM_SAMPLES=num_samples,
+        NUM_PROVIDED_SAMPLES=str(len(df_samples)),
+    )
 
-def retrive_tmc_from_message(message: str, expected_returns: int = 1) -> List[str]:
+def retrive_tmc_from_message(
+    message: str,
+    expected_returns: int = 1,
+    aliases: Optional[LigandAliases] = None,
+) -> List[str]:
     """
     Extract TMC strings from LLM response message.
     
     Args:
         message: Response message from LLM
         expected_returns: Expected number of TMCs to extract
+        aliases: Optional ligand aliases used in the prompt, mapped back to ligand IDs
         
     Returns:
         List of extracted TMC strings
     """
-    # TMC pattern matching regex
-    pattern = r"Pd_(\w{6})-subgraph-(\d+)_(\w{6})-subgraph-(\d+)_(\w{6})-subgraph-(\d+)_(\w{6})-subgraph-(\d+)"
-    
-    # Possible delimiters for TMC in message
-    delimiters = [
-        "*TMC*", "<<<TMC>>>:", "<TMC>", "TMC:", " TMC"
-    ]
-    
+    if aliases is not None:
+        message = aliases.expand(message)
+
     # Try to split message using different delimiters
     message_parts = None
-    for delimiter in delimiters:
+    for delimiter in TMC_DELIMITERS:
         if delimiter in message:
             message_parts = message.split(delimiter)
             break
@@ -147,7 +265,7 @@ def retrive_tmc_from_message(message: str, expected_returns: int = 1) -> List[st
     for i in range(expected_returns):
         try:
             idx = -expected_returns + i
-            match = re.search(pattern, message_parts[idx])
+            match = TMC_REGEX.search(message_parts[idx])
             
             if match:
                 tmc = match.group()
@@ -162,6 +280,255 @@ def retrive_tmc_from_message(message: str, expected_returns: int = 1) -> List[st
     return tmcs
 
 
+class TMCStreamParser:
+    """
+    Incrementally extract TMC strings from a streamed LLM response.
+
+    Text chunks are passed to `feed` as they arrive; every TMC that follows a
+    structured delimiter is returned as soon as it is complete, i.e. once a
+    character after it has been received or the stream is closed. With
+    `aliases`, aliased TMCs are recognized and emitted with canonical IDs.
+    """
+
+    def __init__(self, aliases: Optional[LigandAliases] = None):
+        self.aliases = aliases
+        self._tmc_regex = TMC_REGEX if aliases is None else ALIAS_TMC_REGEX
+        self.text = ""
+        self.emitted: List[str] = []
+        self._cursor = 0
+        self._armed = False
+
+    def feed(self, chunk: str) -> List[str]:
+        """Add a chunk of text and return the TMCs completed by it"""
+        self.text += chunk
+        return self._scan(final=False)
+
+    def close(self) -> List[str]:
+        """Mark the end of the stream and return any remaining TMC"""
+        return self._scan(final=True)
+
+    def _scan(self, final: bool) -> List[str]:
+        new_tmcs = []
+        while True:
+            if not self._armed:
+                delimiter = STREAM_DELIMITER_REGEX.search(self.text, self._cursor)
+                if delimiter is None:
+                    break
+                self._cursor = delimiter.end()
+                self._armed = True
+
+            match = self._tmc_regex.search(self.text, self._cursor)
+            if match is None:
+                break
+            # A later delimiter without a TMC in between re-arms the parser there
+            delimiter = STREAM_DELIMITER_REGEX.search(self.text, self._cursor, match.start())
+            if delimiter is not None:
+                self._cursor = delimiter.end()
+                continue
+            # The last ligand index may still be growing
+            if match.end() == len(self.text) and not final:
+                break
+
+            self._cursor = match.end()
+            self._armed = False
+            tmc = match.group()
+            new_tmcs.append(tmc if self.aliases is None else self.aliases.expand(tmc))
+
+        self.emitted.extend(new_tmcs)
+        return new_tmcs
+
+
+class ExtractionResult:
+    """TMCs extracted from one LLM message together with the rejected candidates"""
+
+    def __init__(self, tmcs: List[str], rejected: List[Tuple[str, str]], method: str):
+        self.tmcs = tmcs
+        self.rejected = rejected
+        self.method = method
+
+
+class TMCExtractor:
+    """
+    Single-pass extractor validating LLM-proposed TMCs before they are looked up.
+
+    A message is read as a JSON structured-output answer, else as lines of the
+    strict `TMC: Pd_$L1_$L2_$L3_$L4` grammar, else with the delimiter-based
+    `retrive_tmc_from_message`. Every candidate is checked against the ligand
+    vocabulary and the total-charge rule, and rejected ones are reported with
+    the reason: "malformed", "unknown_ligand", "invalid_charge" or "duplicate".
+    Ligand aliases, if given, are expanded before parsing.
+    """
+
+    CANDIDATE_REGEX = re.compile(r"Pd(?:_[A-Za-z0-9][A-Za-z0-9-]*)+")
+    GRAMMAR_REGEX = re.compile(
+        r"^[ \t]*TMC:[ \t]*(Pd(?:_[A-Za-z0-9][A-Za-z0-9-]*)+)[ \t.]*$", re.MULTILINE
+    )
+    JSON_FENCE_REGEX = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+    def __init__(
+        self,
+        lig_charge: Dict[str, int],
+        metal_charge: int = 2,
+        charge_range: Tuple[int, int] = (-1, 1),
+        aliases: Optional[LigandAliases] = None,
+    ):
+        self.lig_charge = lig_charge
+        self.aliases = aliases
+        self.metal_charge = metal_charge
+        self.charge_range = charge_range
+
+    def validate(self, candidate: str) -> Optional[str]:
+        """Return the reason a candidate TMC is invalid, or None if it is valid"""
+        if not self.CANDIDATE_REGEX.fullmatch(candidate):
+            return "malformed"
+        ligs = candidate.split("_")[1:]
+        if len(ligs) != 4:
+            return "malformed"
+        if any(lig not in self.lig_charge for lig in ligs):
+            return "unknown_ligand"
+        charge = self.metal_charge + sum(self.lig_charge[lig] for lig in ligs)
+        if not self.charge_range[0] <= charge <= self.charge_range[1]:
+            return "invalid_charge"
+        return None
+
+    def _json_candidates(self, message: str) -> Optional[List[str]]:
+        text = self.JSON_FENCE_REGEX.sub("", message.strip())
+        if not text.startswith("{"):
+            return None
+        try:
+            items = json.loads(text).get("tmcs", [])
+        except (ValueError, AttributeError):
+            return None
+        return [
+            str(item.get("tmc", "")).strip().strip("[]") if isinstance(item, dict) else str(item)
+            for item in items
+        ]
+
+    def extract(self, message: str, expected_returns: Optional[int] = None) -> ExtractionResult:
+        """
+        Extract and validate TMCs from an LLM message.
+
+        Args:
+            message: Response message from LLM
+            expected_returns: Maximum number of valid TMCs to return
+
+        Returns:
+            ExtractionResult with valid TMCs, rejected (candidate, reason) pairs and the parse method
+        """
+        if self.aliases is not None:
+            message = self.aliases.expand(message)
+        candidates = self._json_candidates(message)
+        method = "json"
+        if candidates is None:
+            candidates = self.GRAMMAR_REGEX.findall(message)
+            method = "grammar"
+        if not candidates:
+            candidates = retrive_tmc_from_message(message, expected_returns or 1)
+            method = "delimiter"
+
+        tmcs, rejected, seen = [], [], set()
+        for candidate in candidates:
+            reason = self.validate(candidate)
+            if reason is None and candidate in seen:
+                reason = "duplicate"
+            if reason is not None:
+                rejected.append((candidate, reason))
+                continue
+            seen.add(candidate)
+            tmcs.append(candidate)
+
+        if expected_returns is not None:
+            tmcs = tmcs[:expected_returns]
+        return ExtractionResult(tmcs, rejected, method if candidates else "none")
+
+
+class ParseStats:
+    """Running parse success statistics of LLM messages"""
+
+    def __init__(self):
+        self.messages = 0
+        self.parsed = 0
+        self.accepted = 0
+        self.rejected: Dict[str, int] = {}
+        self.methods: Dict[str, int] = {}
+
+    def record(self, result: ExtractionResult) -> None:
+        """Add the outcome of parsing one message"""
+        self.messages += 1
+        self.parsed += bool(result.tmcs)
+        self.accepted += len(result.tmcs)
+        self.methods[result.method] = self.methods.get(result.method, 0) + 1
+        for _, reason in result.rejected:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def success_rate(self) -> float:
+        """Fraction of messages yielding at least one valid TMC"""
+        return self.parsed / self.messages if self.messages else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "messages": self.messages,
+            "parsed": self.parsed,
+            "success_rate": self.success_rate(),
+            "accepted_tmcs": self.accepted,
+            "rejected_tmcs": dict(self.rejected),
+            "methods": dict(self.methods),
+        }
+
+
+class RepairResult:
+    """Outcome of the follow-up turns asking the LLM to replace unusable TMCs"""
+
+    def __init__(self, first_shot_valid: int, expected: int):
+        self.first_shot_valid = first_shot_valid
+        self.expected = expected
+        self.tmcs: List[str] = []
+        self.responses: List = []
+        self.reasons: Dict[str, int] = {}
+
+    @property
+    def rounds(self) -> int:
+        return len(self.responses)
+
+
+class RepairStats:
+    """Running statistics of repair turns, kept apart from the first-shot ParseStats"""
+
+    def __init__(self):
+        self.iterations = 0
+        self.first_shot_complete = 0
+        self.repaired_iterations = 0
+        self.rescued_iterations = 0
+        self.rounds = 0
+        self.recovered_tmcs = 0
+        self.reasons: Dict[str, int] = {}
+
+    def record(self, result: RepairResult) -> None:
+        """Add the repair outcome of one iteration"""
+        self.iterations += 1
+        self.first_shot_complete += result.first_shot_valid >= result.expected
+        if result.rounds:
+            self.repaired_iterations += 1
+            # Iterations that would have produced no offspring at all without repair
+            self.rescued_iterations += result.first_shot_valid == 0 and bool(result.tmcs)
+        self.rounds += result.rounds
+        self.recovered_tmcs += len(result.tmcs)
+        for reason, n in result.reasons.items():
+            self.reasons[reason] = self.reasons.get(reason, 0) + n
+
+    def to_dict(self) -> Dict:
+        return {
+            "iterations": self.iterations,
+            "first_shot_complete": self.first_shot_complete,
+            "repaired_iterations": self.repaired_iterations,
+            "rescued_iterations": self.rescued_iterations,
+            "repair_rounds": self.rounds,
+            "recovered_tmcs": self.recovered_tmcs,
+            "recovered_per_round": self.recovered_tmcs / self.rounds if self.rounds else 0.0,
+            "reasons": dict(self.reasons),
+        }
+
+
 def hash_string_to_number(input_string, output_length=10):  
     """  
     Generate a numeric hash from a string.  
@@ -178,17 +545,94 @@ def hash_string_to_number(input_string, output_length=10):
     return str(hash_int)[:output_length]  
 
 
+# Column name lists of ligand space DataFrames
+LIG_LIST = ['lig1', 'lig2', 'lig3', 'lig4']
+LIG_SMILE_LIST = ['lig1_smiles', 'lig2_smiles', 'lig3_smiles', 'lig4_smiles']
+LIG_CONNECTING_ATOM_LIST = ['lig1_element', 'lig2_element', 'lig3_element', 'lig4_element']
+LIG_CONNECTING_ATOM_INDEX = ['lig1_index', 'lig2_index', 'lig3_index', 'lig4_index']
+# Wall time of the xTB optimization of a row, the history of the runtime predictor
+TIMING_COLUMN = "xtb_seconds"
+# Optimization tiers a row went through, see fidelity.py
+TIERS_COLUMN = "tiers"
+# Optimization cycles of the tight xTB run, and those saved by a warm start, see warmstart.py
+CYCLES_COLUMN = "xtb_cycles"
+CYCLES_SAVED_COLUMN = "cycles_saved"
+RESULT_COLUMNS = [
+    "_error", "fileName", "homo_lumo_gap", "polarisability",
+    TIMING_COLUMN, TIERS_COLUMN, CYCLES_COLUMN, CYCLES_SAVED_COLUMN,
+]
+
+
+def prepare_ligand_space(df, root_path, unbounded=False):
+    """
+    Add the result columns to df and create the output directories.
+
+    Args:
+        df: DataFrame of TMCs to evaluate, modified in place
+        root_path: Base directory for file generation and calculations
+        unbounded: Whether the lig{n} columns hold SMILES instead of ligand IDs
+    """
+    # Initialize DataFrame columns; object dtype as they receive strings and floats
+    for column in RESULT_COLUMNS:
+        df[column] = pd.Series("", index=df.index, dtype=object)
+
+    if unbounded:
+        for i in range(4):
+            df[LIG_SMILE_LIST[i]] = df[LIG_LIST[i]]
+
+    # Create necessary directories
+    os.makedirs(f"{root_path}/molSimplify_xyz/", exist_ok=True)
+    os.makedirs(f"{root_path}/xtb_xyz/", exist_ok=True)
+
+
+def align_csv_header(file_name, columns):
+    """
+    Header that rows with `columns` are appended under.
+
+    A file written by an older version may lack columns added since. It is
+    rewritten once with those columns appended to its header (empty in the
+    old rows), so every appended row has as many fields as the header.
+
+    Args:
+        file_name: Path to the CSV file
+        columns: Columns of the rows about to be appended
+
+    Returns:
+        list: Header of the file, or None if the file is new or empty
+    """
+    if not os.path.exists(file_name) or os.path.getsize(file_name) == 0:
+        return None
+    with open(file_name, newline="") as fo:
+        header = next(csv.reader(fo), [])
+    missing = [column for column in columns if column not in header]
+    if not missing:
+        return header
+    stored = pd.read_csv(file_name, dtype=str, keep_default_na=False)
+    header = header + missing
+    tmp = f"{file_name}.{uuid4().hex}.tmp"
+    stored.reindex(columns=header, fill_value="").to_csv(tmp, index=False)
+    os.replace(tmp, file_name)
+    return header
+
+
 def save_row_to_csv(row, idx, file_name):  
     """  
     Save a single row to a CSV file.  
     
+    The header is written only if the file is new or empty, so resumed runs  
+    keep appending to a single table. Rows are written in the column order  
+    of the existing header, see align_csv_header.  
+    
     Args:  
         row: DataFrame row to save  
         idx: Index of the row  
         file_name: Path to the CSV file  
     """  
-    store_header = (idx == 0)  
-    row.to_frame().T.to_csv(file_name, mode='a', header=store_header, index=False) 
+    frame = row.to_frame().T
+    header = align_csv_header(file_name, list(frame.columns))
+    if header is not None:
+        frame = frame.reindex(columns=header)
+    frame.to_csv(file_name, mode='a', header=header is None, index=False) 
 
 
 # Text extraction helper functions
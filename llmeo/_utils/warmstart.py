@@ -0,0 +1,352 @@
+import hashlib
+import json
+import os
+from uuid import uuid4
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .geometry import read_xyz, write_xyz
+from .ligands import ligand_descriptors
+from .utils import CYCLES_COLUMN, CYCLES_SAVED_COLUMN
+
+
+def count_optimization_cycles(run_dir: str) -> Optional[int]:
+    """
+    Number of geometry optimization cycles of an xTB run.
+
+    xTB writes one frame per cycle to xtbopt.log in its run directory.
+
+    Returns:
+        int: Frames in xtbopt.log, or None if there is no readable log
+    """
+    try:
+        with open(os.path.join(run_dir, "xtbopt.log")) as fo:
+            lines = fo.read().splitlines()
+    except OSError:
+        return None
+    cycles, position = 0, 0
+    while position < len(lines) and lines[position].strip():
+        try:
+            count = int(lines[position])
+        except ValueError:
+            break
+        cycles += 1
+        position += count + 2
+    return cycles
+
+
+def kabsch(mobile: np.ndarray, target: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rigid motion superimposing mobile onto target with the least RMSD.
+
+    Returns:
+        tuple: (rotation, translation) with mobile @ rotation + translation ~ target
+    """
+    mobile_center = mobile.mean(axis=0)
+    target_center = target.mean(axis=0)
+    u, _, vt = np.linalg.svd((mobile - mobile_center).T @ (target - target_center))
+    # Proper rotation only, mirror images are different molecules
+    sign = np.sign(np.linalg.det(u @ vt)) or 1.0
+    rotation = u @ np.diag([1.0, 1.0, sign]) @ vt
+    return rotation, target_center - mobile_center @ rotation
+
+
+def ligand_blocks(ligands: Sequence[Tuple]) -> Optional[List[slice]]:
+    """
+    Atom ranges of the four ligands in a molSimplify structure.
+
+    molSimplify writes the metal first and then every ligand with its
+    hydrogens, in the order the ligands were given.
+
+    Args:
+        ligands: Four (SMILES, connecting atom index) pairs in clockwise order
+
+    Returns:
+        List of four slices, or None if a SMILES could not be parsed
+    """
+    blocks, start = [], 1
+    for smiles, _ in ligands:
+        atoms = ligand_descriptors(str(smiles))[0]
+        if atoms == 0:
+            return None
+        blocks.append(slice(start, start + atoms))
+        start += atoms
+    return blocks
+
+
+def splice_geometry(
+    elements: Sequence[str],
+    coords: np.ndarray,
+    ligands: Sequence[Tuple],
+    neighbour_elements: Sequence[str],
+    neighbour_coords: np.ndarray,
+    neighbour_ligands: Sequence[Tuple],
+    rotation: int,
+    min_distance: float = 0.8,
+) -> Optional[np.ndarray]:
+    """
+    Starting geometry of a TMC from the optimized geometry of a neighbour.
+
+    The neighbour is superimposed onto the fresh molSimplify build of the
+    TMC using the metal and the ligands both share. The metal and the shared
+    ligands then take the optimized coordinates; a differing ligand keeps
+    its molSimplify coordinates, moved along with the metal.
+
+    Args:
+        elements, coords: Fresh molSimplify structure of the TMC
+        ligands: Its four (SMILES, connecting atom index) pairs
+        neighbour_elements, neighbour_coords: Optimized structure of the neighbour
+        neighbour_ligands: The neighbour's four ligand pairs
+        rotation: Ligand j of the neighbour sits at position (j + rotation) % 4 of the TMC
+        min_distance: Closest allowed contact of a differing ligand, in Angstrom
+
+    Returns:
+        np.ndarray: Spliced coordinates, or None if the structures do not
+        correspond atom by atom or the differing ligand clashes
+    """
+    blocks = ligand_blocks(ligands)
+    neighbour_blocks = ligand_blocks(neighbour_ligands)
+    if blocks is None or neighbour_blocks is None:
+        return None
+    if len(elements) != blocks[-1].stop or len(neighbour_elements) != neighbour_blocks[-1].stop:
+        return None
+    if elements[0] != neighbour_elements[0]:
+        return None
+
+    shared = []
+    for j in range(4):
+        position = (j + rotation) % 4
+        if [str(value) for value in neighbour_ligands[j]] != [str(value) for value in ligands[position]]:
+            continue
+        if list(neighbour_elements[neighbour_blocks[j]]) != list(elements[blocks[position]]):
+            return None
+        shared.append((neighbour_blocks[j], blocks[position]))
+    if len(shared) < 3:
+        return None
+
+    mobile = np.concatenate([[0]] + [np.arange(n.start, n.stop) for n, _ in shared])
+    fixed = np.concatenate([[0]] + [np.arange(b.start, b.stop) for _, b in shared])
+    turn, shift = kabsch(neighbour_coords[mobile], coords[fixed])
+    aligned = neighbour_coords @ turn + shift
+
+    spliced = coords + (aligned[0] - coords[0])
+    spliced[fixed] = aligned[mobile]
+    moved = np.setdiff1d(np.arange(len(elements)), fixed)
+    if len(moved):
+        distances = np.linalg.norm(spliced[moved][:, None, :] - spliced[fixed][None, :, :], axis=-1)
+        if distances.min() < min_distance:
+            return None
+    return spliced
+
+
+class GeometryStore:
+    """
+    Optimized TMC geometries for warm-starting the optimization of neighbours.
+
+    Neighbouring TMCs share three of their four ligands, and their optimized
+    geometries differ mostly around the fourth. A geometry is stored under a
+    hash of its ligands in clockwise order, and indexed under the four
+    patterns with one ligand left out, so the neighbours of a TMC, in any
+    rotation, are found by listing a few directories. The ligands of a
+    geometry are also kept in a small JSON file next to it, so neighbours
+    are ranked without reading their coordinates. Files are renamed into
+    place, so workers on several nodes can share one store.
+
+    Every geometry records the cycles a cold start of it took, measured or
+    inherited from the neighbour it was warm-started from; the difference
+    to the cycles of a warm start is the saving.
+    """
+
+    def __init__(self, directory: str, min_distance: float = 0.8):
+        self.directory = directory
+        self.min_distance = min_distance
+        self.warm = 0
+        self.cold = 0
+        self.rejected = 0
+        os.makedirs(os.path.join(directory, "geometries"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "neighbours"), exist_ok=True)
+
+    @staticmethod
+    def _digest(content) -> str:
+        return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+    @staticmethod
+    def _normalize(ligands: Sequence[Tuple]) -> List[List[str]]:
+        return [[str(smiles), str(index)] for smiles, index in ligands]
+
+    def key(self, ligands: Sequence[Tuple]) -> str:
+        """Key of the geometry of four (SMILES, connecting atom index) pairs in clockwise order"""
+        return self._digest(self._normalize(ligands))
+
+    def _pattern_dirs(self, ligands: List[List[str]]) -> List[str]:
+        return [
+            os.path.join(self.directory, "neighbours", self._digest(ligands[:p] + [None] + ligands[p + 1:]))
+            for p in range(4)
+        ]
+
+    def _geometry_path(self, key: str) -> str:
+        return os.path.join(self.directory, "geometries", f"{key}.xyz")
+
+    def _metadata_path(self, key: str) -> str:
+        return os.path.join(self.directory, "geometries", f"{key}.json")
+
+    def put(self, ligands: Sequence[Tuple], xyz_path: str, cold_cycles: Optional[int] = None) -> bool:
+        """
+        Store an optimized geometry.
+
+        Args:
+            ligands: Four (SMILES, connecting atom index) pairs in clockwise order
+            xyz_path: Optimized structure, e.g. xtbopt.xyz of the xTB run
+            cold_cycles: Optimization cycles of a cold start of this TMC
+
+        Returns:
+            bool: Whether the geometry was stored
+        """
+        try:
+            elements, coords, _ = read_xyz(str(xyz_path))
+        except (OSError, ValueError, IndexError):
+            return False
+        ligands = self._normalize(ligands)
+        key = self._digest(ligands)
+        comment = json.dumps({"ligands": ligands, "cold_cycles": cold_cycles})
+        tmp = f"{self._metadata_path(key)}.{uuid4().hex}.tmp"
+        with open(tmp, "w") as fo:
+            fo.write(comment)
+        os.replace(tmp, self._metadata_path(key))
+        write_xyz(self._geometry_path(key), elements, coords, comment)
+        for directory in self._pattern_dirs(ligands):
+            os.makedirs(directory, exist_ok=True)
+            open(os.path.join(directory, key), "a").close()
+        return True
+
+    def neighbours(self, ligands: Sequence[Tuple]) -> List[Tuple[str, int]]:
+        """
+        Stored TMCs sharing at least three ligands with a TMC.
+
+        Returns:
+            List of (key, rotation) pairs, ligand j of the neighbour sitting at
+            position (j + rotation) % 4 of the TMC
+        """
+        ligands = self._normalize(ligands)
+        found: Dict[str, int] = {}
+        for rotation in range(4):
+            rotated = ligands[rotation:] + ligands[:rotation]
+            for directory in self._pattern_dirs(rotated):
+                if os.path.isdir(directory):
+                    for key in sorted(os.listdir(directory)):
+                        found.setdefault(key, rotation)
+        return sorted(found.items())
+
+    def load(self, key: str) -> Optional[Tuple[List[str], np.ndarray, Dict]]:
+        """Elements, coordinates and metadata of a stored geometry"""
+        try:
+            elements, coords, comment = read_xyz(self._geometry_path(key))
+            return elements, coords, json.loads(comment)
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def metadata(self, key: str) -> Optional[Dict]:
+        """
+        Ligands and cold start cycles of a stored geometry, without its coordinates.
+
+        Geometries stored before the metadata files existed are read up to
+        the comment line of their XYZ file.
+        """
+        try:
+            with open(self._metadata_path(key)) as fo:
+                return json.load(fo)
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(self._geometry_path(key)) as fo:
+                fo.readline()
+                return json.loads(fo.readline())
+        except (OSError, ValueError):
+            return None
+
+    def warm_start(self, ligands: Sequence[Tuple], xyz_path: str, output_path: str) -> Optional[Dict]:
+        """
+        Write a warm-start geometry of a TMC built from its nearest neighbour.
+
+        Neighbours are ranked by how close their differing ligand is in size
+        to the TMC's, from their metadata; only the geometries of the
+        neighbours tried are read.
+
+        Args:
+            ligands: Four (SMILES, connecting atom index) pairs in clockwise order
+            xyz_path: Fresh molSimplify structure of the TMC
+            output_path: Where to write the starting geometry
+
+        Returns:
+            dict: "neighbour" key and its "cold_cycles", or None for a cold start
+        """
+        elements, coords, _ = read_xyz(str(xyz_path))
+        ligands = self._normalize(ligands)
+        own = self._digest(ligands)
+
+        def size_difference(candidate):
+            key, rotation = candidate
+            meta = self.metadata(key)
+            if meta is None:
+                return None
+            stored_ligands = meta["ligands"]
+            difference = sum(
+                abs(ligand_descriptors(stored_ligands[j][0])[0] - ligand_descriptors(ligands[(j + rotation) % 4][0])[0])
+                for j in range(4)
+            )
+            return difference, key != own, key, rotation
+
+        candidates = sorted(filter(None, (size_difference(candidate) for candidate in self.neighbours(ligands))))
+        for _, _, key, rotation in candidates:
+            stored = self.load(key)
+            if stored is None:
+                continue
+            neighbour_elements, neighbour_coords, meta = stored
+            spliced = splice_geometry(
+                elements, coords, ligands, neighbour_elements, neighbour_coords, meta["ligands"], rotation,
+                self.min_distance,
+            )
+            if spliced is None:
+                self.rejected += 1
+                continue
+            write_xyz(str(output_path), elements, spliced, f"warm start from {key}")
+            self.warm += 1
+            return {"neighbour": key, "cold_cycles": meta.get("cold_cycles")}
+        self.cold += 1
+        return None
+
+    @property
+    def stats(self) -> Dict:
+        return {"warm": self.warm, "cold": self.cold, "rejected_neighbours": self.rejected}
+
+
+def summarize_warm_starts(df: pd.DataFrame) -> Dict:
+    """
+    Optimization cycles of cold and warm starts.
+
+    Args:
+        df: Rows with the xtb_cycles and cycles_saved columns
+
+    Returns:
+        dict: Number of cold and warm starts, their mean cycles, and the
+        total and mean cycles saved by warm starts
+    """
+    cycles = pd.to_numeric(df.get(CYCLES_COLUMN, pd.Series(dtype=float)), errors="coerce")
+    saved = pd.to_numeric(df.get(CYCLES_SAVED_COLUMN, pd.Series(dtype=float)), errors="coerce")
+    warm = saved.notna() & cycles.notna()
+    cold = saved.isna() & cycles.notna()
+
+    def mean(values: Iterable) -> Optional[float]:
+        values = list(values)
+        return float(np.mean(values)) if values else None
+
+    return {
+        "cold": int(cold.sum()),
+        "warm": int(warm.sum()),
+        "mean_cold_cycles": mean(cycles[cold]),
+        "mean_warm_cycles": mean(cycles[warm]),
+        "cycles_saved": float(saved[warm].sum()),
+        "mean_cycles_saved": mean(saved[warm]),
+    }
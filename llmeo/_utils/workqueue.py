@@ -0,0 +1,335 @@
+import csv
+import json
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+import pandas as pd
+
+from .resume import RetryPolicy, row_outcome
+
+# Column holding the row of the enumerated space a queued row belongs to
+ROW_COLUMN = "_row"
+
+
+def default_worker_id() -> str:
+    """Worker name unique across the nodes sharing a queue"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:6]}"
+
+
+class WorkQueue:
+    """
+    Broker-less work queue of ligand space batches on a shared filesystem.
+
+    Layout of the queue directory:
+
+        tasks/batch-000000.csv   rows of one batch, with their space row in `_row`
+        leases/batch-000000.lease  claim of a batch: {"worker", "expires"}
+        done/batch-000000.done   marker of a finished batch
+        shards/<worker>.csv      rows evaluated by one worker
+
+    A batch is claimed by creating its lease with O_EXCL, which is atomic on
+    NFSv3 and later. The holder rewrites the lease before it expires; a lease
+    past its expiry belongs to a crashed worker and is reclaimed by renaming
+    it away. Two workers may read the same expired lease; the later rename
+    then moves the fresh lease of the earlier one, which is noticed by
+    comparing the renamed file with the expired lease and undone with a
+    link that never replaces a newer lease. Every worker appends only to
+    its own shard, so no file is written by two nodes. Delivery is
+    at-least-once: a worker stalled past its lease may finish a batch that
+    was reclaimed, and `merge` keeps one row per space row.
+    Expiry uses the clocks of the workers, so leases should be long compared
+    to the clock skew between nodes.
+    """
+
+    def __init__(self, directory: str, lease_seconds: float = 600.0):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.tasks = os.path.join(directory, "tasks")
+        self.leases = os.path.join(directory, "leases")
+        self.done = os.path.join(directory, "done")
+        self.shards = os.path.join(directory, "shards")
+        # Outcome of the last merge: malformed lines per shard and the batches reopened
+        self.skipped_lines: Dict[str, int] = {}
+        self.reopened: List[str] = []
+
+    def create(self, df: pd.DataFrame, batch_size: int = 50, order: Optional[Iterable] = None) -> int:
+        """
+        Split a ligand space into batches.
+
+        Args:
+            df: Enumerated ligand space
+            batch_size: Rows per batch
+            order: Row indices in dispatch order, e.g. from a Scheduler; defaults to the frame order
+
+        Returns:
+            int: Number of batches, 0 if the queue already existed
+        """
+        for directory in (self.tasks, self.leases, self.done, self.shards):
+            os.makedirs(directory, exist_ok=True)
+        if self.batches():
+            return 0
+        rows = df.loc[list(df.index if order is None else order)]
+        rows = rows.assign(**{ROW_COLUMN: rows.index})
+        count = 0
+        for count, start in enumerate(range(0, len(rows), batch_size), start=1):
+            path = os.path.join(self.tasks, f"batch-{count - 1:06d}.csv")
+            rows.iloc[start:start + batch_size].to_csv(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+        with open(os.path.join(self.directory, "queue.json"), "w") as fo:
+            json.dump({"rows": len(rows), "batches": count, "batch_size": batch_size}, fo)
+        return count
+
+    def batches(self) -> List[str]:
+        """Names of all batches"""
+        if not os.path.isdir(self.tasks):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.tasks) if name.endswith(".csv"))
+
+    def _lease_path(self, batch: str) -> str:
+        return os.path.join(self.leases, f"{batch}.lease")
+
+    def _done_path(self, batch: str) -> str:
+        return os.path.join(self.done, f"{batch}.done")
+
+    def read_lease(self, batch: str) -> Optional[Dict]:
+        """Current lease of a batch, None if it is unclaimed"""
+        return self._read_lease_file(self._lease_path(batch))
+
+    def _read_lease_file(self, path: str) -> Optional[Dict]:
+        try:
+            with open(path) as fo:
+                return json.load(fo)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Being written right now; treat as held for a full lease
+            return {"worker": None, "expires": time.time() + self.lease_seconds}
+
+    def _write_lease(self, path: str, worker: str) -> None:
+        with open(path, "w") as fo:
+            json.dump({"worker": worker, "expires": time.time() + self.lease_seconds}, fo)
+
+    def claim(self, worker: str) -> Optional[str]:
+        """
+        Claim the first batch that is neither done nor leased.
+
+        Expired leases are reclaimed on the way.
+
+        Returns:
+            str: The claimed batch, or None if no batch is available
+        """
+        for batch in self.batches():
+            if os.path.exists(self._done_path(batch)):
+                continue
+            lease = self.read_lease(batch)
+            if lease is not None:
+                if lease["expires"] > time.time():
+                    continue
+                stale = f"{self._lease_path(batch)}.stale-{worker}"
+                try:
+                    os.rename(self._lease_path(batch), stale)
+                except FileNotFoundError:
+                    continue
+                if self._read_lease_file(stale) != lease:
+                    # Another worker reclaimed the batch since the lease was read; give its
+                    # fresh lease back, unless a third worker has claimed the batch meanwhile
+                    try:
+                        os.link(stale, self._lease_path(batch))
+                    except FileExistsError:
+                        pass
+                    os.remove(stale)
+                    continue
+                os.remove(stale)
+            try:
+                fd = os.open(self._lease_path(batch), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            os.close(fd)
+            self._write_lease(self._lease_path(batch), worker)
+            return batch
+        return None
+
+    def renew(self, batch: str, worker: str) -> bool:
+        """Extend a lease held by worker; False if it was lost to another worker"""
+        lease = self.read_lease(batch)
+        if lease is None or lease["worker"] != worker:
+            return False
+        tmp = f"{self._lease_path(batch)}.{worker}.tmp"
+        self._write_lease(tmp, worker)
+        os.replace(tmp, self._lease_path(batch))
+        return True
+
+    def complete(self, batch: str, worker: str) -> None:
+        """Mark a batch done and drop its lease"""
+        with open(self._done_path(batch), "w") as fo:
+            fo.write(worker)
+        lease = self.read_lease(batch)
+        if lease is not None and lease["worker"] == worker:
+            try:
+                os.remove(self._lease_path(batch))
+            except FileNotFoundError:
+                pass
+
+    def load(self, batch: str) -> pd.DataFrame:
+        """Rows of a batch, indexed by their space row"""
+        df = pd.read_csv(os.path.join(self.tasks, f"{batch}.csv"))
+        return df.set_index(ROW_COLUMN, drop=False).rename_axis(None)
+
+    def shard_path(self, worker: str) -> str:
+        return os.path.join(self.shards, f"{worker}.csv")
+
+    def status(self) -> Dict:
+        """Number of done, leased, expired and pending batches"""
+        status = {"batches": 0, "done": 0, "leased": 0, "expired": 0, "pending": 0}
+        now = time.time()
+        for batch in self.batches():
+            status["batches"] += 1
+            lease = self.read_lease(batch)
+            if os.path.exists(self._done_path(batch)):
+                status["done"] += 1
+            elif lease is None:
+                status["pending"] += 1
+            elif lease["expires"] > now:
+                status["leased"] += 1
+            else:
+                status["expired"] += 1
+        return status
+
+    def merge(self, output_path: Optional[str] = None, policy: Optional[RetryPolicy] = None,
+              logger=None) -> pd.DataFrame:
+        """
+        Combine the shards into one table of the evaluated space.
+
+        Rows evaluated more than once (reclaimed batches) are reduced to one
+        per space row; a final outcome wins over a retryable failure, a later
+        row over an earlier one. Malformed shard lines are skipped and counted
+        in `skipped_lines`. A done batch with rows missing from the shards,
+        e.g. behind a malformed line, loses its done marker, so the next
+        workers evaluate it again; it is listed in `reopened`.
+
+        Args:
+            output_path: CSV file to write the merged rows to
+            policy: Retry policy telling final from retryable outcomes
+            logger: Optional logger for skipped lines and reopened batches
+
+        Returns:
+            pd.DataFrame: Merged rows in space order
+        """
+        policy = policy or RetryPolicy()
+        frames = []
+        self.skipped_lines = {}
+        if os.path.isdir(self.shards):
+            for name in sorted(os.listdir(self.shards)):
+                path = os.path.join(self.shards, name)
+                if name.endswith(".csv") and os.path.getsize(path):
+                    frame, skipped = self._read_shard(path)
+                    frames.append(frame)
+                    if skipped:
+                        self.skipped_lines[name] = skipped
+                        if logger is not None:
+                            logger.warning(f"Skipped {skipped} malformed lines of shard {name}")
+        if not frames:
+            merged = pd.DataFrame()
+        else:
+            rows = pd.concat(frames, ignore_index=True)
+            rows["_final"] = [policy.is_final(row_outcome(row)) for row in rows.to_dict("records")]
+            rows[ROW_COLUMN] = pd.to_numeric(rows[ROW_COLUMN])
+            merged = (
+                rows.sort_values("_final", kind="stable")
+                .drop_duplicates(ROW_COLUMN, keep="last")
+                .sort_values(ROW_COLUMN)
+                .drop(columns="_final")
+                .reset_index(drop=True)
+            )
+        self.reopened = self._reopen_missing(set(merged[ROW_COLUMN]) if len(merged) else set())
+        if self.reopened and logger is not None:
+            logger.warning(f"Reopened batches with rows missing from the shards: {self.reopened}")
+        if output_path is not None:
+            merged.to_csv(output_path, index=False)
+        return merged
+
+    @staticmethod
+    def _read_shard(path: str) -> Tuple[pd.DataFrame, int]:
+        """Well-formed rows of a shard and the number of lines with too many or too few fields"""
+        with open(path, newline="") as fo:
+            header = next(csv.reader(fo))
+        # Explicit names, so a long first row is not taken for an index column
+        bad = []
+        frame = pd.read_csv(
+            path, header=0, names=header, on_bad_lines=bad.append, engine="python",
+            keep_default_na=False, dtype=str,
+        )
+        # Only missing fields are NaN without the default NA values
+        short = frame.isna().any(axis=1)
+        return frame[~short], len(bad) + int(short.sum())
+
+    def _reopen_missing(self, merged_rows) -> List[str]:
+        """Remove the done marker of every done batch with a row not in merged_rows"""
+        reopened = []
+        for batch in self.batches():
+            if not os.path.exists(self._done_path(batch)):
+                continue
+            rows = pd.read_csv(os.path.join(self.tasks, f"{batch}.csv"), usecols=[ROW_COLUMN])[ROW_COLUMN]
+            if not set(rows) <= merged_rows:
+                try:
+                    os.remove(self._done_path(batch))
+                except FileNotFoundError:
+                    pass
+                reopened.append(batch)
+        return reopened
+
+
+def run_worker(
+    queue: WorkQueue,
+    calculate: Callable[[pd.DataFrame, str], pd.DataFrame],
+    worker: Optional[str] = None,
+    max_batches: Optional[int] = None,
+    logger=None,
+) -> int:
+    """
+    Evaluate batches of a work queue until none is left.
+
+    Args:
+        queue: The shared work queue
+        calculate: Called with (batch rows, shard path); evaluates the rows and
+            appends them to the shard, e.g. `calculate_fitness_ligand_space`
+            with the root path and options bound
+        worker: Worker name, defaults to `default_worker_id()`
+        max_batches: Stop after this many batches
+        logger: Optional logger for progress messages
+
+    Returns:
+        int: Number of batches evaluated
+    """
+    worker = worker or default_worker_id()
+    shard = queue.shard_path(worker)
+    evaluated = 0
+    while max_batches is None or evaluated < max_batches:
+        batch = queue.claim(worker)
+        if batch is None:
+            break
+        if logger is not None:
+            logger.info(f"{worker} claimed {batch}")
+
+        # Renew the lease in the background while the batch is evaluated
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(queue.lease_seconds / 3):
+                if not queue.renew(batch, worker) and logger is not None:
+                    logger.warning(f"{worker} lost the lease of {batch}")
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            calculate(queue.load(batch), shard)
+        finally:
+            stop.set()
+            renewer.join()
+        queue.complete(batch, worker)
+        evaluated += 1
+    return evaluated
@@ -1,9 +1,19 @@
+import argparse
 import os
 from itertools import product
 from typing import Dict, List, Set, Tuple
 
 import pandas as pd
-from llmeo._utils.mol_calculation import calculate_fitness_ligand_space
+from llmeo._utils.cache import XtbCache
+from llmeo._utils.fidelity import TIER_PRESETS, parse_tiers
+from llmeo._utils.geometry import GeometryArchive
+from llmeo._utils.jobs import JobLimits
+from llmeo._utils.mol_calculation import DEFAULT_STAGES, calculate_fitness_ligand_space
+from llmeo._utils.parallel import calculate_fitness_ligand_space_parallel
+from llmeo._utils.resume import RetryPolicy
+from llmeo._utils.schedule import SCHEDULES, Scheduler
+from llmeo._utils.warmstart import GeometryStore
+from llmeo._utils.workqueue import WorkQueue, run_worker
 
 
 class TMCGenerator:
@@ -110,7 +120,7 @@ class TMCGenerator:
             
         return tmc_df
 
-def main():
+def main(opt):
     """  
     Main function to generate TMCs and calculate their properties.  
     
@@ -131,13 +141,27 @@ def main():
     
     Note:  
         Property calculations can take multiple days depending on the machine  
-        and number of combinations.  
+        and number of combinations; use --workers to spread them over the cores  
+        and --resume to continue an interrupted run. Across nodes sharing a  
+        filesystem, run once with --queue_role init, then --queue_role work on  
+        every node and finally --queue_role merge.  
     """  
     # Setup paths
     root_path = os.path.dirname(os.path.abspath(__file__))
     ligand_pool_path = os.path.join(root_path, "../data", "ligands10_maxBoth.csv")
     output_path = os.path.join(root_path, "../data", "ligand_pool_calculated_result.csv")
     space_path = os.path.join(root_path, "../data", "lig10_Space.csv")
+    queue = WorkQueue(opt.queue_dir, lease_seconds=opt.lease_seconds) if opt.queue_dir else None
+
+    if queue is not None and opt.queue_role == "status":
+        print(queue.status())
+        return
+    if queue is not None and opt.queue_role == "merge":
+        merged = queue.merge(output_path)
+        print(f"Merged {len(merged)} rows into {output_path}: {queue.status()}")
+        if queue.skipped_lines or queue.reopened:
+            print(f"Malformed shard lines: {queue.skipped_lines}, reopened batches: {queue.reopened}")
+        return
     
     # Generate TMCs
     generator = TMCGenerator(ligand_pool_path)
@@ -146,16 +170,232 @@ def main():
     
     print(f"Generated {len(tmc_with_properties)} valid TMC combinations")
     
-    # Calculate properties
-    result = calculate_fitness_ligand_space(
-        tmc_with_properties,
-        root_path,
-        space_path
-    )
+    # Calculate properties, longest predicted xTB jobs first by default
+    scheduler = Scheduler.from_history([space_path, *opt.timings], mode=opt.schedule)
+    print(f"Runtime predictor fitted to {scheduler.predictor.observations} timings")
+    stages = None
+    if opt.pipeline:
+        stages = {"build": opt.build_workers, "optimize": opt.xtb_workers, "validate": opt.validate_workers}
+    cache = XtbCache(opt.cache_dir) if opt.cache_dir else None
+    retry = RetryPolicy(max_attempts=opt.max_attempts)
+    tiers = parse_tiers(opt.tiers, opt.promote_min_gap)
+    geometries = GeometryStore(opt.warm_start_dir) if opt.warm_start_dir else None
+    archive = GeometryArchive(opt.geometry_archive) if opt.geometry_archive else None
+    limits = {
+        "molsimplify": JobLimits(timeout=opt.molsimplify_timeout, memory_mb=opt.memory_mb, nice=opt.nice),
+        "xtb": JobLimits(
+            timeout=opt.xtb_timeout, memory_mb=opt.memory_mb, nice=opt.nice, threads=opt.threads_per_worker
+        ),
+    }
+    if queue is not None and opt.queue_role == "init":
+        batches = queue.create(tmc_with_properties, opt.batch_size, order=scheduler.order(tmc_with_properties))
+        print(f"Queued {batches} batches in {opt.queue_dir}")
+        return
+    if queue is not None and opt.queue_role == "work":
+        def calculate(batch, shard):
+            if opt.workers > 1:
+                return calculate_fitness_ligand_space_parallel(
+                    batch, root_path, shard, workers=opt.workers, threads_per_worker=opt.threads_per_worker,
+                    cache=cache, limits=limits, cores=opt.cores, scheduler=scheduler,
+                    tiers=tiers, geometries=geometries, archive=archive, ligand_cache=opt.ligand_cache,
+                )
+            return calculate_fitness_ligand_space(
+                batch, root_path, shard, cache=cache, limits=limits, stages=stages, scheduler=scheduler,
+                tiers=tiers, geometries=geometries, archive=archive, ligand_cache=opt.ligand_cache,
+            )
+
+        print(f"Evaluated {run_worker(queue, calculate)} batches: {queue.status()}")
+        return
+
+    if opt.workers > 1:
+        result = calculate_fitness_ligand_space_parallel(
+            tmc_with_properties,
+            root_path,
+            space_path,
+            workers=opt.workers,
+            threads_per_worker=opt.threads_per_worker,
+            cache=cache,
+            resume=opt.resume,
+            retry=retry,
+            limits=limits,
+            cores=opt.cores,
+            scheduler=scheduler,
+            tiers=tiers,
+            geometries=geometries,
+            archive=archive,
+            ligand_cache=opt.ligand_cache,
+        )
+    else:
+        result = calculate_fitness_ligand_space(
+            tmc_with_properties,
+            root_path,
+            space_path,
+            cache=cache,
+            resume=opt.resume,
+            retry=retry,
+            limits=limits,
+            stages=stages,
+            scheduler=scheduler,
+            tiers=tiers,
+            geometries=geometries,
+            archive=archive,
+            ligand_cache=opt.ligand_cache,
+        )
     
     # Save results
     result.to_csv(output_path, index=False)
     print(f"Results saved to {output_path}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Enumerate a ligand space and calculate its TMC properties")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes running molSimplify and xTB; 1 runs the rows one after another"
+    )
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        default=1,
+        help="OMP_NUM_THREADS of every worker; workers * threads_per_worker should not exceed the cores"
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory of the xTB result cache shared across runs; rotations and repeats of a TMC are calculated once"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep the rows already in lig10_Space.csv and only calculate missing or retryable ones"
+    )
+    parser.add_argument(
+        "--max_attempts",
+        type=int,
+        default=3,
+        help="With --resume, attempts after which transient failures (xTB runner, worker crash) are given up"
+    )
+    parser.add_argument(
+        "--molsimplify_timeout",
+        type=float,
+        default=600,
+        help="Wall-clock limit in seconds of one molSimplify build"
+    )
+    parser.add_argument(
+        "--xtb_timeout",
+        type=float,
+        default=3600,
+        help="Wall-clock limit in seconds of one xTB optimization"
+    )
+    parser.add_argument(
+        "--memory_mb",
+        type=int,
+        default=None,
+        help="Address space limit in MiB of every molSimplify and xTB job"
+    )
+    parser.add_argument(
+        "--nice",
+        type=int,
+        default=0,
+        help="Niceness increment of the molSimplify and xTB jobs"
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Cores shared by the jobs of all workers, defaults to the cores of the node"
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Run molSimplify builds, xTB optimizations and validations as pipelined stages with their own pools"
+    )
+    parser.add_argument(
+        "--build_workers",
+        type=int,
+        default=DEFAULT_STAGES["build"],
+        help="With --pipeline, concurrent molSimplify builds"
+    )
+    parser.add_argument(
+        "--xtb_workers",
+        type=int,
+        default=DEFAULT_STAGES["optimize"],
+        help="With --pipeline, concurrent xTB optimizations"
+    )
+    parser.add_argument(
+        "--validate_workers",
+        type=int,
+        default=DEFAULT_STAGES["validate"],
+        help="With --pipeline, concurrent structure validations"
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=[schedule for schedule in SCHEDULES if schedule != "value"],
+        default="lpt",
+        help="Dispatch order: lpt runs the longest predicted xTB jobs first to minimize the makespan, none keeps the enumeration order"
+    )
+    parser.add_argument(
+        "--timings",
+        nargs="*",
+        default=[],
+        help="Storage files of earlier runs whose xtb_seconds train the runtime predictor, besides lig10_Space.csv"
+    )
+    parser.add_argument(
+        "--tiers",
+        type=str,
+        default="",
+        help=f"Comma-separated cheap xTB pre-optimizations run before the tight GFN2 one, of {list(TIER_PRESETS)}; "
+             "structures breaking in a tier are rejected early"
+    )
+    parser.add_argument(
+        "--promote_min_gap",
+        type=float,
+        default=None,
+        help="With --tiers, HOMO-LUMO gap the last tier must estimate for a TMC to get the tight optimization"
+    )
+    parser.add_argument(
+        "--warm_start_dir",
+        type=str,
+        default=None,
+        help="Store of optimized geometries; xTB starts from the nearest stored TMC sharing three ligands"
+    )
+    parser.add_argument(
+        "--geometry_archive",
+        type=str,
+        default=None,
+        help="Append-only archive of the molSimplify and xTB structures, replacing the per-molecule run directories, see migrate_geometries.py"
+    )
+    parser.add_argument(
+        "--ligand_cache",
+        type=str,
+        default=None,
+        help="JSON file of per-ligand connecting atom indices and descriptors, reused by later runs"
+    )
+    parser.add_argument(
+        "--queue_dir",
+        type=str,
+        default=None,
+        help="Work queue directory on a filesystem shared by the nodes evaluating the space"
+    )
+    parser.add_argument(
+        "--queue_role",
+        choices=["init", "work", "merge", "status"],
+        default="work",
+        help="init: split the space into batches, work: evaluate batches until none is left, "
+             "merge: combine the worker shards into the result file, status: count batches"
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=50,
+        help="Rows per queued batch"
+    )
+    parser.add_argument(
+        "--lease_seconds",
+        type=float,
+        default=1800,
+        help="Lease of a claimed batch; batches of workers silent for longer are reclaimed"
+    )
+    main(parser.parse_args())
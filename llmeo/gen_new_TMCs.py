@@ -7,8 +7,10 @@ import pandas as pd
 import logging
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from llmeo._utils.cache import XtbCache
 from llmeo._utils.llm import Claude3, GPTo1, LLMConfig
 from llmeo._utils.mol_calculation import calculate_fitness_ligand_space
+from llmeo._utils.schedule import Scheduler
 from llmeo._utils.utils import extract_english_letters, extract_integers, dataframe_to_str, get_ligand_info
 from prompts import PROMPT_Unbounded_Both, PROMPT_Unbounded_P
 
@@ -21,6 +23,8 @@ CONFIG_PATH = os.path.join(ROOT_PATH, "llm_config.yaml")
 LIGAND_FILE = os.path.join(DATA_PATH, "1M-space_50-ligands-full.csv")
 SAMPLE_TMC_FILE = os.path.join(DATA_PATH, "lig50_top100_S.csv")
 TMC_OUTPUT_FILE = os.path.join(ROOT_PATH, "Opt_TMC_maxBoth.csv")
+# xTB results shared with other runs, e.g. on a shared filesystem
+XTB_CACHE_DIR = os.environ.get("LLMEO_XTB_CACHE", os.path.join(ROOT_PATH, "xtb_cache"))
 
 
 def add_new_lig(new_sample, lig_df, new_lig_df):
@@ -224,7 +228,11 @@ def one_LLM_iteration_unbonded(model, current_round_samples, lig_df, prompt, LIG
     logging.info("Response: %s", response)
     anwser,  new_lig_df = retrive_tmc_from_text(response)
     logging.info(anwser)
-    new_sample = calculate_fitness_ligand_space(anwser, ROOT_PATH, TMC_OUTPUT_FILE, unbounded=True)
+    # Cheapest proposals first, so the first results come in as early as possible
+    new_sample = calculate_fitness_ligand_space(
+        anwser, ROOT_PATH, TMC_OUTPUT_FILE, unbounded=True, cache=XtbCache(XTB_CACHE_DIR),
+        scheduler=Scheduler.from_history([TMC_OUTPUT_FILE], mode="value"),
+    )
     lig_df = add_new_lig(new_sample, lig_df, new_lig_df)
     logging.info("Length of lig_df: %d", len(lig_df))
     return anwser, lig_df
@@ -0,0 +1,55 @@
+import argparse
+import logging
+
+from llmeo._utils.geometry import GeometryArchive, migrate_run_directories
+
+
+def main(opt):
+    """
+    Move the structures of molSimplify_xyz/ and xtb_xyz/ run directories into a geometry archive.
+
+    The migration can be interrupted and run again; archived structures are
+    skipped. Run directories are only deleted with --remove, and only once
+    their structure is archived.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+
+    archive = GeometryArchive(opt.archive_dir, shard=opt.shard)
+    counts = migrate_run_directories(archive, opt.root_path, opt.xtb_dir, remove=opt.remove, logger=logger)
+    logger.info(f"Migration finished: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate per-molecule structure directories into a geometry archive")
+    parser.add_argument(
+        "--root_path",
+        type=str,
+        required=True,
+        help="Directory holding molSimplify_xyz/, e.g. the llmeo package directory"
+    )
+    parser.add_argument(
+        "--archive_dir",
+        type=str,
+        required=True,
+        help="Geometry archive directory"
+    )
+    parser.add_argument(
+        "--xtb_dir",
+        type=str,
+        default=None,
+        help="Directory holding the xTB run directories, defaults to root_path/xtb_xyz"
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default="migrated",
+        help="Archive shard the migrated structures are appended to"
+    )
+    parser.add_argument(
+        "--remove",
+        action="store_true",
+        help="Delete every run directory once its structure is archived"
+    )
+    main(parser.parse_args())
@@ -7,6 +7,43 @@ OFF_SPRING_MAP = {
     200: "TWO_HUNDRED",
 }
 
+# JSON schema for structured-output proposals (tool input / response format)
+TMC_PROPOSAL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tmcs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "explanation": {"type": "string"},
+                    "tmc": {"type": "string"},
+                    "total_charge": {"type": "integer"},
+                },
+                "required": ["explanation", "tmc", "total_charge"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["tmcs"],
+    "additionalProperties": False,
+}
+
+# Strict line grammar appended to the prompt for models without structured output
+STRUCTURED_OUTPUT_SUFFIX = (
+    "\n"
+    + "After your proposals, repeat every proposed TMC on its own line in exactly the format below and nothing else on that line:\n"
+    + "TMC: Pd_$L1_$L2_$L3_$L4\n"
+)
+
+# Follow-up turn asking the LLM to replace unusable TMCs of its previous answer
+REPAIR_PROMPT = (
+    "Some of your proposals cannot be used:\n"
+    + "REPAIR_FEEDBACK"
+    + "\n"
+    + "Please propose NUM_MISSING more *NEW* TMCs that avoid these problems. Only use ids of the ligands in the csv file, keep the total charge at -1, 0 or 1, do not repeat TMCs that were listed or proposed before, and answer in exactly the same output format as before.\n"
+)
+
 PROMPT_G = (
     "I have a pool of 50 ligands in a csv file format below.\n"
     + "CSV_FILE_CONTENT"
@@ -367,3 +404,13 @@ PROMPT_Unbounded_Both =  "I have a pool of 50 ligands in a csv file format below
  "   - connecting atom index: 1\n"+ \
  "}\n"+ \
 "----\n"
+
+# Templates of the 50-ligand space selectable by name (e.g. as bandit arms)
+PROMPT_TEMPLATES = {
+    "PROMPT_G": PROMPT_G,
+    "PROMPT_P": PROMPT_P,
+    "PROMPT_PF": PROMPT_PF,
+    "PROMPT_MB": PROMPT_MB,
+    "PROMPT_MPSG": PROMPT_MPSG,
+    "PROMPT_NL_MB": PROMPT_NL_MB,
+}
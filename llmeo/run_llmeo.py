@@ -1,40 +1,137 @@
 import argparse
+import json
 import logging
 import os
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from copy import copy
 from uuid import uuid4
 
 import pandas as pd
+from llmeo._utils.bandit import BanditArm, BanditScheduler
+from llmeo._utils.cache import XtbCache
+from llmeo._utils.context import estimate_tokens, select_context
+from llmeo._utils.evaluator import XtbEvaluator
 from llmeo._utils.ga import ga_sample
-from llmeo._utils.llm import GPT4, Claude3, GPTo1, Gemini, LLMConfig, LLMError
-from llmeo._utils.utils import (find_tmc_in_space, make_prompt,
-                          retrive_tmc_from_message)
+from llmeo._utils.jobs import JobLimits
+from llmeo._utils.llm import (GPT4, Claude3, Gemini, GPTo1, HedgedLLM, LLMConfig,
+                              LLMError, UsageTracker)
+from llmeo._utils.snap import SnapIndex, SnapStats, ligand_similarity
+from llmeo._utils.utils import (ALIAS_TMC_REGEX, TMC_REGEX, ExtractionResult, LigandAliases, ParseStats,
+                          RepairResult, RepairStats,
+                          TMCExtractor, TMCStreamParser, find_tmc_in_space, make_prompt,
+                          make_text_for_existing_tmcs, retrive_tmc_from_message)
 from llmeo.prompts import (OFF_SPRING_MAP, PROMPT_G, PROMPT_MB, PROMPT_MPSG,
-                           PROMPT_P, PROMPT_PF)
+                           PROMPT_P, PROMPT_PF, PROMPT_TEMPLATES, REPAIR_PROMPT,
+                           STRUCTURED_OUTPUT_SUFFIX, TMC_PROPOSAL_SCHEMA)
 
 
+def build_llm_model(name, config):
+    """Return an uninitialized LLM model instance for a command line model name"""
+    if name == "o1-preview":
+        return GPTo1(config, name="o1-preview")
+    elif name == "o1-mini":
+        return GPTo1(config, name="o1-mini")
+    elif name == "gpt-4":
+        return GPT4(config)
+    elif name == "claude-3-5-sonnet-20240620":
+        return Claude3(config)
+    elif name == "o1":
+        return GPTo1(config, name="o1")
+    elif name == "gemini":
+        return Gemini(config, name="gemini-2.0-flash-thinking-exp")
+    raise LLMError(f"Unknown model: {name}")
+
+def answer_validator(opt):
+    """Whether an LLM answer proposes a TMC, written with aliases if the prompt uses them"""
+    regex = ALIAS_TMC_REGEX if getattr(opt, "alias_ligands", False) else TMC_REGEX
+    return lambda text: regex.search(text or "") is not None
+
+def hedge_llm_model(opt, model, config):
+    """Hedge slow requests of a model and fail over to the --hedge_models, if any"""
+    hedge_models = getattr(opt, "hedge_models", None)
+    if not hedge_models:
+        return model
+    return HedgedLLM(
+        [model] + [build_llm_model(name, config) for name in hedge_models.split(",")],
+        hedge_percentile=getattr(opt, "hedge_percentile", 95.0),
+        validator=answer_validator(opt),
+    )
+
 def get_llm_model(opt):
     """Initialize and return appropriate LLM model based on options"""
     config = LLMConfig.from_yaml(opt.llm_config)
+    # Repair turns resend the first prompt, so it is worth caching
+    if getattr(opt, "repair_rounds", 0) > 0:
+        config.prompt_caching = True
     try:
-        if opt.model == "o1-preview":
-            model = GPTo1(config, name="o1-preview")
-        elif opt.model == "o1-mini":
-            model = GPTo1(config, name="o1-mini")
-        elif opt.model == "gpt-4":
-            model = GPT4(config)
-        elif opt.model == "claude-3-5-sonnet-20240620":
-            model = Claude3(config)
-        elif opt.model == "o1":
-            model = GPTo1(config, name="o1")
-        elif opt.model == "gemini":
-            model = Gemini(config, name="gemini-2.0-flash-thinking-exp")
- 
+        model = hedge_llm_model(opt, build_llm_model(opt.model, config), config)
         model.create()
         return model
     except LLMError as e:
         raise RuntimeError(f"Failed to initialize LLM model: {str(e)}")
 
+def get_bandit(opt):
+    """
+    Build the bandit scheduler over the proposer arms given by --bandit_arms.
+
+    Every arm is written as model[:template[:temperature]], e.g.
+    "gpt-4:PROMPT_MB:0.7,o1"; an empty or "default" field keeps the default.
+    --hedge_models hedge the requests of every arm.
+    """
+    config = LLMConfig.from_yaml(opt.llm_config)
+    if getattr(opt, "repair_rounds", 0) > 0:
+        config.prompt_caching = True
+    arms = []
+    for spec in opt.bandit_arms.split(","):
+        name, template, temperature = (spec.strip().split(":") + ["", ""])[:3]
+        template = None if template in ("", "default") else template
+        temperature = None if temperature in ("", "default") else float(temperature)
+        arm_config = copy(config)
+        if temperature is not None:
+            arm_config.temperature = temperature
+        model = hedge_llm_model(opt, build_llm_model(name, arm_config), arm_config)
+        model.create()
+        arms.append(BanditArm(model, template, temperature))
+    return BanditScheduler(
+        arms,
+        cost=getattr(opt, "bandit_cost", "dollar"),
+        discount=getattr(opt, "bandit_discount", 0.9),
+        seed=opt.seed,
+    )
+
+def check_options(opt):
+    """
+    Reject combinations of command line options that cannot run together.
+
+    Raises:
+        ValueError: If --bandit_arms is combined with --staleness > 0; the
+            bandit needs the gain of an iteration before it picks the next arm
+    """
+    if getattr(opt, "bandit_arms", None) and getattr(opt, "staleness", 0) > 0:
+        raise ValueError("--bandit_arms runs the generational loop and cannot be combined with --staleness > 0")
+
+def get_evaluator(opt, df_ligands):
+    """
+    Evaluator of proposed TMCs selected by --evaluator.
+
+    Args:
+        opt: Command line arguments
+        df_ligands: Ligand table of the search space
+
+    Returns:
+        XtbEvaluator, or None to look proposals up in the ground truth table
+    """
+    if getattr(opt, "evaluator", "lookup") != "xtb":
+        return None
+    limits = {
+        "molsimplify": JobLimits(timeout=opt.molsimplify_timeout),
+        "xtb": JobLimits(timeout=opt.xtb_timeout),
+    }
+    cache = XtbCache(opt.cache_dir) if opt.cache_dir else None
+    return XtbEvaluator(df_ligands, opt.xtb_root_path or f"{opt.path}/xtb", cache=cache, limits=limits)
+
 def get_prompt_and_props(opt):
     """Get appropriate prompt template and properties based on optimization target"""
     props = [opt.prop]
@@ -54,15 +151,87 @@ def get_prompt_and_props(opt):
         props = ["gap", "polarisability"]
     else:
         raise ValueError(f"Invalid property: {opt.prop}")
+
+    # A named template (e.g. of a bandit arm) replaces the default of the property
+    template = getattr(opt, "template", None)
+    if template:
+        if template not in PROMPT_TEMPLATES:
+            raise ValueError(f"Invalid template: {template}")
+        PROMPT = PROMPT_TEMPLATES[template]
         
     return PROMPT, props
 
-def get_llm_response(model, prompt):
-    """Get response from LLM model with appropriate system prompt"""
+def get_llm_response(model, prompt, on_text=None, response_schema=None, history=None):
+    """Get response (text and usage) from LLM model with appropriate system prompt"""
 
     system_prompt = "You are a helpful agent who can perform multi-objective optimization for a transition metal complex for certain chemical properties based on your chemistry knowledge."
 
-    return model.call(prompt, system=system_prompt)
+    kwargs = {}
+    if on_text is not None:
+        kwargs["on_text"] = on_text
+    if response_schema is not None:
+        kwargs["response_schema"] = response_schema
+    if history:
+        kwargs["history"] = history
+    return model.generate(prompt, system=system_prompt, **kwargs)
+
+def stream_llm_response(model, prompt, evaluate, executor, response_schema=None, aliases=None):
+    """
+    Stream the LLM response and start evaluating TMCs while it is generated.
+
+    Every TMC completed in the stream is submitted to `executor` right away, so
+    lookups or xTB calculations overlap with the rest of the generation.
+
+    Args:
+        model: LLM model instance
+        prompt: Prompt to send
+        evaluate: Callable mapping one TMC string to a DataFrame of evaluated rows or None
+        executor: Executor running the evaluations
+        response_schema: Optional JSON schema for structured output
+        aliases: Optional LigandAliases used in the prompt
+
+    Returns:
+        tuple: (LLMResponse, dict mapping TMC strings to evaluation futures)
+    """
+    parser = TMCStreamParser(aliases)
+    prefetched = {}
+
+    def submit(tmcs):
+        for tmc in tmcs:
+            if tmc not in prefetched:
+                prefetched[tmc] = executor.submit(evaluate, tmc)
+
+    response = get_llm_response(
+        model,
+        prompt,
+        on_text=lambda chunk: submit(parser.feed(chunk)),
+        response_schema=response_schema,
+    )
+    submit(parser.close())
+    return response, prefetched
+
+def evaluate_offspring(tmcs, evaluate, prefetched=None):
+    """
+    Evaluate proposed TMCs, reusing evaluations started while streaming.
+
+    Args:
+        tmcs: List of TMC strings
+        evaluate: Callable mapping one TMC string to a DataFrame of evaluated rows or None
+        prefetched: Optional dict mapping TMC strings to evaluation futures
+
+    Returns:
+        DataFrame containing evaluated TMCs, or None if none could be evaluated
+    """
+    prefetched = prefetched or {}
+    evaluated = []
+    for tmc in tmcs:
+        if tmc is None:
+            continue
+        future = prefetched.get(tmc)
+        df = future.result() if future is not None else evaluate(tmc)
+        if df is not None:
+            evaluated.append(df)
+    return pd.concat(evaluated) if evaluated else None
     
 def get_pareto_frontier(
     df: pd.DataFrame, 
@@ -125,6 +294,380 @@ def get_next_round_samples(strategy, df_samples_current, df_samples):
     else:  # "all" strategy
         return df_samples.drop_duplicates(subset=["id"]).sample(frac=1.0)
 
+def select_parents(opt, df_samples_current, df_samples, LIG_CHARGE, logger):
+    """
+    Select the samples shown to the LLM, trimmed to the context budget if one is set.
+    
+    Args:
+        opt: Command line arguments
+        df_samples_current: Current population DataFrame
+        df_samples: Historical samples DataFrame
+        LIG_CHARGE: Dictionary mapping ligand IDs to charges
+        logger: Logger instance
+        
+    Returns:
+        DataFrame: Selected samples for next round
+    """
+    samples = get_next_round_samples(opt.strategy, df_samples_current, df_samples)
+    budget = getattr(opt, "context_budget", None)
+    if not budget or opt.model == "ga":
+        return samples
+
+    _, props = get_prompt_and_props(opt)
+    selected = select_context(samples, LIG_CHARGE, props, opt.prop, budget)
+    tokens = estimate_tokens(make_text_for_existing_tmcs(selected, LIG_CHARGE, props))
+    logger.info(f"context: {len(selected)} of {len(samples)} samples, ~{tokens} tokens (budget {budget})")
+    return selected
+
+def propose_llm_tmcs(
+    opt,
+    model,
+    next_round_samples_in,
+    ligands,
+    LIG_CHARGE,
+    logger,
+    evaluate=None,
+    executor=None,
+):
+    """
+    Ask the LLM for offspring of the given parent samples.
+
+    Args:
+        opt: Command line arguments
+        model: LLM model instance
+        next_round_samples_in: Parent samples shown in the prompt
+        ligands: String containing ligand information
+        LIG_CHARGE: Dictionary mapping ligand IDs to charges
+        logger: Logger instance
+        evaluate: Callable evaluating one TMC, used to start evaluations while streaming
+        executor: Executor running streamed evaluations; streaming is off without it
+
+    Returns:
+        tuple: (LLMResponse, ExtractionResult, dict mapping TMC strings to evaluation futures,
+            RepairResult or None when repair is off)
+    """
+    PROMPT, props = get_prompt_and_props(opt)
+    aliases = LigandAliases(LIG_CHARGE) if getattr(opt, "alias_ligands", False) else None
+    prompt = make_prompt(
+        PROMPT,
+        ligands,
+        next_round_samples_in,
+        LIG_CHARGE,
+        num_samples=OFF_SPRING_MAP[opt.num_offspring],
+        props=props,
+        aliases=aliases,
+    )
+    if aliases is not None:
+        full_tokens = estimate_tokens(make_prompt(
+            PROMPT,
+            ligands,
+            next_round_samples_in,
+            LIG_CHARGE,
+            num_samples=OFF_SPRING_MAP[opt.num_offspring],
+            props=props,
+        ))
+        tokens = estimate_tokens(prompt)
+        logger.info(f"aliased prompt: ~{tokens} tokens instead of ~{full_tokens} (saved ~{full_tokens - tokens})")
+
+    # Structured output uses a JSON schema where the model supports it,
+    # otherwise the strict line grammar appended to the prompt
+    structured = getattr(opt, "structured", False)
+    response_schema = None
+    if structured:
+        if getattr(model, "supports_structured_output", False):
+            response_schema = TMC_PROPOSAL_SCHEMA
+        else:
+            prompt += STRUCTURED_OUTPUT_SUFFIX
+
+    prefetched = {}
+    if getattr(opt, "stream", False) and executor is not None:
+        response, prefetched = stream_llm_response(
+            model, prompt, evaluate, executor, response_schema=response_schema, aliases=aliases
+        )
+        logger.info(f"streamed candidates: {list(prefetched)}")
+    else:
+        response = get_llm_response(model, prompt, response_schema=response_schema)
+    text_out = response.text
+    logger.info(f"message: {text_out}")
+    logger.info(f"usage: {response.usage.to_dict()}")
+
+    extraction = extract_llm_tmcs(opt, text_out, LIG_CHARGE, aliases, opt.num_offspring)
+    if extraction.rejected:
+        logger.warning(f"rejected proposals: {extraction.rejected}")
+
+    repair = None
+    if getattr(opt, "repair_rounds", 0) > 0 and evaluate is not None:
+        repair = repair_llm_tmcs(
+            opt, model, prompt, response, extraction, evaluate, prefetched,
+            LIG_CHARGE, logger, aliases=aliases, response_schema=response_schema,
+        )
+    return response, extraction, prefetched, repair
+
+def extract_llm_tmcs(opt, text, LIG_CHARGE, aliases, expected_returns):
+    """Extract TMCs from an LLM message, validated in structured mode"""
+    if getattr(opt, "structured", False):
+        return TMCExtractor(LIG_CHARGE, aliases=aliases).extract(
+            text, expected_returns=expected_returns
+        )
+    return ExtractionResult(
+        retrive_tmc_from_message(
+            message=text,
+            expected_returns=expected_returns,
+            aliases=aliases,
+        ),
+        [],
+        "delimiter",
+    )
+
+def make_repair_feedback(problems, LIG_CHARGE, aliases=None):
+    """
+    Describe the unusable TMCs of an LLM answer, one line per problem.
+
+    Args:
+        problems: List of (TMC or None, reason) pairs
+        LIG_CHARGE: Dictionary mapping ligand IDs to charges
+        aliases: Optional LigandAliases the LLM was prompted with
+
+    Returns:
+        str: Feedback lines
+    """
+    lines = []
+    for tmc, reason in problems:
+        if tmc is None:
+            lines.append("- No TMC in the requested format could be found in your answer.")
+            continue
+        ligs = tmc.split("_")[1:]
+        shown = tmc
+        if aliases is not None and reason != "malformed":
+            shown = "Pd_" + "_".join(aliases.alias(lig) for lig in ligs)
+        if reason == "invalid_charge":
+            charge = 2 + sum(LIG_CHARGE[lig] for lig in ligs)
+            lines.append(f"- {shown}: its total charge is {charge}, not -1, 0 or 1.")
+        elif reason == "unknown_ligand":
+            lines.append(f"- {shown}: uses ligand ids that are not in the csv file.")
+        elif reason == "duplicate":
+            lines.append(f"- {shown}: was already proposed.")
+        elif reason == "absent":
+            lines.append(f"- {shown}: is not in the space of TMCs that can be evaluated.")
+        else:
+            lines.append(f"- {shown}: is not of the form Pd_$L1_$L2_$L3_$L4 with four ligand ids.")
+    if not lines:
+        lines.append("- Your answer contained fewer TMCs than requested.")
+    return "\n".join(lines)
+
+def repair_llm_tmcs(
+    opt,
+    model,
+    prompt,
+    response,
+    extraction,
+    evaluate,
+    prefetched,
+    LIG_CHARGE,
+    logger,
+    aliases=None,
+    response_schema=None,
+):
+    """
+    Ask the LLM in the same conversation to replace its unusable TMCs.
+
+    First-shot TMCs are classified as usable, malformed, unknown_ligand,
+    invalid_charge or absent (not evaluable). While fewer usable TMCs than
+    requested were found, and for at most opt.repair_rounds turns, a short
+    follow-up lists the problems and asks for the missing number of TMCs.
+    Earlier turns are resent as history, so providers with prompt caching
+    only pay the cached rate for the long first prompt. Evaluations made for
+    the check are stored in `prefetched` and are not repeated.
+
+    Args:
+        opt: Command line arguments
+        model: LLM model instance
+        prompt: First prompt of the iteration
+        response: First LLM response
+        extraction: ExtractionResult of the first response
+        evaluate: Callable mapping one TMC string to a DataFrame of evaluated rows or None
+        prefetched: Dict mapping TMC strings to evaluation futures, extended in place
+        LIG_CHARGE: Dictionary mapping ligand IDs to charges
+        logger: Logger instance
+        aliases: Optional LigandAliases used in the prompt
+        response_schema: Optional JSON schema for structured output
+
+    Returns:
+        RepairResult with the usable TMCs recovered by the follow-up turns
+    """
+    validator = TMCExtractor(LIG_CHARGE)
+
+    def usable(tmc):
+        future = prefetched.get(tmc)
+        if future is None:
+            future = Future()
+            future.set_result(evaluate(tmc))
+            prefetched[tmc] = future
+        return future.result() is not None
+
+    def check(candidates, rejected, seen):
+        valid, problems = [], list(rejected)
+        for tmc in candidates:
+            reason = "duplicate" if tmc in seen else validator.validate(tmc)
+            seen.add(tmc)
+            if reason is None and not usable(tmc):
+                reason = "absent"
+            if reason is None:
+                valid.append(tmc)
+            else:
+                problems.append((tmc, reason))
+        if not candidates and not rejected:
+            problems.append((None, "none_found"))
+        return valid, problems
+
+    seen = set()
+    valid, problems = check(extraction.tmcs, extraction.rejected, seen)
+    result = RepairResult(first_shot_valid=len(valid), expected=opt.num_offspring)
+    history = [
+        {"role": "user", "content": prompt},
+        {"role": "assistant", "content": response.text},
+    ]
+
+    while len(valid) + len(result.tmcs) < opt.num_offspring and result.rounds < opt.repair_rounds:
+        missing = opt.num_offspring - len(valid) - len(result.tmcs)
+        for _, reason in problems:
+            result.reasons[reason] = result.reasons.get(reason, 0) + 1
+        feedback = REPAIR_PROMPT.replace(
+            "REPAIR_FEEDBACK", make_repair_feedback(problems, LIG_CHARGE, aliases)
+        ).replace("NUM_MISSING", str(missing))
+        try:
+            repair_response = get_llm_response(
+                model, feedback, response_schema=response_schema, history=history
+            )
+        except Exception as e:
+            logger.error(f"LLM error during repair: {str(e)}")
+            break
+        result.responses.append(repair_response)
+        logger.info(f"repair {result.rounds}: {repair_response.text}")
+
+        repaired = extract_llm_tmcs(opt, repair_response.text, LIG_CHARGE, aliases, missing)
+        recovered, problems = check(repaired.tmcs, repaired.rejected, seen)
+        result.tmcs.extend(recovered)
+        history = history + [
+            {"role": "user", "content": feedback},
+            {"role": "assistant", "content": repair_response.text},
+        ]
+
+    if result.rounds:
+        logger.info(f"repair: {result.rounds} rounds recovered {result.tmcs}, reasons {result.reasons}")
+    return result
+
+def record_proposal(
+    ii,
+    response,
+    extraction,
+    failed_messages,
+    usage_tracker=None,
+    parse_stats=None,
+    repair=None,
+    repair_stats=None,
+):
+    """Book-keep usage, parse and repair statistics and failed messages of one LLM proposal"""
+    if usage_tracker is not None:
+        usage_tracker.record(ii, response)
+        for repair_response in (repair.responses if repair is not None else []):
+            usage_tracker.record(ii, repair_response)
+    # Parse statistics describe the first shot only, repairs are counted separately
+    if parse_stats is not None:
+        parse_stats.record(extraction)
+    if repair_stats is not None and repair is not None:
+        repair_stats.record(repair)
+    if not len(extraction.tmcs):
+        failed_messages.append(response.text)
+
+def snap_llm_tmcs(opt, snap_index, tmcs, rejected, df_samples, logger, snap_stats=None):
+    """
+    Replace proposals outside the search space by their nearest members.
+
+    Proposals that are members (up to rotation) are kept. The others, and
+    proposals rejected for their charge or unknown ligands, are snapped to the
+    nearest member within `opt.snap_swaps` ligand swaps that is neither known
+    yet nor proposed in the same iteration.
+
+    Args:
+        opt: Command line arguments
+        snap_index: SnapIndex over the search space
+        tmcs: Proposed TMC strings
+        rejected: Rejected (candidate, reason) pairs of the extraction
+        df_samples: Historical samples DataFrame
+        logger: Logger instance
+        snap_stats: Optional SnapStats collecting the snap rate
+
+    Returns:
+        list: TMC strings, all members of the search space
+    """
+    exclude = snap_index.frame_keys(df_samples)
+    kept, misses = [], []
+    for tmc in tmcs:
+        if snap_index.lookup(tmc) is not None:
+            kept.append(tmc)
+            exclude.add(snap_index.key(tmc))
+        else:
+            misses.append(tmc)
+    misses += [tmc for tmc, reason in rejected if reason in ("invalid_charge", "unknown_ligand")]
+    if snap_stats is not None:
+        snap_stats.record_in_space(len(kept))
+
+    for tmc in misses:
+        if len(kept) >= opt.num_offspring:
+            break
+        nearest = snap_index.nearest(tmc, max_swaps=getattr(opt, "snap_swaps", 1), exclude=exclude)
+        if nearest:
+            snapped, distance = nearest[0]
+            kept.append(snapped)
+            exclude.add(snap_index.key(snapped))
+            logger.info(f"snapped {tmc} to {snapped} (distance {distance})")
+        else:
+            snapped, distance = None, None
+        if snap_stats is not None:
+            snap_stats.record(tmc, snapped, distance)
+    return kept
+
+def merge_offspring(opt, ii, df_new, df_samples, logger):
+    """
+    Add evaluated offspring to the history and select the new population.
+
+    Args:
+        opt: Command line arguments
+        ii: Iteration that proposed the offspring
+        df_new: DataFrame of evaluated offspring
+        df_samples: Historical samples DataFrame
+        logger: Logger instance
+
+    Returns:
+        tuple: (updated_current_samples, updated_historical_samples)
+    """
+    _, props = get_prompt_and_props(opt)
+
+    df_new["iter"] = ii + 1
+    df_samples = pd.concat([df_samples, df_new])
+    
+    # Update current samples based on optimization property
+    if opt.prop == "pf":
+        df_samples["x"] = df_samples.apply(lambda row: row["gap"] * row["polarisability"], axis=1)
+        df_samples_current = get_pareto_frontier(df_samples, "gap", "polarisability")
+        _df = df_samples_current[["id", "x", "polarisability", "gap", "iter"]]
+    elif opt.prop == "mb":
+        df_samples["x"] = df_samples.apply(lambda row: row["gap"] * row["polarisability"], axis=1)
+        df_samples_current = df_samples.drop_duplicates(subset=["id"]).nlargest(opt.population, "x")
+        _df = df_samples_current[["id", "x", "polarisability", "gap", "iter"]]
+    elif opt.prop == "mpsg":
+        df_samples["alpha/g"] = df_samples.apply(lambda row: row["polarisability"] / row["gap"], axis=1)
+        df_samples_current = df_samples.drop_duplicates(subset=["id"]).nlargest(opt.population, "alpha/g")
+        _df = df_samples_current[["id", "alpha/g", "polarisability", "gap", "iter"]]
+    else:
+        df_samples_current = df_samples.drop_duplicates(subset=["id"]).nlargest(opt.population, props[0])
+        _df = df_samples_current[["id", "polarisability", "gap", "iter"]]
+
+    logger.info(f"current: {_df}")
+
+    return df_samples_current, df_samples
+
 def move_one_iter(
     opt,
     model,
@@ -136,6 +679,12 @@ def move_one_iter(
     ligands,
     LIG_CHARGE,
     logger,
+    usage_tracker=None,
+    evaluate_fn=None,
+    parse_stats=None,
+    repair_stats=None,
+    snap_index=None,
+    snap_stats=None,
 ):
     """  
     Perform one iteration of the optimization process.  
@@ -151,41 +700,51 @@ def move_one_iter(
         ligands: String containing ligand information  
         LIG_CHARGE: Dictionary mapping ligand IDs to charges  
         logger: Logger instance
+        usage_tracker: Optional UsageTracker collecting token, latency and cost of LLM calls
+        evaluate_fn: Optional callable mapping one TMC string to a DataFrame of evaluated
+            rows (e.g. an xTB calculation); defaults to a lookup in df_1Mspace
+        parse_stats: Optional ParseStats collecting parse success of LLM messages
+        repair_stats: Optional RepairStats collecting the outcome of repair turns
+        snap_index: Optional SnapIndex over df_1Mspace; out-of-space LLM proposals
+            are snapped to their nearest members and lookups use the index
+        snap_stats: Optional SnapStats collecting the snap rate
         
     Returns:  
         tuple: (updated_current_samples, updated_historical_samples, updated_failed_messages)  
     """  
     # Determine next round samples based on strategy
-    next_round_samples_in = get_next_round_samples(opt.strategy, df_samples_current, df_samples)
+    next_round_samples_in = select_parents(opt, df_samples_current, df_samples, LIG_CHARGE, logger)
 
     # Get appropriate prompt and properties
-    PROMPT, props = get_prompt_and_props(opt)
+    _, props = get_prompt_and_props(opt)
+
+    evaluate = evaluate_fn or (lambda tmc: find_tmc_in_space(df_1Mspace, [tmc], index=snap_index))
+    prefetched = {}
+    executor = None
 
     # Generate TMCs using either LLM or GA approach
     if opt.model != "ga":
-        prompt = make_prompt(
-            PROMPT,
-            ligands,
-            next_round_samples_in,
-            LIG_CHARGE,
-            num_samples=OFF_SPRING_MAP[opt.num_offspring],
-            props=props,
-        )
-        
+        if getattr(opt, "stream", False):
+            executor = ThreadPoolExecutor(max_workers=getattr(opt, "eval_workers", 1))
         try:
-            text_out = get_llm_response(model, prompt)
-            logger.info(f"message: {text_out}")
-            
-            tmcs = retrive_tmc_from_message(
-                message=text_out,
-                expected_returns=opt.num_offspring,
+            response, extraction, prefetched, repair = propose_llm_tmcs(
+                opt, model, next_round_samples_in, ligands, LIG_CHARGE, logger,
+                evaluate=evaluate, executor=executor,
             )
-            if not len(tmcs):
-                failed_messages.append(text_out)
-                
         except Exception as e:
             logger.error(f"LLM error: {str(e)}")
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
             return df_samples_current, df_samples, failed_messages
+        record_proposal(
+            ii, response, extraction, failed_messages, usage_tracker, parse_stats,
+            repair=repair, repair_stats=repair_stats,
+        )
+        tmcs = extraction.tmcs + (repair.tmcs if repair is not None else [])
+        if snap_index is not None:
+            tmcs = snap_llm_tmcs(
+                opt, snap_index, tmcs, extraction.rejected, df_samples, logger, snap_stats
+            )
 
     else:
         tmcs = ga_sample(
@@ -194,68 +753,252 @@ def move_one_iter(
             num_offspring=opt.num_offspring,
         )
 
-    # Process results
-    df_new = find_tmc_in_space(df_1Mspace, tmcs)
+    # Process results; streamed candidates missing from the final answer are dropped once
+    # their running evaluations finish, so none outlives the iteration
+    df_new = evaluate_offspring(tmcs, evaluate, prefetched)
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
     if df_new is None:
         logger.warning(f"no match: {tmcs}")
         if opt.model != "ga":
-            failed_messages.append(text_out)
+            failed_messages.append(response.text)
         return df_samples_current, df_samples, failed_messages
 
     logger.info(f"{ii}, proposed: {tmcs}, {df_new[props[0]].values}")
 
-    df_new["iter"] = ii + 1
-    df_samples = pd.concat([df_samples, df_new])
-    
-    # Update current samples based on optimization property
-    if opt.prop == "pf":
-        df_samples["x"] = df_samples.apply(lambda row: row["gap"] * row["polarisability"], axis=1)
-        df_samples_current = get_pareto_frontier(df_samples, "gap", "polarisability")
-        _df = df_samples_current[["id", "x", "polarisability", "gap", "iter"]]
-    elif opt.prop == "mb":
-        df_samples["x"] = df_samples.apply(lambda row: row["gap"] * row["polarisability"], axis=1)
-        df_samples_current = df_samples.drop_duplicates(subset=["id"]).nlargest(opt.population, "x")
-        _df = df_samples_current[["id", "x", "polarisability", "gap", "iter"]]
-    elif opt.prop == "mpsg":
-        df_samples["alpha/g"] = df_samples.apply(lambda row: row["polarisability"] / row["gap"], axis=1)
-        df_samples_current = df_samples.drop_duplicates(subset=["id"]).nlargest(opt.population, "alpha/g")
-        _df = df_samples_current[["id", "alpha/g", "polarisability", "gap", "iter"]]
-    else:
-        df_samples_current = df_samples.drop_duplicates(subset=["id"]).nlargest(opt.population, props[0])
-        _df = df_samples_current[["id", "polarisability", "gap", "iter"]]
+    df_samples_current, df_samples = merge_offspring(opt, ii, df_new, df_samples, logger)
 
-    logger.info(f"current: {_df}")
+    return df_samples_current, df_samples, failed_messages
+
+def move_one_bandit_iter(
+    opt,
+    bandit,
+    ii,
+    df_samples_current,
+    df_samples,
+    failed_messages,
+    df_1Mspace,
+    ligands,
+    LIG_CHARGE,
+    logger,
+    usage_tracker,
+    evaluate_fn=None,
+    parse_stats=None,
+    repair_stats=None,
+    snap_index=None,
+    snap_stats=None,
+):
+    """
+    Perform one iteration with the proposer arm chosen by the bandit.
+
+    The gain of the iteration is the number of offspring in the new population
+    (new Pareto points for "pf"); with its wall time and LLM cost it is fed
+    back to the bandit.
+
+    Args:
+        opt: Command line arguments
+        bandit: BanditScheduler over the proposer arms
+        usage_tracker: UsageTracker of the run, used to price the iteration
+        Other arguments as for move_one_iter
+
+    Returns:
+        tuple: (updated_current_samples, updated_historical_samples, updated_failed_messages)
+    """
+    arm = bandit.select()
+    arm_opt = copy(opt)
+    # The arm decides between LLM and GA, whatever --model says
+    arm_opt.model = arm.model.name
+    if arm.template is not None:
+        arm_opt.template = arm.template
+    logger.info(f"{ii}, bandit arm: {arm.name}")
+
+    start = time.perf_counter()
+    calls = len(usage_tracker.records)
+    df_samples_current, df_samples, failed_messages = move_one_iter(
+        arm_opt,
+        arm.model,
+        ii,
+        df_samples_current,
+        df_samples,
+        failed_messages,
+        df_1Mspace,
+        ligands,
+        LIG_CHARGE,
+        logger,
+        usage_tracker=usage_tracker,
+        evaluate_fn=evaluate_fn,
+        parse_stats=parse_stats,
+        repair_stats=repair_stats,
+        snap_index=snap_index,
+        snap_stats=snap_stats,
+    )
+    seconds = time.perf_counter() - start
+    dollars = sum(record["cost"] for record in usage_tracker.records[calls:])
+    gain = int((df_samples_current["iter"] == ii + 1).sum())
+
+    record = bandit.update(arm, gain, seconds, dollars)
+    scores = {a.name: round(score, 4) for a, score in zip(bandit.arms, bandit.scores())}
+    logger.info(f"{ii}, bandit update: {record}, ucb: {scores}")
+    return df_samples_current, df_samples, failed_messages
+
+def run_pipelined(
+    opt,
+    model,
+    df_samples_current,
+    df_samples,
+    failed_messages,
+    df_1Mspace,
+    ligands,
+    LIG_CHARGE,
+    logger,
+    usage_tracker=None,
+    evaluate_fn=None,
+    parse_stats=None,
+    repair_stats=None,
+    snap_index=None,
+    snap_stats=None,
+    on_merge=None,
+):
+    """
+    Run all iterations as a steady-state loop overlapping proposal and evaluation.
+
+    Iteration i+1 asks for offspring of the population known so far while the
+    offspring of earlier iterations are still being evaluated. At most
+    `opt.staleness` iterations may be unmerged when a new proposal starts, so
+    a staleness of 0 reproduces the generational loop. Offspring are merged in
+    the order their evaluations finish.
+
+    Args:
+        opt: Command line arguments (uses `staleness` and `eval_workers`)
+        on_merge: Optional callback receiving the historical samples after every merge
+        Remaining arguments are as in `move_one_iter`.
+
+    Returns:
+        tuple: (updated_current_samples, updated_historical_samples, updated_failed_messages)
+    """
+    staleness = max(getattr(opt, "staleness", 0), 0)
+    evaluate = evaluate_fn or (lambda tmc: find_tmc_in_space(df_1Mspace, [tmc], index=snap_index))
+    _, props = get_prompt_and_props(opt)
+
+    propose_pool = ThreadPoolExecutor(max_workers=staleness + 1)
+    eval_pool = ThreadPoolExecutor(max_workers=getattr(opt, "eval_workers", 1))
+
+    def propose(parents):
+        if opt.model == "ga":
+            tmcs = ga_sample(parents, LIG_CHARGE, num_offspring=opt.num_offspring)
+            return None, ExtractionResult(tmcs, [], "ga"), {}, None
+        return propose_llm_tmcs(
+            opt, model, parents, ligands, LIG_CHARGE, logger,
+            evaluate=evaluate, executor=eval_pool,
+        )
+
+    pending = {}
+    started = merged = 0
+    try:
+        while merged < opt.num_iter:
+            while started < opt.num_iter and started - merged <= staleness:
+                parents = select_parents(opt, df_samples_current, df_samples, LIG_CHARGE, logger)
+                logger.info(f"{started}, proposing from population after {merged} merged iterations")
+                pending[propose_pool.submit(propose, parents)] = (started, "propose")
+                started += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ii, stage = pending.pop(future)
+                if stage == "propose":
+                    try:
+                        response, extraction, prefetched, repair = future.result()
+                    except Exception as e:
+                        logger.error(f"LLM error: {str(e)}")
+                        merged += 1
+                        continue
+                    if response is not None:
+                        record_proposal(
+                            ii, response, extraction, failed_messages, usage_tracker, parse_stats,
+                            repair=repair, repair_stats=repair_stats,
+                        )
+                    tmcs = extraction.tmcs + (repair.tmcs if repair is not None else [])
+                    if response is not None and snap_index is not None:
+                        tmcs = snap_llm_tmcs(
+                            opt, snap_index, tmcs, extraction.rejected, df_samples, logger, snap_stats
+                        )
+                    evaluation = eval_pool.submit(evaluate_offspring, tmcs, evaluate, prefetched)
+                    pending[evaluation] = (ii, (tmcs, response))
+                    continue
+
+                tmcs, response = stage
+                merged += 1
+                df_new = future.result()
+                if df_new is None:
+                    logger.warning(f"no match: {tmcs}")
+                    if response is not None:
+                        failed_messages.append(response.text)
+                    continue
+
+                logger.info(f"{ii}, proposed: {tmcs}, {df_new[props[0]].values}")
+                df_samples_current, df_samples = merge_offspring(opt, ii, df_new, df_samples, logger)
+                if on_merge is not None:
+                    on_merge(df_samples)
+    finally:
+        propose_pool.shutdown(wait=False, cancel_futures=True)
+        eval_pool.shutdown(wait=True, cancel_futures=True)
 
     return df_samples_current, df_samples, failed_messages
 
-def main(opt):
+def main(opt, model=None):
+    """
+    Run one optimization and write its results below opt.path.
+
+    Args:
+        opt: Command line arguments
+        model: Optional LLM model instance to use instead of building one from opt.model
+
+    Returns:
+        DataFrame: All evaluated samples, or None if the LLM could not be initialized
+    """
+    check_options(opt)
+
     # Set up logging and directories
     os.makedirs(opt.path, exist_ok=True)
     _id = str(uuid4()).split("-")[0]
-    logfile = f"{opt.path}/{opt.prop}-pop_{opt.population}-offspring_{opt.num_offspring}-iter_{opt.num_iter}-seed_{opt.seed}-model_{opt.model}-ss_{opt.strategy}-{_id}.log"
-    csvfile = f"{opt.path}/{opt.prop}-pop_{opt.population}-offspring_{opt.num_offspring}-iter_{opt.num_iter}-seed_{opt.seed}-model_{opt.model}-ss_{opt.strategy}-{_id}.csv"
+    prefix = f"{opt.path}/{opt.prop}-pop_{opt.population}-offspring_{opt.num_offspring}-iter_{opt.num_iter}-seed_{opt.seed}-model_{'bandit' if getattr(opt, 'bandit_arms', None) else opt.model}-ss_{opt.strategy}-{_id}"
+    logfile = f"{prefix}.log"
+    csvfile = f"{prefix}.csv"
+    usage_csvfile = f"{prefix}-usage.csv"
+    usage_jsonfile = f"{prefix}-usage.json"
+    parse_jsonfile = f"{prefix}-parse.json"
+    repair_jsonfile = f"{prefix}-repair.json"
+    snap_jsonfile = f"{prefix}-snap.json"
+    bandit_jsonfile = f"{prefix}-bandit.json"
     
-    # Configure logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(logfile),
-            logging.StreamHandler()
-        ]
-    )
-    logger = logging.getLogger(__name__)
+    # Configure logging; every run has its own logger so concurrent runs of a sweep keep separate log files
+    log_format = '%(asctime)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_format, handlers=[logging.StreamHandler()])
+    logger = logging.getLogger(f"{__name__}.{_id}")
+    file_handler = logging.FileHandler(logfile)
+    file_handler.setFormatter(logging.Formatter(log_format))
+    logger.addHandler(file_handler)
     
     logger.info("Command used: %s", " ".join(sys.argv))
     logger.info("Options: %s", vars(opt))
 
-    # Initialize LLM model if needed
-    model = None
-    if opt.model != "ga":
+    # Initialize LLM model (or the bandit arms) if needed
+    bandit = None
+    if getattr(opt, "bandit_arms", None):
+        try:
+            bandit = get_bandit(opt)
+        except Exception as e:
+            logger.error(f"Failed to initialize bandit arms: {str(e)}")
+            logger.removeHandler(file_handler)
+            file_handler.close()
+            return
+    elif model is None and opt.model != "ga":
         try:
             model = get_llm_model(opt)
         except Exception as e:
             logger.error(f"Failed to initialize LLM model: {str(e)}")
+            logger.removeHandler(file_handler)
+            file_handler.close()
             return
 
     # Load data
@@ -270,6 +1013,14 @@ def main(opt):
 
     df_1Mspace = pd.read_csv(gt_tmc_file)
     # df_1Mspace = df_1Mspace.rename(columns={"homo_lumo_gap": "gap"})
+    evaluate_fn = get_evaluator(opt, df_ligands)
+
+    snap_index = None
+    if getattr(opt, "snap", False):
+        start = time.perf_counter()
+        similarity = ligand_similarity(df_ligands) if getattr(opt, "snap_similarity", False) else None
+        snap_index = SnapIndex(df_1Mspace, LIG_CHARGE, similarity=similarity)
+        logger.info(f"Built snap index over {len(df_1Mspace)} TMCs in {time.perf_counter() - start:.1f}s")
 
     # Initialize samples
     df_samples = df_1Mspace.sample(opt.population, random_state=opt.seed)
@@ -278,11 +1029,41 @@ def main(opt):
 
     # Main optimization loop
     failed_messages = []
-    for ii in range(opt.num_iter):
-        df_samples_current, df_samples, failed_messages = move_one_iter(
+    usage_tracker = UsageTracker()
+    parse_stats = ParseStats()
+    repair_stats = RepairStats()
+    snap_stats = SnapStats()
+
+    def save_progress(df_samples):
+        df_samples.to_csv(csvfile, index=False)
+        if usage_tracker.records:
+            pd.DataFrame(usage_tracker.per_iteration()).to_csv(usage_csvfile, index=False)
+
+    if bandit is not None:
+        for ii in range(opt.num_iter):
+            df_samples_current, df_samples, failed_messages = move_one_bandit_iter(
+                opt,
+                bandit,
+                ii,
+                df_samples_current,
+                df_samples,
+                failed_messages,
+                df_1Mspace,
+                ligands,
+                LIG_CHARGE,
+                logger,
+                usage_tracker,
+                evaluate_fn=evaluate_fn,
+                parse_stats=parse_stats,
+                repair_stats=repair_stats,
+                snap_index=snap_index,
+                snap_stats=snap_stats,
+            )
+            save_progress(df_samples)
+    elif getattr(opt, "staleness", 0) > 0:
+        df_samples_current, df_samples, failed_messages = run_pipelined(
             opt,
             model,
-            ii,
             df_samples_current,
             df_samples,
             failed_messages,
@@ -290,14 +1071,73 @@ def main(opt):
             ligands,
             LIG_CHARGE,
             logger,
+            usage_tracker=usage_tracker,
+            evaluate_fn=evaluate_fn,
+            parse_stats=parse_stats,
+            repair_stats=repair_stats,
+            snap_index=snap_index,
+            snap_stats=snap_stats,
+            on_merge=save_progress,
         )
-        df_samples.to_csv(csvfile, index=False)
+    else:
+        for ii in range(opt.num_iter):
+            df_samples_current, df_samples, failed_messages = move_one_iter(
+                opt,
+                model,
+                ii,
+                df_samples_current,
+                df_samples,
+                failed_messages,
+                df_1Mspace,
+                ligands,
+                LIG_CHARGE,
+                logger,
+                usage_tracker=usage_tracker,
+                evaluate_fn=evaluate_fn,
+                parse_stats=parse_stats,
+                repair_stats=repair_stats,
+                snap_index=snap_index,
+                snap_stats=snap_stats,
+            )
+            save_progress(df_samples)
 
     logger.info("===== End =====")
     df_samples.to_csv(csvfile, index=False)
+    if usage_tracker.records:
+        usage_summary = {
+            "run": usage_tracker.totals(),
+            "per_iteration": usage_tracker.per_iteration(),
+        }
+        logger.info(f"LLM usage: {usage_summary['run']}")
+        with open(usage_jsonfile, "w") as fo:
+            json.dump(usage_summary, fo, indent=2)
+    if isinstance(model, HedgedLLM):
+        logger.info(f"Hedging statistics: {model.stats}")
+    if bandit is not None:
+        for arm in bandit.arms:
+            if isinstance(arm.model, HedgedLLM):
+                logger.info(f"Hedging statistics of {arm.name}: {arm.model.stats}")
+        logger.info(f"Bandit summary: {bandit.summary()}")
+        with open(bandit_jsonfile, "w") as fo:
+            json.dump({"arms": bandit.summary(), "history": bandit.history}, fo, indent=2)
+    if parse_stats.messages:
+        logger.info(f"LLM parse statistics: {parse_stats.to_dict()}")
+        with open(parse_jsonfile, "w") as fo:
+            json.dump(parse_stats.to_dict(), fo, indent=2)
+    if repair_stats.rounds:
+        logger.info(f"LLM repair statistics: {repair_stats.to_dict()}")
+        with open(repair_jsonfile, "w") as fo:
+            json.dump(repair_stats.to_dict(), fo, indent=2)
+    if snap_stats.proposals:
+        logger.info(f"Snap rate: {snap_stats.snap_rate:.2f} ({snap_stats.snapped} of {snap_stats.snapped + snap_stats.unsnapped} out-of-space proposals)")
+        with open(snap_jsonfile, "w") as fo:
+            json.dump(snap_stats.to_dict(), fo, indent=2)
+    logger.removeHandler(file_handler)
+    file_handler.close()
     return df_samples
 
-if __name__ == "__main__":
+def build_parser():
+    """Command line options of an optimization run"""
     parser = argparse.ArgumentParser()
 
     # Property selection  
@@ -377,6 +1217,81 @@ if __name__ == "__main__":
         """  
     )  
 
+    parser.add_argument(  
+        "--context_budget",  
+        type=int,  
+        default=None,  
+        help="Token budget for the samples shown to the LLM. When the selected parents exceed it, a subset of top performers, Pareto members and a diverse spread by ligand composition is used"  
+    )  
+
+    parser.add_argument(  
+        "--alias_ligands",  
+        action="store_true",  
+        help="Refer to ligands by short aliases (L01, L02, ...) and round property values in the prompt to reduce its token count"  
+    )  
+
+    parser.add_argument(  
+        "--stream",  
+        action="store_true",  
+        help="Stream LLM responses and start evaluating each proposed TMC as soon as it is complete"  
+    )  
+
+    parser.add_argument(  
+        "--structured",  
+        action="store_true",  
+        help="Request structured output (JSON schema or tool call where supported, strict line grammar otherwise) and validate proposals before lookup"  
+    )  
+
+    parser.add_argument(  
+        "--staleness",  
+        type=int,  
+        default=0,  
+        help="Maximum number of iterations whose offspring may still be under evaluation when the next LLM request starts. 0 runs the generational loop; >0 pipelines proposal and evaluation"  
+    )  
+
+    parser.add_argument(  
+        "--eval_workers",  
+        type=int,  
+        default=1,  
+        help="Number of concurrent evaluations of streamed or pipelined TMCs"  
+    )  
+
+    parser.add_argument(  
+        "--evaluator",  
+        type=str,  
+        default="lookup",  
+        choices=["lookup", "xtb"],  
+        help="How proposed TMCs are evaluated: lookup in the ground truth table (TMCs outside it are dropped) or a molSimplify and xTB calculation"  
+    )  
+
+    parser.add_argument(  
+        "--xtb_root_path",  
+        type=str,  
+        default=None,  
+        help="Directory of the calculations of --evaluator xtb, defaults to <path>/xtb"  
+    )  
+
+    parser.add_argument(  
+        "--cache_dir",  
+        type=str,  
+        default=None,  
+        help="Directory of the xTB result cache shared with cal_new_ligand_space.py runs"  
+    )  
+
+    parser.add_argument(  
+        "--molsimplify_timeout",  
+        type=float,  
+        default=600,  
+        help="Wall-clock limit in seconds of one molSimplify build of --evaluator xtb"  
+    )  
+
+    parser.add_argument(  
+        "--xtb_timeout",  
+        type=float,  
+        default=3600,  
+        help="Wall-clock limit in seconds of one xTB optimization of --evaluator xtb"  
+    )  
+
     # LLM configuration  
     parser.add_argument(  
         "--llm_config",   
@@ -385,6 +1300,68 @@ if __name__ == "__main__":
         help="Path to YAML configuration file containing LLM API keys and settings"  
     )  
 
+    parser.add_argument(  
+        "--bandit_arms",  
+        type=str,  
+        default=None,  
+        help="Comma separated proposer arms model[:template[:temperature]] (e.g. gpt-4:PROMPT_MB:0.7,o1). A bandit picks the arm of every iteration by its gain per unit cost; overrides --model. --stream and --hedge_models apply to every arm; --staleness must be 0"  
+    )  
+
+    parser.add_argument(  
+        "--bandit_cost",  
+        type=str,  
+        default="dollar",  
+        choices=["dollar", "time"],  
+        help="Cost unit of the bandit reward: LLM price in dollars or wall time in seconds"  
+    )  
+
+    parser.add_argument(  
+        "--bandit_discount",  
+        type=float,  
+        default=0.9,  
+        help="Per-iteration discount of past bandit rewards; lower values adapt faster to changing arms"  
+    )  
+
+    parser.add_argument(  
+        "--repair_rounds",  
+        type=int,  
+        default=0,  
+        help="Follow-up turns asking the LLM to replace malformed, invalid-charge or unknown TMCs before an iteration is given up (0 disables repair)"  
+    )  
+
+    parser.add_argument(  
+        "--snap",  
+        action="store_true",  
+        help="Snap LLM proposals outside the search space (wrong ligand, invalid charge) to the nearest TMC of the space instead of dropping them"  
+    )  
+
+    parser.add_argument(  
+        "--snap_swaps",  
+        type=int,  
+        default=1,  
+        help="Largest number of ligand positions a snapped TMC may differ in; above 1 the whole space is scanned"  
+    )  
+
+    parser.add_argument(  
+        "--snap_similarity",  
+        action="store_true",  
+        help="Prefer snapping to ligands with the same charge and connecting atom element"  
+    )  
+
+    parser.add_argument(  
+        "--hedge_models",  
+        type=str,  
+        default=None,  
+        help="Comma separated secondary models (same names as --model) used for hedged requests and failover when the primary model is slow or failing"  
+    )  
+
+    parser.add_argument(  
+        "--hedge_percentile",  
+        type=float,  
+        default=95.0,  
+        help="Latency percentile of a model after which a hedge request is fired at the next model"  
+    )  
+
     # Output path  
     parser.add_argument(  
         "--path",   
@@ -393,5 +1370,13 @@ if __name__ == "__main__":
         help="Directory path where optimization results and logs will be saved"  
     )  
 
+    return parser
+
+if __name__ == "__main__":
+    parser = build_parser()
     opt = parser.parse_args()
+    try:
+        check_options(opt)
+    except ValueError as e:
+        parser.error(str(e))
     main(opt)
@@ -0,0 +1,132 @@
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from itertools import product
+
+from llmeo._utils.batch import (AnthropicBatchBackend, BatchCollector,
+                                BatchedLLM, LocalBatchBackend,
+                                OpenAIBatchBackend)
+from llmeo._utils.llm import GPT4, Claude3, GPTo1, LLMConfig, LLMError
+from llmeo.run_llmeo import build_llm_model, build_parser, main
+
+
+def get_batch_backend(opt, run_opt):
+    """
+    Create the batch backend for the model of the sweep.
+
+    Args:
+        opt: Sweep arguments
+        run_opt: Arguments shared by all runs
+
+    Returns:
+        Backend with `submit` and `poll` methods
+    """
+    if opt.batch_backend == "local":
+        return LocalBatchBackend(opt.batch_dir, name=run_opt.model)
+
+    model = build_llm_model(run_opt.model, LLMConfig.from_yaml(run_opt.llm_config))
+    if isinstance(model, (GPT4, GPTo1)):
+        backend = OpenAIBatchBackend(model)
+    elif isinstance(model, Claude3):
+        backend = AnthropicBatchBackend(model)
+    else:
+        raise LLMError(f"No batch endpoint for model: {run_opt.model}")
+    model.create()
+    return backend
+
+
+def run_sweep(run_opts, collector, logger):
+    """
+    Run all optimizations concurrently with their LLM calls batched.
+
+    Args:
+        run_opts: List of run arguments, one per run
+        collector: BatchCollector shared by the runs
+        logger: Logger instance
+
+    Returns:
+        list: Evaluated samples of every run (None for failed runs)
+    """
+    def run_one(run_opt):
+        try:
+            return main(run_opt, model=BatchedLLM(collector))
+        except Exception as e:
+            logger.error(f"Run seed={run_opt.seed} strategy={run_opt.strategy} failed: {str(e)}")
+            return None
+        finally:
+            collector.unregister()
+
+    for _ in run_opts:
+        collector.register()
+    with ThreadPoolExecutor(max_workers=len(run_opts)) as executor:
+        results = list(executor.map(run_one, run_opts))
+
+    logger.info(f"Batch statistics: {collector.stats}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a seed/strategy sweep of run_llmeo with LLM calls submitted as batch jobs. "
+        "Options not listed here are passed on to every run."
+    )
+    parser.add_argument(
+        "--seeds",
+        type=str,
+        default="0",
+        help="Comma separated random seeds of the runs"
+    )
+    parser.add_argument(
+        "--strategies",
+        type=str,
+        default="all",
+        help="Comma separated parent selection strategies of the runs"
+    )
+    parser.add_argument(
+        "--batch_backend",
+        type=str,
+        default="provider",
+        choices=["provider", "local"],
+        help="provider: OpenAI/Anthropic batch API of --model; local: batch files in --batch_dir completed by another process"
+    )
+    parser.add_argument(
+        "--batch_dir",
+        type=str,
+        default="./llm-batches",
+        help="Directory of the local batch backend"
+    )
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=60.0,
+        help="Seconds between polls of a running batch"
+    )
+    parser.add_argument(
+        "--max_wait",
+        type=float,
+        default=None,
+        help="Seconds a request may wait for the other runs before a partial batch is submitted"
+    )
+    opt, run_args = parser.parse_known_args()
+    base_opt = build_parser().parse_args(run_args)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+
+    run_opts = []
+    for seed, strategy in product(opt.seeds.split(","), opt.strategies.split(",")):
+        if strategy not in ("best", "all", "const"):
+            parser.error(f"invalid strategy: {strategy}")
+        run_opt = copy(base_opt)
+        run_opt.seed = int(seed)
+        run_opt.strategy = strategy
+        run_opts.append(run_opt)
+
+    collector = BatchCollector(
+        get_batch_backend(opt, base_opt),
+        poll_interval=opt.poll_interval,
+        max_wait=opt.max_wait,
+        logger=logger,
+    )
+    run_sweep(run_opts, collector, logger)
@@ -0,0 +1,72 @@
+"""
+Micro-benchmarks of the structure validation in mol_analysis.
+
+Run with `python tests/benchmark_mol_analysis.py`; compares the KD-tree
+adjacency of `radius_graph_is_connected` with the pairwise loop it replaced.
+With `--corpus ROOT --xtb_dir DIR`, the coordination fast path of
+`compare_connecting_idx` is checked against mol3D (needs molSimplify) on
+the xtbopt.xyz files in DIR and the molSimplify structures in ROOT.
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse.csgraph import connected_components
+
+from llmeo._utils.mol_analysis import radius_graph_is_connected, verify_coordination_fast_path
+
+
+def _loop_adjacency_matrix(positions, radius_cutoff):
+    """Pairwise loop the vectorized adjacency replaced, as in test_mol_analysis"""
+    adjacency_matrix = np.zeros((len(positions), len(positions)))
+    for i in range(len(positions)):
+        for j in range(i + 1, len(positions)):
+            if np.linalg.norm(np.array(positions[i]) - np.array(positions[j])) <= radius_cutoff:
+                adjacency_matrix[i, j] = adjacency_matrix[j, i] = 1
+    return adjacency_matrix
+
+
+def _structure(n_atoms, seed=0):
+    """Random atoms at roughly molecular density, 1.5 A apart on average"""
+    return (np.random.default_rng(seed).random((n_atoms, 3)) * 1.5 * n_atoms ** (1 / 3)).tolist()
+
+
+def _time(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def corpus_pairs(root_path, xtb_dir):
+    """(xtbopt.xyz, molSimplify XYZ) pairs of the runs stored below xtb_dir and root_path"""
+    for run in sorted(Path(xtb_dir).iterdir()):
+        optimized = run / "xtbopt.xyz"
+        built = [path for path in (Path(root_path) / "molSimplify_xyz" / run.name).rglob("*.xyz")
+                 if "badjob" not in str(path)]
+        if optimized.exists() and built:
+            yield optimized, built[0]
+
+
+def benchmark_radius_graph(sizes=(25, 50, 100, 200, 500, 1000), repeats=20):
+    print(f"{'atoms':>6} {'loop ms':>10} {'kd-tree ms':>11} {'speedup':>8}")
+    for n_atoms in sizes:
+        positions = _structure(n_atoms)
+        loop = _time(lambda: connected_components(_loop_adjacency_matrix(positions, 3.0)), max(1, repeats // 10))
+        tree = _time(lambda: radius_graph_is_connected(positions, 3.0), repeats)
+        print(f"{n_atoms:>6} {loop * 1e3:>10.2f} {tree * 1e3:>11.3f} {loop / tree:>7.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark and verify the structure validation")
+    parser.add_argument("--corpus", type=str, default=None, help="Root path holding molSimplify_xyz/")
+    parser.add_argument("--xtb_dir", type=str, default=None, help="Directory holding the xtb_xyz/<fileName>/ runs")
+    opt = parser.parse_args()
+    if opt.corpus:
+        pairs = list(corpus_pairs(opt.corpus, opt.xtb_dir or Path(opt.corpus) / "xtb_xyz"))
+        start = time.perf_counter()
+        print(verify_coordination_fast_path(pairs))
+        print(f"{len(pairs)} pairs in {time.perf_counter() - start:.1f}s")
+    else:
+        benchmark_radius_graph()
@@ -0,0 +1,63 @@
+from unittest.mock import MagicMock
+
+import pytest
+from llmeo._utils.bandit import BanditArm, BanditScheduler
+
+
+def _arm(name):
+    model = MagicMock()
+    model.name = name
+    return BanditArm(model)
+
+
+def test_bandit_tries_every_arm_first():
+    """Test that each arm is pulled once before exploiting"""
+    arms = [_arm("a"), _arm("b"), _arm("c")]
+    bandit = BanditScheduler(arms, seed=0)
+    pulled = []
+    for _ in arms:
+        arm = bandit.select()
+        pulled.append(arm.name)
+        bandit.update(arm, gain=1, seconds=1.0, dollars=0.01)
+    assert sorted(pulled) == sorted(arm.name for arm in arms)
+
+
+@pytest.mark.parametrize("cost,cheap_stats", [
+    ("dollar", {"seconds": 60.0, "dollars": 0.01}),
+    ("time", {"seconds": 5.0, "dollars": 1.0}),
+])
+def test_bandit_prefers_gain_per_cost(cost, cheap_stats):
+    """Test that pulls shift to the arm with the best gain per unit cost"""
+    cheap, expensive = _arm("cheap"), _arm("expensive")
+    bandit = BanditScheduler([cheap, expensive], cost=cost, seed=0)
+    for _ in range(30):
+        arm = bandit.select()
+        if arm is cheap:
+            bandit.update(arm, gain=2, **cheap_stats)
+        else:
+            bandit.update(arm, gain=3, seconds=30.0, dollars=0.5)
+
+    summary = {row["arm"]: row for row in bandit.summary()}
+    assert summary["cheap:default:default"]["pulls"] > 20
+    assert summary["cheap:default:default"]["gain_per_dollar"] == pytest.approx(2 / cheap_stats["dollars"])
+
+
+def test_bandit_adapts_when_arm_stops_paying_off():
+    """Test that discounting moves away from an arm whose gains dry up"""
+    first, second = _arm("first"), _arm("second")
+    bandit = BanditScheduler([first, second], discount=0.8, seed=0)
+    gains = {"first": 5, "second": 1}
+    for ii in range(60):
+        if ii == 20:
+            gains["first"] = 0
+        arm = bandit.select()
+        bandit.update(arm, gain=gains[arm.model.name], seconds=1.0, dollars=0.1)
+    late = [record["arm"] for record in bandit.history[-20:]]
+    assert late.count("second:default:default") > 15
+
+
+def test_bandit_rejects_invalid_configuration():
+    with pytest.raises(ValueError):
+        BanditScheduler([])
+    with pytest.raises(ValueError):
+        BanditScheduler([_arm("a")], cost="tokens")
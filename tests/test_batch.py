@@ -0,0 +1,175 @@
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from llmeo import GPT4, Claude3, LLMError
+from llmeo._utils.batch import (BATCH_DISCOUNT, AnthropicBatchBackend,
+                                BatchCollector, BatchedLLM, LocalBatchBackend,
+                                OpenAIBatchBackend)
+from llmeo.run_sweep import run_sweep
+
+
+def _echo(request):
+    return f"echo {request.content}"
+
+
+def _ask_concurrently(collector, prompts):
+    """Send one prompt per registered run from its own thread"""
+    results = {}
+
+    def ask(prompt):
+        try:
+            results[prompt] = collector.request(prompt).text
+        except LLMError as e:
+            results[prompt] = e
+        finally:
+            collector.unregister()
+
+    for _ in prompts:
+        collector.register()
+    threads = [threading.Thread(target=ask, args=(prompt,)) for prompt in prompts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def test_collector_batches_one_request_per_run(tmp_path):
+    """Test that one generation step of all runs becomes a single batch"""
+    collector = BatchCollector(LocalBatchBackend(str(tmp_path), responder=_echo), poll_interval=0.01)
+    results = _ask_concurrently(collector, ["a", "b", "c"])
+
+    assert results == {"a": "echo a", "b": "echo b", "c": "echo c"}
+    assert collector.stats == {"batches": 1, "requests": 3, "errors": 0}
+    batch_dir = next(tmp_path.iterdir())
+    inputs = [json.loads(line) for line in (batch_dir / "input.jsonl").read_text().splitlines()]
+    assert sorted(record["content"] for record in inputs) == ["a", "b", "c"]
+
+
+def test_collector_waits_for_external_completion(tmp_path):
+    """Test that a batch resolves once another process writes its output"""
+    backend = LocalBatchBackend(str(tmp_path))
+    collector = BatchCollector(backend, poll_interval=0.01)
+    collector.register()
+    model = BatchedLLM(collector)
+
+    answer = {}
+    thread = threading.Thread(target=lambda: answer.update(text=model.call("prompt")))
+    thread.start()
+    while not any(tmp_path.iterdir()):
+        thread.join(timeout=0.01)
+    batch_dir = next(tmp_path.iterdir())
+    while not (batch_dir / "input.jsonl").exists():
+        thread.join(timeout=0.01)
+    request = json.loads((batch_dir / "input.jsonl").read_text())
+    backend.write_output(batch_dir.name, [{"custom_id": request["custom_id"], "text": "done"}])
+    thread.join(timeout=10)
+
+    assert answer == {"text": "done"}
+
+
+def test_collector_max_wait_submits_partial_batch(tmp_path):
+    """Test that a run is not blocked forever by a run that never asks"""
+    collector = BatchCollector(
+        LocalBatchBackend(str(tmp_path), responder=_echo), poll_interval=0.01, max_wait=0.05
+    )
+    collector.register()
+    collector.register()  # second run never sends a request
+    assert collector.request("alone").text == "echo alone"
+    assert collector.stats["requests"] == 1
+
+
+def test_collector_propagates_request_errors(tmp_path):
+    """Test that failed requests raise LLMError in their own run only"""
+    def responder(request):
+        if request.content == "bad":
+            raise ValueError("refused")
+        return "ok"
+
+    collector = BatchCollector(LocalBatchBackend(str(tmp_path), responder=responder), poll_interval=0.01)
+    results = _ask_concurrently(collector, ["good", "bad"])
+
+    assert results["good"] == "ok"
+    assert isinstance(results["bad"], LLMError)
+    assert collector.stats["errors"] == 1
+
+
+def test_openai_batch_backend(test_config):
+    """Test OpenAI batch file contents and result parsing"""
+    model = GPT4(test_config)
+    model.client = MagicMock()
+    model.client.batches.create.return_value.id = "batch_1"
+    backend = OpenAIBatchBackend(model)
+    backend.submit([MagicMock(custom_id="req-0", content="hello", system=None, response_schema=None)])
+
+    uploaded = model.client.files.create.call_args[1]["file"][1].decode()
+    body = json.loads(uploaded)["body"]
+    assert body["model"] == "gpt-4"
+    assert body["messages"][-1] == {"role": "user", "content": "hello"}
+
+    model.client.batches.retrieve.return_value = MagicMock(status="in_progress")
+    assert backend.poll("batch_1") is None
+
+    model.client.batches.retrieve.return_value = MagicMock(
+        status="completed", output_file_id="file_out", error_file_id=None
+    )
+    model.client.files.content.return_value.text = json.dumps({
+        "custom_id": "req-0",
+        "response": {"status_code": 200, "body": {
+            "id": "c", "object": "chat.completion", "created": 0, "model": "gpt-4",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "hi"}}],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": 100, "total_tokens": 1100},
+        }},
+    })
+    result = backend.poll("batch_1")["req-0"]
+    assert result.text == "hi"
+    assert result.usage.input_tokens == 1000
+    assert result.usage.cost == pytest.approx((1000 * 30 + 100 * 60) / 1e6 * BATCH_DISCOUNT)
+
+
+def test_anthropic_batch_backend(test_config):
+    """Test Anthropic batch requests and result parsing"""
+    model = Claude3(test_config)
+    model.client = MagicMock()
+    model.client.messages.batches.create.return_value.id = "msgbatch_1"
+    backend = AnthropicBatchBackend(model)
+    schema = {"type": "object"}
+    backend.submit([MagicMock(custom_id="req-0", content="hello", system="sys", response_schema=schema)])
+
+    params = model.client.messages.batches.create.call_args[1]["requests"][0]["params"]
+    assert params["system"] == "sys"
+    assert params["tools"][0]["input_schema"] is schema
+
+    model.client.messages.batches.retrieve.return_value.processing_status = "ended"
+    block = MagicMock(type="tool_use", input={"tmcs": []})
+    succeeded = MagicMock(custom_id="req-0")
+    succeeded.result.type = "succeeded"
+    succeeded.result.message.content = [block]
+    succeeded.result.message.usage = MagicMock(
+        input_tokens=10, output_tokens=5, cache_read_input_tokens=0, cache_creation_input_tokens=0
+    )
+    errored = MagicMock(custom_id="req-1")
+    errored.result.type = "errored"
+    model.client.messages.batches.results.return_value = [succeeded, errored]
+
+    results = backend.poll("msgbatch_1")
+    assert results["req-0"].text == '{"tmcs": []}'
+    assert results["req-0"].usage.input_tokens == 10
+    assert isinstance(results["req-1"], LLMError)
+
+
+def test_run_sweep_unregisters_failed_runs(tmp_path, mock_logger):
+    """Test that a failing run releases the batch barrier for the others"""
+    collector = BatchCollector(LocalBatchBackend(str(tmp_path), responder=_echo), poll_interval=0.01)
+    opts = [MagicMock(seed=0, strategy="all"), MagicMock(seed=1, strategy="all")]
+
+    def fake_main(opt, model):
+        if opt.seed == 0:
+            raise RuntimeError("broken run")
+        return model.call("prompt")
+
+    with patch("llmeo.run_sweep.main", fake_main):
+        assert run_sweep(opts, collector, mock_logger) == [None, "echo prompt"]
@@ -0,0 +1,72 @@
+import json
+import os
+
+from llmeo._utils.cache import XtbCache, canonical_ligands, error_class
+
+VERSIONS = {"xtb": "6.7.1", "molSimplify": "1.7.3", "uxtbpy": "0.1"}
+LIGANDS = [("CP(C)C", 2), ("O", 1), ("[Br-]", 1), ("N", 1)]
+PARAMETERS = "--opt tight --uhf 0 --norestart -v"
+
+
+def test_key_is_rotation_invariant(tmp_path):
+    """Test that the four rotations of a TMC share one key while reflections do not"""
+    cache = XtbCache(str(tmp_path), versions=VERSIONS)
+    keys = {cache.key(LIGANDS[i:] + LIGANDS[:i], 0, PARAMETERS) for i in range(4)}
+    assert len(keys) == 1
+    assert canonical_ligands(LIGANDS) == canonical_ligands(LIGANDS[2:] + LIGANDS[:2])
+
+    swapped = [LIGANDS[1], LIGANDS[0]] + LIGANDS[2:]
+    assert cache.key(swapped, 0, PARAMETERS) not in keys
+
+
+def test_key_depends_on_charge_parameters_and_versions(tmp_path):
+    """Test that any change of the calculation setup gives a new key"""
+    cache = XtbCache(str(tmp_path), versions=VERSIONS)
+    key = cache.key(LIGANDS, 0, PARAMETERS)
+    assert cache.key(LIGANDS, 1, PARAMETERS) != key
+    assert cache.key(LIGANDS, 0, PARAMETERS.replace("tight", "loose")) != key
+    assert cache.key([("CP(C)C", 1)] + LIGANDS[1:], 0, PARAMETERS) != key
+
+    newer = XtbCache(str(tmp_path), versions=dict(VERSIONS, xtb="6.7.2"))
+    assert newer.key(LIGANDS, 0, PARAMETERS) != key
+
+
+def test_put_get_roundtrip(tmp_path):
+    """Test that stored entries are read back by any cache on the same directory"""
+    cache = XtbCache(str(tmp_path), versions=VERSIONS)
+    key = cache.key(LIGANDS, 0, PARAMETERS)
+    assert cache.get(key) is None
+
+    entry = {"_error": "", "fileName": 42, "homo_lumo_gap": 3.2, "polarisability": 250.0, "optimised_xyz": "1\n\nPd 0 0 0"}
+    assert cache.put(key, entry)
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+    other = XtbCache(str(tmp_path), versions=VERSIONS)
+    stored = other.get(key)
+    assert stored["homo_lumo_gap"] == 3.2
+    assert stored["error_class"] == "ok"
+    assert cache.stats == {"hits": 0, "misses": 1, "hit_rate": 0.0}
+    assert other.stats["hit_rate"] == 1.0
+
+
+def test_put_skips_transient_failures(tmp_path):
+    """Test that only reproducible outcomes are cached"""
+    cache = XtbCache(str(tmp_path), versions=VERSIONS)
+    key = cache.key(LIGANDS, 0, PARAMETERS)
+    assert not cache.put(key, {"_error": "XtbRunner failed: no such file", "homo_lumo_gap": ""})
+    assert not cache.put(key, {"_error": "Worker error: killed", "homo_lumo_gap": ""})
+    assert not cache.put(key, {"_error": "", "homo_lumo_gap": ""})
+    assert cache.get(key) is None
+
+    assert cache.put(key, {"_error": "Graph not connected", "homo_lumo_gap": 3.0})
+    with open(cache._path(key)) as fo:
+        assert json.load(fo)["error_class"] == "fragmented"
+
+
+def test_error_class():
+    """Test classification of the `_error` messages"""
+    assert error_class("") == "ok"
+    assert error_class(float("nan")) == "ok"
+    assert error_class("Bad Structure: 12 MolSimplify failed") == "build_failed"
+    assert error_class("Connecting indices change") == "connectivity_changed"
+    assert error_class("something new") == "unknown"
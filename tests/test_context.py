@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from llmeo._utils.context import (estimate_tokens, ligand_composition,
+                                  pareto_mask, select_context)
+from llmeo._utils.utils import make_text_for_existing_tmcs
+
+
+@pytest.fixture
+def space_charges(sample_search_space):
+    """Charges for every ligand of the sample search space"""
+    ligs = set(sample_search_space[["lig1", "lig2", "lig3", "lig4"]].to_numpy().ravel())
+    return {lig: 0 for lig in ligs}
+
+
+def test_pareto_mask_matches_sweep(sample_search_space):
+    """Test the vectorized Pareto mask against a brute-force dominance check"""
+    gap = sample_search_space["gap"].to_numpy()
+    pol = sample_search_space["polarisability"].to_numpy()
+    dominated = ((gap[None, :] >= gap[:, None]) & (pol[None, :] >= pol[:, None])
+                 & ((gap[None, :] > gap[:, None]) | (pol[None, :] > pol[:, None]))).any(axis=1)
+    np.testing.assert_array_equal(pareto_mask(gap, pol), ~dominated)
+
+
+def test_pareto_mask_directions(sample_search_space):
+    """Test that minimized objectives flip the dominance of the Pareto mask"""
+    gap = sample_search_space["gap"].to_numpy()
+    pol = sample_search_space["polarisability"].to_numpy()
+    dominated = ((gap[None, :] <= gap[:, None]) & (pol[None, :] >= pol[:, None])
+                 & ((gap[None, :] < gap[:, None]) | (pol[None, :] > pol[:, None]))).any(axis=1)
+    np.testing.assert_array_equal(pareto_mask(gap, pol, maximize1=False), ~dominated)
+    np.testing.assert_array_equal(pareto_mask(-gap, pol), ~dominated)
+
+
+def test_select_context_mpsg_pareto(sample_search_space, space_charges):
+    """Test that for mpsg the Pareto share goes to small-gap, large-polarisability TMCs"""
+    props = ["gap", "polarisability"]
+    frontier = sample_search_space[pareto_mask(
+        sample_search_space["gap"].to_numpy(), sample_search_space["polarisability"].to_numpy(), maximize1=False
+    )]
+    budget = sum(estimate_tokens(line + "\n") for line in
+                 make_text_for_existing_tmcs(frontier, space_charges, props).split("\n"))
+
+    selected = select_context(sample_search_space, space_charges, props, "mpsg", budget,
+                              top_fraction=0.0, pareto_fraction=1.0, seed=0)
+    assert set(selected["id"]) == set(frontier["id"])
+
+
+def test_ligand_composition(sample_tmc_data):
+    """Test that composition counts sum to four ligands per TMC"""
+    counts = ligand_composition(sample_tmc_data)
+    assert counts.shape == (4, 6)
+    assert (counts.sum(axis=1) == 4).all()
+    assert counts[1].max() == 3  # three WECJIA ligands
+
+
+def test_select_context_fits_budget(sample_search_space, space_charges):
+    """Test that the selection respects the budget and keeps top and Pareto TMCs"""
+    props = ["gap", "polarisability"]
+    full = make_text_for_existing_tmcs(sample_search_space, space_charges, props)
+    budget = estimate_tokens(full) // 5
+
+    selected = select_context(sample_search_space, space_charges, props, "pf", budget, seed=0)
+
+    assert 0 < len(selected) < len(sample_search_space)
+    assert selected["id"].is_unique
+    assert estimate_tokens(make_text_for_existing_tmcs(selected, space_charges, props)) <= budget
+    best = sample_search_space.loc[
+        (sample_search_space["gap"] * sample_search_space["polarisability"]).idxmax(), "id"]
+    assert best in set(selected["id"])
+    # Selection beyond the top performers covers every ligand of the space
+    ligs = ["lig1", "lig2", "lig3", "lig4"]
+    assert set(selected[ligs].to_numpy().ravel()) == set(sample_search_space[ligs].to_numpy().ravel())
+
+
+def test_select_context_under_budget_keeps_all(sample_tmc_data, lig_charges):
+    """Test that nothing is dropped when everything fits"""
+    selected = select_context(sample_tmc_data, lig_charges, ["gap"], "gap", 10**6, seed=0)
+    assert sorted(selected["id"]) == sorted(sample_tmc_data["id"])
@@ -0,0 +1,69 @@
+import threading
+
+import pandas as pd
+import pytest
+from llmeo._utils.evaluator import XtbEvaluator
+from llmeo.run_llmeo import build_parser, get_evaluator
+
+
+@pytest.fixture
+def ligand_table(sample_ligand_data):
+    return sample_ligand_data.rename(columns={
+        "smiles": "SMILES",
+        "connecting_atom": "connecting atom element",
+        "connecting_index": "connecting atom index",
+    })
+
+
+def test_frame_layout(ligand_table, tmp_path):
+    """Test that a TMC becomes a row in the layout of the generated ligand spaces"""
+    evaluator = XtbEvaluator(ligand_table, str(tmp_path))
+    df = evaluator.frame("Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_MEBXUN-subgraph-1_CORTOU-subgraph-2")
+
+    row = df.iloc[0]
+    assert row["lig1"] == "WECJIA-subgraph-3" and row["lig2_smiles"] == "[Br-]"
+    assert row["lig4_element"] == "I" and row["lig3_index"] == 1
+    assert row["charge"] == 0
+    rotated = evaluator.frame("Pd_OBONEA-subgraph-1_MEBXUN-subgraph-1_CORTOU-subgraph-2_WECJIA-subgraph-3")
+    assert rotated.iloc[0]["id"] == row["id"]
+
+    assert evaluator.frame("Pd_UNKNOWN_OBONEA-subgraph-1_MEBXUN-subgraph-1_CORTOU-subgraph-2") is None
+    assert evaluator.frame("Pd_WECJIA-subgraph-3") is None
+    assert evaluator("Pd_UNKNOWN_OBONEA-subgraph-1_MEBXUN-subgraph-1_CORTOU-subgraph-2") is None
+
+
+def test_repeats_calculated_once(ligand_table, tmp_path, monkeypatch):
+    """Test that concurrent calls for rotations of a TMC run one calculation"""
+    evaluator = XtbEvaluator(ligand_table, str(tmp_path))
+    calls = []
+
+    def fake_evaluate(df):
+        calls.append(df.loc[0, "id"])
+        return df.assign(gap=1.0, polarisability=100.0)
+
+    monkeypatch.setattr(evaluator, "_evaluate", fake_evaluate)
+    ligs = ["WECJIA-subgraph-3", "OBONEA-subgraph-1", "MEBXUN-subgraph-1", "CORTOU-subgraph-2"]
+    results = []
+    threads = [
+        threading.Thread(target=lambda i=i: results.append(evaluator("Pd_" + "_".join(ligs[i:] + ligs[:i]))))
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(isinstance(df, pd.DataFrame) and df["gap"].iloc[0] == 1.0 for df in results)
+
+
+def test_get_evaluator(ligand_table, tmp_path):
+    """Test that --evaluator selects the lookup or an xTB evaluator below --path"""
+    opt = build_parser().parse_args(["--path", str(tmp_path)])
+    assert get_evaluator(opt, ligand_table) is None
+
+    opt = build_parser().parse_args(["--path", str(tmp_path), "--evaluator", "xtb"])
+    evaluator = get_evaluator(opt, ligand_table)
+    assert isinstance(evaluator, XtbEvaluator)
+    assert evaluator.root_path == str((tmp_path / "xtb").absolute())
+    assert evaluator.limits["xtb"].timeout == 3600
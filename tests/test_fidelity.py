@@ -0,0 +1,74 @@
+import pickle
+
+import pandas as pd
+import pytest
+from llmeo._utils.fidelity import (FINAL_TIER, NOT_PROMOTED, PASSED, REJECTED, TIER_PRESETS, MinGap,
+                                   add_tier_record, parse_tiers, reject_last_tier, summarize_tiers,
+                                   tiers_signature)
+from llmeo._utils.utils import TIERS_COLUMN
+
+
+def test_parse_tiers():
+    """Test that presets are parsed in order and the promotion rule goes to the last tier"""
+    assert parse_tiers("") == []
+    assert parse_tiers(None) == []
+    tiers = parse_tiers(" gfnff, gfn2-crude ", promote_min_gap=1.5)
+    assert [tier.name for tier in tiers] == ["gfnff", "gfn2-crude"]
+    assert tiers[0].parameters == TIER_PRESETS["gfnff"]
+    assert tiers[0].promote is None
+    assert tiers[1].promote({"homo_lumo_gap": 2.0})
+    assert not tiers[1].promote({"homo_lumo_gap": 1.0})
+    assert tiers[1].promote({})
+    with pytest.raises(ValueError):
+        parse_tiers("gfnff,dft")
+
+
+def test_tiers_survive_pickling():
+    """Test that tiers can be sent to worker processes"""
+    tiers = pickle.loads(pickle.dumps(parse_tiers("gfn0", promote_min_gap=1.0)))
+    assert not tiers[0].promote({"homo_lumo_gap": 0.5})
+    assert tiers_signature(tiers) == tiers_signature(parse_tiers("gfn0", promote_min_gap=1.0))
+
+
+def test_signature_separates_configurations():
+    """Test that results of other tier configurations get other cache keys"""
+    assert tiers_signature(None) == ""
+    assert tiers_signature([]) == ""
+    signatures = {
+        tiers_signature(parse_tiers(spec, gap))
+        for spec, gap in [("gfnff", None), ("gfn2-crude", None), ("gfnff", 1.0), ("gfnff", 2.0),
+                          ("gfnff,gfn2-crude", None)]
+    }
+    assert len(signatures) == 5
+    assert MinGap(1.0).signature in tiers_signature(parse_tiers("gfnff", 1.0))
+
+
+def test_tier_records():
+    """Test that tier outcomes accumulate and a failed validation rejects the final tier"""
+    df = pd.DataFrame({TIERS_COLUMN: ["", ""]}, dtype=object)
+    add_tier_record(df, 0, "gfnff", PASSED, 1.234)
+    add_tier_record(df, 0, FINAL_TIER, PASSED, 10)
+    reject_last_tier(df, 0)
+    reject_last_tier(df, 1)
+    assert df.loc[0, TIERS_COLUMN] == "gfnff:passed:1.23;gfn2:rejected:10.00"
+    assert df.loc[1, TIERS_COLUMN] == ""
+
+
+def test_summarize_tiers():
+    """Test pass rates and times per tier"""
+    summary = summarize_tiers([
+        "gfnff:passed:1.00;gfn2:passed:10.00",
+        "gfnff:rejected:2.00",
+        f"gfnff:{NOT_PROMOTED}:3.00",
+        "gfnff:passed:2.00;gfn2:failed:20.00",
+        "",
+        float("nan"),
+    ])
+    assert list(summary) == ["gfnff", FINAL_TIER]
+    assert summary["gfnff"]["entered"] == 4
+    assert summary["gfnff"][PASSED] == 2
+    assert summary["gfnff"][REJECTED] == 1
+    assert summary["gfnff"][NOT_PROMOTED] == 1
+    assert summary["gfnff"]["pass_rate"] == 0.5
+    assert summary["gfnff"]["mean_seconds"] == 2.0
+    assert summary[FINAL_TIER]["seconds"] == 30.0
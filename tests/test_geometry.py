@@ -0,0 +1,99 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from llmeo._utils.geometry import (INITIAL, OPTIMIZED, GeometryArchive, migrate_run_directories,
+                                   parse_xyz_text, read_xyz, write_xyz)
+
+WATER = "3\nwater\nO 0.0 0.0 0.1\nH 0.76 0.0 -0.45\nH -0.76 0.0 -0.45\n"
+
+
+def test_parse_xyz_text():
+    """Test the vectorized reader, including extra columns and trailing frames"""
+    elements, coords, comment = parse_xyz_text(WATER + WATER)
+    assert elements == ["O", "H", "H"]
+    assert comment == "water"
+    assert np.allclose(coords, [[0.0, 0.0, 0.1], [0.76, 0.0, -0.45], [-0.76, 0.0, -0.45]])
+
+    charges = "2\n\nNa 0 0 0 1.0\nCl 2.4 0 0 -1.0\n"
+    elements, coords, _ = parse_xyz_text(charges)
+    assert elements == ["Na", "Cl"]
+    assert coords[1, 0] == 2.4
+    with pytest.raises(ValueError):
+        parse_xyz_text("4\n\nO 0 0 0\nH 1 0 0\n")
+
+
+def test_archive_roundtrip(tmp_path):
+    """Test that structures come back as float32 views and later puts supersede earlier ones"""
+    archive = GeometryArchive(str(tmp_path), shard="a")
+    coords = np.random.default_rng(0).random((3, 3)) * 10
+    archive.put("mol", ["O", "H", "H"], coords, kind=INITIAL)
+    archive.put("mol", ["O", "H", "H"], coords + 1, comment="energy -5.0")
+    with pytest.raises(ValueError):
+        archive.put("bad", ["O"], coords)
+
+    elements, stored, comment = archive.get("mol")
+    assert elements == ["O", "H", "H"] and comment == "energy -5.0"
+    assert stored.dtype == np.float32 and not stored.flags.writeable
+    assert np.allclose(stored, coords + 1, atol=1e-5)
+    assert np.allclose(archive.get("mol", INITIAL)[1], coords, atol=1e-5)
+    assert archive.get("other") is None
+
+    archive.put("mol", ["O", "H", "H"], coords + 2)
+    archive.refresh()
+    assert np.allclose(archive.get("mol")[1], coords + 2, atol=1e-5)
+    assert archive.keys(INITIAL) == ["mol"]
+
+
+def test_archive_shards_and_partial_index(tmp_path):
+    """Test that readers see every shard and skip an index line still being written"""
+    writer = GeometryArchive(str(tmp_path), shard="w1")
+    writer.put("a", ["O", "H", "H"], np.zeros((3, 3)))
+    pickle.loads(pickle.dumps(GeometryArchive(str(tmp_path), shard="w2"))).put("b", ["H"], np.ones((1, 3)))
+    with open(tmp_path / "w2.idx", "a") as fo:
+        fo.write('{"key": "c", "kind": "optim')
+
+    reader = GeometryArchive(str(tmp_path))
+    assert reader.keys() == ["a", "b"]
+    assert np.array_equal(reader.get("b")[1], np.ones((1, 3), dtype=np.float32))
+
+    reader.export_xyz("a", str(tmp_path / "a.xyz"))
+    assert read_xyz(str(tmp_path / "a.xyz"))[0] == ["O", "H", "H"]
+    assert not reader.export_xyz("c", str(tmp_path / "c.xyz"))
+
+
+def test_concurrent_readers(tmp_path):
+    """Test that threads refreshing one archive together see every structure"""
+    writer = GeometryArchive(str(tmp_path), shard="w")
+    for i in range(200):
+        writer.put(f"mol{i}", ["H"], np.full((1, 3), i))
+
+    reader = GeometryArchive(str(tmp_path))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        found = list(executor.map(lambda i: reader.get(f"mol{i}") is not None, range(200)))
+    assert all(found)
+    assert len(reader.keys()) == 200
+
+
+def test_migrate_run_directories(tmp_path):
+    """Test that migration archives every readable structure once and removes only archived runs"""
+    for name in ("111", "222"):
+        run = tmp_path / "molSimplify_xyz" / name / "Pd_sqp" / "run"
+        run.mkdir(parents=True)
+        write_xyz(str(run / f"{name}.xyz"), ["O", "H", "H"], np.zeros((3, 3)))
+    bad = tmp_path / "molSimplify_xyz" / "333" / "badjob"
+    bad.mkdir(parents=True)
+    write_xyz(str(bad / "333.xyz"), ["H"], np.zeros((1, 3)))
+    (tmp_path / "xtb_xyz" / "111").mkdir(parents=True)
+    (tmp_path / "xtb_xyz" / "111" / "xtbopt.xyz").write_text(WATER)
+
+    archive = GeometryArchive(str(tmp_path / "archive"), shard="migrated")
+    counts = migrate_run_directories(archive, str(tmp_path))
+    assert counts == {INITIAL: 2, OPTIMIZED: 1, "skipped": 0, "unreadable": 1, "removed": 0}
+    assert archive.keys(INITIAL) == ["111", "222"]
+
+    counts = migrate_run_directories(archive, str(tmp_path), remove=True)
+    assert counts == {INITIAL: 0, OPTIMIZED: 0, "skipped": 3, "unreadable": 1, "removed": 3}
+    assert [path.name for path in (tmp_path / "molSimplify_xyz").iterdir()] == ["333"]
+    assert not (tmp_path / "xtb_xyz" / "111").exists()
@@ -0,0 +1,112 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+import pytest
+from llmeo._utils.cache import TRANSIENT_ERRORS, error_class
+from llmeo._utils.jobs import (CoreBudget, JobKilled, JobLimits, JobTimeout,
+                               run_command, run_function, set_core_budget)
+
+
+def test_run_command_pins_threads():
+    """Test that the job sees the thread count of its limits"""
+    result = run_command("echo $OMP_NUM_THREADS", JobLimits(threads=3), shell=True)
+    assert result.returncode == 0
+    assert result.stdout.decode().strip() == "3"
+
+
+def test_run_command_timeout_kills_process_group(tmp_path):
+    """Test that a hanging job and its children are killed at the timeout"""
+    marker = tmp_path / "marker"
+    start = time.perf_counter()
+    with pytest.raises(JobTimeout) as info:
+        run_command(f"sleep 1 && touch {marker} & sleep 5", JobLimits(timeout=0.3), name="molSimplify", shell=True)
+    assert time.perf_counter() - start < 3
+    assert error_class(str(info.value)) == "timeout"
+    time.sleep(1.2)
+    assert not marker.exists()
+
+
+def test_run_command_memory_limit():
+    """Test that the address space limit applies to the job"""
+    command = [sys.executable, "-c", "b = bytearray(512 * 1024 * 1024)"]
+    assert run_command(command).returncode == 0
+    assert run_command(command, JobLimits(memory_mb=256)).returncode != 0
+
+
+def _square(x):
+    return x * x
+
+
+def _hang():
+    time.sleep(10)
+
+
+def _die():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def _fail():
+    raise ValueError("bad geometry")
+
+
+def _niceness():
+    return os.nice(0), os.environ["OMP_NUM_THREADS"]
+
+
+def test_run_function():
+    """Test results, limits and failures of functions run in a child process"""
+    assert run_function(_square, 7, limits=JobLimits(timeout=10)) == 49
+    assert run_function(_niceness, limits=JobLimits(nice=5, threads=2)) == (os.nice(0) + 5, "2")
+
+    with pytest.raises(JobTimeout):
+        run_function(_hang, limits=JobLimits(timeout=0.3), name="xTB")
+    with pytest.raises(JobKilled) as info:
+        run_function(_die, name="xTB")
+    assert error_class(str(info.value)) == "killed"
+    with pytest.raises(RuntimeError, match="bad geometry"):
+        run_function(_fail)
+    assert {"timeout", "killed"} <= TRANSIENT_ERRORS
+
+
+def test_run_function_from_threads():
+    """Test that functions run from several threads, which must not fork, return their results"""
+    results = {}
+
+    def call(x):
+        results[x] = run_function(_square, x, limits=JobLimits(timeout=30))
+
+    threads = [threading.Thread(target=call, args=(x,)) for x in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {x: x * x for x in range(4)}
+
+
+def test_core_budget_limits_concurrent_threads():
+    """Test that concurrent jobs never hold more cores than the budget"""
+    budget = CoreBudget(4)
+    set_core_budget(budget)
+    lowest = []
+
+    def job():
+        run_command("sleep 0.2", JobLimits(threads=3), shell=True)
+
+    def watch():
+        while any(thread.is_alive() for thread in jobs):
+            lowest.append(budget.free)
+            time.sleep(0.01)
+
+    try:
+        jobs = [threading.Thread(target=job) for _ in range(3)]
+        for thread in jobs:
+            thread.start()
+        watch()
+    finally:
+        set_core_budget(None)
+
+    assert min(lowest) >= 1
+    assert budget.free == 4
@@ -0,0 +1,71 @@
+import json
+import pickle
+
+import pandas as pd
+from llmeo._utils.ligands import LIGANDS, LigandTable, prepare_ligands
+
+
+def test_connecting_atom_lookup():
+    """Test that lookups resolve connecting atoms like find_index did"""
+    table = LigandTable()
+    assert table.info("CP(C)C", "P", 1).index == 2
+    assert table.info("CCN(CC)CCP(C)C", "C", 3).index == 4
+    assert table.info("CCN(CC)CCP(C)C", "C", "3").index == 4
+
+    missing = table.info("CP(C)C", "P", 2)
+    assert missing.index is None and "2-th occurrence of atom 'P'" in missing.error
+    assert not missing.valid
+    assert table.info("CP(C)C", "P", float("nan")).index is None
+    invalid = table.info("not a smiles", "P", 1)
+    assert invalid.index is None and invalid.atoms == 0 and not invalid.valid
+
+
+def test_parsed_once():
+    """Test that a SMILES is parsed once however many rows and attachments use it"""
+    table = LigandTable()
+    for _ in range(100):
+        table.info("CCN(CC)CCP(C)C", "N", 1)
+        table.info("CCN(CC)CCP(C)C", "P", 1)
+        table.molecule("CCN(CC)CCP(C)C")
+    assert table.stats == {"ligands": 2, "smiles": 1, "parsed": 1, "lookups": 200}
+
+
+def test_save_and_load(tmp_path):
+    """Test that a saved table is reused and a table from another RDKit version is ignored"""
+    path = str(tmp_path / "ligands.json")
+    table = LigandTable(path)
+    table.info("CP(C)C", "P", 1)
+    table.info("CP(C)C", "P", 2)
+    table.save()
+
+    loaded = LigandTable(path)
+    assert loaded.info("CP(C)C", "P", 1).index == 2
+    assert loaded.info("CP(C)C", "P", 2).error
+    assert loaded.molecule("CP(C)C")["atoms"] == 13
+    assert loaded.stats["parsed"] == 0
+
+    with open(path) as fo:
+        stored = json.load(fo)
+    stored["rdkit"] = "0.0.0"
+    with open(path, "w") as fo:
+        json.dump(stored, fo)
+    assert LigandTable().load(path) == 0
+
+    worker = LigandTable()
+    worker.update(pickle.loads(pickle.dumps(loaded)))
+    assert worker.info("CP(C)C", "P", 1).index == 2 and worker.stats["parsed"] == 0
+
+
+def test_prepare_ligands(tmp_path):
+    """Test that the distinct ligands of a frame are resolved into the process table"""
+    df = pd.DataFrame({
+        **{f"lig{i}_smiles": ["CP(C)C", "O"] for i in range(1, 5)},
+        **{f"lig{i}_element": ["P", "O"] for i in range(1, 5)},
+        **{f"lig{i}_index": [1, 1] for i in range(1, 5)},
+    })
+    assert LigandTable().precompute(df) == 2
+
+    path = tmp_path / "ligands.json"
+    stats = prepare_ligands(df, str(path))
+    assert stats["ligands"] >= 2 and path.exists()
+    assert LIGANDS.info("O", "O", 1).index == 1
@@ -1,7 +1,11 @@
+import json
+import time
 from unittest.mock import MagicMock, patch
 
 import pytest
-from llmeo import GPT4, Claude3, GPTo1, LLMConfig, LLMError
+from llmeo import (GPT4, CircuitBreaker, Claude3, GPTo1, HedgedLLM, LLMConfig,
+                   LLMError, LLMResponse, LLMUsage, UsageTracker)
+from llmeo._utils.llm import estimate_cost
 
 
 # Test LLMConfig
@@ -133,3 +137,263 @@ def test_gpto1_with_system_prompt(mock_openai, test_config):
     # Verify that system prompt was included in the content
     call_args = mock_client.chat.completions.create.call_args[1]
     assert system_prompt in call_args["messages"][0]["content"]
+
+
+@patch("openai.OpenAI")
+def test_gpt4_generate_usage(mock_openai, test_config):
+    """Test token accounting of a GPT4 call"""
+    mock_response = MagicMock()
+    mock_response.choices[0].message.content = "Test response"
+    mock_response.usage.prompt_tokens = 1000
+    mock_response.usage.completion_tokens = 200
+    mock_response.usage.prompt_tokens_details.cached_tokens = 400
+    mock_response.usage.completion_tokens_details.reasoning_tokens = 0
+    mock_openai.return_value.chat.completions.create.return_value = mock_response
+
+    model = GPT4(test_config)
+    model.create()
+    response = model.generate("Test prompt")
+
+    assert response.text == "Test response"
+    assert response.usage.input_tokens == 1000
+    assert response.usage.output_tokens == 200
+    assert response.usage.cached_tokens == 400
+    assert response.usage.latency >= 0
+    assert response.usage.time_to_first_token == response.usage.latency
+    assert response.usage.cost == pytest.approx(estimate_cost("gpt-4", response.usage))
+
+
+@patch("anthropic.Anthropic")
+def test_claude3_generate_usage(mock_anthropic, test_config):
+    """Test that Claude cache reads are counted as cached input tokens"""
+    mock_response = MagicMock()
+    mock_response.content[0].text = "Test response"
+    mock_response.usage.input_tokens = 100
+    mock_response.usage.cache_read_input_tokens = 900
+    mock_response.usage.cache_creation_input_tokens = 0
+    mock_response.usage.output_tokens = 50
+    mock_anthropic.return_value.messages.create.return_value = mock_response
+
+    model = Claude3(test_config)
+    model.create()
+    usage = model.generate("Test prompt").usage
+
+    assert usage.input_tokens == 1000
+    assert usage.cached_tokens == 900
+    assert usage.cost == pytest.approx((100 * 3.0 + 900 * 0.3 + 50 * 15.0) / 1e6)
+
+
+def test_claude3_history_prompt_caching(test_config):
+    """Test that follow-up turns replay the conversation with a cached first prompt"""
+    test_config.prompt_caching = True
+    model = Claude3(test_config)
+    history = [
+        {"role": "user", "content": "long prompt"},
+        {"role": "assistant", "content": "answer"},
+    ]
+    params = model.request_params("fix it", history=history)
+
+    assert [m["role"] for m in params["messages"]] == ["user", "assistant", "user"]
+    assert params["messages"][0]["content"] == [
+        {"type": "text", "text": "long prompt", "cache_control": {"type": "ephemeral"}}
+    ]
+    assert params["messages"][-1] == {"role": "user", "content": "fix it"}
+    assert history[0]["content"] == "long prompt"
+
+
+def test_estimate_cost_unknown_model():
+    """Unknown models are priced at zero"""
+    assert estimate_cost("unknown", LLMUsage(input_tokens=10, output_tokens=10)) == 0.0
+
+
+def test_usage_tracker_aggregation():
+    """Test per-iteration and per-run aggregation of usage"""
+    tracker = UsageTracker()
+    tracker.record(0, LLMResponse("a", LLMUsage(input_tokens=10, output_tokens=5, latency=1.0, cost=0.1)))
+    tracker.record(0, LLMResponse("b", LLMUsage(input_tokens=20, output_tokens=5, latency=2.0, cost=0.2)))
+    tracker.record(1, LLMResponse("c", LLMUsage(input_tokens=30, output_tokens=5, latency=3.0, cost=0.3)))
+
+    per_iter = tracker.per_iteration()
+    assert [row["iter"] for row in per_iter] == [0, 1]
+    assert per_iter[0]["calls"] == 2
+    assert per_iter[0]["input_tokens"] == 30
+    assert per_iter[0]["latency"] == pytest.approx(3.0)
+
+    totals = tracker.totals()
+    assert totals["calls"] == 3
+    assert totals["input_tokens"] == 60
+    assert totals["cost"] == pytest.approx(0.6)
+    assert totals["mean_latency"] == pytest.approx(2.0)
+
+
+@patch("openai.OpenAI")
+def test_gpt4_streaming_call(mock_openai, test_config):
+    """Test that streamed deltas are forwarded and usage taken from the final chunk"""
+    chunks = []
+    for delta in ["Hello", " ", "world"]:
+        chunk = MagicMock()
+        chunk.usage = None
+        chunk.choices[0].delta.content = delta
+        chunks.append(chunk)
+    final = MagicMock()
+    final.choices = []
+    final.usage.prompt_tokens = 12
+    final.usage.completion_tokens = 3
+    chunks.append(final)
+    mock_client = mock_openai.return_value
+    mock_client.chat.completions.create.return_value = iter(chunks)
+
+    model = GPT4(test_config)
+    model.create()
+    received = []
+    response = model.generate("Test prompt", on_text=received.append)
+
+    assert received == ["Hello", " ", "world"]
+    assert response.text == "Hello world"
+    assert response.usage.input_tokens == 12
+    assert response.usage.output_tokens == 3
+    assert response.usage.time_to_first_token <= response.usage.latency
+    assert mock_client.chat.completions.create.call_args[1]["stream"] is True
+
+
+@patch("anthropic.Anthropic")
+def test_claude3_structured_output(mock_anthropic, test_config):
+    """Test that a response schema forces a tool call returning JSON"""
+    tool_block = MagicMock()
+    tool_block.type = "tool_use"
+    tool_block.input = {"tmcs": [{"explanation": "x", "tmc": "Pd_A_B_C_D", "total_charge": 0}]}
+    mock_response = MagicMock()
+    mock_response.content = [tool_block]
+    mock_client = mock_anthropic.return_value
+    mock_client.messages.create.return_value = mock_response
+
+    model = Claude3(test_config)
+    model.create()
+    schema = {"type": "object"}
+    response = model.generate("Test prompt", response_schema=schema)
+
+    assert json.loads(response.text) == tool_block.input
+    call_args = mock_client.messages.create.call_args[1]
+    assert call_args["tools"][0]["input_schema"] is schema
+    assert call_args["tool_choice"]["name"] == "propose_tmcs"
+
+
+def test_structured_output_support(test_config):
+    """Only models with JSON-schema output advertise structured output"""
+    assert Claude3(test_config).supports_structured_output
+    assert GPTo1(test_config, name="o1").supports_structured_output
+    assert not GPTo1(test_config, name="o1-mini").supports_structured_output
+    assert not GPT4(test_config).supports_structured_output
+
+
+class FakeModel:
+    """Minimal provider with a fixed delay and answer"""
+    def __init__(self, name, delay=0.0, text="answer", error=None):
+        self.name = name
+        self.delay = delay
+        self.text = text
+        self.error = error
+        self.calls = 0
+
+    def create(self):
+        pass
+
+    def generate(self, content, system=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise LLMError(self.error)
+        return LLMResponse(self.text, LLMUsage(latency=self.delay, cost=1.0), model=self.name)
+
+
+def test_hedged_llm_primary_fast():
+    """No hedge is fired when the primary answers in time"""
+    primary, secondary = FakeModel("a"), FakeModel("b")
+    model = HedgedLLM([primary, secondary], initial_hedge_delay=1.0)
+    assert model.generate("prompt").model == "a"
+    assert secondary.calls == 0
+    assert model.stats["hedges"] == 0
+
+
+def test_hedged_llm_hedge_wins():
+    """A slow primary is hedged and the faster answer is returned"""
+    primary, secondary = FakeModel("a", delay=0.5), FakeModel("b")
+    model = HedgedLLM([primary, secondary], initial_hedge_delay=0.05)
+    response = model.generate("prompt")
+    assert response.model == "b"
+    assert model.stats["hedges"] == 1
+    assert model.stats["hedge_wins"] == 1
+
+
+@pytest.mark.parametrize("primary", [
+    FakeModel("a", error="boom"),
+    FakeModel("a", text="no tmc here"),
+])
+def test_hedged_llm_failover(primary):
+    """Errors and invalid answers fail over without waiting for the hedge delay"""
+    secondary = FakeModel("b", text="Pd_answer")
+    model = HedgedLLM(
+        [primary, secondary], initial_hedge_delay=10.0, validator=lambda text: "Pd_" in text
+    )
+    start = time.monotonic()
+    assert model.generate("prompt").model == "b"
+    assert time.monotonic() - start < 5.0
+    assert model.stats["failovers"] == 1
+    assert model.stats["errors"]["a"] == 1
+
+
+def test_hedged_llm_hedge_deadlines():
+    """Hedges are due a hedge delay after the latest launch, using the delay of the model launched"""
+    # A hedge failing while the primary is still running does not restart the wait
+    slow, failing, fast = FakeModel("a", delay=3.0), FakeModel("b", delay=0.45, error="boom"), FakeModel("c")
+    model = HedgedLLM([slow, failing, fast], initial_hedge_delay=0.5)
+    start = time.monotonic()
+    assert model.generate("prompt").model == "c"
+    assert time.monotonic() - start < 1.3
+
+    # A failover waits for the hedge delay of the model it fails over to
+    failing, slow, fast = FakeModel("a", error="boom"), FakeModel("b", delay=3.0), FakeModel("c")
+    model = HedgedLLM([failing, slow, fast], initial_hedge_delay=10.0, min_samples=5)
+    model.latencies["b"].extend([0.1] * 5)
+    start = time.monotonic()
+    assert model.generate("prompt").model == "c"
+    assert time.monotonic() - start < 2.0
+    assert model.stats["failovers"] == 1
+
+
+def test_hedged_llm_all_fail():
+    """An LLMError is raised when no model gives a valid answer"""
+    model = HedgedLLM([FakeModel("a", error="boom"), FakeModel("b", error="bang")])
+    with pytest.raises(LLMError, match="All hedged requests failed"):
+        model.generate("prompt")
+
+
+def test_hedge_delay_percentile():
+    """The hedge delay follows the latency percentile once enough samples exist"""
+    model = HedgedLLM([FakeModel("a")], hedge_percentile=50.0, initial_hedge_delay=7.0, min_samples=3)
+    assert model.hedge_delay(model.models[0]) == 7.0
+    model.latencies["a"].extend([1.0, 2.0, 3.0, 4.0])
+    assert model.hedge_delay(model.models[0]) == 2.0
+
+
+def test_circuit_breaker_sidelines_failing_provider():
+    """The breaker opens on a high error rate and closes after a successful trial"""
+    breaker = CircuitBreaker(window=4, error_threshold=0.5, min_calls=4, cooldown=0.05)
+    for success in [True, False, True, False]:
+        breaker.record(success)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.record(True)
+    assert breaker.state == "closed"
+
+
+def test_hedged_llm_skips_open_breaker():
+    """A sidelined provider is not used while its breaker is open"""
+    primary, secondary = FakeModel("a"), FakeModel("b")
+    model = HedgedLLM([primary, secondary], breaker_kwargs={"min_calls": 1, "cooldown": 60.0})
+    model.breakers["a"].record(False)
+    assert model.generate("prompt").model == "b"
+    assert primary.calls == 0
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import connected_components
+from llmeo._utils import mol_analysis
+from llmeo._utils.mol_analysis import (compare_connecting_idx, get_radius_adjacency,
+                                       get_radius_adjacency_matrix, metal_coordination,
+                                       radius_graph_is_connected)
+from llmeo._utils.geometry import write_xyz
+
+# Pd(NH3)(H2O)Cl2 with ligand bonds of typical length and a distant water
+ELEMENTS = ["Pd", "N", "O", "Cl", "Cl", "H", "H", "H", "H", "H", "O", "H", "H"]
+COORDS = np.array([
+    [0.0, 0.0, 0.0], [2.05, 0.0, 0.0], [0.0, 2.05, 0.0], [-2.3, 0.0, 0.0], [0.0, -2.3, 0.0],
+    [2.4, 0.95, 0.0], [2.4, -0.45, 0.8], [2.4, -0.45, -0.8], [0.8, 2.4, 0.0], [-0.8, 2.4, 0.0],
+    [0.0, 0.0, 3.6], [0.76, 0.0, 4.2], [-0.76, 0.0, 4.2],
+])
+
+
+def _loop_adjacency_matrix(positions, radius_cutoff):
+    """Pairwise loop the vectorized adjacency replaced"""
+    adjacency_matrix = np.zeros((len(positions), len(positions)))
+    for i in range(len(positions)):
+        for j in range(i + 1, len(positions)):
+            if np.linalg.norm(np.array(positions[i]) - np.array(positions[j])) <= radius_cutoff:
+                adjacency_matrix[i, j] = adjacency_matrix[j, i] = 1
+    return adjacency_matrix
+
+
+@pytest.mark.parametrize("n_atoms", [0, 1, 2, 30, 120])
+def test_adjacency_matches_loop(n_atoms):
+    """Test that the KD-tree adjacency equals the pairwise loop"""
+    positions = (np.random.default_rng(n_atoms).random((n_atoms, 3)) * 8).tolist()
+    expected = _loop_adjacency_matrix(positions, 3.0)
+    assert np.array_equal(get_radius_adjacency_matrix(positions, 3.0), expected)
+    assert get_radius_adjacency(positions, 3.0).nnz * 2 == expected.sum()
+
+
+def test_cutoff_is_inclusive():
+    """Test that atoms exactly radius_cutoff apart are connected"""
+    positions = [[0.0, 0.0, 0.0], [3.0, 0.0, 0.0], [6.5, 0.0, 0.0]]
+    assert np.array_equal(get_radius_adjacency_matrix(positions, 3.0), _loop_adjacency_matrix(positions, 3.0))
+    assert not radius_graph_is_connected(positions, 3.0)
+    assert radius_graph_is_connected(positions, 3.5)
+
+
+def test_connectivity_matches_loop():
+    """Test connectivity decisions on random structures around the percolation point"""
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        positions = (rng.random((40, 3)) * rng.uniform(4, 14)).tolist()
+        n_components = connected_components(_loop_adjacency_matrix(positions, 3.0))[0]
+        assert radius_graph_is_connected(positions, 3.0) == (n_components == 1)
+
+
+
+def test_metal_coordination():
+    """Test the coordination set, and deferral to mol3D near a cutoff or for unknown atoms"""
+    assert metal_coordination(ELEMENTS, COORDS) == frozenset({1, 2, 3, 4})
+    stretched = COORDS.copy()
+    stretched[3] = [-2.95, 0.0, 0.0]
+    assert metal_coordination(ELEMENTS, stretched) is None
+    stretched[3] = [-3.5, 0.0, 0.0]
+    assert metal_coordination(ELEMENTS, stretched) == frozenset({1, 2, 4})
+    assert metal_coordination(["Xx"] + ELEMENTS[1:], COORDS) is None
+    assert metal_coordination(["C"] + ELEMENTS[1:], COORDS) is None
+
+
+def test_compare_connecting_idx_without_mol3d(tmp_path, monkeypatch):
+    """Test that clear-cut structures are compared without molSimplify"""
+    def no_mol3d(path):
+        raise AssertionError("mol3D must not be used")
+
+    monkeypatch.setattr(mol_analysis, "_mol3d_metal_row", no_mol3d)
+    write_xyz(str(tmp_path / "init.xyz"), ELEMENTS, COORDS)
+    write_xyz(str(tmp_path / "same.xyz"), ELEMENTS, COORDS * 1.02)
+    broken = COORDS.copy()
+    broken[2] = [0.0, 3.8, 0.0]
+    broken[8:10] += [0.0, 1.75, 0.0]
+    write_xyz(str(tmp_path / "broken.xyz"), ELEMENTS, broken)
+    write_xyz(str(tmp_path / "short.xyz"), ELEMENTS[:-1], COORDS[:-1])
+
+    assert compare_connecting_idx(tmp_path / "same.xyz", tmp_path / "init.xyz")
+    assert not compare_connecting_idx(tmp_path / "broken.xyz", tmp_path / "init.xyz")
+    assert not compare_connecting_idx(tmp_path / "short.xyz", tmp_path / "init.xyz")
+
+
+def test_compare_connecting_idx_falls_back_to_mol3d(tmp_path, monkeypatch):
+    """Test that an ambiguous structure is decided by the mol3D graph"""
+    rows = {"init.xyz": np.array([0, 1, 1]), "opt.xyz": np.array([0, 1, 0])}
+    monkeypatch.setattr(mol_analysis, "_mol3d_metal_row", lambda path: rows[path.name])
+    stretched = COORDS.copy()
+    stretched[3] = [-2.95, 0.0, 0.0]
+    write_xyz(str(tmp_path / "init.xyz"), ELEMENTS, COORDS)
+    write_xyz(str(tmp_path / "opt.xyz"), ELEMENTS, stretched)
+
+    assert not compare_connecting_idx(tmp_path / "opt.xyz", tmp_path / "init.xyz")
+    rows["opt.xyz"] = rows["init.xyz"]
+    assert compare_connecting_idx(tmp_path / "opt.xyz", tmp_path / "init.xyz")
@@ -0,0 +1,65 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+from llmeo._utils.parallel import RowWriter, calculate_fitness_ligand_space_parallel
+
+
+def _fake_evaluate(df, idx, row, root_path, unbounded=False, scratch_dir=None, cache=None, limits=None,
+                   tiers=None, geometries=None, archive=None):
+    """Stand-in for evaluate_row recording where and how it ran"""
+    assert Path.cwd() == scratch_dir
+    run_dir = scratch_dir / "xtb_xyz" / f"{row['lig1']}{row['lig2']}{row['lig3']}{row['lig4']}"
+    run_dir.mkdir(parents=True, exist_ok=True)
+    if row["charge"] > 0:
+        df.loc[idx, "_error"] = "Error: xtb_runner.run_xtb_from_xyz failed"
+        return
+    df.loc[idx, "fileName"] = os.getpid()
+    df.loc[idx, "homo_lumo_gap"] = float(idx) / 10
+    df.loc[idx, "polarisability"] = os.environ["OMP_NUM_THREADS"]
+
+
+def test_parallel_matches_input_order(sample_tmc_data, tmp_path):
+    """Test that every row is evaluated once, written once and returned in order"""
+    df = pd.concat([sample_tmc_data] * 3, ignore_index=True)[["lig1", "lig2", "lig3", "lig4"]]
+    df["charge"] = [0, 1, 0, -1] * 3
+    storage = tmp_path / "space.csv"
+
+    result = calculate_fitness_ligand_space_parallel(
+        df, str(tmp_path), str(storage), workers=2, threads_per_worker=3, evaluate=_fake_evaluate
+    )
+
+    assert list(result.index) == list(range(12))
+    ok = result["charge"] <= 0
+    assert list(result.loc[ok, "homo_lumo_gap"].astype(float)) == list(result.index[ok] / 10)
+    assert (result.loc[~ok, "_error"] != "").all()
+    assert set(result.loc[ok, "polarisability"].astype(str)) == {"3"}
+
+    stored = pd.read_csv(storage)
+    assert len(stored) == 12
+    assert list(stored.columns) == list(result.columns)
+    # Each worker ran in its own scratch directory
+    for pid in set(result.loc[ok, "fileName"].astype(str)):
+        assert (tmp_path / "scratch" / f"worker-{pid}" / "xtb_xyz").is_dir()
+
+
+def test_parallel_keeps_duplicate_tmcs_together(sample_tmc_data, tmp_path):
+    """Test that rows of the same TMC are evaluated by the same worker"""
+    df = pd.concat([sample_tmc_data] * 4, ignore_index=True)[["lig1", "lig2", "lig3", "lig4"]]
+    df["charge"] = 0
+
+    result = calculate_fitness_ligand_space_parallel(
+        df, str(tmp_path), str(tmp_path / "space.csv"), workers=3, evaluate=_fake_evaluate
+    )
+
+    assert (result.groupby(["lig1", "lig2", "lig3", "lig4"])["fileName"].nunique() == 1).all()
+
+
+def test_row_writer_appends_without_second_header(tmp_path):
+    """Test that a resumed writer appends to an existing file"""
+    path = str(tmp_path / "rows.csv")
+    for value in (1, 2):
+        writer = RowWriter(path, ["a", "b"])
+        writer.put({"a": value, "b": "x"})
+        writer.close()
+    assert pd.read_csv(path).to_dict("list") == {"a": [1, 2], "b": ["x", "x"]}
@@ -0,0 +1,123 @@
+import threading
+import time
+
+from llmeo._utils.pipeline import KeyedLocks, Pipeline, Stage
+
+
+class Item:
+    def __init__(self, value):
+        self.value = value
+        self.trace = []
+        self.error = None
+
+
+def _step(name, delay=0.0, stop_if=None):
+    def function(item):
+        time.sleep(delay)
+        item.trace.append((name, threading.current_thread().name))
+        return not (stop_if and stop_if(item))
+    return function
+
+
+def test_pipeline_runs_every_item_through_the_stages():
+    """Test that finished items arrive once each, in the calling thread, after all stages"""
+    pipeline = Pipeline([Stage("a", _step("a"), 2), Stage("b", _step("b"), 3)], queue_size=2, sample_interval=0.01)
+    done = []
+    caller = threading.current_thread().name
+
+    def on_done(item):
+        assert threading.current_thread().name == caller
+        done.append(item)
+
+    stats = pipeline.run((Item(i) for i in range(20)), on_done)
+
+    assert sorted(item.value for item in done) == list(range(20))
+    assert all([name for name, _ in item.trace] == ["a", "b"] for item in done)
+    assert stats["a"]["processed"] == stats["b"]["processed"] == 20
+    assert stats["b"]["workers"] == 3
+
+
+def test_pipeline_drops_finished_and_failed_items():
+    """Test that items leave early when a stage finishes them or raises"""
+    def explode(item):
+        if item.value == 3:
+            raise ValueError("bad geometry")
+        return True
+
+    def on_error(item, stage, error):
+        item.error = (stage, str(error))
+
+    pipeline = Pipeline([
+        Stage("build", _step("build", stop_if=lambda item: item.value % 2 == 0), 2),
+        Stage("optimize", explode, 2),
+        Stage("validate", _step("validate"), 1),
+    ])
+    done = []
+    stats = pipeline.run((Item(i) for i in range(6)), done.append, on_error=on_error)
+
+    by_value = {item.value: item for item in done}
+    assert len(done) == 6
+    assert by_value[3].error == ("optimize", "bad geometry")
+    assert [name for name, _ in by_value[5].trace] == ["build", "validate"]
+    assert [name for name, _ in by_value[4].trace] == ["build"]
+    assert stats["optimize"]["failed"] == 1
+    assert stats["validate"]["processed"] == 2
+
+
+def test_pipeline_bounds_queues_behind_slow_stage():
+    """Test that a fast stage runs ahead of a slow one only as far as the queue allows"""
+    queue_size = 3
+    built = []
+    in_flight = []
+
+    def build(item):
+        built.append(item.value)
+        return True
+
+    def optimize(item):
+        in_flight.append(len(built) - item.value)
+        time.sleep(0.02)
+        return True
+
+    pipeline = Pipeline([Stage("build", build, 2), Stage("optimize", optimize, 1)], queue_size=queue_size, sample_interval=0.01)
+    stats = pipeline.run((Item(i) for i in range(20)), lambda item: None)
+
+    # Builds ahead of the optimizer: its queue, the item it holds, one per build worker,
+    # and one refill of the queue slot freed by taking the item
+    assert max(in_flight) <= queue_size + 1 + 2 + 1
+    assert max(in_flight) >= queue_size
+    assert stats["optimize"]["max_queue_depth"] <= queue_size
+    assert stats["optimize"]["mean_queue_depth"] >= 1
+
+
+def test_pipeline_reports_progress():
+    """Test that reports are made while the pipeline runs"""
+    reports = []
+    pipeline = Pipeline([Stage("a", _step("a", delay=0.02), 1)], report_interval=0.05, sample_interval=0.01)
+    pipeline.run((Item(i) for i in range(10)), lambda item: None, on_report=reports.append)
+    assert reports
+    assert set(reports[-1]["a"]) >= {"throughput", "utilization", "mean_queue_depth", "max_queue_depth"}
+
+
+def test_keyed_locks():
+    """Test that holders of the same key are serialized and different keys are not"""
+    locks = KeyedLocks()
+    active = {"x": 0, "y": 0}
+    peak = {"x": 0, "y": 0}
+    both = []
+
+    def hold(key):
+        with locks.hold(key):
+            active[key] += 1
+            peak[key] = max(peak[key], active[key])
+            both.append(active["x"] and active["y"])
+            time.sleep(0.02)
+            active[key] -= 1
+
+    threads = [threading.Thread(target=hold, args=(key,)) for key in "xyxyxy"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == {"x": 1, "y": 1}
+    assert any(both)
@@ -0,0 +1,148 @@
+import pandas as pd
+import pytest
+from llmeo._utils.parallel import RowWriter, calculate_fitness_ligand_space_parallel
+from llmeo._utils.resume import RetryPolicy, ligand_key, load_progress, plan_resume
+from llmeo._utils.utils import TIMING_COLUMN, prepare_ligand_space, save_row_to_csv
+
+from test_parallel import _fake_evaluate
+
+SMILES = {"A": "CP(C)C", "B": "O", "C": "[Br-]", "D": "N"}
+ELEMENTS = {"A": "P", "B": "O", "C": "Br", "D": "N"}
+
+
+def _space(tmcs):
+    """Ligand space rows with the SMILES and connecting atom columns of evaluate_row"""
+    rows = []
+    for tmc in tmcs:
+        row = {"charge": 0}
+        for i, lig in enumerate(tmc, start=1):
+            row.update({
+                f"lig{i}": lig,
+                f"lig{i}_smiles": SMILES[lig],
+                f"lig{i}_element": ELEMENTS[lig],
+                f"lig{i}_index": 1,
+            })
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _store(path, df, results):
+    """Append rows with the given (_error, homo_lumo_gap) results to a storage file"""
+    stored = df.copy()
+    stored["_error"] = [error for error, _ in results]
+    stored["fileName"] = range(len(stored))
+    stored["homo_lumo_gap"] = [gap for _, gap in results]
+    stored["polarisability"] = [100.0 if gap != "" else "" for _, gap in results]
+    stored.to_csv(path, mode="a", header=not path.exists(), index=False)
+
+
+def test_ligand_key_is_rotation_invariant():
+    """Test that a TMC stored under another rotation is recognized"""
+    df = _space([("A", "B", "C", "D"), ("C", "D", "A", "B"), ("A", "C", "B", "D")])
+    keys = [ligand_key(row) for _, row in df.iterrows()]
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+
+    stored = df.iloc[0].astype(str).to_dict()
+    stored["lig1_index"] = "1.0"
+    assert ligand_key(stored) == keys[0]
+
+
+def test_plan_resume_requeues_missing_and_retryable(tmp_path):
+    """Test that only missing rows and transient failures are pending"""
+    storage = tmp_path / "space.csv"
+    space = [("A", "A", "A", "A"), ("B", "B", "B", "B"), ("C", "C", "C", "C"), ("D", "D", "D", "D"), ("A", "B", "A", "B")]
+    _store(storage, _space(space[:4]), [
+        ("", 3.5),
+        ("Error: uxtbpy.XtbRunner failed", ""),
+        ("Graph not connected, metal bond is break after xtb", ""),
+        ("", ""),
+    ])
+    # A run killed in the middle of writing a row
+    with open(storage, "a") as fo:
+        fo.write("A,B,A,B,CP(C)")
+
+    df = _space([("A", "A", "A", "A"), ("B", "B", "B", "B"), ("C", "C", "C", "C"), ("D", "D", "D", "D"), ("B", "A", "B", "A")])
+    prepare_ligand_space(df, str(tmp_path))
+    plan = plan_resume(df, str(storage))
+
+    assert plan.pending == [1, 3, 4]
+    assert plan.to_dict() == {"pending": 3, "finished": 2, "retried": 2, "exhausted": 0, "missing": 1}
+    assert df.loc[0, "homo_lumo_gap"] == 3.5
+    assert df.loc[2, "_error"].startswith("Graph not connected")
+    assert storage.read_text().endswith("\n")
+
+
+def test_retry_policy_limits_attempts(tmp_path):
+    """Test that a TMC failing transiently is given up after max_attempts"""
+    storage = tmp_path / "space.csv"
+    df = _space([("B", "B", "B", "B")])
+    for _ in range(2):
+        _store(storage, df, [("Worker error: killed", "")])
+
+    policy = RetryPolicy(max_attempts=2)
+    assert list(load_progress(str(storage), policy).values())[0][1] == 2
+
+    prepare_ligand_space(df, str(tmp_path))
+    plan = plan_resume(df, str(storage), policy)
+    assert plan.pending == []
+    assert plan.exhausted == 1
+    assert plan_resume(df, str(storage), RetryPolicy(max_attempts=3)).pending == [0]
+
+
+def test_final_row_wins_over_later_failure(tmp_path):
+    """Test that a finished TMC is not re-run because a later duplicate failed"""
+    storage = tmp_path / "space.csv"
+    df = _space([("A", "A", "A", "A")])
+    _store(storage, df, [("", 2.0)])
+    _store(storage, df, [("Error: uxtbpy.XtbRunner failed", "")])
+
+    prepare_ligand_space(df, str(tmp_path))
+    assert plan_resume(df, str(storage)).pending == []
+    assert df.loc[0, "homo_lumo_gap"] == 2.0
+
+
+def test_rows_appended_to_older_storage(tmp_path):
+    """Test that rows with columns added since a storage file was written still resume"""
+    storage = tmp_path / "space.csv"
+    df = _space([("A", "A", "A", "A"), ("B", "B", "B", "B"), ("C", "C", "C", "C")])
+    _store(storage, df.iloc[:1], [("", 2.0)])
+
+    prepare_ligand_space(df, str(tmp_path))
+    df.loc[1, ["_error", "homo_lumo_gap", TIMING_COLUMN]] = ["", 3.0, 12.5]
+    save_row_to_csv(df.loc[1], 1, str(storage))
+    writer = RowWriter(str(storage), list(df.columns))
+    writer.put(df.loc[2].to_dict())
+    writer.close()
+
+    assert len(load_progress(str(storage), RetryPolicy())) == 3
+    assert plan_resume(df, str(storage)).pending == [2]
+    assert df.loc[1, TIMING_COLUMN] == 12.5
+
+    with open(storage, "a") as fo:
+        fo.write("too,many," * 40 + "\n")
+    with pytest.raises(ValueError, match="do not match its header"):
+        load_progress(str(storage), RetryPolicy())
+
+
+def _failing_evaluate(df, idx, row, root_path, unbounded=False, scratch_dir=None, cache=None, limits=None,
+                     tiers=None, geometries=None, archive=None):
+    raise RuntimeError("must not run")
+
+
+def test_parallel_resume_skips_finished_rows(tmp_path):
+    """Test that resuming a finished space calculates nothing and appends nothing"""
+    storage = tmp_path / "space.csv"
+    space = [("A", "A", "A", "A"), ("A", "B", "C", "D"), ("C", "C", "D", "D")]
+    df = _space(space)
+    df["charge"] = [0, 1, 0]
+    calculate_fitness_ligand_space_parallel(df, str(tmp_path), str(storage), workers=2, evaluate=_fake_evaluate)
+    lines = storage.read_text().splitlines()
+
+    resumed = calculate_fitness_ligand_space_parallel(
+        _space(space), str(tmp_path), str(storage), workers=2, evaluate=_failing_evaluate, resume=True
+    )
+
+    assert storage.read_text().splitlines() == lines
+    assert list(resumed["homo_lumo_gap"].astype(str)) == ["0.0", "", "0.2"]
+    assert resumed.loc[1, "_error"] == "Error: xtb_runner.run_xtb_from_xyz failed"
@@ -1,12 +1,23 @@
+import time
 from unittest.mock import MagicMock, mock_open, patch
 
 import pandas as pd
 import pytest
+from llmeo import HedgedLLM, LLMError, LLMResponse, LLMUsage, UsageTracker
+from llmeo._utils.bandit import BanditArm, BanditScheduler
+from llmeo._utils.snap import SnapIndex, SnapStats
+from llmeo._utils.utils import ParseStats, RepairStats, find_tmc_in_space
+from llmeo.prompts import STRUCTURED_OUTPUT_SUFFIX
 from llmeo.run_llmeo import (
+    check_options,
+    get_bandit,
+    get_llm_model,
     get_next_round_samples,
     get_prompt_and_props,
     main,
+    move_one_bandit_iter,
     move_one_iter,
+    run_pipelined,
 )
 
 
@@ -76,6 +87,62 @@ def test_move_one_iter_ga(
     assert len(new_df_samples) == len(df_samples) + mock_opt_args.num_offspring
 
 
+def test_get_prompt_and_props_template(mock_opt_args):
+    """Test that a named template replaces the default of the property"""
+    from llmeo.prompts import PROMPT_NL_MB
+    mock_opt_args.prop = "mb"
+    mock_opt_args.template = "PROMPT_NL_MB"
+    assert get_prompt_and_props(mock_opt_args) == (PROMPT_NL_MB, ["gap", "polarisability"])
+    mock_opt_args.template = "PROMPT_UNKNOWN"
+    with pytest.raises(ValueError):
+        get_prompt_and_props(mock_opt_args)
+
+
+@patch("llmeo.run_llmeo.get_llm_response")
+def test_move_one_bandit_iter(
+    mock_get_response,
+    mock_opt_args,
+    sample_tmc_data,
+    sample_search_space,
+    lig_charges,
+    mock_logger,
+    mock_llm_response,
+):
+    """Test that a bandit iteration uses the chosen arm and reports its gain and cost"""
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.model = "gpt-4"
+    mock_opt_args.num_offspring = 3
+    mock_get_response.return_value = LLMResponse(mock_llm_response, usage=LLMUsage(cost=0.25))
+
+    model = MagicMock()
+    model.name = "gpt-4"
+    arm = BanditArm(model, template="PROMPT_G", temperature=0.7)
+    bandit = BanditScheduler([arm], seed=0)
+
+    new_df_current, new_df_samples, _ = move_one_bandit_iter(
+        mock_opt_args,
+        bandit,
+        0,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        UsageTracker(),
+    )
+
+    assert mock_get_response.call_args[0][0] is model
+    assert "maximize its HOMO-LUMO gap" in mock_get_response.call_args[0][1]
+    assert not hasattr(mock_opt_args, "template")  # the arm template does not leak into opt
+    record = bandit.history[0]
+    assert record["arm"] == "gpt-4:PROMPT_G:0.7"
+    assert record["dollars"] == 0.25
+    assert record["gain"] == int((new_df_current["iter"] == 1).sum())
+    assert len(new_df_samples) == len(sample_tmc_data) + 3
+
+
 @patch("llmeo.run_llmeo.get_llm_response")
 def test_move_one_iter_llm(
     mock_get_response,
@@ -93,7 +160,7 @@ def test_move_one_iter_llm(
     mock_opt_args.num_offspring = 3
 
     # Mock LLM response
-    mock_get_response.return_value = mock_llm_response
+    mock_get_response.return_value = LLMResponse(mock_llm_response)
 
     df_samples_current = sample_tmc_data.copy()
     df_samples = sample_tmc_data.copy()
@@ -119,6 +186,326 @@ def test_move_one_iter_llm(
     assert mock_get_response.called
 
 
+def test_move_one_iter_llm_streaming(
+    mock_opt_args,
+    sample_tmc_data,
+    sample_search_space,
+    lig_charges,
+    mock_logger,
+    mock_llm_response,
+):
+    """Test that streamed TMCs are evaluated while the response is generated"""
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.model = "claude-3-5-sonnet-20240620"
+    mock_opt_args.num_offspring = 3
+    mock_opt_args.stream = True
+
+    class StreamingModel:
+        def generate(self, content, system=None, on_text=None):
+            for i in range(0, len(mock_llm_response), 16):
+                on_text(mock_llm_response[i:i + 16])
+            return LLMResponse(mock_llm_response)
+
+    evaluated = []
+
+    def evaluate(tmc):
+        evaluated.append(tmc)
+        return find_tmc_in_space(sample_search_space, [tmc])
+
+    new_df_current, new_df_samples, new_failed = move_one_iter(
+        mock_opt_args,
+        StreamingModel(),
+        0,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        evaluate_fn=evaluate,
+    )
+
+    assert len(evaluated) == 3
+    assert len(new_df_samples) == len(sample_tmc_data) + 3
+    assert new_failed == []
+
+
+def test_move_one_iter_streaming_waits_for_evaluations(
+    mock_opt_args,
+    sample_tmc_data,
+    sample_search_space,
+    lig_charges,
+    mock_logger,
+    mock_llm_response,
+):
+    """Test that evaluations started by a failed stream finish before the iteration returns"""
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.model = "claude-3-5-sonnet-20240620"
+    mock_opt_args.stream = True
+
+    class FailingStreamModel:
+        def generate(self, content, system=None, on_text=None):
+            on_text(mock_llm_response)
+            raise LLMError("connection reset")
+
+    started, finished = [], []
+
+    def evaluate(tmc):
+        started.append(tmc)
+        time.sleep(0.2)
+        finished.append(tmc)
+        return find_tmc_in_space(sample_search_space, [tmc])
+
+    _, new_df_samples, _ = move_one_iter(
+        mock_opt_args,
+        FailingStreamModel(),
+        0,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        evaluate_fn=evaluate,
+    )
+
+    assert started and finished == started
+    assert len(new_df_samples) == len(sample_tmc_data)
+
+
+def test_move_one_iter_structured_grammar(
+    mock_opt_args,
+    sample_tmc_data,
+    sample_search_space,
+    lig_charges,
+    mock_logger,
+):
+    """Test the strict grammar path for models without structured output"""
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.model = "gpt-4"
+    mock_opt_args.num_offspring = 3
+    mock_opt_args.structured = True
+
+    model = MagicMock()
+    model.supports_structured_output = False
+    model.generate.return_value = LLMResponse(
+        "TMC: Pd_WECJIA-subgraph-3_IRIXUC-subgraph-3_IRIXUC-subgraph-3_IRIXUC-subgraph-3\n"
+        "TMC: Pd_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1\n"
+        "TMC: Pd_CORTOU-subgraph-2_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3\n"
+    )
+    parse_stats = ParseStats()
+
+    _, new_df_samples, new_failed = move_one_iter(
+        mock_opt_args,
+        model,
+        0,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        parse_stats=parse_stats,
+    )
+
+    prompt = model.generate.call_args[0][0]
+    assert prompt.endswith(STRUCTURED_OUTPUT_SUFFIX)
+    assert "response_schema" not in model.generate.call_args[1]
+    # The TMC with total charge -2 is rejected before lookup
+    assert len(new_df_samples) == len(sample_tmc_data) + 2
+    assert parse_stats.to_dict()["rejected_tmcs"] == {"invalid_charge": 1}
+
+
+def test_move_one_iter_repair(
+    mock_opt_args,
+    sample_tmc_data,
+    sample_search_space,
+    lig_charges,
+    mock_logger,
+):
+    """Test that unusable TMCs are replaced in a follow-up turn instead of dropped"""
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.model = "gpt-4"
+    mock_opt_args.num_offspring = 3
+    mock_opt_args.structured = True
+    mock_opt_args.repair_rounds = 2
+
+    first = (
+        "TMC: Pd_WECJIA-subgraph-3_IRIXUC-subgraph-3_IRIXUC-subgraph-3_IRIXUC-subgraph-3\n"
+        "TMC: Pd_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1\n"
+        "TMC: Pd_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3_OBONEA-subgraph-1\n"
+    )
+    repaired = (
+        "TMC: Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_WECJIA-subgraph-3_CORTOU-subgraph-2\n"
+        "TMC: Pd_CORTOU-subgraph-2_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3\n"
+    )
+    model = MagicMock()
+    model.supports_structured_output = False
+    model.generate.side_effect = [LLMResponse(first), LLMResponse(repaired)]
+    parse_stats, repair_stats = ParseStats(), RepairStats()
+    usage_tracker = UsageTracker()
+    absent = "Pd_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3_OBONEA-subgraph-1"
+
+    def evaluate(tmc):
+        return None if tmc == absent else find_tmc_in_space(sample_search_space, [tmc])
+
+    _, new_df_samples, new_failed = move_one_iter(
+        mock_opt_args,
+        model,
+        0,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        usage_tracker=usage_tracker,
+        evaluate_fn=evaluate,
+        parse_stats=parse_stats,
+        repair_stats=repair_stats,
+    )
+
+    assert model.generate.call_count == 2
+    prompt = model.generate.call_args_list[0][0][0]
+    feedback, kwargs = model.generate.call_args_list[1][0][0], model.generate.call_args_list[1][1]
+    assert kwargs["history"] == [
+        {"role": "user", "content": prompt},
+        {"role": "assistant", "content": first},
+    ]
+    assert "total charge is -2" in feedback
+    assert "not in the space of TMCs" in feedback
+    assert len(new_df_samples) == len(sample_tmc_data) + 3
+    assert new_failed == []
+    # First-shot statistics are unaffected by the repair
+    assert parse_stats.to_dict()["rejected_tmcs"] == {"invalid_charge": 1}
+    assert repair_stats.to_dict()["repaired_iterations"] == 1
+    assert repair_stats.to_dict()["recovered_tmcs"] == 2
+    assert repair_stats.to_dict()["reasons"] == {"invalid_charge": 1, "absent": 1}
+    assert len(usage_tracker.records) == 2
+
+
+def test_move_one_iter_snaps_invalid_proposals(
+    mock_opt_args,
+    sample_tmc_data,
+    sample_search_space,
+    lig_charges,
+    mock_logger,
+):
+    """Test that an invalid-charge proposal is snapped to a new member of the space"""
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.model = "gpt-4"
+    mock_opt_args.num_offspring = 3
+
+    model = MagicMock()
+    model.generate.return_value = LLMResponse(
+        "<<<TMC>>>: [Pd_WECJIA-subgraph-3_IRIXUC-subgraph-3_IRIXUC-subgraph-3_IRIXUC-subgraph-3]\n"
+        "<<<TMC>>>: [Pd_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1]\n"
+        "<<<TMC>>>: [Pd_CORTOU-subgraph-2_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3]\n"
+    )
+    snap_index = SnapIndex(sample_search_space, lig_charges)
+    snap_stats = SnapStats()
+
+    _, new_df_samples, _ = move_one_iter(
+        mock_opt_args,
+        model,
+        0,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        snap_index=snap_index,
+        snap_stats=snap_stats,
+    )
+
+    assert len(new_df_samples) == len(sample_tmc_data) + 3
+    assert new_df_samples["id"].is_unique
+    summary = snap_stats.to_dict()
+    assert summary["in_space"] == 2
+    assert summary["snapped"] == 1
+    assert summary["pairs"][0]["distance"] == 1.0
+
+
+@pytest.mark.parametrize("staleness", [1, 3])
+def test_run_pipelined_ga(
+    staleness, mock_opt_args, sample_tmc_data, sample_search_space, lig_charges, mock_logger
+):
+    """Test that the pipelined scheduler merges every iteration"""
+    mock_opt_args.model = "ga"
+    mock_opt_args.staleness = staleness
+    merges = []
+
+    _, df_samples, _ = run_pipelined(
+        mock_opt_args,
+        None,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        on_merge=lambda df: merges.append(len(df)),
+    )
+
+    assert len(merges) == mock_opt_args.num_iter
+    assert len(df_samples) == (
+        len(sample_tmc_data) + mock_opt_args.num_iter * mock_opt_args.num_offspring
+    )
+    assert sorted(df_samples["iter"].unique()) == list(range(mock_opt_args.num_iter + 1))
+
+
+def test_run_pipelined_overlaps_llm_and_evaluation(
+    mock_opt_args, sample_tmc_data, sample_search_space, lig_charges, mock_logger, mock_llm_response
+):
+    """Test that the next LLM request starts while offspring are being evaluated"""
+    import threading
+
+    mock_opt_args.model = "claude-3-5-sonnet-20240620"
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.num_iter = 2
+    mock_opt_args.staleness = 1
+
+    second_request = threading.Event()
+    calls = []
+
+    class Model:
+        def generate(self, content, system=None):
+            calls.append(content)
+            if len(calls) == 2:
+                second_request.set()
+            return LLMResponse(mock_llm_response)
+
+    overlapped = []
+
+    def evaluate(tmc):
+        overlapped.append(second_request.wait(timeout=5))
+        return find_tmc_in_space(sample_search_space, [tmc])
+
+    _, df_samples, _ = run_pipelined(
+        mock_opt_args,
+        Model(),
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        evaluate_fn=evaluate,
+    )
+
+    assert len(calls) == 2
+    assert all(overlapped)
+    assert len(df_samples) == len(sample_tmc_data) + 2 * mock_opt_args.num_offspring
+
+
 # Test different optimization strategies
 @patch("llmeo.run_llmeo.get_llm_response")
 @pytest.mark.parametrize("strategy", ["best", "all", "const"])
@@ -138,7 +525,7 @@ def test_different_strategies(
     mock_opt_args.strategy = strategy
 
     # Mock LLM response
-    mock_get_response.return_value = mock_llm_response
+    mock_get_response.return_value = LLMResponse(mock_llm_response)
 
     df_samples_current = sample_tmc_data.copy()
     df_samples = sample_tmc_data.copy()
@@ -194,7 +581,7 @@ def test_main_optimization_loop(
     if model == "o1-preview":
         # Mock LLM response
         mock_get_model.return_value = MagicMock()
-        mock_get_response.return_value = mock_llm_response
+        mock_get_response.return_value = LLMResponse(mock_llm_response)
 
     # Mock file read operation
     mock_file_content = "mock ligand content"
@@ -218,3 +605,140 @@ def test_main_optimization_loop(
         == mock_opt_args.num_offspring * mock_opt_args.num_iter
         + mock_opt_args.population
     )
+
+
+def test_move_one_bandit_iter_overrides_ga_model(
+    mock_opt_args,
+    sample_tmc_data,
+    sample_search_space,
+    lig_charges,
+    mock_logger,
+    mock_llm_response,
+):
+    """Test that a bandit arm proposes with its LLM even when --model is left at ga"""
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.model = "ga"
+    mock_opt_args.num_offspring = 3
+
+    model = MagicMock()
+    model.name = "gpt-4"
+    model.generate.return_value = LLMResponse(mock_llm_response, usage=LLMUsage(cost=0.25))
+    bandit = BanditScheduler([BanditArm(model)], seed=0)
+
+    move_one_bandit_iter(
+        mock_opt_args,
+        bandit,
+        0,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        UsageTracker(),
+    )
+
+    model.generate.assert_called_once()
+    assert mock_opt_args.model == "ga"
+    assert bandit.history[0]["dollars"] == 0.25
+
+
+def test_move_one_bandit_iter_streams(
+    mock_opt_args,
+    sample_tmc_data,
+    sample_search_space,
+    lig_charges,
+    mock_logger,
+    mock_llm_response,
+):
+    """Test that --stream applies to the arm chosen by the bandit"""
+    mock_opt_args.prop = "polarisability"
+    mock_opt_args.stream = True
+
+    class StreamingModel:
+        name = "gpt-4"
+
+        def generate(self, content, system=None, on_text=None):
+            on_text(mock_llm_response)
+            return LLMResponse(mock_llm_response)
+
+    streamed = []
+
+    def evaluate(tmc):
+        streamed.append(tmc)
+        return find_tmc_in_space(sample_search_space, [tmc])
+
+    move_one_bandit_iter(
+        mock_opt_args,
+        BanditScheduler([BanditArm(StreamingModel())], seed=0),
+        0,
+        sample_tmc_data.copy(),
+        sample_tmc_data.copy(),
+        [],
+        sample_search_space,
+        "test_ligands",
+        lig_charges,
+        mock_logger,
+        UsageTracker(),
+        evaluate_fn=evaluate,
+    )
+
+    assert len(streamed) == 3
+
+
+def test_bandit_arms_are_hedged(mock_opt_args, mock_llm_config_file):
+    """Test that --hedge_models hedges the requests of every bandit arm"""
+    def build(name, config):
+        provider = MagicMock()
+        provider.name = name
+        return provider
+
+    mock_opt_args.bandit_arms = "gpt-4,claude-3-5-sonnet-20240620:PROMPT_MB"
+    mock_opt_args.hedge_models = "o1"
+    mock_opt_args.llm_config = mock_llm_config_file
+    with patch("llmeo.run_llmeo.build_llm_model", side_effect=build):
+        bandit = get_bandit(mock_opt_args)
+
+    assert all(isinstance(arm.model, HedgedLLM) for arm in bandit.arms)
+    assert [arm.model.name for arm in bandit.arms] == ["hedged(gpt-4,o1)", "hedged(claude-3-5-sonnet-20240620,o1)"]
+
+
+def test_bandit_arms_reject_staleness(mock_opt_args, temp_output_dir):
+    """Test that the bandit refuses the pipelined loop instead of silently running generationally"""
+    mock_opt_args.bandit_arms = "gpt-4"
+    mock_opt_args.staleness = 1
+    mock_opt_args.path = str(temp_output_dir)
+    with pytest.raises(ValueError, match="--staleness"):
+        check_options(mock_opt_args)
+    with pytest.raises(ValueError, match="--staleness"):
+        main(mock_opt_args)
+
+    mock_opt_args.staleness = 0
+    check_options(mock_opt_args)
+
+
+@pytest.mark.parametrize("alias_ligands", [False, True])
+def test_hedged_model_validates_prompt_mode(alias_ligands, mock_opt_args, mock_llm_config_file):
+    """Test that hedged answers are validated in the ID form the prompt asks for"""
+    canonical = "Pd_ABCDEF-subgraph-1_ABCDEF-subgraph-2_ABCDEF-subgraph-3_ABCDEF-subgraph-4"
+    text = "*TMC* Pd_L01_L07_L03_L12" if alias_ligands else f"*TMC* {canonical}"
+    providers = {}
+
+    def build(name, config):
+        provider = MagicMock()
+        provider.name = name
+        provider.generate.return_value = LLMResponse(text, usage=LLMUsage(latency=0.1))
+        providers[name] = provider
+        return provider
+
+    mock_opt_args.model = "gpt-4"
+    mock_opt_args.hedge_models = "o1"
+    mock_opt_args.alias_ligands = alias_ligands
+    mock_opt_args.llm_config = mock_llm_config_file
+    with patch("llmeo.run_llmeo.build_llm_model", side_effect=build):
+        model = get_llm_model(mock_opt_args)
+
+    assert model.generate("prompt").text == text
+    assert providers["o1"].generate.call_count == 0
+    assert model.stats["errors"] == {"gpt-4": 0, "o1": 0}
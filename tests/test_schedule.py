@@ -0,0 +1,91 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+import pytest
+from llmeo._utils.schedule import (RuntimePredictor, Scheduler, ligand_descriptors,
+                                   load_timings, tmc_features)
+
+SMILES = ["O", "N", "[Br-]", "CP(C)C", "CCCCCCP(CCCCCC)CCCCCC", "c1ccc(cc1)P(c1ccccc1)c1ccccc1"]
+
+
+def _space(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({f"lig{i}_smiles": rng.choice(SMILES, n) for i in range(1, 5)})
+
+
+def _true_seconds(features):
+    return 0.01 * features["atoms"].to_numpy() ** 1.5 * np.exp(0.05 * features["rotatable"].to_numpy())
+
+
+def test_ligand_descriptors():
+    """Test atom and rotatable bond counts from SMILES"""
+    assert ligand_descriptors("O") == (3, 0)
+    assert ligand_descriptors("CP(C)C") == (13, 0)
+    assert ligand_descriptors("CCCCCCP(CCCCCC)CCCCCC")[1] == 15
+    assert ligand_descriptors("not a smiles") == (0, 0)
+
+    features = tmc_features(pd.DataFrame({f"lig{i}_smiles": ["O"] for i in range(1, 5)}))
+    assert features.loc[0, "atoms"] == 13
+
+
+def test_predictor_fits_timings():
+    """Test that the log-linear model recovers a power law in atom count"""
+    df = _space(60)
+    features = tmc_features(df)
+    seconds = _true_seconds(features)
+
+    predictor = RuntimePredictor().fit(features, seconds)
+    assert predictor.observations == 60
+    np.testing.assert_allclose(predictor.coefficients[1:], [1.5, 0.05], atol=1e-6)
+    np.testing.assert_allclose(predictor.predict(features), seconds, rtol=1e-6)
+
+    # Too few timings keep the prior
+    assert RuntimePredictor().fit(features[:3], seconds[:3]).coefficients is None
+
+
+def test_lpt_reduces_makespan():
+    """Test that longest-first dispatch finishes a batch sooner than frame order"""
+    df = _space(40, seed=1)
+    seconds = pd.Series(_true_seconds(tmc_features(df)), index=df.index)
+
+    def makespan(order, workers=4):
+        free = [0.0] * workers
+        for idx in order:
+            heapq.heappush(free, heapq.heappop(free) + seconds[idx])
+        return max(free)
+
+    scheduler = Scheduler(mode="lpt")
+    order = scheduler.order(df)
+    assert sorted(order) == list(df.index)
+    assert makespan(order) < makespan(list(df.index))
+    assert Scheduler(mode="none").order(df, [3, 1, 2]) == [3, 1, 2]
+
+
+def test_value_schedule():
+    """Test value per predicted second ordering"""
+    df = _space(4, seed=2)
+    predicted = Scheduler().predict(df)
+
+    shortest_first = Scheduler(mode="value").order(df)
+    assert list(predicted[shortest_first]) == sorted(predicted)
+
+    df["estimate"] = predicted * [1, 2, 3, 4]
+    assert Scheduler(mode="value", value_column="estimate").order(df) == [3, 2, 1, 0]
+
+    with pytest.raises(ValueError):
+        Scheduler(mode="fifo")
+
+
+def test_from_history(tmp_path):
+    """Test that timings stored by earlier runs train the predictor"""
+    df = _space(30, seed=3)
+    df["xtb_seconds"] = _true_seconds(tmc_features(df))
+    df.loc[0, "xtb_seconds"] = None
+    path = tmp_path / "space.csv"
+    df.to_csv(path, index=False)
+
+    assert len(load_timings([str(path), str(tmp_path / "missing.csv")])) == 29
+    scheduler = Scheduler.from_history([str(path)])
+    assert scheduler.predictor.observations == 29
+    np.testing.assert_allclose(scheduler.predictor.coefficients[1], 1.5, atol=1e-6)
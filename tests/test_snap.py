@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+from llmeo._utils.snap import SnapIndex, SnapStats, ligand_similarity
+from llmeo._utils.utils import find_tmc_in_space
+
+LIGS = ["lig1", "lig2", "lig3", "lig4"]
+
+
+@pytest.fixture
+def space_index(sample_search_space, lig_charges):
+    return SnapIndex(sample_search_space, lig_charges)
+
+
+def test_lookup_matches_find_tmc_in_space(sample_search_space, space_index):
+    """Test that the index lookup agrees with the rotation scan"""
+    for _, row in sample_search_space.head(20).iterrows():
+        ligs = list(row[LIGS])
+        rotated = "Pd_" + "_".join(ligs[2:] + ligs[:2])
+        expected = find_tmc_in_space(sample_search_space, [rotated])
+        found = find_tmc_in_space(sample_search_space, [rotated], index=space_index)
+        pd.testing.assert_frame_equal(found, expected)
+    assert space_index.lookup("Pd_A_B_C_D") is None
+    assert space_index.lookup("Pd_A_B") is None
+
+
+def test_nearest_single_swap(sample_search_space, space_index):
+    """Test that a proposal with one unknown ligand snaps to a member differing only there"""
+    ligs = list(sample_search_space.iloc[0][LIGS])
+    proposal = "Pd_" + "_".join(["UNKNOWN"] + ligs[1:])
+
+    nearest = space_index.nearest(proposal, k=50)
+
+    assert nearest
+    assert all(distance == 1.0 for _, distance in nearest)
+    for tmc, _ in nearest:
+        snapped = tmc.split("_")[1:]
+        rotations = [snapped[i:] + snapped[:i] for i in range(4)]
+        assert any(sum(a != b for a, b in zip(r, ["UNKNOWN"] + ligs[1:])) == 1 for r in rotations)
+    assert len({space_index.key(tmc) for tmc, _ in nearest}) == len(nearest)
+
+
+def test_nearest_matches_brute_force(sample_search_space, space_index):
+    """Test that the triple index finds every single-swap member found by scanning"""
+    proposal = "Pd_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3"
+    indexed = space_index.nearest(proposal, k=10**6, max_swaps=1)
+    scanned = space_index.nearest(proposal, k=10**6, max_swaps=2)
+    assert {tmc for tmc, d in scanned if d <= 1} == {tmc for tmc, _ in indexed}
+
+
+def test_nearest_prefers_charge_bucket(sample_search_space, lig_charges, space_index):
+    """Test that an over-charged proposal snaps to the closest allowed charge"""
+    proposal = "Pd_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3"
+    assert space_index.target_charge(proposal) == 1
+
+    tmc, distance = space_index.nearest(proposal)[0]
+    charge = 2 + sum(lig_charges[lig] for lig in tmc.split("_")[1:])
+    assert distance == 1.0
+    assert charge == 1
+
+
+def test_nearest_excludes_known(space_index):
+    """Test that excluded members are never returned"""
+    proposal = "Pd_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3"
+    first = space_index.snap(proposal)
+    second = space_index.snap(proposal, exclude={space_index.key(first)})
+    assert second is not None and space_index.key(second) != space_index.key(first)
+
+
+def test_similarity_ranks_swaps(sample_search_space, sample_ligand_data, lig_charges):
+    """Test that similar replacement ligands are ranked first"""
+    ligands = sample_ligand_data.rename(columns={"connecting_atom": "connecting atom element"})
+    similarity = ligand_similarity(ligands)
+    assert similarity.loc["OBONEA-subgraph-1", "CORTOU-subgraph-2"] == 0.5
+    assert similarity.loc["OBONEA-subgraph-1", "OBONEA-subgraph-1"] == 1.0
+
+    index = SnapIndex(sample_search_space, lig_charges, similarity=similarity)
+    member = "Pd_OBONEA-subgraph-1_OBONEA-subgraph-1_WECJIA-subgraph-3_WECJIA-subgraph-3"
+    nearest = index.nearest(member, k=100, exclude={index.key(member)})
+    distances = [distance for _, distance in nearest]
+    assert distances == sorted(distances)
+    # Swapping a ligand for one of the same charge costs half a swap
+    assert distances[0] == 0.5
+    assert distances[-1] == 1.0
+
+
+def test_snap_stats():
+    """Test snap rate bookkeeping"""
+    stats = SnapStats()
+    stats.record_in_space(2)
+    stats.record("Pd_A_B_C_D", "Pd_A_B_C_E", 1.0)
+    stats.record("Pd_X_X_X_X", None)
+
+    summary = stats.to_dict()
+    assert summary["proposals"] == 4
+    assert summary["snap_rate"] == 0.5
+    assert summary["pairs"] == [{"proposal": "Pd_A_B_C_D", "snapped": "Pd_A_B_C_E", "distance": 1.0}]
@@ -0,0 +1,198 @@
+import json
+
+import pytest
+import pandas as pd
+from llmeo import prompts
+from llmeo._utils.utils import (LigandAliases, ParseStats, TMCExtractor,
+                                TMCStreamParser, make_prompt,
+                                make_text_for_existing_tmcs,
+                                retrive_tmc_from_message)
+
+
+def _stream(parser, text, chunk_size):
+    """Feed text to the parser in fixed-size chunks, collecting emitted TMCs"""
+    emitted = []
+    for i in range(0, len(text), chunk_size):
+        emitted.extend(parser.feed(text[i:i + chunk_size]))
+    emitted.extend(parser.close())
+    return emitted
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 100000])
+def test_stream_parser_matches_full_parse(mock_llm_response, chunk_size):
+    """Test that streamed extraction agrees with the full-message parser"""
+    emitted = _stream(TMCStreamParser(), mock_llm_response, chunk_size)
+    assert emitted == retrive_tmc_from_message(mock_llm_response, expected_returns=3)
+
+
+def test_stream_parser_emits_early():
+    """Test that a TMC is emitted before the stream ends"""
+    parser = TMCStreamParser()
+    assert parser.feed("<<<TMC>>>: [Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_") == []
+    # The last index could still grow, so nothing is emitted yet
+    assert parser.feed("WECJIA-subgraph-3_CORTOU-subgraph-1") == []
+    assert parser.feed("2], <<<TOTAL_CHARGE>>>") == [
+        "Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_WECJIA-subgraph-3_CORTOU-subgraph-12"
+    ]
+    assert parser.close() == []
+
+
+def test_stream_parser_ignores_tmcs_without_delimiter():
+    """TMCs quoted in explanations before any delimiter are not emitted"""
+    text = (
+        "Compared to Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1, "
+        "*TMC* Pd_MEBXUN-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1"
+    )
+    assert _stream(TMCStreamParser(), text, 5) == [
+        "Pd_MEBXUN-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1"
+    ]
+
+
+def test_extractor_json(lig_charges):
+    """Test extraction and validation of a structured-output answer"""
+    message = json.dumps({"tmcs": [
+        {"explanation": "", "tmc": "Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_WECJIA-subgraph-3_CORTOU-subgraph-2", "total_charge": 0},
+        {"explanation": "", "tmc": "Pd_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1_OBONEA-subgraph-1", "total_charge": -2},
+        {"explanation": "", "tmc": "Pd_XXXXXX-subgraph-1_OBONEA-subgraph-1_WECJIA-subgraph-3_WECJIA-subgraph-3", "total_charge": 1},
+        {"explanation": "", "tmc": "Pd_WECJIA-subgraph-3_OBONEA-subgraph-1", "total_charge": 1},
+        {"explanation": "", "tmc": "Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_WECJIA-subgraph-3_CORTOU-subgraph-2", "total_charge": 0},
+    ]})
+    result = TMCExtractor(lig_charges).extract(message, expected_returns=3)
+
+    assert result.method == "json"
+    assert result.tmcs == ["Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_WECJIA-subgraph-3_CORTOU-subgraph-2"]
+    assert [reason for _, reason in result.rejected] == [
+        "invalid_charge", "unknown_ligand", "malformed", "duplicate"
+    ]
+
+
+def test_extractor_grammar_and_fallback(lig_charges, mock_llm_response):
+    """Test the strict line grammar and the delimiter fallback"""
+    extractor = TMCExtractor(lig_charges)
+    message = (
+        "Some reasoning.\n"
+        "TMC: Pd_WECJIA-subgraph-3_IRIXUC-subgraph-3_IRIXUC-subgraph-3_IRIXUC-subgraph-3\n"
+        "TMC: Pd_CORTOU-subgraph-2_WECJIA-subgraph-3_WECJIA-subgraph-3_WECJIA-subgraph-3\n"
+    )
+    result = extractor.extract(message, expected_returns=2)
+    assert result.method == "grammar"
+    assert len(result.tmcs) == 2
+
+    result = extractor.extract(mock_llm_response, expected_returns=3)
+    assert result.method == "delimiter"
+    assert result.tmcs == retrive_tmc_from_message(mock_llm_response, expected_returns=3)
+
+
+def test_parse_stats(lig_charges, mock_llm_response, mock_failed_llm_response):
+    """Test parse success bookkeeping"""
+    extractor = TMCExtractor(lig_charges)
+    stats = ParseStats()
+    stats.record(extractor.extract(mock_llm_response, expected_returns=3))
+    stats.record(extractor.extract(mock_failed_llm_response, expected_returns=3))
+
+    summary = stats.to_dict()
+    assert summary["messages"] == 2
+    assert summary["success_rate"] == 0.5
+    assert summary["accepted_tmcs"] == 3
+    assert summary["methods"] == {"delimiter": 1, "none": 1}
+
+
+@pytest.fixture
+def aliases(lig_charges):
+    return LigandAliases(lig_charges)
+
+
+def test_ligand_aliases_round_trip(aliases, lig_charges):
+    """Test that aliases are short, stable and expand back to ligand IDs"""
+    assert aliases.alias("WECJIA-subgraph-3") == "L01"
+    assert LigandAliases(lig_charges).to_alias == aliases.to_alias
+    tmc = "Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_CORTOU-subgraph-2_IRIXUC-subgraph-3"
+    aliased = "Pd_" + "_".join(aliases.alias(lig) for lig in tmc.split("_")[1:])
+    assert aliased == "Pd_L01_L04_L05_L06"
+    assert aliases.expand(f"<<<TMC>>>: [{aliased}], L1 and L99 stay") == (
+        f"<<<TMC>>>: [{tmc}], L1 and L99 stay"
+    )
+
+
+def test_make_prompt_with_aliases(aliases, lig_charges, sample_tmc_data):
+    """Test that the compact prompt is shorter and carries no ligand IDs"""
+    ligands = (
+        "SMILES,id,charge,connecting atom element,connecting atom index\n"
+        + "".join(f"C,{lig},{charge},C,1\n" for lig, charge in lig_charges.items())
+    )
+    template = "CSV_FILE_CONTENT\nCURRENT_SAMPLES\nNUM_SAMPLES NUM_PROVIDED_SAMPLES"
+    full = make_prompt(template, ligands, sample_tmc_data, lig_charges,
+                       props=["gap", "polarisability"])
+    compact = make_prompt(template, ligands, sample_tmc_data, lig_charges,
+                          props=["gap", "polarisability"], aliases=aliases)
+    assert len(compact) < len(full)
+    assert "subgraph" not in compact
+    assert "{Pd_L05_L06_L01_L01, 0, 3.25, 212.4}" in compact
+    assert "SMILES,id,charge,element,index\nC,L01,0,C,1" in compact
+
+
+def test_aliased_messages_parse_to_ligand_ids(aliases, lig_charges):
+    """Test that every parser maps aliased answers back to ligand IDs"""
+    tmc = "Pd_WECJIA-subgraph-3_OBONEA-subgraph-1_CORTOU-subgraph-2_IRIXUC-subgraph-3"
+    message = "{<<<TMC>>>: [Pd_L01_L04_L05_L06], <<<TOTAL_CHARGE>>>: -1}"
+    assert retrive_tmc_from_message(message, aliases=aliases) == [tmc]
+    assert TMCExtractor(lig_charges, aliases=aliases).extract(message, 1).tmcs == [tmc]
+    assert _stream(TMCStreamParser(aliases), message, 3) == [tmc]
+
+
+def _reference_text(df, lig_charge, props):
+    """Row-wise renderer the vectorized make_text_for_existing_tmcs replaced"""
+    lines = []
+    for _, row in df.iterrows():
+        tmc = "Pd_" + "_".join([row["lig1"], row["lig2"], row["lig3"], row["lig4"]])
+        total_charge = 2 + sum(lig_charge[row[f"lig{i}"]] for i in range(1, 5))
+        prop_values = [str(round(row[prop], 3)) for prop in props]
+        lines.append("{" + ", ".join([tmc, str(total_charge)] + prop_values) + "}")
+    return "\n".join(lines)
+
+
+def _reference_prompt(template, ligands, df, lig_charge, num_samples, props):
+    """Sequential str.replace prompt filling make_prompt replaced"""
+    replacements = {
+        "CSV_FILE_CONTENT": ligands,
+        "CURRENT_SAMPLES": _reference_text(df, lig_charge, props),
+        "NUM_SAMPLES": num_samples,
+        "NUM_PROVIDED_SAMPLES": str(len(df)),
+    }
+    for key, value in replacements.items():
+        template = template.replace(key, value)
+    return template
+
+
+def test_vectorized_text_is_byte_identical(sample_search_space, sample_tmc_data, lig_charges):
+    """Test the vectorized renderer against the row-wise implementation"""
+    charges = {lig: (i % 3) - 1 for i, lig in enumerate(
+        sorted(set(sample_search_space[["lig1", "lig2", "lig3", "lig4"]].to_numpy().ravel())))}
+    df = sample_search_space.assign(iter=3)
+    # Values on rounding boundaries, tiny, huge, integral and missing
+    df.loc[:5, "gap"] = [2.675, 1.0005, 1e-7, 123456789.98765, 3.0, float("nan")]
+    for props in (["gap"], ["polarisability"], ["gap", "polarisability", "iter"]):
+        assert make_text_for_existing_tmcs(df, charges, props) == _reference_text(df, charges, props)
+    assert make_text_for_existing_tmcs(df.iloc[:0], charges, ["gap"]) == ""
+    sample = sample_tmc_data.set_index(pd.Index([7, 3, 3, 1]))
+    assert (make_text_for_existing_tmcs(sample, lig_charges, ["gap"])
+            == _reference_text(sample, lig_charges, ["gap"]))
+
+
+def test_make_text_unknown_ligand(sample_tmc_data, lig_charges):
+    """Test that unknown ligands still raise a KeyError"""
+    del lig_charges["IRIXUC-subgraph-3"]
+    with pytest.raises(KeyError):
+        make_text_for_existing_tmcs(sample_tmc_data, lig_charges, ["gap"])
+
+
+@pytest.mark.parametrize("name", ["PROMPT_G", "PROMPT_P", "PROMPT_PF", "PROMPT_MB",
+                                  "PROMPT_MPSG", "PROMPT_NL_MB"])
+def test_compiled_prompt_is_byte_identical(name, sample_tmc_data, lig_charges):
+    """Test that precompiled templates render exactly like sequential replacement"""
+    template = getattr(prompts, name)
+    ligands = "SMILES,id,charge\nC,WECJIA-subgraph-3,0\n"
+    props = ["gap", "polarisability"]
+    assert make_prompt(template, ligands, sample_tmc_data, lig_charges, "THREE", props) == (
+        _reference_prompt(template, ligands, sample_tmc_data, lig_charges, "THREE", props)
+    )
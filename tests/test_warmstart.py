@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+from llmeo._utils.utils import CYCLES_COLUMN, CYCLES_SAVED_COLUMN
+from llmeo._utils.geometry import read_xyz, write_xyz
+from llmeo._utils.warmstart import (GeometryStore, count_optimization_cycles, kabsch, splice_geometry,
+                                    summarize_warm_starts)
+
+# Ligand pairs with their atoms as molSimplify writes them, heavy atom first
+LIGANDS = {
+    ("O", 0): ["O", "H", "H"],
+    ("N", 0): ["N", "H", "H", "H"],
+    ("[Cl-]", 0): ["Cl"],
+}
+
+
+def _build(ligands, scale=1.0):
+    """Square planar Pd structure with ligand j along the j-th axis direction"""
+    elements, coords = ["Pd"], [[0.0, 0.0, 0.0]]
+    for position, ligand in enumerate(ligands):
+        direction = np.array([np.cos(np.pi / 2 * position), np.sin(np.pi / 2 * position), 0.0])
+        for atom, element in enumerate(LIGANDS[ligand]):
+            offset = np.array([0.0, 0.0, 0.3 * (atom - 1)]) if atom else 0.0
+            elements.append(element)
+            coords.append(direction * scale * (2.0 + 0.9 * (atom > 0)) + offset)
+    return elements, np.array(coords)
+
+
+def _rotate(coords, angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return coords @ np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]]) + np.array([1.0, -2.0, 0.5])
+
+
+def test_kabsch_recovers_rigid_motion():
+    """Test that a rotated and shifted copy is superimposed exactly"""
+    _, coords = _build([("O", 0), ("N", 0), ("O", 0), ("[Cl-]", 0)])
+    moved = _rotate(coords, 0.7)
+    rotation, translation = kabsch(moved, coords)
+    assert np.allclose(moved @ rotation + translation, coords)
+
+
+def test_splice_takes_shared_ligands_from_neighbour():
+    """Test that shared ligands take the optimized geometry and the new ligand stays bonded"""
+    target = [("O", 0), ("N", 0), ("O", 0), ("N", 0)]
+    neighbour = [("O", 0), ("N", 0), ("O", 0), ("[Cl-]", 0)]
+    elements, fresh = _build(target)
+    neighbour_elements, optimized = _build(neighbour, scale=0.95)
+    optimized = _rotate(optimized, 1.1)
+
+    spliced = splice_geometry(elements, fresh, target, neighbour_elements, optimized, neighbour, rotation=0)
+    assert spliced is not None
+    shared = np.arange(11)
+    expected = _build(neighbour, scale=0.95)[1][shared]
+    distances = np.linalg.norm(spliced[shared][:, None] - spliced[shared][None], axis=-1)
+    assert np.allclose(distances, np.linalg.norm(expected[:, None] - expected[None], axis=-1))
+    assert np.allclose(np.linalg.norm(spliced[11:] - spliced[0], axis=1), np.linalg.norm(fresh[11:], axis=1), atol=0.2)
+
+    assert splice_geometry(elements, fresh, target, neighbour_elements, optimized, neighbour, rotation=1) is None
+    crowded = fresh.copy()
+    crowded[11] = fresh[1] + 0.1
+    assert splice_geometry(elements, crowded, target, neighbour_elements, optimized, neighbour, rotation=0) is None
+
+
+def test_store_finds_rotated_neighbours(tmp_path):
+    """Test that a neighbour stored in another rotation warm-starts the optimization"""
+    store = GeometryStore(str(tmp_path / "store"))
+    neighbour = [("O", 0), ("N", 0), ("O", 0), ("[Cl-]", 0)]
+    elements, optimized = _build(neighbour, scale=0.95)
+    write_xyz(str(tmp_path / "xtbopt.xyz"), elements, optimized)
+    assert store.put(neighbour, str(tmp_path / "xtbopt.xyz"), cold_cycles=40)
+    assert not store.put(neighbour, str(tmp_path / "missing.xyz"))
+
+    target = [("N", 0), ("O", 0), ("[Cl-]", 0), ("O", 0)]
+    assert store.neighbours(target) == [(store.key(neighbour), 3)]
+    assert store.neighbours([("N", 0)] * 4) == []
+
+    elements, fresh = _build(target)
+    write_xyz(str(tmp_path / "fresh.xyz"), elements, fresh)
+    warm = store.warm_start(target, str(tmp_path / "fresh.xyz"), str(tmp_path / "start.xyz"))
+    assert warm == {"neighbour": store.key(neighbour), "cold_cycles": 40}
+    start_elements, start, _ = read_xyz(str(tmp_path / "start.xyz"))
+    assert start_elements == elements
+    assert not np.allclose(start, fresh)
+
+    far = [("N", 0), ("N", 0), ("N", 0), ("N", 0)]
+    elements, fresh = _build(far)
+    write_xyz(str(tmp_path / "far.xyz"), elements, fresh)
+    assert store.warm_start(far, str(tmp_path / "far.xyz"), str(tmp_path / "far_start.xyz")) is None
+    assert store.stats == {"warm": 1, "cold": 1, "rejected_neighbours": 0}
+
+
+def test_store_ranks_neighbours_from_metadata(tmp_path, monkeypatch):
+    """Test that neighbours are ranked without reading their geometries and only the chosen one is loaded"""
+    store = GeometryStore(str(tmp_path / "store"))
+    close = [("O", 0), ("O", 0), ("N", 0), ("O", 0)]
+    far = [("O", 0), ("O", 0), ("[Cl-]", 0), ("O", 0)]
+    for cycles, neighbour in enumerate([close, far]):
+        elements, optimized = _build(neighbour, scale=0.95)
+        write_xyz(str(tmp_path / "xtbopt.xyz"), elements, optimized)
+        assert store.put(neighbour, str(tmp_path / "xtbopt.xyz"), cold_cycles=cycles)
+
+    target = [("O", 0)] * 4
+    elements, fresh = _build(target)
+    write_xyz(str(tmp_path / "fresh.xyz"), elements, fresh)
+    loaded = []
+    load = store.load
+    monkeypatch.setattr(store, "load", lambda key: loaded.append(key) or load(key))
+
+    warm = store.warm_start(target, str(tmp_path / "fresh.xyz"), str(tmp_path / "start.xyz"))
+    assert warm == {"neighbour": store.key(close), "cold_cycles": 0}
+    assert loaded == [store.key(close)]
+
+    (tmp_path / "store" / "geometries" / f"{store.key(far)}.json").unlink()
+    assert store.metadata(store.key(far)) == {"ligands": [["O", "0"], ["O", "0"], ["[Cl-]", "0"], ["O", "0"]], "cold_cycles": 1}
+    assert store.metadata("missing") is None
+
+
+def test_count_optimization_cycles(tmp_path):
+    """Test that every frame of xtbopt.log is one cycle"""
+    assert count_optimization_cycles(str(tmp_path)) is None
+    frame = "2\n energy: -1.0\nH 0 0 0\nH 0 0 0.74\n"
+    (tmp_path / "xtbopt.log").write_text(frame * 7)
+    assert count_optimization_cycles(str(tmp_path)) == 7
+
+
+def test_summarize_warm_starts():
+    """Test cycles of cold and warm starts and the cycles saved"""
+    df = pd.DataFrame({
+        CYCLES_COLUMN: [40, 50, 10, 20, ""],
+        CYCLES_SAVED_COLUMN: ["", "", 30, 25.0, ""],
+    })
+    assert summarize_warm_starts(df) == {
+        "cold": 2,
+        "warm": 2,
+        "mean_cold_cycles": 45.0,
+        "mean_warm_cycles": 15.0,
+        "cycles_saved": 55.0,
+        "mean_cycles_saved": 27.5,
+    }
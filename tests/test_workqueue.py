@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+from llmeo._utils.workqueue import WorkQueue, run_worker
+
+
+def _space(n):
+    return pd.DataFrame({
+        "lig1": [f"L{i}" for i in range(n)],
+        "lig1_smiles": ["O"] * n,
+        "charge": [0] * n,
+    })
+
+
+def _fake_calculate(batch, shard, delay=0.0, error=""):
+    """Stand-in for calculate_fitness_ligand_space appending the batch to the shard"""
+    time.sleep(delay)
+    batch = batch.copy()
+    batch["_error"] = error
+    batch["homo_lumo_gap"] = "" if error else batch["_row"] / 10
+    batch["worker"] = os.getpid()
+    batch.to_csv(shard, mode="a", header=not os.path.exists(shard), index=False)
+    return batch
+
+
+def test_claims_are_exclusive(tmp_path):
+    """Test that every batch is claimed by one worker only"""
+    queue = WorkQueue(str(tmp_path), lease_seconds=60)
+    assert queue.create(_space(10), batch_size=4) == 3
+    assert queue.create(_space(10), batch_size=4) == 0
+
+    claims = [queue.claim(f"w{i}") for i in range(4)]
+    assert claims == ["batch-000000", "batch-000001", "batch-000002", None]
+    assert queue.status() == {"batches": 3, "done": 0, "leased": 3, "expired": 0, "pending": 0}
+    assert list(queue.load("batch-000002")["_row"]) == [8, 9]
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    """Test that the batch of a silent worker goes to the next worker"""
+    queue = WorkQueue(str(tmp_path), lease_seconds=0.2)
+    queue.create(_space(2), batch_size=2)
+    assert queue.claim("crashed") == "batch-000000"
+    assert queue.claim("other") is None
+
+    time.sleep(0.3)
+    assert queue.status()["expired"] == 1
+    assert queue.claim("other") == "batch-000000"
+    assert not queue.renew("batch-000000", "crashed")
+    assert queue.renew("batch-000000", "other")
+    assert not [name for name in os.listdir(queue.leases) if "stale" in name]
+
+
+def test_concurrent_reclaim_keeps_fresh_lease(tmp_path):
+    """Test that a worker that read an expired lease late does not take over its fresh replacement"""
+    queue = WorkQueue(str(tmp_path), lease_seconds=0.2)
+    queue.create(_space(2), batch_size=2)
+    queue.claim("crashed")
+    time.sleep(0.3)
+    expired = queue.read_lease("batch-000000")
+
+    queue.lease_seconds = 60
+    assert queue.claim("first") == "batch-000000"
+    late = WorkQueue(str(tmp_path), lease_seconds=60)
+    late.read_lease = lambda batch: expired
+    assert late.claim("second") is None
+    assert queue.read_lease("batch-000000")["worker"] == "first"
+    assert queue.renew("batch-000000", "first")
+    assert not [name for name in os.listdir(queue.leases) if "stale" in name]
+
+
+def test_lease_is_renewed_while_working(tmp_path):
+    """Test that a batch taking longer than the lease is not reclaimed"""
+    queue = WorkQueue(str(tmp_path), lease_seconds=0.3)
+    queue.create(_space(3), batch_size=3)
+    claimed = []
+
+    def slow(batch, shard):
+        for _ in range(4):
+            time.sleep(0.2)
+            claimed.append(queue.claim("thief"))
+        return _fake_calculate(batch, shard)
+
+    assert run_worker(queue, slow, worker="slow") == 1
+    assert claimed == [None] * 4
+    assert queue.status()["done"] == 1
+    assert os.listdir(queue.leases) == []
+
+
+def _work(directory):
+    run_worker(WorkQueue(directory, lease_seconds=5), lambda batch, shard: _fake_calculate(batch, shard, delay=0.05))
+
+
+def test_workers_evaluate_every_row_once(tmp_path):
+    """Test that concurrent worker processes split the batches and merge restores the space"""
+    queue = WorkQueue(str(tmp_path), lease_seconds=5)
+    queue.create(_space(40), batch_size=3, order=reversed(range(40)))
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_work, args=(str(tmp_path),)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert queue.status() == {"batches": 14, "done": 14, "leased": 0, "expired": 0, "pending": 0}
+    assert len(os.listdir(queue.shards)) >= 2
+    output = tmp_path / "merged.csv"
+    merged = queue.merge(str(output))
+    assert list(merged["_row"]) == list(range(40))
+    assert list(merged["lig1"]) == [f"L{i}" for i in range(40)]
+    assert len(pd.read_csv(output)) == 40
+
+
+def test_merge_prefers_final_rows(tmp_path):
+    """Test that a reclaimed batch evaluated twice yields one row per space row"""
+    queue = WorkQueue(str(tmp_path))
+    queue.create(_space(2), batch_size=2)
+    batch = queue.load("batch-000000")
+    _fake_calculate(batch, queue.shard_path("a"))
+    _fake_calculate(batch, queue.shard_path("b"), error="Worker error: killed")
+
+    merged = queue.merge()
+    assert list(merged["_row"]) == [0, 1]
+    assert list(merged["_error"]) == ["", ""]
+    assert list(merged["homo_lumo_gap"]) == ["0.0", "0.1"]
+
+
+def test_merge_reopens_batches_behind_malformed_lines(tmp_path):
+    """Test that rows lost to a malformed shard line are counted and their batch is evaluated again"""
+    queue = WorkQueue(str(tmp_path))
+    queue.create(_space(4), batch_size=2)
+    assert run_worker(queue, _fake_calculate, worker="a") == 2
+
+    shard = queue.shard_path("a")
+    with open(shard) as fo:
+        lines = fo.read().splitlines()
+    lines[1] += ",stray,fields"
+    lines[4] = lines[4].rsplit(",", 2)[0]
+    with open(shard, "w") as fo:
+        fo.write("\n".join(lines) + "\n")
+
+    merged = queue.merge()
+    assert list(merged["_row"]) == [1, 2]
+    assert queue.skipped_lines == {"a.csv": 2}
+    assert queue.reopened == ["batch-000000", "batch-000001"]
+    assert queue.status()["pending"] == 2
+
+    assert run_worker(queue, _fake_calculate, worker="b") == 2
+    assert list(queue.merge()["_row"]) == [0, 1, 2, 3]
+    assert queue.reopened == [] and queue.skipped_lines == {"a.csv": 2}